@@ -0,0 +1,117 @@
+"""
+Asyncio execution path for I/O-bound handler stages.
+
+Cloud Functions for Python runs synchronous handlers only, and every stage
+in main.py blocks its thread on Firestore, requests or OpenAI. A fan-out
+stage (one read per recipient, one upstream call per recipient) is
+therefore a sequence of round trips. With ASYNC_HANDLERS=1 those stages
+run as coroutines instead, and their independent calls are issued
+together with asyncio.gather:
+
+    suggestions = async_core.run(_generate_smart_replies_async(...))
+
+run() submits a coroutine to the instance's event loop and blocks the
+calling handler until it finishes. The loop runs on one daemon thread, so
+the coroutines of all concurrent requests on an instance share it. The
+caller's context (request deadline, trace) is carried over, so spans,
+deadlines.call_async() and circuit breakers work as on the threaded path.
+
+The clients are created on the loop and reused by every request:
+
+    firestore()        firebase_admin.firestore_async (AsyncClient)
+    http()             httpx.AsyncClient (Vertex AI REST calls)
+    openai_client()    openai.AsyncOpenAI
+    FCM                firebase_admin.messaging.send_each_async
+
+Coroutines must never block: a synchronous client call on the loop stalls
+every request on the instance. Use asyncio.to_thread for anything without
+an async client.
+"""
+
+import asyncio
+import os
+import threading
+from typing import Any, Coroutine, TypeVar
+
+T = TypeVar("T")
+
+# Connections kept open to each upstream host by the shared HTTP client
+HTTP_MAX_CONNECTIONS = 100
+
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_lock = threading.Lock()
+
+# Clients are bound to the loop; only touched from coroutines running on it
+_firestore: Any = None
+_http: Any = None
+_openai_clients: dict[tuple[str, str | None], Any] = {}
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="async-core", daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+def run(coro: Coroutine[Any, Any, T]) -> T:
+    """
+    Run a coroutine on the instance's event loop and wait for its result.
+
+    Must be called from a handler thread, never from a coroutine on the loop.
+    """
+    loop = _get_loop()
+    if threading.current_thread().name == "async-core":
+        coro.close()
+        raise RuntimeError("async_core.run() called from the event loop; await the coroutine instead")
+    # run_coroutine_threadsafe copies the caller's contextvars into the task
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+def firestore() -> Any:
+    """The instance's async Firestore client."""
+    global _firestore
+    if _firestore is None:
+        from firebase_admin import firestore_async
+        _firestore = firestore_async.client()
+    return _firestore
+
+
+def http() -> Any:
+    """The instance's async HTTP client."""
+    global _http
+    if _http is None:
+        import httpx
+        _http = httpx.AsyncClient(limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS))
+    return _http
+
+
+def openai_client(api_key: str) -> Any:
+    """Async OpenAI client, one per key (and OPENAI_BASE_URL)."""
+    cache_key = (api_key, os.environ.get("OPENAI_BASE_URL"))
+    client = _openai_clients.get(cache_key)
+    if client is None:
+        import openai
+        client = _openai_clients[cache_key] = openai.AsyncOpenAI(api_key=api_key)
+    return client
+
+
+async def _close_clients() -> None:
+    global _firestore, _http
+    clients = [_http, *_openai_clients.values()]
+    _firestore = _http = None
+    _openai_clients.clear()
+    for client in clients:
+        if client is not None:
+            # httpx.AsyncClient.aclose(), AsyncOpenAI.close()
+            await (getattr(client, "aclose", None) or client.close)()
+
+
+def reset() -> None:
+    """Close and forget the cached clients (e.g. between benchmark runs)."""
+    if _loop is not None:
+        run(_close_clients())
@@ -0,0 +1,12 @@
+"""
+Offline benchmarks for the MessageAI Cloud Functions.
+
+Modules:
+- fakes:   In-memory Firestore and FCM fakes with read/write accounting
+- stubs:   Local HTTP stub servers for Translation, Vertex AI and OpenAI
+- harness: Points main.py at the fakes and stubs
+- run:     Runs every callable and trigger and writes JSON results
+- compare: Diffs two result files
+
+Run from the functions/ directory, e.g. `python -m benchmarks.run`.
+"""
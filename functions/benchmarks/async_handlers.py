@@ -0,0 +1,159 @@
+"""
+Threaded vs. asyncio handler stages.
+
+Runs the stages main.py can move onto the async_core event loop
+(ASYNC_HANDLERS=1) both ways and compares latency and throughput:
+
+    notifications   send_message_notification for a group of --participants
+                    (one user read per recipient vs. one get_all, and one
+                    FCM send per token vs. send_each_async batches)
+    smart_replies   generate_smart_replies_complete cache misses with
+                    semantic enrichment (context, style and vector search
+                    sequential vs. gathered)
+    precompute      precompute_smart_replies for --precompute-recipients
+                    recipients (one pipeline after another vs. gathered)
+
+Firestore and FCM latency come from the fakes (awaited, not slept, on the
+async path), upstream latency from the local stub servers.
+
+Usage (from the functions/ directory):
+    python -m benchmarks.async_handlers
+    python -m benchmarks.async_handlers --participants 500 --firestore-latency-ms 5 --fcm-latency-ms 20
+"""
+
+import argparse
+import json
+import time
+from typing import Any, Callable
+from unittest import mock
+
+from benchmarks import fanout
+from benchmarks.fakes import FakeFirestore
+from benchmarks.harness import BenchEnvironment, load_main
+from benchmarks.run import ScenarioContext, _create_message, percentile, seed_conversation
+from benchmarks.stubs import UpstreamConfig
+
+MODES = (("threaded", False), ("async", True))
+
+
+def _summarize(latencies: list[float], wall_seconds: float, errors: int) -> dict[str, Any]:
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50Ms": round(percentile(latencies, 0.50), 1),
+        "p95Ms": round(percentile(latencies, 0.95), 1),
+        "throughputRps": round(len(latencies) / wall_seconds, 2) if wall_seconds else 0.0,
+    }
+
+
+def _timed(calls: list[Callable[[], Any]]) -> dict[str, Any]:
+    latencies = []
+    errors = 0
+    wall_start = time.perf_counter()
+    for call in calls:
+        start = time.perf_counter()
+        try:
+            call()
+        except Exception:  # noqa: BLE001 - count and keep going
+            errors += 1
+        latencies.append((time.perf_counter() - start) * 1000)
+    return _summarize(latencies, time.perf_counter() - wall_start, errors)
+
+
+def bench_notifications(args: argparse.Namespace) -> dict[str, Any]:
+    result = fanout.run_fanout(
+        participants=args.participants,
+        tokens_per_user=args.tokens_per_user,
+        messages=args.messages,
+        fcm_latency_ms=args.fcm_latency_ms,
+        firestore_latency_ms=args.firestore_latency_ms,
+        seed=args.seed,
+    )
+    return {
+        "requests": result["messages"],
+        "errors": result["errors"],
+        "p50Ms": round(result["p50Ms"], 1),
+        "p95Ms": round(result["p95Ms"], 1),
+        "throughputRps": result["throughputRps"],
+        "deliveries": result["deliveries"],
+        "expectedDeliveries": result["expectedDeliveries"],
+    }
+
+
+def bench_smart_replies(args: argparse.Namespace) -> dict[str, Any]:
+    upstream = UpstreamConfig(args.latency_ms, args.latency_ms / 10)
+    db = FakeFirestore(latency_ms=args.firestore_latency_ms, seed=args.seed)
+    with BenchEnvironment(upstream=upstream, firestore=db, seed=args.seed) as env:
+        ctx = ScenarioContext(env, args.messages, 2, 1)
+        seed_conversation(ctx)
+        with mock.patch.object(env.main, "SMART_REPLY_VECTOR_SEARCH", True):
+            # Distinct texts: every request is a cache miss
+            return _timed([
+                lambda i=i: env.call("generate_smart_replies_complete", {
+                    "conversationId": "bench-conv", "incomingMessageText": f"Are we still on for {i}pm?",
+                    "userId": "bench-user-1",
+                }, uid="bench-user-1")
+                for i in range(args.messages)
+            ])
+
+
+def bench_precompute(args: argparse.Namespace) -> dict[str, Any]:
+    upstream = UpstreamConfig(args.latency_ms, args.latency_ms / 10)
+    db = FakeFirestore(latency_ms=args.firestore_latency_ms, seed=args.seed)
+    with BenchEnvironment(upstream=upstream, firestore=db, seed=args.seed) as env:
+        ctx = ScenarioContext(env, args.messages, args.precompute_recipients + 1, 1)
+        seed_conversation(ctx)
+        paths = [_create_message(ctx, i) for i in range(args.messages)]
+        with mock.patch.object(env.main, "SMART_REPLY_PRECOMPUTE", True), \
+                mock.patch.object(env.main, "SMART_REPLY_PRECOMPUTE_BUDGET", 10 ** 6):
+            summary = _timed([lambda path=path: env.trigger("precompute_smart_replies", path) for path in paths])
+        summary["precomputed"] = len(env.db.dump("smart_reply_cache/"))
+    return summary
+
+
+SCENARIOS = {
+    "notifications": bench_notifications,
+    "smart_replies": bench_smart_replies,
+    "precompute": bench_precompute,
+}
+
+
+def main(argv: list[str] | None = None) -> dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Compare threaded and asyncio handler stages")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="Run only these (repeatable)")
+    parser.add_argument("--messages", type=int, default=20, help="Requests or events per scenario")
+    parser.add_argument("--participants", type=int, default=100, help="Group size for notifications")
+    parser.add_argument("--tokens-per-user", type=int, default=2, help="FCM tokens per participant")
+    parser.add_argument("--precompute-recipients", type=int, default=4, help="Recipients per precomputed message")
+    parser.add_argument("--latency-ms", type=float, default=150.0, help="Mean upstream stub latency")
+    parser.add_argument("--firestore-latency-ms", type=float, default=3.0, help="Latency per Firestore RPC")
+    parser.add_argument("--fcm-latency-ms", type=float, default=15.0, help="Latency per FCM RPC")
+    parser.add_argument("--output", help="Write the report as JSON to this path")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    main_module = load_main()
+    report: dict[str, Any] = {}
+    for name in args.scenario or SCENARIOS:
+        report[name] = {}
+        for mode, enabled in MODES:
+            with mock.patch.object(main_module, "ASYNC_HANDLERS", enabled):
+                report[name][mode] = SCENARIOS[name](args)
+
+    print(f"{'scenario':15s} {'mode':9s} {'p50 ms':>8s} {'p95 ms':>8s} {'req/s':>8s} {'err':>5s}")
+    for name, modes in report.items():
+        for mode, row in modes.items():
+            print(f"{name:15s} {mode:9s} {row['p50Ms']:8.1f} {row['p95Ms']:8.1f} "
+                  f"{row['throughputRps']:8.2f} {row['errors']:5d}")
+        if "deliveries" in modes["async"] and modes["async"]["deliveries"] != modes["async"]["expectedDeliveries"]:
+            print(f"  ! async delivered {modes['async']['deliveries']} of {modes['async']['expectedDeliveries']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Notification coalescing benchmark.
+
+Replays a message trace through send_message_notification, once pushing
+every message and once with NOTIFICATION_COALESCING, and compares the
+pushes sent. The trace runs on a virtual clock: flush_notification_bursts
+tasks are dispatched when they fall due between messages, so an hour of
+traffic replays in seconds.
+
+The default trace is synthetic chat traffic: each conversation has
+sessions in which participants take turns, and each turn is a burst of
+quick messages. --trace replays a recorded one instead, as JSON lines of
+{"conversationId", "senderId", "timestamp", "text"} (participants are
+inferred from the senders).
+
+Usage (from the functions/ directory):
+    python -m benchmarks.coalescing
+    python -m benchmarks.coalescing --conversations 50 --burst-mean 5 --window 20
+    python -m benchmarks.coalescing --trace messages.jsonl
+"""
+
+import argparse
+import json
+import random
+from typing import Any
+from unittest import mock
+
+import notification_coalescing
+from benchmarks.fakes import FakeFirestore, FakeTaskQueues
+from benchmarks.harness import BenchEnvironment
+
+
+class _Clock:
+    """Virtual time for the replay (stands in for the time module)."""
+
+    def __init__(self, now: float) -> None:
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+
+def synthetic_trace(args: argparse.Namespace) -> list[dict[str, Any]]:
+    rng = random.Random(args.seed)
+    start = 1_700_000_000.0
+    end = start + args.duration_minutes * 60
+    trace = []
+    for c in range(args.conversations):
+        participants = [f"coalesce-user-{c}-{n}" for n in range(rng.randint(2, args.max_participants))]
+        t = start + rng.uniform(0, 600)
+        while t < end:
+            # A session: participants take turns, each sending a burst
+            for _ in range(rng.randint(2, 8)):
+                sender = rng.choice(participants)
+                burst = 1
+                while rng.random() > 1 / args.burst_mean:
+                    burst += 1
+                for _ in range(burst):
+                    trace.append({"conversationId": f"coalesce-conv-{c}", "senderId": sender,
+                                  "timestamp": t, "text": f"message {len(trace)}"})
+                    t += rng.uniform(1, 6)
+                t += rng.uniform(10, 90)
+            t += rng.expovariate(1 / 900)
+    return sorted((m for m in trace if m["timestamp"] < end), key=lambda m: m["timestamp"])
+
+
+def load_trace(path: str) -> list[dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        trace = [json.loads(line) for line in f if line.strip()]
+    return sorted(trace, key=lambda m: m["timestamp"])
+
+
+def replay(trace: list[dict[str, Any]], coalescing: bool, args: argparse.Namespace) -> dict[str, Any]:
+    clock = _Clock(trace[0]["timestamp"])
+    db = FakeFirestore(seed=args.seed)
+    participants: dict[str, set[str]] = {}
+    for message in trace:
+        participants.setdefault(message["conversationId"], set()).add(message["senderId"])
+
+    with BenchEnvironment(firestore=db, tasks=FakeTaskQueues(clock=clock.time), seed=args.seed) as env, \
+            mock.patch.object(env.main, "NOTIFICATION_COALESCING", coalescing), \
+            mock.patch.object(notification_coalescing, "WINDOW_SECONDS", args.window), \
+            mock.patch.object(notification_coalescing, "time", clock):
+        for conversation_id, uids in participants.items():
+            db.seed(f"conversations/{conversation_id}", {
+                "type": "group" if len(uids) > 2 else "direct",
+                "participantIds": sorted(uids),
+                "participants": [{"uid": uid, "name": uid} for uid in sorted(uids)],
+            })
+            for uid in uids:
+                db.seed(f"users/{uid}", {"displayName": uid, "fcmTokens": [f"token-{uid}"]})
+        db.stats.reset()
+
+        flushes = 0
+
+        def dispatch_due() -> None:
+            nonlocal flushes
+            for name, data in env.tasks.pop_due(clock.now):
+                env.call(name, data)
+                flushes += 1
+
+        for i, message in enumerate(trace):
+            clock.now = message["timestamp"]
+            dispatch_due()
+            path = f"conversations/{message['conversationId']}/messages/coalesce-msg-{i}"
+            db.seed(path, {**message, "senderName": message["senderId"]})
+            env.trigger("send_message_notification", path)
+        clock.now += args.window * 2
+        dispatch_due()
+
+        io_stats = db.stats.snapshot()
+        recipient_messages = sum(len(participants[m["conversationId"]]) - 1 for m in trace)
+        return {
+            "messages": len(trace),
+            "recipientMessages": recipient_messages,
+            "pushes": len(env.messaging.sent),
+            "pushesPerRecipientMessage": round(len(env.messaging.sent) / recipient_messages, 3),
+            "flushTasks": flushes,
+            "firestoreReadsPerMessage": round(io_stats["reads"] / len(trace), 2),
+            "firestoreWritesPerMessage": round(io_stats["writes"] / len(trace), 2),
+        }
+
+
+def main(argv: list[str] | None = None) -> dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Measure push volume saved by notification coalescing")
+    parser.add_argument("--trace", help="JSON-lines message trace to replay instead of synthetic traffic")
+    parser.add_argument("--conversations", type=int, default=20, help="Synthetic conversations")
+    parser.add_argument("--max-participants", type=int, default=5, help="Largest synthetic conversation")
+    parser.add_argument("--duration-minutes", type=float, default=60, help="Synthetic trace length")
+    parser.add_argument("--burst-mean", type=float, default=3.0, help="Mean messages per synthetic burst")
+    parser.add_argument("--window", type=float, default=notification_coalescing.WINDOW_SECONDS,
+                        help="Coalescing window in seconds")
+    parser.add_argument("--output", help="Write the report as JSON to this path")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    trace = load_trace(args.trace) if args.trace else synthetic_trace(args)
+    report: dict[str, Any] = {"windowSeconds": args.window}
+    for mode, coalescing in (("everyMessage", False), ("coalesced", True)):
+        report[mode] = replay(trace, coalescing, args)
+    baseline = report["everyMessage"]["pushes"]
+    report["pushReduction"] = round(1 - report["coalesced"]["pushes"] / baseline, 3) if baseline else None
+
+    print(f"{report['everyMessage']['messages']} messages, "
+          f"{report['everyMessage']['recipientMessages']} recipient-messages, window {args.window:g}s")
+    print(f"{'mode':14s} {'pushes':>8s} {'per msg':>8s} {'flushes':>8s} {'reads/msg':>10s} {'writes/msg':>11s}")
+    for mode in ("everyMessage", "coalesced"):
+        row = report[mode]
+        print(f"{mode:14s} {row['pushes']:8d} {row['pushesPerRecipientMessage']:8.3f} {row['flushTasks']:8d} "
+              f"{row['firestoreReadsPerMessage']:10.2f} {row['firestoreWritesPerMessage']:11.2f}")
+    if report["pushReduction"] is not None:
+        print(f"push reduction: {report['pushReduction']:.1%}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
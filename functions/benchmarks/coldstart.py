@@ -0,0 +1,151 @@
+"""
+Cold-start profiler for functions/main.py.
+
+Imports main.py in fresh interpreters (as a new Cloud Functions instance
+would) and reports:
+- instance init time, from the startup profile logged by startup.py
+- import time per top-level module, parsed from `python -X importtime`
+- the first-use cost of each lazy_import() module, i.e. what the first
+  request of a function that needs it pays (or warm-up absorbs)
+
+Usage (from the functions/ directory):
+    python -m benchmarks.coldstart
+    python -m benchmarks.coldstart --runs 5 --top 15
+    python -m benchmarks.coldstart --warm-up        # WARMUP_CLIENTS=1
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from typing import Any
+
+FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+_LAZY_IMPORT = re.compile(r"""lazy_import\(\s*["']([\w.]+)["']\s*\)""")
+
+_FIRST_USE_SCRIPT = """
+import importlib, json, sys, time
+import main
+name = sys.argv[1]
+start = time.perf_counter()
+importlib.import_module(name)
+print(json.dumps({"firstUseMs": (time.perf_counter() - start) * 1000}))
+"""
+
+
+def _environment(warm_up: bool) -> dict[str, str]:
+    env = dict(os.environ)
+    env.setdefault("GCLOUD_PROJECT", "message-ai-coldstart")
+    env.setdefault("TRACE_DUMP_INTERVAL_SECONDS", "0")
+    env["WARMUP_CLIENTS"] = "1" if warm_up else "0"
+    return env
+
+
+def _parse_importtime(stderr: str) -> dict[str, Any]:
+    """Return main's cumulative import time and its direct imports (microseconds)."""
+    direct: dict[str, int] = {}
+    total_us = 0
+    for line in stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        cumulative, indent, name = int(match.group(2)), len(match.group(3)), match.group(4)
+        # importtime indents nested imports by two spaces per level
+        depth = (indent - 1) // 2
+        if depth == 0 and name == "main":
+            total_us = cumulative
+        elif depth == 1:
+            direct[name] = direct.get(name, 0) + cumulative
+    return {"totalUs": total_us, "direct": direct}
+
+
+def _parse_startup_profile(stdout: str) -> dict[str, Any]:
+    for line in stdout.splitlines():
+        if '"startupProfile"' in line:
+            try:
+                return json.loads(line)
+            except json.JSONDecodeError:
+                pass
+    return {}
+
+
+def profile_once(warm_up: bool) -> dict[str, Any]:
+    """Import main.py once in a fresh interpreter."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=FUNCTIONS_DIR, env=_environment(warm_up), capture_output=True, text=True, check=True,
+    )
+    imports = _parse_importtime(result.stderr)
+    startup = _parse_startup_profile(result.stdout)
+    return {
+        "initMs": startup.get("initMs"),
+        "lazyImportsMs": startup.get("lazyImportsMs", {}),
+        "importMainMs": imports["totalUs"] / 1000,
+        "directImportsMs": {name: us / 1000 for name, us in imports["direct"].items()},
+    }
+
+
+def lazy_modules() -> list[str]:
+    """Modules main.py loads through lazy_import()."""
+    with open(os.path.join(FUNCTIONS_DIR, "main.py"), encoding="utf-8") as f:
+        return sorted(set(_LAZY_IMPORT.findall(f.read())))
+
+
+def first_use_cost(module: str) -> float:
+    """Milliseconds to import `module` on a fresh instance that has already loaded main.py."""
+    result = subprocess.run(
+        [sys.executable, "-c", _FIRST_USE_SCRIPT, module],
+        cwd=FUNCTIONS_DIR, env=_environment(False), capture_output=True, text=True, check=True,
+    )
+    for line in result.stdout.splitlines():
+        if line.startswith('{"firstUseMs"'):
+            return json.loads(line)["firstUseMs"]
+    raise RuntimeError(f"no timing reported for {module}")
+
+
+def main(argv: list[str] | None = None) -> dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Profile main.py cold start")
+    parser.add_argument("--runs", type=int, default=3, help="Fresh interpreters to average over")
+    parser.add_argument("--top", type=int, default=10, help="Top-level imports to list")
+    parser.add_argument("--warm-up", action="store_true", help="Profile with WARMUP_CLIENTS=1")
+    parser.add_argument("--output", help="Write the report as JSON to this path")
+    args = parser.parse_args(argv)
+
+    runs = [profile_once(args.warm_up) for _ in range(args.runs)]
+    modules = sorted({name for run in runs for name in run["directImportsMs"]})
+    direct = {
+        name: statistics.median(run["directImportsMs"].get(name, 0.0) for run in runs) for name in modules
+    }
+    report: dict[str, Any] = {
+        "runs": args.runs,
+        "warmUp": args.warm_up,
+        "initMs": statistics.median(run["initMs"] or 0.0 for run in runs),
+        "importMainMs": statistics.median(run["importMainMs"] for run in runs),
+        "directImportsMs": dict(sorted(direct.items(), key=lambda item: -item[1])),
+        "lazyFirstUseMs": {module: first_use_cost(module) for module in lazy_modules()},
+        "lazyImportsDuringInitMs": runs[-1]["lazyImportsMs"],
+    }
+
+    print(f"instance init (median of {args.runs}): {report['initMs']:.1f} ms"
+          f"{' with warm-up' if args.warm_up else ''}")
+    print(f"import main:                     {report['importMainMs']:.1f} ms\n")
+    print("top-level imports")
+    for name, ms in list(report["directImportsMs"].items())[:args.top]:
+        print(f"  {name:44} {ms:9.1f} ms")
+    print("\nlazy imports (paid by the first request that uses them)")
+    for name, ms in report["lazyFirstUseMs"].items():
+        print(f"  {name:44} {ms:9.1f} ms")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
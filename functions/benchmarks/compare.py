@@ -0,0 +1,58 @@
+"""
+Compare two benchmark result files written by benchmarks.run.
+
+Usage (from the functions/ directory):
+    python -m benchmarks.compare results/baseline.json results/candidate.json
+"""
+
+import argparse
+import json
+from typing import Any
+
+METRICS = (
+    ("p50Ms", "p50 ms"),
+    ("p95Ms", "p95 ms"),
+    ("p99Ms", "p99 ms"),
+    ("throughputRps", "req/s"),
+    ("firestoreReadsPerRequest", "reads/req"),
+    ("firestoreWritesPerRequest", "writes/req"),
+    ("errors", "errors"),
+)
+
+
+def _load(path: str) -> dict[str, Any]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _delta(before: float, after: float) -> str:
+    if before == 0:
+        return "   n/a" if after == 0 else "   new"
+    return f"{(after - before) / before * 100:+6.1f}%"
+
+
+def compare(baseline: dict[str, Any], candidate: dict[str, Any]) -> list[str]:
+    """Return report lines comparing every scenario present in both runs."""
+    lines = []
+    for name in sorted(set(baseline["scenarios"]) & set(candidate["scenarios"])):
+        before, after = baseline["scenarios"][name], candidate["scenarios"][name]
+        lines.append(name)
+        for key, label in METRICS:
+            b, a = before.get(key, 0), after.get(key, 0)
+            lines.append(f"  {label:12} {b:10.2f} -> {a:10.2f}  {_delta(b, a)}")
+    only = sorted(set(baseline["scenarios"]) ^ set(candidate["scenarios"]))
+    if only:
+        lines.append(f"Scenarios present in only one run: {', '.join(only)}")
+    return lines
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    args = parser.parse_args(argv)
+    print("\n".join(compare(_load(args.baseline), _load(args.candidate))))
+
+
+if __name__ == "__main__":
+    main()
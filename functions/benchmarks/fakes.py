@@ -0,0 +1,1044 @@
+"""
+In-memory fakes for Firestore and Firebase Cloud Messaging.
+
+FakeFirestore implements the subset of the google-cloud-firestore client
+API used by main.py (documents, subcollections, queries, collection groups,
+batches, transactions, transforms and find_nearest) and counts document
+reads and writes so benchmarks can report them per request.
+FakeAsyncFirestore is the firestore_async view of the same documents.
+
+FakeMessaging mimics firebase_admin.messaging send/topic calls (and their
+_async variants) with configurable latency and error rate. FakeTaskQueues
+records Cloud Tasks enqueued through firebase_admin.functions so benchmarks
+can dispatch them when they fall due.
+"""
+
+import asyncio
+import copy
+import itertools
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from typing import Any, AsyncIterator, Iterable, Iterator
+
+from firebase_admin import exceptions as firebase_exceptions
+from google.api_core import exceptions as gexc
+from google.cloud.firestore_v1 import transforms
+from google.cloud.firestore_v1.vector import Vector
+
+
+class FirestoreStats:
+    """Thread-safe document read/write counters."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reads = 0
+        self.writes = 0
+
+    def read(self, n: int = 1) -> None:
+        with self._lock:
+            self.reads += n
+
+    def write(self, n: int = 1) -> None:
+        with self._lock:
+            self.writes += n
+
+    def snapshot(self) -> dict[str, int]:
+        with self._lock:
+            return {"reads": self.reads, "writes": self.writes}
+
+    def reset(self) -> None:
+        with self._lock:
+            self.reads = 0
+            self.writes = 0
+
+
+def _get_field(data: dict[str, Any], field_path: str) -> Any:
+    value: Any = data
+    for part in field_path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def _set_field(data: dict[str, Any], field_path: str, value: Any) -> None:
+    parts = field_path.split(".")
+    target = data
+    for part in parts[:-1]:
+        if not isinstance(target.get(part), dict):
+            target[part] = {}
+        target = target[part]
+    if value is transforms.DELETE_FIELD:
+        target.pop(parts[-1], None)
+    else:
+        target[parts[-1]] = _resolve(target.get(parts[-1]), value)
+
+
+def _resolve(current: Any, value: Any) -> Any:
+    """Apply a Firestore transform sentinel against the current value."""
+    if value is transforms.SERVER_TIMESTAMP:
+        return time.time()
+    if isinstance(value, transforms.Increment):
+        return (current if isinstance(current, (int, float)) else 0) + value.value
+    if isinstance(value, transforms.Maximum):
+        return max(current, value.value) if isinstance(current, (int, float)) else value.value
+    if isinstance(value, transforms.Minimum):
+        return min(current, value.value) if isinstance(current, (int, float)) else value.value
+    if isinstance(value, transforms.ArrayUnion):
+        result = list(current) if isinstance(current, list) else []
+        for item in value.values:
+            if item not in result:
+                result.append(item)
+        return result
+    if isinstance(value, transforms.ArrayRemove):
+        result = list(current) if isinstance(current, list) else []
+        return [item for item in result if item not in value.values]
+    if isinstance(value, Vector):
+        return list(value)
+    if isinstance(value, dict):
+        base = current if isinstance(current, dict) else {}
+        return {k: _resolve(base.get(k), v) for k, v in value.items() if v is not transforms.DELETE_FIELD}
+    return copy.deepcopy(value)
+
+
+def _deep_merge(target: dict[str, Any], updates: dict[str, Any]) -> None:
+    for key, value in updates.items():
+        if value is transforms.DELETE_FIELD:
+            target.pop(key, None)
+        elif isinstance(value, dict) and isinstance(target.get(key), dict):
+            _deep_merge(target[key], value)
+        else:
+            target[key] = _resolve(target.get(key), value)
+
+
+def _compare(op: str, left: Any, right: Any) -> bool:
+    try:
+        if op == "==":
+            return left == right
+        if op == "!=":
+            return left is not None and left != right
+        if op == "<":
+            return left is not None and left < right
+        if op == "<=":
+            return left is not None and left <= right
+        if op == ">":
+            return left is not None and left > right
+        if op == ">=":
+            return left is not None and left >= right
+        if op == "in":
+            return left in right
+        if op == "not-in":
+            return left is not None and left not in right
+        if op == "array_contains":
+            return isinstance(left, list) and right in left
+        if op == "array_contains_any":
+            return isinstance(left, list) and any(item in left for item in right)
+    except TypeError:
+        return False
+    raise ValueError(f"Unsupported operator: {op}")
+
+
+class FakeDocumentSnapshot:
+    def __init__(self, reference: "FakeDocumentReference", data: dict[str, Any] | None) -> None:
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self) -> dict[str, Any] | None:
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path: str) -> Any:
+        return _get_field(self._data or {}, field_path)
+
+
+class FakeDocumentReference:
+    def __init__(self, client: "FakeFirestore", path: str) -> None:
+        self._client = client
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    @property
+    def parent(self) -> "FakeCollectionReference":
+        return FakeCollectionReference(self._client, self.path.rsplit("/", 1)[0])
+
+    def collection(self, name: str) -> "FakeCollectionReference":
+        return FakeCollectionReference(self._client, f"{self.path}/{name}")
+
+    def collections(self) -> list["FakeCollectionReference"]:
+        return [FakeCollectionReference(self._client, p) for p in self._client._subcollection_paths(self.path)]
+
+    def get(self, field_paths: Any = None, transaction: Any = None, **_: Any) -> FakeDocumentSnapshot:
+        self._client._maybe_fail("get")
+        self._client.stats.read()
+        return FakeDocumentSnapshot(self, self._client._read(self.path))
+
+    def set(self, data: dict[str, Any], merge: bool = False) -> None:
+        self._client._maybe_fail("set")
+        self._client._write_set(self.path, data, merge)
+
+    def update(self, field_updates: dict[str, Any]) -> None:
+        self._client._maybe_fail("update")
+        self._client._write_update(self.path, field_updates)
+
+    def create(self, data: dict[str, Any]) -> None:
+        self._client._maybe_fail("create")
+        self._client._write_create(self.path, data)
+
+    def delete(self) -> None:
+        self._client._maybe_fail("delete")
+        self._client._write_delete(self.path)
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, FakeDocumentReference) and other.path == self.path
+
+    def __hash__(self) -> int:
+        return hash(self.path)
+
+
+class FakeQuery:
+    def __init__(
+        self,
+        client: "FakeFirestore",
+        parent_path: str | None,
+        collection_id: str | None = None,
+        filters: tuple = (),
+        orders: tuple = (),
+        limit_count: int | None = None,
+        offset_count: int = 0,
+        start: tuple | None = None,
+        end: tuple | None = None,
+    ) -> None:
+        self._client = client
+        self._parent_path = parent_path
+        self._collection_id = collection_id
+        self._filters = filters
+        self._orders = orders
+        self._limit = limit_count
+        self._offset = offset_count
+        self._start = start
+        self._end = end
+
+    def _copy(self, **changes: Any) -> "FakeQuery":
+        params = {
+            "filters": self._filters,
+            "orders": self._orders,
+            "limit_count": self._limit,
+            "offset_count": self._offset,
+            "start": self._start,
+            "end": self._end,
+        }
+        params.update(changes)
+        return FakeQuery(self._client, self._parent_path, self._collection_id, **params)
+
+    def where(self, field_path: str | None = None, op_string: str | None = None, value: Any = None, *, filter: Any = None) -> "FakeQuery":
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path: str, direction: str = "ASCENDING") -> "FakeQuery":
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count: int) -> "FakeQuery":
+        return self._copy(limit_count=count)
+
+    def offset(self, num_to_skip: int) -> "FakeQuery":
+        return self._copy(offset_count=num_to_skip)
+
+    def select(self, field_paths: Iterable[str]) -> "FakeQuery":
+        return self
+
+    def start_at(self, document_fields_or_snapshot: Any) -> "FakeQuery":
+        return self._copy(start=(document_fields_or_snapshot, False))
+
+    def start_after(self, document_fields_or_snapshot: Any) -> "FakeQuery":
+        return self._copy(start=(document_fields_or_snapshot, True))
+
+    def end_before(self, document_fields_or_snapshot: Any) -> "FakeQuery":
+        return self._copy(end=(document_fields_or_snapshot, True))
+
+    def end_at(self, document_fields_or_snapshot: Any) -> "FakeQuery":
+        return self._copy(end=(document_fields_or_snapshot, False))
+
+    def _candidates(self) -> list[tuple[str, dict[str, Any]]]:
+        return self._client._scan(self._parent_path, self._collection_id)
+
+    def _sort_key(self, path: str, data: dict[str, Any]) -> tuple:
+        key = []
+        for field_path, direction in self._orders or (("__name__", "ASCENDING"),):
+            value = path if field_path == "__name__" else _get_field(data, field_path)
+            key.append((value is None, value))
+        return tuple(key)
+
+    def _cursor_key(self, cursor: Any) -> tuple:
+        if isinstance(cursor, FakeDocumentSnapshot):
+            return self._sort_key(cursor.reference.path, cursor._data or {})
+        if isinstance(cursor, FakeDocumentReference):
+            return self._sort_key(cursor.path, {})
+        if isinstance(cursor, dict):
+            name = cursor.get("__name__")
+            return self._sort_key(name.path if isinstance(name, FakeDocumentReference) else "", cursor)
+        values = cursor if isinstance(cursor, (list, tuple)) else [cursor]
+        return tuple((v is None, v) for v in values)
+
+    def _results(self) -> list[tuple[str, dict[str, Any]]]:
+        self._client._maybe_fail("query")
+        rows = [
+            (path, data) for path, data in self._candidates()
+            if all(_compare(op, path.rsplit("/", 1)[-1] if fp == "__name__" else _get_field(data, fp), value)
+                   for fp, op, value in self._filters)
+        ]
+        descending = bool(self._orders) and self._orders[0][1] == "DESCENDING"
+        rows.sort(key=lambda row: self._sort_key(*row), reverse=descending)
+        if self._start is not None:
+            cursor, exclusive = self._start
+            ck = self._cursor_key(cursor)
+            cmp = (lambda k: k > ck) if exclusive else (lambda k: k >= ck)
+            if descending:
+                cmp = (lambda k: k < ck) if exclusive else (lambda k: k <= ck)
+            rows = [row for row in rows if cmp(self._sort_key(*row)[:len(ck)])]
+        if self._end is not None:
+            cursor, exclusive = self._end
+            ck = self._cursor_key(cursor)
+            cmp = (lambda k: k < ck) if exclusive else (lambda k: k <= ck)
+            rows = [row for row in rows if cmp(self._sort_key(*row)[:len(ck)])]
+        rows = rows[self._offset:]
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        return rows
+
+    def stream(self, transaction: Any = None, **_: Any) -> Iterator[FakeDocumentSnapshot]:
+        rows = self._results()
+        self._client.stats.read(max(len(rows), 1))
+        for path, data in rows:
+            yield FakeDocumentSnapshot(FakeDocumentReference(self._client, path), copy.deepcopy(data))
+
+    def get(self, transaction: Any = None, **_: Any) -> list[FakeDocumentSnapshot]:
+        return list(self.stream(transaction=transaction))
+
+    def count(self, alias: str | None = None) -> "_FakeAggregation":
+        return _FakeAggregation(self)
+
+    def find_nearest(
+        self,
+        vector_field: str,
+        query_vector: Any,
+        limit: int,
+        distance_measure: Any = None,
+        distance_result_field: str | None = None,
+        **_: Any,
+    ) -> "FakeVectorQuery":
+        return FakeVectorQuery(self, vector_field, list(query_vector), limit, distance_result_field)
+
+    def get_partitions(self, partition_count: int, **_: Any) -> Iterator["FakeQueryPartition"]:
+        paths = [path for path, _ in self._candidates()]
+        paths.sort()
+        self._client.stats.read(1)
+        if partition_count <= 1 or len(paths) < 2:
+            yield FakeQueryPartition(self, None, None)
+            return
+        step = max(1, math.ceil(len(paths) / partition_count))
+        bounds = [paths[i] for i in range(step, len(paths), step)]
+        previous = None
+        for bound in bounds + [None]:
+            yield FakeQueryPartition(self, previous, bound)
+            previous = bound
+
+
+class FakeQueryPartition:
+    """Mirrors google.cloud.firestore_v1.base_query.QueryPartition."""
+
+    def __init__(self, query: FakeQuery, start_at: str | None, end_at: str | None) -> None:
+        self._query = query
+        self.start_at = start_at
+        self.end_at = end_at
+
+    def query(self) -> FakeQuery:
+        query = self._query.order_by("__name__")
+        if self.start_at is not None:
+            query = query.start_at(FakeDocumentReference(query._client, self.start_at))
+        if self.end_at is not None:
+            query = query.end_before(FakeDocumentReference(query._client, self.end_at))
+        return query
+
+
+class _FakeAggregation:
+    def __init__(self, query: FakeQuery) -> None:
+        self._query = query
+
+    def get(self, **_: Any) -> list[list[Any]]:
+        rows = self._query._results()
+        self._query._client.stats.read(max(1, math.ceil(len(rows) / 1000)))
+
+        class _Result:
+            def __init__(self, value: int) -> None:
+                self.value = value
+                self.alias = "count"
+
+        return [[_Result(len(rows))]]
+
+
+class FakeVectorQuery:
+    """Brute-force cosine nearest-neighbour search over a FakeQuery."""
+
+    def __init__(self, query: FakeQuery, vector_field: str, query_vector: list[float], limit: int,
+                 distance_result_field: str | None) -> None:
+        self._query = query
+        self._vector_field = vector_field
+        self._query_vector = query_vector
+        self._limit = limit
+        self._distance_result_field = distance_result_field
+
+    def where(self, *args: Any, **kwargs: Any) -> "FakeVectorQuery":
+        return FakeVectorQuery(self._query.where(*args, **kwargs), self._vector_field, self._query_vector,
+                               self._limit, self._distance_result_field)
+
+    def _distance(self, vector: list[float]) -> float:
+        dot = sum(a * b for a, b in zip(vector, self._query_vector))
+        norm = math.sqrt(sum(a * a for a in vector)) * math.sqrt(sum(b * b for b in self._query_vector))
+        return 1.0 - dot / norm if norm else 1.0
+
+    def stream(self, **_: Any) -> Iterator[FakeDocumentSnapshot]:
+        self._query._client._maybe_fail("vector_query")
+        scored = []
+        for path, data in self._query._results():
+            vector = _get_field(data, self._vector_field)
+            if not isinstance(vector, list) or len(vector) != len(self._query_vector):
+                continue
+            scored.append((self._distance(vector), path, data))
+        scored.sort(key=lambda row: row[0])
+        scored = scored[:self._limit]
+        self._query._client.stats.read(max(len(scored), 1))
+        for distance, path, data in scored:
+            data = copy.deepcopy(data)
+            if self._distance_result_field:
+                data[self._distance_result_field] = distance
+            yield FakeDocumentSnapshot(FakeDocumentReference(self._query._client, path), data)
+
+    def get(self, **_: Any) -> list[FakeDocumentSnapshot]:
+        return list(self.stream())
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, client: "FakeFirestore", path: str) -> None:
+        super().__init__(client, path)
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def document(self, document_id: str | None = None) -> FakeDocumentReference:
+        if document_id is None:
+            document_id = uuid.uuid4().hex[:20]
+        if "/" in document_id:
+            raise ValueError(f"Invalid document id: {document_id!r}")
+        if len(document_id.encode("utf-8")) > 1500:
+            raise gexc.InvalidArgument("Document name exceeds 1500 bytes")
+        return FakeDocumentReference(self._client, f"{self.path}/{document_id}")
+
+    def add(self, data: dict[str, Any]) -> tuple[float, FakeDocumentReference]:
+        ref = self.document()
+        ref.set(data)
+        return time.time(), ref
+
+    def list_documents(self, page_size: int | None = None) -> Iterator[FakeDocumentReference]:
+        for path, _ in self._client._scan(self.path, None):
+            yield FakeDocumentReference(self._client, path)
+
+
+class FakeWriteBatch:
+    def __init__(self, client: "FakeFirestore") -> None:
+        self._client = client
+        self._ops: list[tuple[str, str, Any, bool]] = []
+
+    def set(self, reference: FakeDocumentReference, document_data: dict[str, Any], merge: bool = False) -> None:
+        self._ops.append(("set", reference.path, document_data, merge))
+
+    def update(self, reference: FakeDocumentReference, field_updates: dict[str, Any]) -> None:
+        self._ops.append(("update", reference.path, field_updates, False))
+
+    def create(self, reference: FakeDocumentReference, document_data: dict[str, Any]) -> None:
+        self._ops.append(("create", reference.path, document_data, False))
+
+    def delete(self, reference: FakeDocumentReference) -> None:
+        self._ops.append(("delete", reference.path, None, False))
+
+    def __len__(self) -> int:
+        return len(self._ops)
+
+    def commit(self) -> list[Any]:
+        if len(self._ops) > 500:
+            raise gexc.InvalidArgument("maximum 500 writes allowed per request")
+        self._client._maybe_fail("commit")
+        with self._client._lock:
+            for op, path, data, merge in self._ops:
+                self._client._apply(op, path, data, merge)
+        self._ops = []
+        return []
+
+
+class FakeTransaction(FakeWriteBatch):
+    """
+    Transaction compatible with google.cloud.firestore.transactional.
+
+    Transactions are serialized with a client-wide lock, which makes them
+    trivially serializable for concurrent benchmarks.
+    """
+
+    def __init__(self, client: "FakeFirestore", max_attempts: int = 5, read_only: bool = False) -> None:
+        super().__init__(client)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id: bytes | None = None
+        self._held = False
+
+    @property
+    def in_progress(self) -> bool:
+        return self._id is not None
+
+    def _clean_up(self) -> None:
+        self._ops = []
+        self._id = None
+
+    def _begin(self, retry_id: Any = None) -> None:
+        self._client._txn_lock.acquire()
+        self._held = True
+        self._id = uuid.uuid4().bytes
+
+    def _release(self) -> None:
+        if self._held:
+            self._held = False
+            self._client._txn_lock.release()
+
+    def _commit(self) -> list[Any]:
+        try:
+            return self.commit()
+        finally:
+            self._clean_up()
+            self._release()
+
+    def _rollback(self) -> None:
+        self._clean_up()
+        self._release()
+
+    def get_all(self, references: Iterable[FakeDocumentReference], **_: Any) -> Iterator[FakeDocumentSnapshot]:
+        return self._client.get_all(references)
+
+    def get(self, ref_or_query: Any, **_: Any) -> Any:
+        if isinstance(ref_or_query, FakeDocumentReference):
+            return iter([ref_or_query.get()])
+        return ref_or_query.stream()
+
+
+class FakeBulkWriter:
+    """
+    Applies writes immediately; mirrors the BulkWriter surface used by migrations.
+
+    The real BulkWriter commits asynchronously in batches of 20, so RPC
+    latency is charged once per 20 operations rather than per write.
+    """
+
+    batch_size = 20
+
+    def __init__(self, client: "FakeFirestore") -> None:
+        self._client = client
+        self._error_callback = None
+        self._success_callback = None
+        self._operations = itertools.count(1)
+
+    def on_write_error(self, callback: Any) -> None:
+        self._error_callback = callback
+
+    def on_write_result(self, callback: Any) -> None:
+        self._success_callback = callback
+
+    def _run(self, op: str, reference: FakeDocumentReference, data: Any = None, merge: bool = False) -> None:
+        if next(self._operations) % self.batch_size == 0:
+            self._client._maybe_fail("bulk")
+        with self._client._lock:
+            self._client._apply(op, reference.path, data, merge)
+        if self._success_callback:
+            self._success_callback(reference, None, self)
+
+    def set(self, reference: FakeDocumentReference, document_data: dict[str, Any], merge: bool = False, **_: Any) -> None:
+        self._run("set", reference, document_data, merge)
+
+    def create(self, reference: FakeDocumentReference, document_data: dict[str, Any], **_: Any) -> None:
+        self._run("create", reference, document_data)
+
+    def update(self, reference: FakeDocumentReference, field_updates: dict[str, Any], **_: Any) -> None:
+        self._run("update", reference, field_updates)
+
+    def delete(self, reference: FakeDocumentReference, **_: Any) -> None:
+        self._run("delete", reference)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class FakeFirestore:
+    """
+    In-memory Firestore client.
+
+    Args:
+        error_rate: Probability that any single RPC raises ServiceUnavailable
+        latency_ms: Artificial latency added to every RPC
+        seed: Random seed for error injection
+    """
+
+    def __init__(self, error_rate: float = 0.0, latency_ms: float = 0.0, seed: int | None = None) -> None:
+        self._docs: dict[str, dict[str, Any]] = {}
+        self._lock = threading.RLock()
+        self._txn_lock = threading.RLock()
+        self._random = random.Random(seed)
+        self.error_rate = error_rate
+        self.latency_ms = latency_ms
+        self.stats = FirestoreStats()
+
+    # --- client surface ---
+
+    def collection(self, path: str) -> FakeCollectionReference:
+        return FakeCollectionReference(self, path)
+
+    def document(self, path: str) -> FakeDocumentReference:
+        return FakeDocumentReference(self, path)
+
+    def collection_group(self, collection_id: str) -> FakeQuery:
+        return FakeQuery(self, None, collection_id)
+
+    def collections(self) -> list[FakeCollectionReference]:
+        return [FakeCollectionReference(self, p) for p in self._subcollection_paths(None)]
+
+    def batch(self) -> FakeWriteBatch:
+        return FakeWriteBatch(self)
+
+    def transaction(self, max_attempts: int = 5, read_only: bool = False) -> FakeTransaction:
+        return FakeTransaction(self, max_attempts, read_only)
+
+    def bulk_writer(self, options: Any = None) -> FakeBulkWriter:
+        return FakeBulkWriter(self)
+
+    def get_all(self, references: Iterable[FakeDocumentReference], field_paths: Any = None,
+                transaction: Any = None, **_: Any) -> Iterator[FakeDocumentSnapshot]:
+        references = list(references)
+        self._maybe_fail("get_all")
+        self.stats.read(len(references))
+        for ref in references:
+            yield FakeDocumentSnapshot(ref, self._read(ref.path))
+
+    def recursive_delete(self, reference: Any, bulk_writer: Any = None, chunk_size: int = 5000) -> int:
+        prefix = reference.path + "/"
+        with self._lock:
+            paths = [p for p in self._docs if p.startswith(prefix) or p == reference.path]
+            for path in paths:
+                del self._docs[path]
+        self.stats.read(len(paths))
+        self.stats.write(len(paths))
+        return len(paths)
+
+    # --- helpers used by benchmarks ---
+
+    def seed(self, path: str, data: dict[str, Any]) -> None:
+        """Write a document without counting it as a benchmark write."""
+        with self._lock:
+            self._docs[path] = _resolve(None, data)
+
+    def dump(self, prefix: str = "") -> dict[str, dict[str, Any]]:
+        with self._lock:
+            return {p: copy.deepcopy(d) for p, d in self._docs.items() if p.startswith(prefix)}
+
+    # --- internals ---
+
+    def _maybe_fail(self, operation: str) -> None:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        if self.error_rate and self._random.random() < self.error_rate:
+            raise gexc.ServiceUnavailable(f"Injected Firestore failure during {operation}")
+
+    def _read(self, path: str) -> dict[str, Any] | None:
+        with self._lock:
+            data = self._docs.get(path)
+            return copy.deepcopy(data) if data is not None else None
+
+    def _scan(self, parent_path: str | None, collection_id: str | None) -> list[tuple[str, dict[str, Any]]]:
+        with self._lock:
+            rows = []
+            for path, data in self._docs.items():
+                parent, _, _ = path.rpartition("/")
+                if parent_path is not None and parent != parent_path:
+                    continue
+                if collection_id is not None and parent.rsplit("/", 1)[-1] != collection_id:
+                    continue
+                rows.append((path, copy.deepcopy(data)))
+            return rows
+
+    def _subcollection_paths(self, document_path: str | None) -> list[str]:
+        with self._lock:
+            found = set()
+            for path in self._docs:
+                segments = path.split("/")
+                if document_path is None:
+                    found.add(segments[0])
+                    continue
+                depth = len(document_path.split("/"))
+                if path.startswith(document_path + "/") and len(segments) > depth + 1:
+                    found.add("/".join(segments[:depth + 1]))
+            return sorted(found)
+
+    def _write_set(self, path: str, data: dict[str, Any], merge: bool) -> None:
+        with self._lock:
+            self._apply("set", path, data, merge)
+
+    def _write_update(self, path: str, data: dict[str, Any]) -> None:
+        with self._lock:
+            self._apply("update", path, data, False)
+
+    def _write_create(self, path: str, data: dict[str, Any]) -> None:
+        with self._lock:
+            self._apply("create", path, data, False)
+
+    def _write_delete(self, path: str) -> None:
+        with self._lock:
+            self._apply("delete", path, None, False)
+
+    def _apply(self, op: str, path: str, data: Any, merge: bool) -> None:
+        self.stats.write()
+        if op == "delete":
+            self._docs.pop(path, None)
+        elif op == "create":
+            if path in self._docs:
+                raise gexc.AlreadyExists(f"Document already exists: {path}")
+            self._docs[path] = _resolve(None, data)
+        elif op == "update":
+            if path not in self._docs:
+                raise gexc.NotFound(f"No document to update: {path}")
+            doc = self._docs[path]
+            for field_path, value in data.items():
+                _set_field(doc, field_path, value)
+        elif merge and path in self._docs:
+            _deep_merge(self._docs[path], data)
+        else:
+            self._docs[path] = _resolve(None, data)
+
+
+class _AsyncDocumentReference:
+    def __init__(self, client: "FakeAsyncFirestore", reference: FakeDocumentReference) -> None:
+        self._client = client
+        self._reference = reference
+        self.path = reference.path
+        self.id = reference.id
+
+    def collection(self, name: str) -> "_AsyncCollectionReference":
+        return _AsyncCollectionReference(self._client, self._reference.collection(name))
+
+    async def get(self, field_paths: Any = None, transaction: Any = None, **_: Any) -> FakeDocumentSnapshot:
+        await self._client._rpc("get")
+        return self._reference.get()
+
+    async def set(self, data: dict[str, Any], merge: bool = False) -> None:
+        await self._client._rpc("set")
+        self._reference.set(data, merge=merge)
+
+    async def update(self, field_updates: dict[str, Any]) -> None:
+        await self._client._rpc("update")
+        self._reference.update(field_updates)
+
+    async def create(self, data: dict[str, Any]) -> None:
+        await self._client._rpc("create")
+        self._reference.create(data)
+
+    async def delete(self) -> None:
+        await self._client._rpc("delete")
+        self._reference.delete()
+
+
+class _AsyncQuery:
+    """Async view of a FakeQuery or FakeVectorQuery; builder methods wrap their result."""
+
+    def __init__(self, client: "FakeAsyncFirestore", query: Any) -> None:
+        self._client = client
+        self._query = query
+
+    def __getattr__(self, name: str) -> Any:
+        method = getattr(self._query, name)
+
+        def build(*args: Any, **kwargs: Any) -> "_AsyncQuery":
+            return _AsyncQuery(self._client, method(*args, **kwargs))
+        return build
+
+    async def stream(self, transaction: Any = None, **_: Any) -> AsyncIterator[FakeDocumentSnapshot]:
+        await self._client._rpc("query")
+        for snapshot in self._query.stream():
+            yield snapshot
+
+    async def get(self, transaction: Any = None, **_: Any) -> list[FakeDocumentSnapshot]:
+        return [snapshot async for snapshot in self.stream()]
+
+
+class _AsyncCollectionReference(_AsyncQuery):
+    def __init__(self, client: "FakeAsyncFirestore", collection: FakeCollectionReference) -> None:
+        super().__init__(client, collection)
+        self.path = collection.path
+        self.id = collection.id
+
+    def document(self, document_id: str | None = None) -> _AsyncDocumentReference:
+        return _AsyncDocumentReference(self._client, self._query.document(document_id))
+
+
+class FakeAsyncFirestore:
+    """
+    firestore_async client over a FakeFirestore's documents and stats.
+
+    The owner's latency_ms and error_rate apply per RPC, but the latency is
+    awaited instead of slept, so concurrent coroutines overlap their RPCs.
+    """
+
+    def __init__(self, owner: FakeFirestore) -> None:
+        self._owner = owner
+        # Shares _docs, locks and stats; RPC latency and errors are injected by _rpc()
+        self._sync = copy.copy(owner)
+        self._sync.latency_ms = 0.0
+        self._sync.error_rate = 0.0
+
+    def collection(self, path: str) -> _AsyncCollectionReference:
+        return _AsyncCollectionReference(self, self._sync.collection(path))
+
+    def document(self, path: str) -> _AsyncDocumentReference:
+        return _AsyncDocumentReference(self, self._sync.document(path))
+
+    def collection_group(self, collection_id: str) -> _AsyncQuery:
+        return _AsyncQuery(self, self._sync.collection_group(collection_id))
+
+    async def get_all(self, references: Iterable[_AsyncDocumentReference], field_paths: Any = None,
+                      transaction: Any = None, **_: Any) -> AsyncIterator[FakeDocumentSnapshot]:
+        references = list(references)
+        await self._rpc("get_all")
+        for snapshot in self._sync.get_all([ref._reference for ref in references]):
+            yield snapshot
+
+    async def _rpc(self, operation: str) -> None:
+        if self._owner.latency_ms:
+            await asyncio.sleep(self._owner.latency_ms / 1000)
+        if self._owner.error_rate and self._owner._random.random() < self._owner.error_rate:
+            raise gexc.ServiceUnavailable(f"Injected Firestore failure during {operation}")
+
+
+class FakeMessaging:
+    """
+    Fake firebase_admin.messaging backend.
+
+    Records every message sent and supports per-send latency and error rate.
+    topic_latency_ms is added to sends addressed to a topic or condition,
+    for FCM's server-side topic fan-out.
+    """
+
+    def __init__(self, latency_ms: float = 0.0, error_rate: float = 0.0, seed: int | None = None,
+                 topic_latency_ms: float = 0.0) -> None:
+        self.latency_ms = latency_ms
+        self.topic_latency_ms = topic_latency_ms
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.sent: list[Any] = []
+        self.failures = 0
+        self.rpcs = 0
+        self.topic_subscriptions: dict[str, set[str]] = {}
+
+    def _deliver(self, message: Any) -> str:
+        with self._lock:
+            fail = self.error_rate and self._random.random() < self.error_rate
+            if fail:
+                self.failures += 1
+            else:
+                self.sent.append(message)
+            message_id = f"projects/bench/messages/{next(self._ids)}"
+        if fail:
+            raise gexc.ServiceUnavailable("Injected FCM failure")
+        return message_id
+
+    def _rpc(self) -> None:
+        with self._lock:
+            self.rpcs += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+
+    async def _rpc_async(self) -> None:
+        with self._lock:
+            self.rpcs += 1
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+
+    def send(self, message: Any, dry_run: bool = False, app: Any = None) -> str:
+        self._rpc()
+        if self.topic_latency_ms and (getattr(message, "topic", None) or getattr(message, "condition", None)):
+            time.sleep(self.topic_latency_ms / 1000)
+        return self._deliver(message)
+
+    def send_each(self, messages: list[Any], dry_run: bool = False, app: Any = None) -> Any:
+        self._rpc()
+        return _FakeBatchResponse([self._safe_deliver(m) for m in messages])
+
+    def send_each_for_multicast(self, multicast_message: Any, dry_run: bool = False, app: Any = None) -> Any:
+        self._rpc()
+        responses = []
+        for token in multicast_message.tokens:
+            responses.append(self._safe_deliver(_MulticastCopy(multicast_message, token)))
+        return _FakeBatchResponse(responses)
+
+    async def send_each_async(self, messages: list[Any], dry_run: bool = False, app: Any = None) -> Any:
+        await self._rpc_async()
+        return _FakeBatchResponse([self._safe_deliver(m) for m in messages])
+
+    async def send_each_for_multicast_async(self, multicast_message: Any, dry_run: bool = False,
+                                            app: Any = None) -> Any:
+        await self._rpc_async()
+        return _FakeBatchResponse([self._safe_deliver(_MulticastCopy(multicast_message, token))
+                                   for token in multicast_message.tokens])
+
+    def subscribe_to_topic(self, tokens: Any, topic: str, app: Any = None) -> Any:
+        self._rpc()
+        tokens = [tokens] if isinstance(tokens, str) else list(tokens)
+        with self._lock:
+            self.topic_subscriptions.setdefault(topic, set()).update(tokens)
+        return _FakeTopicResponse(len(tokens))
+
+    def unsubscribe_from_topic(self, tokens: Any, topic: str, app: Any = None) -> Any:
+        self._rpc()
+        tokens = [tokens] if isinstance(tokens, str) else list(tokens)
+        with self._lock:
+            self.topic_subscriptions.setdefault(topic, set()).difference_update(tokens)
+        return _FakeTopicResponse(len(tokens))
+
+    def _safe_deliver(self, message: Any) -> "_FakeSendResponse":
+        try:
+            return _FakeSendResponse(self._deliver(message), None)
+        except gexc.ServiceUnavailable as e:
+            return _FakeSendResponse(None, e)
+
+    def condition_tokens(self, condition: str) -> set[str]:
+        """Tokens matched by a condition of the form "'a' in topics && !('b' in topics)"."""
+        excluded = set(re.findall(r"!\('([^']+)' in topics\)", condition))
+        included = set(re.findall(r"'([^']+)' in topics", condition)) - excluded
+        with self._lock:
+            tokens = set().union(*(self.topic_subscriptions.get(t, set()) for t in included))
+            return tokens - set().union(*(self.topic_subscriptions.get(t, set()) for t in excluded))
+
+    def deliveries(self) -> int:
+        """Number of device deliveries (topic and condition messages count once per matching device)."""
+        total = 0
+        for message in list(self.sent):
+            topic = getattr(message, "topic", None)
+            condition = getattr(message, "condition", None)
+            if condition:
+                total += len(self.condition_tokens(condition))
+            elif topic:
+                with self._lock:
+                    total += len(self.topic_subscriptions.get(topic, ()))
+            else:
+                total += 1
+        return total
+
+    def reset(self) -> None:
+        with self._lock:
+            self.sent = []
+            self.failures = 0
+            self.rpcs = 0
+
+
+class _MulticastCopy:
+    def __init__(self, multicast: Any, token: str) -> None:
+        self.__dict__.update(vars(multicast))
+        self.token = token
+
+
+class _FakeSendResponse:
+    def __init__(self, message_id: str | None, exception: Exception | None) -> None:
+        self.message_id = message_id
+        self.exception = exception
+        self.success = exception is None
+
+
+class _FakeBatchResponse:
+    def __init__(self, responses: list[_FakeSendResponse]) -> None:
+        self.responses = responses
+        self.success_count = sum(1 for r in responses if r.success)
+        self.failure_count = len(responses) - self.success_count
+
+
+class _FakeTopicResponse:
+    def __init__(self, count: int) -> None:
+        self.success_count = count
+        self.failure_count = 0
+        self.errors: list[Any] = []
+
+
+class FakeTaskQueues:
+    """
+    Fake firebase_admin.functions task queues.
+
+    Tasks are recorded with their due time (by `clock`) instead of being
+    dispatched; benchmarks pop and run them with pop_due(). Named tasks
+    (TaskOptions.task_id) are deduplicated like Cloud Tasks does: reusing a
+    name raises AlreadyExistsError, even after the task has run.
+    """
+
+    def __init__(self, clock: Any = time.time) -> None:
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        # (due_at, task number, function name, data)
+        self.tasks: list[tuple[float, int, str, Any]] = []
+        self.enqueued = 0
+        self.task_ids: set[str] = set()
+
+    def task_queue(self, function_name: str, extension_id: str | None = None, app: Any = None) -> "_FakeTaskQueue":
+        return _FakeTaskQueue(self, function_name)
+
+    def pop_due(self, now: float | None = None) -> list[tuple[str, Any]]:
+        """Remove and return (function name, data) of every task due by `now`, oldest first."""
+        now = self._clock() if now is None else now
+        with self._lock:
+            due = sorted(task for task in self.tasks if task[0] <= now)
+            self.tasks = [task for task in self.tasks if task[0] > now]
+        return [(name, data) for _, _, name, data in due]
+
+
+class _FakeTaskQueue:
+    def __init__(self, queues: FakeTaskQueues, function_name: str) -> None:
+        self._queues = queues
+        self._function_name = function_name
+
+    def enqueue(self, task_data: Any, opts: Any = None) -> str:
+        delay = getattr(opts, "schedule_delay_seconds", None) or 0
+        task_id = getattr(opts, "task_id", None)
+        with self._queues._lock:
+            if task_id is not None:
+                if task_id in self._queues.task_ids:
+                    raise firebase_exceptions.AlreadyExistsError(f"Task {task_id} already exists")
+                self._queues.task_ids.add(task_id)
+            number = next(self._queues._ids)
+            self._queues.tasks.append((self._queues._clock() + delay, number, self._function_name,
+                                       copy.deepcopy(task_data)))
+            self._queues.enqueued += 1
+        return f"task-{number}"
+
+    def delete(self, task_id: str) -> None:
+        number = int(task_id.rsplit("-", 1)[-1])
+        with self._queues._lock:
+            self._queues.tasks = [task for task in self._queues.tasks if task[1] != number]
+
+
+class FakeEvent:
+    """Minimal stand-in for firestore_fn.Event passed to trigger handlers."""
+
+    def __init__(self, data: Any, params: dict[str, str]) -> None:
+        self.data = data
+        self.params = params
+        self.id = uuid.uuid4().hex
+        self.time = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
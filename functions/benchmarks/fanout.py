@@ -0,0 +1,292 @@
+"""
+Notification fan-out load generator.
+
+Builds synthetic conversations with N participants and M FCM tokens per
+participant, replays message-creation events against the notification
+trigger (send_message_notification -> _send_notification_for_message) and
+reports sends/sec, wall time, FCM RPCs and Firestore reads. Everything runs
+against FakeFirestore and FakeMessaging, so results only reflect the
+fan-out code path and the configured latencies.
+
+--delivery runs each size with one or more delivery modes: "token" (per-token
+batches, the default), "async" (ASYNC_HANDLERS) and "topic" (the
+conversation is indexed with FCM topic delivery first; its one-time
+subscription RPCs are reported separately). With "token" and "topic" both
+in a sweep, the report ends with the smallest size at which topic delivery
+has the lower p95, which is what FCM_TOPIC_MIN_PARTICIPANTS should be set
+from. The fake does not know how long FCM takes to fan a topic message
+out; --topic-latency-ms adds that to every topic publish, so measure it
+against a real project before trusting the crossover.
+
+Usage (from the functions/ directory):
+    python -m benchmarks.fanout --participants 200 --tokens-per-user 3
+    python -m benchmarks.fanout --sweep 2,10,50,200 --fcm-latency-ms 15 --firestore-latency-ms 3
+    python -m benchmarks.fanout --sweep 10,25,50,100,200 --delivery token,async,topic
+    python -m benchmarks.compare old.json new.json   # works on fan-out results too
+"""
+
+import argparse
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from unittest import mock
+
+import conversation_tokens
+import fcm_topics
+from benchmarks.fakes import FakeFirestore, FakeMessaging
+from benchmarks.harness import BenchEnvironment
+from benchmarks.run import RESULTS_DIR, _git_revision, percentile
+
+
+def seed_group(
+    db: FakeFirestore,
+    conversation_id: str,
+    participants: int,
+    tokens_per_user: int,
+    users_without_tokens: float = 0.0,
+) -> list[str]:
+    """
+    Create a conversation document and its participants' user documents.
+
+    Args:
+        db: Fake Firestore to seed (seeding does not count towards stats)
+        conversation_id: Conversation document ID
+        participants: Number of participants, including the sender
+        tokens_per_user: FCM tokens registered per participant
+        users_without_tokens: Fraction of participants with no FCM tokens
+
+    Returns:
+        Participant IDs; the first one is used as the sender
+    """
+    participant_ids = [f"fanout-user-{n}" for n in range(participants)]
+    db.seed(f"conversations/{conversation_id}", {
+        "type": "group" if participants > 2 else "direct",
+        "name": f"Fan-out group ({participants})",
+        "participantIds": participant_ids,
+        "participants": [{"uid": uid, "name": f"User {n}"} for n, uid in enumerate(participant_ids)],
+    })
+    tokenless = int(participants * users_without_tokens)
+    for n, uid in enumerate(participant_ids):
+        has_tokens = n == 0 or n > tokenless
+        db.seed(f"users/{uid}", {
+            "displayName": f"User {n}",
+            "fcmTokens": [f"fcm-{uid}-{t}" for t in range(tokens_per_user)] if has_tokens else [],
+        })
+    return participant_ids
+
+
+def run_fanout(
+    participants: int,
+    tokens_per_user: int,
+    messages: int,
+    concurrency: int = 1,
+    fcm_latency_ms: float = 0.0,
+    fcm_error_rate: float = 0.0,
+    firestore_latency_ms: float = 0.0,
+    users_without_tokens: float = 0.0,
+    seed: int = 7,
+    delivery: str = "token",
+    topic_latency_ms: float = 0.0,
+) -> dict[str, Any]:
+    """
+    Replay `messages` message-creation events into one synthetic conversation.
+
+    Args:
+        delivery: "token", "async" or "topic" (see the module docstring)
+        topic_latency_ms: Extra latency of a topic publish (FCM's fan-out)
+
+    Returns:
+        Dict with wall time, sends/sec, per-message latency percentiles,
+        FCM RPC and delivery counts and Firestore reads/writes
+    """
+    db = FakeFirestore(latency_ms=firestore_latency_ms, seed=seed)
+    fcm = FakeMessaging(latency_ms=fcm_latency_ms, error_rate=fcm_error_rate, seed=seed,
+                        topic_latency_ms=topic_latency_ms)
+    conversation_id = f"fanout-{participants}x{tokens_per_user}"
+
+    subscription_rpcs = 0
+
+    with BenchEnvironment(firestore=db, messaging=fcm, seed=seed) as env, \
+            mock.patch.object(env.main, "ASYNC_HANDLERS", delivery == "async"), \
+            mock.patch.object(fcm_topics, "TOPIC_MIN_PARTICIPANTS", 0 if delivery == "topic" else 10 ** 9):
+        participant_ids = seed_group(db, conversation_id, participants, tokens_per_user, users_without_tokens)
+        if delivery == "topic":
+            # What index_conversation_tokens does when the group is created
+            conversation_tokens.build(db, conversation_id, db._read(f"conversations/{conversation_id}"))
+            subscription_rpcs = fcm.rpcs
+            fcm.reset()
+            db.stats.reset()
+        paths = []
+        for i in range(messages):
+            path = f"conversations/{conversation_id}/messages/fanout-msg-{i}"
+            db.seed(path, {
+                "text": f"Load test message {i}",
+                "senderId": participant_ids[0],
+                "senderName": "Load Generator",
+                "conversationId": conversation_id,
+                "timestamp": time.time(),
+            })
+            paths.append(path)
+
+        latencies: list[float] = []
+        errors = 0
+        lock = threading.Lock()
+
+        def one(path: str) -> None:
+            nonlocal errors
+            start = time.perf_counter()
+            failed = False
+            try:
+                env.trigger("send_message_notification", path)
+            except Exception:  # noqa: BLE001 - count and keep replaying
+                failed = True
+            with lock:
+                latencies.append((time.perf_counter() - start) * 1000)
+                errors += failed
+
+        wall_start = time.perf_counter()
+        if concurrency <= 1:
+            for path in paths:
+                one(path)
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                list(pool.map(one, paths))
+        wall_seconds = time.perf_counter() - wall_start
+
+    latencies.sort()
+    io_stats = db.stats.snapshot()
+    sends = len(fcm.sent)
+    deliveries = fcm.deliveries()
+    expected = messages * (participants - 1 - int(participants * users_without_tokens)) * tokens_per_user
+    return {
+        "participants": participants,
+        "tokensPerUser": tokens_per_user,
+        "delivery": delivery,
+        "messages": messages,
+        "errors": errors,
+        "wallSeconds": round(wall_seconds, 3),
+        "sends": sends,
+        "sendFailures": fcm.failures,
+        "deliveries": deliveries,
+        "expectedDeliveries": expected,
+        "sendsPerSecond": round(sends / wall_seconds, 1) if wall_seconds else 0.0,
+        "deliveriesPerSecond": round(deliveries / wall_seconds, 1) if wall_seconds else 0.0,
+        "fcmRpcs": fcm.rpcs,
+        "fcmRpcsPerMessage": round(fcm.rpcs / messages, 2),
+        "subscriptionRpcs": subscription_rpcs,
+        "firestoreReads": io_stats["reads"],
+        "firestoreReadsPerMessage": round(io_stats["reads"] / messages, 2),
+        "firestoreWrites": io_stats["writes"],
+        # Same keys as benchmarks.run so benchmarks.compare works on both
+        "firestoreReadsPerRequest": round(io_stats["reads"] / messages, 3),
+        "firestoreWritesPerRequest": round(io_stats["writes"] / messages, 3),
+        "p50Ms": round(percentile(latencies, 0.50), 3),
+        "p95Ms": round(percentile(latencies, 0.95), 3),
+        "p99Ms": round(percentile(latencies, 0.99), 3),
+        "throughputRps": round(messages / wall_seconds, 2) if wall_seconds else 0.0,
+    }
+
+
+def print_report(results: dict[str, Any]) -> None:
+    header = (f"{'scenario':22} {'wall s':>8} {'sends':>8} {'sends/s':>9} {'fcm rpc':>8} "
+              f"{'reads':>8} {'p50':>8} {'p95':>8} {'err':>5}")
+    print(header)
+    print("-" * len(header))
+    for name, r in results["scenarios"].items():
+        print(f"{name:22} {r['wallSeconds']:8.2f} {r['sends']:8d} {r['sendsPerSecond']:9.1f} {r['fcmRpcs']:8d} "
+              f"{r['firestoreReads']:8d} {r['p50Ms']:8.1f} {r['p95Ms']:8.1f} {r['errors']:5d}")
+        if r["deliveries"] != r["expectedDeliveries"] and not r["sendFailures"]:
+            print(f"  ! delivered {r['deliveries']} of {r['expectedDeliveries']} expected")
+        if r.get("subscriptionRpcs"):
+            print(f"  + {r['subscriptionRpcs']} one-time subscription RPCs")
+
+    crossover = results.get("topicCrossover")
+    if crossover is not None:
+        print(f"\nTopic delivery p95 beats per-token from {crossover} participants")
+    elif "topicCrossover" in results:
+        print("\nTopic delivery p95 did not beat per-token at any size in the sweep")
+
+
+def topic_crossover(scenarios: dict[str, Any]) -> int | None:
+    """Smallest size at which topic delivery's p95 is at or below the best per-token mode's."""
+    by_size: dict[int, dict[str, float]] = {}
+    for r in scenarios.values():
+        by_size.setdefault(r["participants"], {})[r["delivery"]] = r["p95Ms"]
+    for size in sorted(by_size):
+        modes = by_size[size]
+        per_token = [modes[m] for m in ("token", "async") if m in modes]
+        if "topic" in modes and per_token and modes["topic"] <= min(per_token):
+            return size
+    return None
+
+
+def main(argv: list[str] | None = None) -> dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Load-test notification fan-out offline")
+    parser.add_argument("--participants", type=int, default=200, help="Participants per conversation")
+    parser.add_argument("--tokens-per-user", type=int, default=2, help="FCM tokens per participant")
+    parser.add_argument("--sweep", help="Comma-separated participant counts to run instead of --participants")
+    parser.add_argument("--messages", type=int, default=20, help="Message-creation events to replay")
+    parser.add_argument("--concurrency", type=int, default=1, help="Concurrent trigger invocations")
+    parser.add_argument("--fcm-latency-ms", type=float, default=10.0, help="Latency per FCM RPC")
+    parser.add_argument("--fcm-error-rate", type=float, default=0.0, help="FCM per-message failure rate (0-1)")
+    parser.add_argument("--firestore-latency-ms", type=float, default=2.0, help="Latency per Firestore RPC")
+    parser.add_argument("--users-without-tokens", type=float, default=0.0,
+                        help="Fraction of participants with no registered tokens")
+    parser.add_argument("--delivery", default="token",
+                        help="Comma-separated delivery modes to run per size: token, async, topic")
+    parser.add_argument("--topic-latency-ms", type=float, default=0.0,
+                        help="Extra latency per topic publish, for FCM's server-side fan-out")
+    parser.add_argument("--output", help="Result JSON path (default: benchmarks/results/fanout-<timestamp>.json)")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sweep.split(",")] if args.sweep else [args.participants]
+    deliveries = args.delivery.split(",")
+    for delivery in deliveries:
+        if delivery not in ("token", "async", "topic"):
+            parser.error(f"unknown delivery mode: {delivery}")
+    results: dict[str, Any] = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "gitRevision": _git_revision(),
+            "python": sys.version.split()[0],
+            "config": vars(args),
+        },
+        "scenarios": {},
+    }
+    for size in sizes:
+        for delivery in deliveries:
+            # Per-token scenarios keep their old names so earlier results still compare
+            name = f"fanout_{size}x{args.tokens_per_user}" + ("" if delivery == "token" else f"_{delivery}")
+            results["scenarios"][name] = run_fanout(
+                size, args.tokens_per_user, args.messages,
+                concurrency=args.concurrency,
+                fcm_latency_ms=args.fcm_latency_ms,
+                fcm_error_rate=args.fcm_error_rate,
+                firestore_latency_ms=args.firestore_latency_ms,
+                users_without_tokens=args.users_without_tokens,
+                seed=args.seed,
+                delivery=delivery,
+                topic_latency_ms=args.topic_latency_ms,
+            )
+    if "topic" in deliveries and len(deliveries) > 1:
+        results["topicCrossover"] = topic_crossover(results["scenarios"])
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, "fanout-" + datetime.datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, default=str)
+
+    print_report(results)
+    print(f"\nResults written to {output}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
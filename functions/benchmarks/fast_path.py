@@ -0,0 +1,208 @@
+"""
+Fast-path classifier evaluation.
+
+Runs fast_path.classify over a labelled sample of chat messages and
+reports the skip rate (messages answered without GPT-4o-mini) and its
+accuracy: a message is labelled trivial when the model has nothing to
+say about it (no cultural context, no idioms). False positives are the
+costly error, since those messages lose their analysis, so they are
+listed individually.
+
+The sample is then sent through analyze_message_context and
+adjust_formality against the OpenAI stub to confirm the OpenAI requests
+actually saved.
+
+Usage (from the functions/ directory):
+    python -m benchmarks.fast_path
+    python -m benchmarks.fast_path --output /tmp/fast_path.json
+"""
+
+import argparse
+import json
+from typing import Any
+
+import fast_path
+from benchmarks.fakes import FakeFirestore
+from benchmarks.harness import BenchEnvironment
+from benchmarks.stubs import UpstreamConfig
+
+# (text, language, trivial)
+LABELLED_SAMPLE: list[tuple[str, str, bool]] = [
+    # Trivial: acknowledgements, laughter, greetings, emoji, links
+    ("ok", "en", True),
+    ("Ok!", "en", True),
+    ("okay", "en", True),
+    ("k", "en", True),
+    ("lol", "en", True),
+    ("LOL", "en", True),
+    ("hahaha", "en", True),
+    ("lmao", "en", True),
+    ("yes", "en", True),
+    ("yeah", "en", True),
+    ("nope", "en", True),
+    ("thanks!", "en", True),
+    ("thank you so much", "en", True),
+    ("thx", "en", True),
+    ("cool", "en", True),
+    ("nice!", "en", True),
+    ("sounds good", "en", True),
+    ("got it", "en", True),
+    ("you too", "en", True),
+    ("good morning", "en", True),
+    ("see you soon", "en", True),
+    ("👍", "en", True),
+    ("😂😂😂", "en", True),
+    ("❤️", "en", True),
+    ("🙏🏽", "en", True),
+    ("!!!", "en", True),
+    ("?", "en", True),
+    ("...", "en", True),
+    ("https://example.com/photos/123", "en", True),
+    ("www.example.org", "en", True),
+    ("vale", "es", True),
+    ("sí", "es", True),
+    ("jajaja", "es", True),
+    ("gracias!", "es", True),
+    ("muchas gracias", "es", True),
+    ("de nada", "es", True),
+    ("buenas noches", "es", True),
+    ("hola", "es", True),
+    ("oui", "fr", True),
+    ("merci beaucoup", "fr", True),
+    ("d'accord", "fr", True),
+    ("mdr", "fr", True),
+    ("salut", "fr", True),
+    ("ja", "de", True),
+    ("danke dir", "de", True),
+    ("alles klar", "de", True),
+    ("gute Nacht", "de", True),
+    ("kkkkk", "pt", True),
+    ("valeu", "pt", True),
+    ("obrigada!", "pt", True),
+    ("tudo bem", "pt", True),
+    ("beleza", "pt", True),
+    ("ok 👍", "en", True),
+    ("oh no", "en", True),
+    ("yes please", "en", True),
+    ("good luck!", "en", True),
+    ("bien sûr", "fr", True),
+    ("claro que sí", "es", True),
+    # Non-trivial: idioms, slang with meaning, plans, questions, content
+    ("break a leg!", "en", False),
+    ("it's raining cats and dogs", "en", False),
+    ("no way", "en", False),
+    ("cool beans", "en", False),
+    ("spill the tea", "en", False),
+    ("that's a piece of cake", "en", False),
+    ("see you at 5", "en", False),
+    ("ok see you at the bar", "en", False),
+    ("can you send the report?", "en", False),
+    ("I'm running late, sorry", "en", False),
+    ("yes, but only after lunch", "en", False),
+    ("happy Diwali!", "en", False),
+    ("bless you", "en", False),
+    ("it's all Greek to me", "en", False),
+    ("let's touch base tomorrow", "en", False),
+    ("check this https://example.com it's hilarious", "en", False),
+    ("10:30?", "en", False),
+    ("no pasa nada", "es", False),
+    ("estoy en las nubes", "es", False),
+    ("¿quedamos mañana?", "es", False),
+    ("me tomas el pelo", "es", False),
+    ("¡qué guay!", "es", False),
+    ("c'est la vie", "fr", False),
+    ("je suis crevé", "fr", False),
+    ("on se voit ce soir ?", "fr", False),
+    ("bon appétit", "fr", False),
+    ("Daumen drücken!", "de", False),
+    ("ich verstehe nur Bahnhof", "de", False),
+    ("Feierabend!", "de", False),
+    ("vamos marcar amanhã?", "pt", False),
+    ("saudade de você", "pt", False),
+    ("pisar na bola", "pt", False),
+    ("お疲れ様です", "ja", False),
+    ("加油", "zh", False),
+    ("إن شاء الله", "ar", False),
+    ("Merry Christmas!", "en", False),
+    ("ok boomer", "en", False),
+    ("no cap", "en", False),
+    ("same here, night owl", "en", False),
+]
+
+
+def evaluate(sample: list[tuple[str, str, bool]]) -> dict[str, Any]:
+    """Skip rate, precision and recall of fast_path.classify on a labelled sample."""
+    skipped = [(text, language, trivial, fast_path.classify(text, language)) for text, language, trivial in sample]
+    predicted = [row for row in skipped if row[3] is not None]
+    true_positives = sum(1 for row in predicted if row[2])
+    labelled_trivial = sum(1 for _, _, trivial in sample if trivial)
+    by_kind: dict[str, int] = {}
+    for row in predicted:
+        by_kind[row[3]] = by_kind.get(row[3], 0) + 1
+    return {
+        "messages": len(sample),
+        "labelledTrivial": labelled_trivial,
+        "skipped": len(predicted),
+        "skipRate": round(len(predicted) / len(sample), 3) if sample else 0.0,
+        "precision": round(true_positives / len(predicted), 3) if predicted else 1.0,
+        "recall": round(true_positives / labelled_trivial, 3) if labelled_trivial else 1.0,
+        "byKind": by_kind,
+        "falsePositives": [text for text, _, trivial, kind in skipped if kind is not None and not trivial],
+        "falseNegatives": [text for text, _, trivial, kind in skipped if kind is None and trivial],
+    }
+
+
+def openai_requests(sample: list[tuple[str, str, bool]], seed: int) -> dict[str, dict[str, int]]:
+    """OpenAI requests (and handler errors) for every sample message, per handler."""
+    calls: list[tuple[str, str, dict[str, Any]]] = []
+    for text, language, _ in sample:
+        calls.append(("analyze_message_context", "analyze_message_context", {"text": text, "language": language}))
+    for target in ("casual", "formal"):
+        for text, language, _ in sample:
+            calls.append(("adjust_formality", f"adjust_formality.{target}",
+                          {"text": text, "target_formality": target, "language": language}))
+
+    results: dict[str, dict[str, int]] = {}
+    with BenchEnvironment(upstream=UpstreamConfig(0.0, 0.0), firestore=FakeFirestore(seed=seed), seed=seed) as env:
+        for i, (handler, label, data) in enumerate(calls):
+            before = env.upstream_stats()["openai"]["requests"]
+            row = results.setdefault(label, {"messages": 0, "openaiRequests": 0, "errors": 0})
+            row["messages"] += 1
+            try:
+                env.call(handler, data, uid=f"bench-user-{i}")
+            except Exception:
+                row["errors"] += 1
+            row["openaiRequests"] += env.upstream_stats()["openai"]["requests"] - before
+    return results
+
+
+def main(argv: list[str] | None = None) -> dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Evaluate the trivial-message fast path")
+    parser.add_argument("--skip-handlers", action="store_true", help="Only evaluate the classifier")
+    parser.add_argument("--output", help="Write the report as JSON to this path")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    report = evaluate(LABELLED_SAMPLE)
+    print(f"{report['messages']} labelled messages ({report['labelledTrivial']} trivial)")
+    print(f"  skipped:   {report['skipped']} ({report['skipRate']:.1%}) {report['byKind']}")
+    print(f"  precision: {report['precision']:.1%}   recall: {report['recall']:.1%}")
+    for text in report["falsePositives"]:
+        print(f"  false positive: {text!r}")
+    for text in report["falseNegatives"]:
+        print(f"  false negative: {text!r}")
+
+    if not args.skip_handlers:
+        report["openaiRequests"] = openai_requests(LABELLED_SAMPLE, args.seed)
+        for label, row in report["openaiRequests"].items():
+            print(f"  {label:26s} {row['openaiRequests']:4d} OpenAI requests for {row['messages']} messages"
+                  f" ({row['errors']} errors)")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""
+Wires main.py to the in-memory fakes and local stub servers.
+
+    with BenchEnvironment(upstream=UpstreamConfig(latency_ms=80)) as env:
+        env.call("translate_message", {"text": "hi", "target_language": "es"}, uid="u1")
+        env.trigger("send_message_notification", "conversations/c1/messages/m1")
+
+Import main only through this module: it sets the environment variables
+that must be in place before main.py (and tracing.py) are imported.
+"""
+
+import contextlib
+import importlib
+import io
+import os
+import sys
+import threading
+from types import ModuleType, SimpleNamespace
+from typing import Any, Callable, Iterator
+from unittest import mock
+
+from benchmarks.fakes import (
+    FakeAsyncFirestore, FakeDocumentReference, FakeDocumentSnapshot, FakeEvent, FakeFirestore, FakeMessaging,
+    FakeTaskQueues,
+)
+from benchmarks.stubs import OpenAIStub, TranslationStub, UpstreamConfig, VertexStub
+
+FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# One structured log line per span would swamp benchmark output
+os.environ.setdefault("TRACE_LOG_SPANS", "0")
+os.environ.setdefault("TRACE_DUMP_INTERVAL_SECONDS", "0")
+os.environ.setdefault("GCLOUD_PROJECT", "message-ai-bench")
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+
+
+def load_main() -> ModuleType:
+    """Import (or return the already imported) functions/main.py."""
+    if FUNCTIONS_DIR not in sys.path:
+        sys.path.insert(0, FUNCTIONS_DIR)
+    return importlib.import_module("main")
+
+
+class _FakeCredentials:
+    valid = True
+    token = "bench-token"
+
+    def refresh(self, request: Any) -> None:
+        pass
+
+
+def _fake_default(*args: Any, **kwargs: Any) -> tuple[_FakeCredentials, str]:
+    return _FakeCredentials(), os.environ["GCLOUD_PROJECT"]
+
+
+class _Auth:
+    def __init__(self, uid: str) -> None:
+        self.uid = uid
+        self.token: dict[str, Any] = {}
+
+
+class _CallableRequest:
+    """Duck-typed https_fn.CallableRequest (no Flask request needed)."""
+
+    def __init__(self, data: Any, uid: str | None, app: Any = None, raw_request: Any = None) -> None:
+        self.data = data
+        self.auth = _Auth(uid) if uid else None
+        self.app = app
+        self.raw_request = raw_request
+        self.instance_id_token = None
+
+
+class _QuietStdout(io.TextIOBase):
+    """
+    sys.stdout replacement that drops writes from threads inside quiet().
+
+    contextlib.redirect_stdout swaps the process-wide sys.stdout, which
+    breaks as soon as handlers run on several threads at once.
+    """
+
+    _local = threading.local()
+    _install_lock = threading.Lock()
+
+    def __init__(self, target: Any) -> None:
+        self._target = target
+
+    # Handler threads inside quiet(); while any is, the async_core loop is quiet too
+    _quiet_threads = 0
+
+    def write(self, text: str) -> int:
+        if getattr(self._local, "depth", 0):
+            return len(text)
+        if self._quiet_threads and threading.current_thread().name == "async-core":
+            return len(text)
+        return self._target.write(text)
+
+    def flush(self) -> None:
+        self._target.flush()
+
+    @classmethod
+    @contextlib.contextmanager
+    def quiet(cls) -> Iterator[None]:
+        with cls._install_lock:
+            if not isinstance(sys.stdout, cls):
+                sys.stdout = cls(sys.stdout)
+        cls._local.depth = getattr(cls._local, "depth", 0) + 1
+        with cls._install_lock:
+            cls._quiet_threads += 1
+        try:
+            yield
+        finally:
+            cls._local.depth -= 1
+            with cls._install_lock:
+                cls._quiet_threads -= 1
+
+
+class BenchEnvironment:
+    """
+    Context manager that points main.py at fakes and stub servers.
+
+    Args:
+        upstream: Default latency/error profile for all stub servers
+        translation / vertex / openai: Per-upstream overrides
+        firestore: FakeFirestore to use (a fresh one by default)
+        messaging: FakeMessaging to use (a fresh one by default)
+        tasks: FakeTaskQueues to use (a fresh one by default)
+        quiet: Swallow handler print() output while calls run
+    """
+
+    def __init__(
+        self,
+        upstream: UpstreamConfig | None = None,
+        translation: UpstreamConfig | None = None,
+        vertex: UpstreamConfig | None = None,
+        openai: UpstreamConfig | None = None,
+        firestore: FakeFirestore | None = None,
+        messaging: FakeMessaging | None = None,
+        tasks: FakeTaskQueues | None = None,
+        quiet: bool = True,
+        seed: int = 7,
+    ) -> None:
+        upstream = upstream or UpstreamConfig()
+        self.db = firestore or FakeFirestore(seed=seed)
+        self.messaging = messaging or FakeMessaging(seed=seed)
+        self.tasks = tasks or FakeTaskQueues()
+        self.translation = TranslationStub(translation or upstream, seed=seed)
+        self.vertex = VertexStub(vertex or upstream, seed=seed + 1)
+        self.openai = OpenAIStub(openai or upstream, seed=seed + 2)
+        self.quiet = quiet
+        self.main: ModuleType | None = None
+        self._stack = contextlib.ExitStack()
+
+    def __enter__(self) -> "BenchEnvironment":
+        for stub in (self.translation, self.vertex, self.openai):
+            stub.start()
+            self._stack.callback(stub.stop)
+
+        self._stack.enter_context(mock.patch.dict(os.environ, {
+            "OPENAI_BASE_URL": f"{self.openai.url}/v1",
+            "VERTEX_AI_ENDPOINT": self.vertex.url,
+        }))
+
+        main = self.main = load_main()
+        # Breakers, hedge latency trackers, cache metrics and async clients are per process;
+        # start every run fresh
+        import async_core
+        import cache_metrics
+        import circuit_breaker
+        import deadlines
+        async_core.reset()
+        self._stack.callback(async_core.reset)
+        cache_metrics.reset()
+        circuit_breaker.reset()
+        deadlines.reset()
+        import firebase_admin.firestore
+        import firebase_admin.firestore_async
+        import firebase_admin.functions
+        import firebase_admin.messaging
+        import google.auth
+
+        self._stack.enter_context(mock.patch.object(firebase_admin.firestore, "client", lambda app=None: self.db))
+        self._stack.enter_context(mock.patch.object(
+            firebase_admin.firestore_async, "client", lambda app=None, **_: FakeAsyncFirestore(self.db)
+        ))
+        self._stack.enter_context(mock.patch.object(firebase_admin.functions, "task_queue", self.tasks.task_queue))
+        for name in ("send", "send_each", "send_each_for_multicast", "send_each_async", "send_each_for_multicast_async",
+                     "subscribe_to_topic", "unsubscribe_from_topic"):
+            self._stack.enter_context(mock.patch.object(firebase_admin.messaging, name, getattr(self.messaging, name)))
+        self._stack.enter_context(mock.patch.object(google.auth, "default", _fake_default))
+        if hasattr(main, "default"):
+            self._stack.enter_context(mock.patch.object(main, "default", _fake_default))
+
+        from google.auth.credentials import AnonymousCredentials
+        from google.cloud import translate_v2
+        translate_client = translate_v2.Client(
+            credentials=AnonymousCredentials(),
+            client_options={"api_endpoint": self.translation.url},
+        )
+        self._stack.enter_context(mock.patch.object(main, "translate_client", translate_client))
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._stack.close()
+
+    def _quiet(self) -> contextlib.AbstractContextManager:
+        return _QuietStdout.quiet() if self.quiet else contextlib.nullcontext()
+
+    def handler(self, name: str) -> Callable[..., Any]:
+        """Return the undecorated (but still traced) handler from main.py."""
+        assert self.main is not None
+        function = getattr(self.main, name)
+        # Firebase wrappers (and CORS for callables) stack several __wrapped__
+        # layers; stop at the tracing wrapper so spans are still recorded.
+        while hasattr(function, "__wrapped__"):
+            code = getattr(function, "__code__", None)
+            if code is not None and os.path.basename(code.co_filename) == "tracing.py":
+                break
+            function = function.__wrapped__
+        return function
+
+    def call(self, name: str, data: dict[str, Any], uid: str | None = None, app: Any = None,
+             raw_request: Any = None) -> Any:
+        """Invoke a callable (or task queue) function with a synthetic CallableRequest."""
+        with self._quiet():
+            return self.handler(name)(_CallableRequest(data, uid, app, raw_request))
+
+    def request(self, name: str, raw_request: Any = None) -> Any:
+        """Invoke an on_request function."""
+        with self._quiet():
+            return self.handler(name)(raw_request)
+
+    def trigger(self, name: str, document_path: str, params: dict[str, str] | None = None) -> Any:
+        """Invoke a Firestore on_document_created trigger for an existing fake document."""
+        ref = FakeDocumentReference(self.db, document_path)
+        snapshot = FakeDocumentSnapshot(ref, self.db._read(document_path))
+        if params is None:
+            params = _params_from_path(document_path)
+        with self._quiet():
+            return self.handler(name)(FakeEvent(snapshot, params))
+
+    def trigger_write(self, name: str, document_path: str, before: dict[str, Any] | None,
+                      params: dict[str, str] | None = None) -> Any:
+        """Invoke an on_document_written/updated trigger; `after` is the fake document's current data."""
+        ref = FakeDocumentReference(self.db, document_path)
+        change = SimpleNamespace(before=FakeDocumentSnapshot(ref, before),
+                                 after=FakeDocumentSnapshot(ref, self.db._read(document_path)))
+        if params is None:
+            params = _params_from_path(document_path)
+        with self._quiet():
+            return self.handler(name)(FakeEvent(change, params))
+
+    def upstream_stats(self) -> dict[str, Any]:
+        return {
+            "translation": self.translation.stats(),
+            "vertex": self.vertex.stats(),
+            "openai": self.openai.stats(),
+        }
+
+
+def _params_from_path(document_path: str) -> dict[str, str]:
+    """Map conversations/{conversationId}/messages/{messageId} style paths to params."""
+    names = {"conversations": "conversationId", "messages": "messageId", "users": "userId", "status": "userId"}
+    segments = document_path.split("/")
+    params = {}
+    for collection, doc_id in zip(segments[0::2], segments[1::2]):
+        if collection in names:
+            params[names[collection]] = doc_id
+    return params
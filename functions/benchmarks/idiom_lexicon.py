@@ -0,0 +1,119 @@
+"""
+Idiom lexicon benchmark.
+
+Phase 1 sends analyze_message_context a stream of messages that use
+common idioms in varied sentences, which fills message_context_cache the
+way production traffic does. The lexicon is then mined from that cache
+with the same code as build_idiom_lexicon.py. Phase 2 sends new phrasings
+of the same idioms, once without and once with the lexicon, and compares
+the OpenAI requests made, the completion characters generated (the idiom
+explanations are most of the output) and latency.
+
+Usage (from the functions/ directory):
+    python -m benchmarks.idiom_lexicon
+    python -m benchmarks.idiom_lexicon --messages 300 --latency-ms 600
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from typing import Any
+from unittest import mock
+
+import idiom_lexicon
+from benchmarks.fakes import FakeFirestore
+from benchmarks.harness import BenchEnvironment
+from benchmarks.run import percentile
+from benchmarks.stubs import OpenAIStub, UpstreamConfig
+
+TRAINING_TEMPLATES = [
+    "{idiom}!",
+    "Honestly, {idiom}.",
+    "You know what they say, {idiom}",
+    "{idiom} - I mean it",
+]
+
+# New phrasings: some are nothing but the idiom, some add content GPT still analyzes
+EVALUATION_TEMPLATES = [
+    "{idiom}!!",
+    "Well... {idiom}",
+    "{idiom} tonight, see you after the show at {n}",
+    "Told my boss about the plan for week {n}, {idiom}",
+]
+
+ENGLISH = ["break a leg", "piece of cake", "under the weather", "hit the sack", "spill the beans"]
+
+
+def _messages(templates: list[str], count: int, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    return [rng.choice(templates).format(idiom=rng.choice(ENGLISH), n=rng.randint(1, 50)) for _ in range(count)]
+
+
+def _analyze_all(env: BenchEnvironment, messages: list[str]) -> dict[str, Any]:
+    latencies = []
+    before = env.upstream_stats()["openai"]
+    for i, text in enumerate(messages):
+        start = time.perf_counter()
+        env.call("analyze_message_context", {"text": text, "language": "en"}, uid=f"bench-user-{i % 97}")
+        latencies.append((time.perf_counter() - start) * 1000)
+    after = env.upstream_stats()["openai"]
+    latencies.sort()
+    return {
+        "messages": len(messages),
+        "openaiRequests": after["requests"] - before["requests"],
+        "completionCharacters": after["completionCharacters"] - before["completionCharacters"],
+        "p50Ms": round(percentile(latencies, 0.50), 1),
+        "p95Ms": round(percentile(latencies, 0.95), 1),
+    }
+
+
+def main(argv: list[str] | None = None) -> dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Measure OpenAI work saved by the idiom lexicon")
+    parser.add_argument("--messages", type=int, default=200, help="Messages per phase")
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="Mean upstream stub latency")
+    parser.add_argument("--output", help="Write the report as JSON to this path")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    upstream = UpstreamConfig(args.latency_ms, args.latency_ms / 10)
+    training = _messages(TRAINING_TEMPLATES, args.messages, args.seed)
+    evaluation = _messages(EVALUATION_TEMPLATES, args.messages, args.seed + 1)
+    report: dict[str, Any] = {"idioms": len(ENGLISH), "stubIdioms": len(OpenAIStub.IDIOMS)}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "idiom_lexicon.json")
+
+        # Phase 1: accumulate analyses in message_context_cache, then mine them
+        with mock.patch.object(idiom_lexicon, "_lexicon", idiom_lexicon.Lexicon({})), \
+                BenchEnvironment(upstream=upstream, firestore=FakeFirestore(seed=args.seed), seed=args.seed) as env:
+            report["training"] = _analyze_all(env, training)
+            entries = [doc.to_dict() for doc in env.db.collection("message_context_cache").stream()]
+        lexicon_data = idiom_lexicon.mine(entries)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(lexicon_data, f)
+        report["lexiconPhrases"] = {language: len(p) for language, p in lexicon_data["languages"].items()}
+
+        # Phase 2: new phrasings, without and with the lexicon
+        for mode, lexicon in (("withoutLexicon", idiom_lexicon.Lexicon({})), ("withLexicon", idiom_lexicon.load(path))):
+            with mock.patch.object(idiom_lexicon, "_lexicon", lexicon), \
+                    BenchEnvironment(upstream=upstream, firestore=FakeFirestore(seed=args.seed), seed=args.seed) as env:
+                report[mode] = _analyze_all(env, evaluation)
+
+    print(f"lexicon mined from {report['training']['messages']} cached analyses: {report['lexiconPhrases']}")
+    print(f"{'mode':16s} {'OpenAI req':>10s} {'completion chars':>17s} {'p50 ms':>8s} {'p95 ms':>8s}")
+    for mode in ("withoutLexicon", "withLexicon"):
+        row = report[mode]
+        print(f"{mode:16s} {row['openaiRequests']:10d} {row['completionCharacters']:17d} "
+              f"{row['p50Ms']:8.1f} {row['p95Ms']:8.1f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Delivery/read aggregate benchmark.
+
+Replays a group conversation through the status pipeline: messages are
+created (count_unread_message), every recipient marks each one delivered
+and later read (aggregate_message_status on the status documents), and
+rollup_message_status tasks are dispatched when they fall due. Everything
+runs on a virtual clock, like benchmarks.coalescing.
+
+At the end the rolled-up deliveredCount/readCount and unreadCount are
+compared with the truth from the status documents, and the reads a client
+needs are reported: the whole status subcollection per message before,
+the message (or conversation) document after.
+
+Usage (from the functions/ directory):
+    python -m benchmarks.message_status
+    python -m benchmarks.message_status --participants 200 --messages 20 --read-fraction 0.6
+"""
+
+import argparse
+import json
+import random
+from typing import Any
+from unittest import mock
+
+import message_status
+from benchmarks.coalescing import _Clock
+from benchmarks.fakes import FakeFirestore, FakeTaskQueues
+from benchmarks.harness import BenchEnvironment
+
+
+def replay(args: argparse.Namespace) -> dict[str, Any]:
+    rng = random.Random(args.seed)
+    clock = _Clock(1_700_000_000.0)
+    db = FakeFirestore(seed=args.seed)
+    conversation_id = "status-group"
+    participant_ids = [f"status-user-{n}" for n in range(args.participants)]
+
+    with BenchEnvironment(firestore=db, tasks=FakeTaskQueues(clock=clock.time), seed=args.seed) as env, \
+            mock.patch.object(message_status, "time", clock):
+        db.seed(f"conversations/{conversation_id}", {
+            "type": "group",
+            "name": "Status group",
+            "participantIds": participant_ids,
+            "participants": [{"uid": uid, "name": uid} for uid in participant_ids],
+            "lastUpdatedAt": clock.now,
+        })
+        db.stats.reset()
+
+        rollups = 0
+
+        def dispatch_due() -> None:
+            nonlocal rollups
+            for name, data in env.tasks.pop_due(clock.now):
+                env.call(name, data)
+                rollups += 1
+
+        # Status events: each recipient receives every message within seconds
+        # and reads a fraction of them later
+        events: list[tuple[float, str, str, str]] = []
+        message_ids = []
+        for i in range(args.messages):
+            sent_at = clock.now + i * args.message_interval
+            sender = rng.choice(participant_ids)
+            message_id = f"status-msg-{i}"
+            message_ids.append(message_id)
+            events.append((sent_at, "create", message_id, sender))
+            for uid in participant_ids:
+                if uid == sender:
+                    continue
+                delivered_at = sent_at + rng.expovariate(1 / 2)
+                events.append((delivered_at, "delivered", message_id, uid))
+                if rng.random() < args.read_fraction:
+                    events.append((delivered_at + rng.expovariate(1 / 30), "read", message_id, uid))
+        events.sort()
+
+        senders = {}
+        status_events = 0
+        for at, kind, message_id, uid in events:
+            clock.now = at
+            dispatch_due()
+            message_path = f"conversations/{conversation_id}/messages/{message_id}"
+            if kind == "create":
+                senders[message_id] = uid
+                db.seed(message_path, {"senderId": uid, "text": f"message {message_id}", "timestamp": at,
+                                       "type": "text"})
+                env.trigger("count_unread_message", message_path)
+                continue
+            status_path = f"{message_path}/status/{uid}"
+            before = db._read(status_path)
+            db.seed(status_path, {"status": kind, "userId": uid, "timestamp": at,
+                                  "conversationId": conversation_id, "messageId": message_id})
+            env.trigger_write("aggregate_message_status", status_path, before)
+            status_events += 1
+        clock.now += message_status.ROLLUP_SECONDS * 2
+        dispatch_due()
+
+        io_stats = db.stats.snapshot()
+
+        # Truth from the status documents
+        mismatches = 0
+        unread_truth = {uid: 0 for uid in participant_ids}
+        for message_id in message_ids:
+            message_path = f"conversations/{conversation_id}/messages/{message_id}"
+            statuses = [data.get("status") for path, data in db.dump(f"{message_path}/status/").items()]
+            message = db._read(message_path) or {}
+            if (message.get("deliveredCount", 0), message.get("readCount", 0)) != (
+                    sum(s in ("delivered", "read") for s in statuses), statuses.count("read")):
+                mismatches += 1
+            for uid in participant_ids:
+                status = (db._read(f"{message_path}/status/{uid}") or {}).get("status")
+                if uid != senders[message_id] and status != "read":
+                    unread_truth[uid] += 1
+        conversation = db._read(f"conversations/{conversation_id}") or {}
+        unread = conversation.get("unreadCount", {})
+        unread_mismatches = sum(unread.get(uid, 0) != count for uid, count in unread_truth.items())
+        last_message_at = max(at for at, kind, _, _ in events if kind == "create")
+
+        return {
+            "participants": args.participants,
+            "messages": args.messages,
+            "statusEvents": status_events,
+            "rollups": rollups,
+            "rollupsPerMessage": round(rollups / args.messages, 2),
+            "firestoreWritesPerStatusEvent": round(io_stats["writes"] / (status_events + args.messages), 2),
+            "firestoreReadsPerStatusEvent": round(io_stats["reads"] / (status_events + args.messages), 2),
+            "countMismatches": mismatches,
+            "unreadMismatches": unread_mismatches,
+            "lastUpdatedAtCurrent": conversation.get("lastUpdatedAt") == last_message_at,
+            # What a client reads to render "read by N" for every message / the conversation row
+            "clientReadsBefore": args.messages * (args.participants - 1),
+            "clientReadsAfter": args.messages,
+        }
+
+
+def main(argv: list[str] | None = None) -> dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Replay status writes through the delivery/read aggregates")
+    parser.add_argument("--participants", type=int, default=50, help="Group size")
+    parser.add_argument("--messages", type=int, default=10, help="Messages sent")
+    parser.add_argument("--message-interval", type=float, default=20.0, help="Seconds between messages")
+    parser.add_argument("--read-fraction", type=float, default=0.7, help="Share of deliveries later read")
+    parser.add_argument("--output", help="Write the report as JSON to this path")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    report = replay(args)
+    for key, value in report.items():
+        print(f"{key:32s} {value}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Benchmark for migrate_group_conversations.py against FakeFirestore.
+
+Seeds a synthetic 'group-conversations' collection (conversations x
+messages x status docs) and migrates it with different worker counts,
+reporting docs/sec. FakeFirestore latency stands in for RPC round trips,
+which is what the worker pool and the BulkWriter overlap.
+
+Usage (from the functions/ directory):
+    python -m benchmarks.migration
+    python -m benchmarks.migration --conversations 200 --messages 50 --workers 1,4,16
+"""
+
+import argparse
+import contextlib
+import io
+from typing import Any
+
+from benchmarks.fakes import FakeFirestore
+from benchmarks.harness import load_main  # noqa: F401 - sets benchmark environment defaults
+
+import migrate_group_conversations as migration
+
+
+def seed_source(db: FakeFirestore, conversations: int, messages: int, statuses: int) -> int:
+    """Create the source collection; returns the number of documents seeded."""
+    for c in range(conversations):
+        conversation_path = f"{migration.SOURCE_COLLECTION}/group-{c}"
+        db.seed(conversation_path, {
+            "type": "group",
+            "groupName": f"Group {c}",
+            "participantIds": [f"user-{n}" for n in range(statuses + 1)],
+        })
+        for m in range(messages):
+            message_path = f"{conversation_path}/messages/msg-{m}"
+            db.seed(message_path, {"text": f"Message {m}", "senderId": "user-0", "timestamp": m})
+            for s in range(statuses):
+                db.seed(f"{message_path}/status/user-{s + 1}", {"status": "read", "timestamp": m})
+    return conversations * (1 + messages * (1 + statuses))
+
+
+def run(args: argparse.Namespace, workers: int) -> dict[str, Any]:
+    db = FakeFirestore(latency_ms=args.firestore_latency_ms, seed=args.seed)
+    seeded = seed_source(db, args.conversations, args.messages, args.statuses)
+    ramp = migration.WriteRamp(args.max_ops_per_second, args.max_ops_per_second)
+    with contextlib.redirect_stdout(io.StringIO()):
+        stats = migration.migrate_conversations(
+            db, workers=workers, partitions=args.partitions, ramp=ramp, progress_interval_seconds=3600,
+        )
+    stats["seededDocs"] = seeded
+    stats["firestoreReads"] = db.stats.snapshot()["reads"]
+    return stats
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the group conversation migration offline")
+    parser.add_argument("--conversations", type=int, default=40)
+    parser.add_argument("--messages", type=int, default=20, help="Messages per conversation")
+    parser.add_argument("--statuses", type=int, default=3, help="Status docs per message")
+    parser.add_argument("--workers", default="1,4,16", help="Comma-separated worker counts")
+    parser.add_argument("--partitions", type=int, default=8)
+    parser.add_argument("--max-ops-per-second", type=int, default=100000)
+    parser.add_argument("--firestore-latency-ms", type=float, default=2.0, help="Added latency per Firestore RPC")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    header = f"{'workers':>7} {'docs':>8} {'seconds':>8} {'docs/sec':>10} {'reads':>8} {'errors':>6}"
+    print(header)
+    print("-" * len(header))
+    for workers in (int(w) for w in args.workers.split(",")):
+        stats = run(args, workers)
+        print(f"{workers:7d} {stats['docs_written']:8d} {stats['elapsed_seconds']:8.1f} "
+              f"{stats['docs_per_second']:10.1f} {stats['firestoreReads']:8d} {stats['errors']:6d}")
+        if stats["docs_written"] != stats["seededDocs"]:
+            print(f"  ! wrote {stats['docs_written']} of {stats['seededDocs']} documents")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Speculative smart-reply precompute benchmark.
+
+Replays a conversation where each new message is followed by the
+recipient opening the chat and asking for smart replies. It runs once
+with suggestions generated on demand, and once with
+precompute_smart_replies filling smart_reply_cache at ingest. It then
+compares the latency the recipient sees, the cache hit rate and the
+OpenAI requests spent (speculation that is never used still costs a
+request).
+
+Usage (from the functions/ directory):
+    python -m benchmarks.precompute
+    python -m benchmarks.precompute --messages 40 --participants 3 --open-rate 0.6 --latency-ms 400
+    python -m benchmarks.precompute --budget 1000
+"""
+
+import argparse
+import json
+import random
+import time
+from typing import Any
+from unittest import mock
+
+from benchmarks.fakes import FakeFirestore
+from benchmarks.harness import BenchEnvironment
+from benchmarks.run import ScenarioContext, _create_message, percentile, seed_conversation
+from benchmarks.stubs import UpstreamConfig
+
+
+def replay(args: argparse.Namespace, precompute: bool) -> dict[str, Any]:
+    """Run the message / open-chat sequence and summarize what recipients saw."""
+    rng = random.Random(args.seed)
+    latencies: list[float] = []
+    hits = 0
+    with BenchEnvironment(upstream=UpstreamConfig(args.latency_ms, args.jitter_ms),
+                          firestore=FakeFirestore(seed=args.seed), seed=args.seed) as env:
+        ctx = ScenarioContext(env, args.messages, args.participants, 1)
+        recipients = [uid for uid in seed_conversation(ctx) if uid != "bench-user-0"]
+        budget = args.budget if args.budget is not None else env.main.SMART_REPLY_PRECOMPUTE_BUDGET
+        with mock.patch.object(env.main, "SMART_REPLY_PRECOMPUTE", precompute), \
+                mock.patch.object(env.main, "SMART_REPLY_PRECOMPUTE_BUDGET", budget):
+            for i in range(args.messages):
+                path = _create_message(ctx, i)
+                env.trigger("precompute_smart_replies", path)
+                text = env.db.document(path).get().to_dict()["text"]
+                # Only some recipients open the chat (and ask for replies)
+                for recipient in recipients:
+                    if rng.random() >= args.open_rate:
+                        continue
+                    start = time.perf_counter()
+                    result = env.call("generate_smart_replies_complete", {
+                        "conversationId": "bench-conv", "incomingMessageText": text, "userId": recipient,
+                    }, uid=recipient)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    hits += 1 if result.get("cached") else 0
+        openai_requests = env.upstream_stats()["openai"]["requests"]
+
+    latencies.sort()
+    return {
+        "opens": len(latencies),
+        "cacheHitRate": round(hits / len(latencies), 3) if latencies else 0.0,
+        "p50Ms": round(percentile(latencies, 0.50), 1),
+        "p95Ms": round(percentile(latencies, 0.95), 1),
+        "openaiRequests": openai_requests,
+    }
+
+
+def main(argv: list[str] | None = None) -> dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Compare on-demand and precomputed smart replies")
+    parser.add_argument("--messages", type=int, default=60,
+                        help="Messages sent by bench-user-0 (opens count against the 50/hour smart reply limit)")
+    parser.add_argument("--participants", type=int, default=2, help="Conversation participants (sender included)")
+    parser.add_argument("--open-rate", type=float, default=0.7,
+                        help="Probability that a recipient asks for replies to a message")
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="Mean upstream stub latency")
+    parser.add_argument("--jitter-ms", type=float, default=50.0, help="Upstream latency jitter (+/-)")
+    parser.add_argument("--budget", type=int, help="Precompute budget per recipient per hour (default: main.py's)")
+    parser.add_argument("--output", help="Write the report as JSON to this path")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    report = {"onDemand": replay(args, precompute=False), "precomputed": replay(args, precompute=True)}
+
+    print(f"{args.messages} messages, {args.participants - 1} recipient(s), open rate {args.open_rate:.0%}")
+    print(f"{'mode':12s} {'opens':>6s} {'hit rate':>9s} {'p50 ms':>8s} {'p95 ms':>8s} {'OpenAI req':>11s}")
+    for mode, row in report.items():
+        print(f"{mode:12s} {row['opens']:6d} {row['cacheHitRate']:9.1%} {row['p50Ms']:8.1f} "
+              f"{row['p95Ms']:8.1f} {row['openaiRequests']:11d}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+"""
+Offline benchmark runner for the Cloud Functions in main.py.
+
+Runs every callable and trigger against FakeFirestore, FakeMessaging and
+local upstream stubs, then reports p50/p95/p99 latency, throughput and
+Firestore reads/writes per request. Results are written as JSON so runs
+can be compared with `python -m benchmarks.compare`.
+
+Usage (from the functions/ directory):
+    python -m benchmarks.run
+    python -m benchmarks.run --requests 300 --concurrency 8 --latency-ms 120 --error-rate 0.02
+    python -m benchmarks.run --scenario translate_message --scenario adjust_formality
+    python -m benchmarks.run --scenario generate_smart_replies_complete --tail-rate 0.03 --tail-ms 1500 --no-hedge
+"""
+
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable
+
+import cache_metrics
+import cache_store
+import conversation_context
+import conversation_tokens
+import deadlines
+import embedding_models
+from flask import Request
+
+from benchmarks.fakes import FakeFirestore
+from benchmarks.harness import BenchEnvironment
+from benchmarks.stubs import UpstreamConfig, deterministic_vector
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+SAMPLE_TEXTS = [
+    "Are we still meeting for lunch tomorrow?",
+    "I'll send the report over before the deadline.",
+    "That presentation was a piece of cake, thanks for the help!",
+    "Can you call me when you get a chance?",
+    "¿Dónde está la estación de tren más cercana?",
+    "Je pense que nous devrions partir plus tôt demain.",
+    "Kannst du mir bitte die Unterlagen schicken?",
+    "Let's break the ice with a quick intro round.",
+    "明日の会議は何時からですか？",
+    "Не забудь купить хлеб по дороге домой.",
+]
+
+
+@dataclass
+class ScenarioContext:
+    env: BenchEnvironment
+    distinct_texts: int
+    participants: int
+    tokens_per_user: int
+
+
+@dataclass
+class Scenario:
+    name: str
+    setup: Callable[[ScenarioContext], None]
+    run: Callable[[ScenarioContext, int], Any]
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(q * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def _text(ctx: ScenarioContext, i: int) -> str:
+    base = SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)]
+    variant = (i * 7919) % max(1, ctx.distinct_texts)
+    return base if variant < len(SAMPLE_TEXTS) else f"{base} (#{variant})"
+
+
+def _uid(i: int) -> str:
+    # Spread load across users so hourly rate limits do not dominate results
+    return f"bench-user-{i % 997}"
+
+
+def seed_conversation(ctx: ScenarioContext, conversation_id: str = "bench-conv", messages: int = 30) -> list[str]:
+    """Create a conversation with participants, FCM tokens and embedded messages."""
+    db = ctx.env.db
+    participant_ids = [f"bench-user-{n}" for n in range(ctx.participants)]
+    db.seed(f"conversations/{conversation_id}", {
+        "type": "group" if ctx.participants > 2 else "direct",
+        "participantIds": participant_ids,
+        "participants": [{"uid": uid, "name": f"User {uid[-3:]}"} for uid in participant_ids],
+        "name": "Bench group",
+    })
+    for uid in participant_ids:
+        db.seed(f"users/{uid}", {
+            "displayName": f"User {uid[-3:]}",
+            "fcmTokens": [f"token-{uid}-{t}" for t in range(ctx.tokens_per_user)],
+            "communicationStyle": {"averageMessageLength": 42, "emojiUsageRate": 0.2, "casualityScore": 0.7},
+        })
+    context = None
+    for n in range(messages):
+        text = SAMPLE_TEXTS[n % len(SAMPLE_TEXTS)]
+        message = {
+            "text": text,
+            "senderId": participant_ids[n % len(participant_ids)],
+            "senderName": "Seeder",
+            "conversationId": conversation_id,
+            "timestamp": time.time() - (messages - n) * 60,
+        }
+        db.seed(f"conversations/{conversation_id}/messages/seed-{n}",
+                {**message, "embedding": deterministic_vector(text)})
+        context = conversation_context.append_message(context, conversation_context.message_entry(f"seed-{n}", message))
+    if context:
+        db.seed(f"{conversation_context.CONTEXT_COLLECTION}/{conversation_id}", {**context, "messagesSinceSummary": 0})
+    return participant_ids
+
+
+def _create_message(ctx: ScenarioContext, i: int, conversation_id: str = "bench-conv") -> str:
+    message_id = f"bench-msg-{i}-{threading.get_ident()}"
+    ctx.env.db.seed(f"conversations/{conversation_id}/messages/{message_id}", {
+        "text": _text(ctx, i),
+        "senderId": "bench-user-0",
+        "senderName": "Bench Sender",
+        "conversationId": conversation_id,
+        "timestamp": time.time(),
+    })
+    return f"conversations/{conversation_id}/messages/{message_id}"
+
+
+def _seed_expired_cache(ctx: ScenarioContext) -> None:
+    old = time.time() - 40 * 86400
+    for n in range(200):
+        ctx.env.db.seed(f"translation_cache/expired-{n}", {"timestamp": old})
+        ctx.env.db.seed(f"formality_cache/expired-{n}", {"timestamp": old})
+        ctx.env.db.seed(f"translation_rate_limits/expired-{n}", {"lastRequest": old})
+
+
+def _seed_cache_metrics(ctx: ScenarioContext) -> None:
+    for store in cache_store.STORES:
+        for shard in range(cache_metrics.NUM_SHARDS):
+            ctx.env.db.seed(f"{cache_metrics.METRICS_COLLECTION}/{store.collection}/shards/{shard}", {
+                "lookups": 1000, "hits": 700, "misses": 300, "stale": 20, "hitAgeSeconds": 700 * 3600.0,
+                "bytesServed": 700 * 400, "writes": 300, "bytesWritten": 300 * 400, "upstreamCallsAvoided": 700,
+            })
+
+
+def _seed_token_drift(ctx: ScenarioContext) -> None:
+    """Conversations with a token index in every state check_conversation_tokens handles."""
+    for n in range(100):
+        conversation_id = f"drift-conv-{n}"
+        participant_ids = [f"drift-user-{(n + k) % 150}" for k in range(ctx.participants)]
+        data = {"type": "group", "name": f"Drift {n}", "participantIds": participant_ids,
+                "participants": [{"uid": uid} for uid in participant_ids]}
+        ctx.env.db.seed(f"conversations/{conversation_id}", data)
+        for uid in participant_ids:
+            ctx.env.db.seed(f"users/{uid}", {"fcmTokens": [f"token-{uid}-{n % 3}"]})
+        if n % 4:  # Every fourth entry is missing
+            entry = conversation_tokens.index_entry(data, {})
+            ctx.env.db.seed(f"{conversation_tokens.TOKENS_COLLECTION}/{conversation_id}", entry)
+    for n in range(10):
+        ctx.env.db.seed(f"{conversation_tokens.TOKENS_COLLECTION}/deleted-conv-{n}", {"participantIds": []})
+
+
+def _no_setup(ctx: ScenarioContext) -> None:
+    pass
+
+
+SCENARIOS: list[Scenario] = [
+    Scenario(
+        "translate_message", _no_setup,
+        lambda ctx, i: ctx.env.call("translate_message", {
+            "text": _text(ctx, i), "target_language": "es" if i % 2 else "en",
+        }, uid=_uid(i)),
+    ),
+    Scenario(
+        "adjust_formality", _no_setup,
+        lambda ctx, i: ctx.env.call("adjust_formality", {
+            "text": _text(ctx, i), "target_formality": "formal", "current_formality": "casual",
+        }, uid=_uid(i)),
+    ),
+    Scenario(
+        "analyze_message_context", _no_setup,
+        lambda ctx, i: ctx.env.call("analyze_message_context", {"text": _text(ctx, i), "language": "en"},
+                                    uid=_uid(i)),
+    ),
+    Scenario(
+        "generate_smart_replies_complete", seed_conversation,
+        lambda ctx, i: ctx.env.call("generate_smart_replies_complete", {
+            "conversationId": "bench-conv", "incomingMessageText": _text(ctx, i), "userId": _uid(i),
+        }, uid=_uid(i)),
+    ),
+    Scenario(
+        "search_messages_semantic", seed_conversation,
+        lambda ctx, i: ctx.env.call("search_messages_semantic", {
+            "conversationId": "bench-conv",
+            "queryEmbedding": deterministic_vector(_text(ctx, i), embedding_models.READ_MODEL.dimension),
+            "limit": 5,
+        }, uid=_uid(i)),
+    ),
+    Scenario(
+        "send_message_notification", seed_conversation,
+        lambda ctx, i: ctx.env.trigger("send_message_notification", _create_message(ctx, i)),
+    ),
+    Scenario(
+        "update_conversation_context", seed_conversation,
+        lambda ctx, i: ctx.env.trigger("update_conversation_context", _create_message(ctx, i)),
+    ),
+    Scenario(
+        "update_communication_style", seed_conversation,
+        lambda ctx, i: ctx.env.trigger("update_communication_style", _create_message(ctx, i)),
+    ),
+    Scenario(
+        "detect_message_language", seed_conversation,
+        lambda ctx, i: ctx.env.trigger("detect_message_language", _create_message(ctx, i)),
+    ),
+    Scenario(
+        "generate_message_embedding", seed_conversation,
+        lambda ctx, i: ctx.env.trigger("generate_message_embedding", _create_message(ctx, i)),
+    ),
+    Scenario(
+        "clean_translation_cache", _seed_expired_cache,
+        lambda ctx, i: ctx.env.request("clean_translation_cache"),
+    ),
+    Scenario(
+        "aggregate_cache_metrics", _seed_cache_metrics,
+        lambda ctx, i: ctx.env.request("aggregate_cache_metrics"),
+    ),
+    Scenario(
+        "check_conversation_tokens", _seed_token_drift,
+        lambda ctx, i: ctx.env.request("check_conversation_tokens", Request.from_values()),
+    ),
+]
+
+
+def run_scenario(ctx: ScenarioContext, scenario: Scenario, requests: int, concurrency: int) -> dict[str, Any]:
+    scenario.setup(ctx)
+    ctx.env.db.stats.reset()
+    ctx.env.messaging.reset()
+    latencies: list[float] = []
+    errors: dict[str, int] = {}
+    lock = threading.Lock()
+
+    def one(i: int) -> None:
+        start = time.perf_counter()
+        error = None
+        try:
+            scenario.run(ctx, i)
+        except Exception as e:  # noqa: BLE001 - benchmarks record every failure type
+            error = type(e).__name__
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            latencies.append(elapsed)
+            if error:
+                errors[error] = errors.get(error, 0) + 1
+
+    wall_start = time.perf_counter()
+    if concurrency <= 1:
+        for i in range(requests):
+            one(i)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(requests)))
+    wall_seconds = time.perf_counter() - wall_start
+
+    latencies.sort()
+    io_stats = ctx.env.db.stats.snapshot()
+    return {
+        "requests": requests,
+        "errors": sum(errors.values()),
+        "errorTypes": errors,
+        "p50Ms": round(percentile(latencies, 0.50), 3),
+        "p95Ms": round(percentile(latencies, 0.95), 3),
+        "p99Ms": round(percentile(latencies, 0.99), 3),
+        "meanMs": round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+        "maxMs": round(latencies[-1], 3) if latencies else 0.0,
+        "wallSeconds": round(wall_seconds, 3),
+        "throughputRps": round(requests / wall_seconds, 2) if wall_seconds else 0.0,
+        "firestoreReadsPerRequest": round(io_stats["reads"] / requests, 3),
+        "firestoreWritesPerRequest": round(io_stats["writes"] / requests, 3),
+        "notificationsSent": len(ctx.env.messaging.sent),
+    }
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results: dict[str, Any]) -> None:
+    header = f"{'scenario':34} {'p50':>9} {'p95':>9} {'p99':>9} {'rps':>8} {'reads':>7} {'writes':>7} {'err':>5}"
+    print(header)
+    print("-" * len(header))
+    for name, r in results["scenarios"].items():
+        print(f"{name:34} {r['p50Ms']:9.1f} {r['p95Ms']:9.1f} {r['p99Ms']:9.1f} {r['throughputRps']:8.1f} "
+              f"{r['firestoreReadsPerRequest']:7.2f} {r['firestoreWritesPerRequest']:7.2f} {r['errors']:5d}")
+
+
+def main(argv: list[str] | None = None) -> dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Benchmark MessageAI Cloud Functions offline")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=1, help="Concurrent in-process callers")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Mean upstream stub latency")
+    parser.add_argument("--jitter-ms", type=float, default=10.0, help="Upstream latency jitter (+/-)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Upstream stub error rate (0-1)")
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="Share of upstream responses that are slow (0-1)")
+    parser.add_argument("--tail-ms", type=float, default=0.0, help="Latency added to slow upstream responses")
+    parser.add_argument("--no-hedge", action="store_true", help="Disable hedged upstream requests")
+    parser.add_argument("--firestore-latency-ms", type=float, default=0.0, help="Added latency per Firestore RPC")
+    parser.add_argument("--distinct-texts", type=int, default=50,
+                        help="Distinct message texts (lower = higher cache hit ratio)")
+    parser.add_argument("--participants", type=int, default=5, help="Participants in the seeded conversation")
+    parser.add_argument("--tokens-per-user", type=int, default=2, help="FCM tokens per participant")
+    parser.add_argument("--scenario", action="append", help="Run only the named scenario(s)")
+    parser.add_argument("--output", help="Result JSON path (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    selected = [s for s in SCENARIOS if not args.scenario or s.name in args.scenario]
+    if args.scenario and len(selected) != len(set(args.scenario)):
+        known = ", ".join(s.name for s in SCENARIOS)
+        parser.error(f"unknown scenario; choose from: {known}")
+
+    upstream = UpstreamConfig(args.latency_ms, args.jitter_ms, args.error_rate, args.tail_rate, args.tail_ms)
+    if args.no_hedge:
+        deadlines.HEDGE_BUDGET = 0.0
+    results: dict[str, Any] = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "gitRevision": _git_revision(),
+            "python": sys.version.split()[0],
+            "config": vars(args),
+        },
+        "scenarios": {},
+    }
+
+    for scenario in selected:
+        env = BenchEnvironment(upstream=upstream, firestore=FakeFirestore(latency_ms=args.firestore_latency_ms,
+                                                                         seed=args.seed), seed=args.seed)
+        with env:
+            ctx = ScenarioContext(env, args.distinct_texts, args.participants, args.tokens_per_user)
+            results["scenarios"][scenario.name] = run_scenario(ctx, scenario, args.requests, args.concurrency)
+            results["scenarios"][scenario.name]["upstream"] = env.upstream_stats()
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, datetime.datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, default=str)
+
+    print_report(results)
+    print(f"\nResults written to {output}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
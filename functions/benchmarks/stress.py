@@ -0,0 +1,113 @@
+"""
+Per-instance concurrency stress test.
+
+Runs one handler with an increasing number of concurrent in-process
+callers, which is what a single Cloud Functions instance sees with
+`concurrency=N`, and reports how throughput scales. Upstream stubs add
+network-like latency, so I/O-bound handlers should scale close to linearly
+until the fakes or the GIL become the bottleneck.
+
+It also checks that shared state survives concurrency: the per-user
+rate-limit counters must add up to the number of requests served (a lower
+total means lost updates).
+
+Usage (from the functions/ directory):
+    python -m benchmarks.stress
+    python -m benchmarks.stress --scenario adjust_formality --levels 1,4,16,64 --latency-ms 200
+"""
+
+import argparse
+import datetime
+import json
+import os
+import sys
+from typing import Any
+
+from benchmarks.fakes import FakeFirestore
+from benchmarks.harness import BenchEnvironment
+from benchmarks.run import RESULTS_DIR, SCENARIOS, ScenarioContext, _git_revision, run_scenario
+from benchmarks.stubs import UpstreamConfig
+
+# Rate-limit collection written by each scenario, for the lost-update check
+RATE_LIMIT_COLLECTIONS = {
+    "translate_message": "translation_rate_limits",
+    "adjust_formality": "formality_rate_limits",
+}
+
+
+def counted_requests(db: FakeFirestore, collection: str) -> int:
+    """Sum of the per-user hourly rate-limit counters in `collection`."""
+    return sum(doc.get("count", 0) for path, doc in db.dump(f"{collection}/").items() if path.count("/") == 1)
+
+
+def run_level(args: argparse.Namespace, concurrency: int) -> dict[str, Any]:
+    scenario = next(s for s in SCENARIOS if s.name == args.scenario)
+    requests = max(args.requests, concurrency * args.requests_per_caller)
+    upstream = UpstreamConfig(args.latency_ms, args.jitter_ms)
+    db = FakeFirestore(latency_ms=args.firestore_latency_ms, seed=args.seed)
+    with BenchEnvironment(upstream=upstream, firestore=db, seed=args.seed) as env:
+        # Every request gets its own text so the cache never short-circuits upstream calls
+        ctx = ScenarioContext(env, requests * 10, args.participants, args.tokens_per_user)
+        result = run_scenario(ctx, scenario, requests, concurrency)
+
+    result["concurrency"] = concurrency
+    collection = RATE_LIMIT_COLLECTIONS.get(args.scenario)
+    if collection:
+        counted = counted_requests(db, collection)
+        result["rateLimitCounted"] = counted
+        result["lostUpdates"] = requests - result["errors"] - counted
+    return result
+
+
+def main(argv: list[str] | None = None) -> dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Measure throughput scaling with per-instance concurrency")
+    parser.add_argument("--scenario", default="translate_message", choices=[s.name for s in SCENARIOS])
+    parser.add_argument("--levels", default="1,2,4,8,16,32", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=40, help="Minimum requests per level")
+    parser.add_argument("--requests-per-caller", type=int, default=4,
+                        help="Requests per concurrent caller (levels run max(requests, N x this))")
+    parser.add_argument("--latency-ms", type=float, default=100.0, help="Mean upstream stub latency")
+    parser.add_argument("--jitter-ms", type=float, default=10.0, help="Upstream latency jitter (+/-)")
+    parser.add_argument("--firestore-latency-ms", type=float, default=5.0, help="Added latency per Firestore RPC")
+    parser.add_argument("--participants", type=int, default=5)
+    parser.add_argument("--tokens-per-user", type=int, default=2)
+    parser.add_argument("--output", help="Result JSON path (default: benchmarks/results/stress-<timestamp>.json)")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    levels = [int(level) for level in args.levels.split(",")]
+    results: dict[str, Any] = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "gitRevision": _git_revision(),
+            "python": sys.version.split()[0],
+            "config": vars(args),
+        },
+        "scenarios": {},
+    }
+    baseline_rps = None
+    header = f"{'concurrency':>11} {'requests':>9} {'rps':>9} {'speedup':>8} {'p50':>9} {'p95':>9} {'err':>5} {'lost':>5}"
+    print(f"{args.scenario} (upstream {args.latency_ms:.0f}ms, firestore {args.firestore_latency_ms:.0f}ms)")
+    print(header)
+    print("-" * len(header))
+    for level in levels:
+        r = run_level(args, level)
+        baseline_rps = baseline_rps or r["throughputRps"]
+        r["speedup"] = round(r["throughputRps"] / baseline_rps, 2) if baseline_rps else 0.0
+        r["efficiency"] = round(r["speedup"] / level, 3)
+        results["scenarios"][f"{args.scenario}_c{level}"] = r
+        lost = r.get("lostUpdates", "-")
+        print(f"{level:11d} {r['requests']:9d} {r['throughputRps']:9.1f} {r['speedup']:7.2f}x "
+              f"{r['p50Ms']:9.1f} {r['p95Ms']:9.1f} {r['errors']:5d} {lost!s:>5}")
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, "stress-" + datetime.datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, default=str)
+    print(f"\nResults written to {output}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+"""
+Local stub servers for the upstream APIs called by main.py.
+
+Each stub is a small threaded HTTP server bound to 127.0.0.1 on a random
+port, with configurable latency (mean + uniform jitter, plus an optional
+slow tail) and error rate:
+
+- TranslationStub: Cloud Translation v2 REST (translate + detect)
+- VertexStub:      Vertex AI text embedding :predict endpoint
+- OpenAIStub:      OpenAI chat completions
+
+The stubs return well-formed, deterministic payloads so handlers exercise
+the same parsing and caching paths as in production.
+"""
+
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+
+class UpstreamConfig:
+    """
+    Latency and failure profile for a stub server.
+
+    Args:
+        latency_ms: Mean added latency per request
+        jitter_ms: Uniform jitter (+/-) applied to the latency
+        error_rate: Probability of answering with HTTP 503
+        tail_rate: Probability of a slow response (e.g. 0.02 for a 2% tail)
+        tail_ms: Latency added to slow responses
+    """
+
+    def __init__(
+        self,
+        latency_ms: float = 50.0,
+        jitter_ms: float = 10.0,
+        error_rate: float = 0.0,
+        tail_rate: float = 0.0,
+        tail_ms: float = 0.0,
+    ) -> None:
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.tail_rate = tail_rate
+        self.tail_ms = tail_ms
+
+    def to_dict(self) -> dict[str, float]:
+        return {"latencyMs": self.latency_ms, "jitterMs": self.jitter_ms, "errorRate": self.error_rate,
+                "tailRate": self.tail_rate, "tailMs": self.tail_ms}
+
+
+class StubServer:
+    """Base class: subclasses implement respond(path, body) -> dict."""
+
+    name = "stub"
+
+    def __init__(self, config: UpstreamConfig | None = None, seed: int | None = None) -> None:
+        self.config = config or UpstreamConfig()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self._server: ThreadingHTTPServer | None = None
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        assert self._server is not None, "stub server not started"
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def respond(self, path: str, body: dict[str, Any]) -> dict[str, Any]:
+        raise NotImplementedError
+
+    def _should_fail(self) -> tuple[bool, float]:
+        with self._lock:
+            self.requests += 1
+            fail = self._random.random() < self.config.error_rate
+            if fail:
+                self.errors += 1
+            jitter = self._random.uniform(-self.config.jitter_ms, self.config.jitter_ms)
+            if self._random.random() < self.config.tail_rate:
+                jitter += self.config.tail_ms
+        return fail, max(0.0, self.config.latency_ms + jitter) / 1000
+
+    def start(self) -> "StubServer":
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self) -> None:  # noqa: N802 (http.server naming)
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                try:
+                    body = json.loads(raw) if raw else {}
+                except json.JSONDecodeError:
+                    body = {}
+                fail, delay = stub._should_fail()
+                time.sleep(delay)
+                if fail:
+                    self._send(503, {"error": {"code": 503, "message": f"{stub.name} unavailable (injected)",
+                                               "status": "UNAVAILABLE"}})
+                    return
+                self._send(200, stub.respond(self.path, body))
+
+            def _send(self, status: int, payload: dict[str, Any]) -> None:
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name=f"{self.name}-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {"requests": self.requests, "errors": self.errors, **self.config.to_dict()}
+
+
+def _guess_language(text: str) -> str:
+    if re.search(r"[぀-ヿ]", text):
+        return "ja"
+    if re.search(r"[一-鿿]", text):
+        return "zh"
+    if re.search(r"[؀-ۿ]", text):
+        return "ar"
+    if re.search(r"[Ѐ-ӿ]", text):
+        return "ru"
+    if re.search(r"[ऀ-ॿ]", text):
+        return "hi"
+    lowered = f" {text.lower()} "
+    for language, words in (("es", (" el ", " la ", " que ", " y ")), ("fr", (" le ", " les ", " et ", " est ")),
+                            ("de", (" der ", " die ", " und ", " ist ")), ("pt", (" não ", " você ", " é "))):
+        if any(word in lowered for word in words):
+            return language
+    return "en"
+
+
+class TranslationStub(StubServer):
+    """Cloud Translation v2: POST /language/translate/v2[/detect]."""
+
+    name = "translation"
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.characters_billed = 0
+
+    def respond(self, path: str, body: dict[str, Any]) -> dict[str, Any]:
+        queries = body.get("q", [])
+        if isinstance(queries, str):
+            queries = [queries]
+        with self._lock:
+            self.characters_billed += sum(len(q) for q in queries)
+        if path.rstrip("/").endswith("/detect"):
+            return {"data": {"detections": [
+                [{"language": _guess_language(q), "confidence": 0.9, "isReliable": True}] for q in queries
+            ]}}
+        target = body.get("target", "en")
+        translations = []
+        for q in queries:
+            entry = {"translatedText": f"[{target}] {q}"}
+            if not body.get("source"):
+                entry["detectedSourceLanguage"] = _guess_language(q)
+            translations.append(entry)
+        return {"data": {"translations": translations}}
+
+    def stats(self) -> dict[str, Any]:
+        stats = super().stats()
+        stats["charactersBilled"] = self.characters_billed
+        return stats
+
+
+def deterministic_vector(text: str, dimensions: int = 768) -> list[float]:
+    """Pseudo-embedding derived from a hash of the text (unit length)."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+    rng = random.Random(seed)
+    values = [rng.uniform(-1.0, 1.0) for _ in range(dimensions)]
+    norm = sum(v * v for v in values) ** 0.5 or 1.0
+    return [v / norm for v in values]
+
+
+class VertexStub(StubServer):
+    """Vertex AI: POST /v1/projects/.../models/{model}:predict."""
+
+    name = "vertex"
+
+    def __init__(self, *args: Any, dimensions: int = 768, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.dimensions = dimensions
+
+    def respond(self, path: str, body: dict[str, Any]) -> dict[str, Any]:
+        return {"predictions": [
+            {"embeddings": {"values": deterministic_vector(instance.get("content", ""), self.dimensions),
+                            "statistics": {"token_count": len(instance.get("content", "").split()),
+                                           "truncated": False}}}
+            for instance in body.get("instances", [])
+        ]}
+
+
+class OpenAIStub(StubServer):
+    """OpenAI: POST /v1/chat/completions (JSON and plain-text responses)."""
+
+    name = "openai"
+
+    # Idioms the stub "recognises" in context analysis prompts
+    IDIOMS = {
+        "break a leg": "good luck",
+        "piece of cake": "very easy",
+        "under the weather": "feeling ill",
+        "hit the sack": "go to bed",
+        "spill the beans": "reveal a secret",
+        "no pasa nada": "no problem",
+        "c'est la vie": "that's life",
+    }
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.prompt_characters = 0
+        self.completion_characters = 0
+
+    def stats(self) -> dict[str, Any]:
+        stats = super().stats()
+        stats["promptCharacters"] = self.prompt_characters
+        stats["completionCharacters"] = self.completion_characters
+        return stats
+
+    def _idioms(self, user: str) -> list[dict[str, Any]]:
+        match = re.search(r'Message: "(.*)"', user, re.DOTALL)
+        message = match.group(1).lower() if match else ""
+        known = re.search(r"Already explained \(do not include in idioms\): (.*)", user)
+        skipped = known.group(1).lower() if known else ""
+        return [
+            {
+                "phrase": phrase,
+                "meaning": meaning,
+                "culturalNote": f"Common expression ({phrase})",
+                "equivalentIn": {lang: f"{meaning} ({lang})" for lang in ("es", "fr", "de", "zh", "ja", "ar", "pt")},
+            }
+            for phrase, meaning in self.IDIOMS.items()
+            if phrase in message and f'"{phrase}"' not in skipped
+        ]
+
+    def respond(self, path: str, body: dict[str, Any]) -> dict[str, Any]:
+        messages = body.get("messages", [])
+        system = next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+        user = next((m.get("content", "") for m in messages if m.get("role") == "user"), "")
+        with self._lock:
+            self.prompt_characters += len(system) + len(user)
+
+        json_mode = (body.get("response_format") or {}).get("type") == "json_object"
+        if json_mode and "smart reply" in system.lower():
+            content = json.dumps({"suggestions": [
+                {"text": "Sounds great!", "intent": "positive"},
+                {"text": "Okay, noted", "intent": "neutral"},
+                {"text": "What time works?", "intent": "question"},
+            ]})
+        elif json_mode:
+            content = json.dumps({
+                "culturalHint": None,
+                "formality": "neutral",
+                "culturalNote": None,
+                "idioms": self._idioms(user),
+            })
+        else:
+            match = re.search(r'Message: "(.*)"', user, re.DOTALL)
+            content = match.group(1) if match else "Rewritten message"
+
+        with self._lock:
+            self.completion_characters += len(content)
+        return {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o-mini"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": (len(system) + len(user)) // 4, "completion_tokens": len(content) // 4,
+                      "total_tokens": (len(system) + len(user) + len(content)) // 4},
+        }
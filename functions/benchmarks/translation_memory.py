@@ -0,0 +1,93 @@
+"""
+Translation memory savings benchmark.
+
+Sends translate_message a stream of multi-sentence messages that reuse
+sentences from a fixed pool (the way chat messages repeat greetings,
+sign-offs and quoted lines) and compares the characters billed by the
+Translation API stub with what whole-message caching alone would bill:
+every distinct message text once.
+
+Usage (from the functions/ directory):
+    python -m benchmarks.translation_memory
+    python -m benchmarks.translation_memory --messages 500 --pool 40 --sentences 4
+"""
+
+import argparse
+import json
+import random
+from typing import Any
+
+from benchmarks.fakes import FakeFirestore
+from benchmarks.harness import BenchEnvironment
+from benchmarks.stubs import UpstreamConfig
+
+SENTENCE_POOL = [
+    "Hi everyone, quick update on the launch.",
+    "The build passed all checks this morning.",
+    "Please review the release notes before Friday.",
+    "Let me know if anything is unclear.",
+    "Thanks again for all the hard work!",
+    "The demo is scheduled for Thursday at 10am.",
+    "We still need volunteers for the on-call rotation.",
+    "I moved the retro to next week.",
+    "Can someone double-check the translation strings?",
+    "Dinner is on me if we ship on time.",
+    "The client asked for two more screenshots.",
+    "Have a great weekend, see you Monday.",
+]
+
+
+def build_messages(count: int, pool_size: int, sentences: int, seed: int) -> list[str]:
+    """Messages of `sentences` sentences each, drawn from a pool of `pool_size`."""
+    rng = random.Random(seed)
+    pool = [SENTENCE_POOL[n % len(SENTENCE_POOL)] + ("" if n < len(SENTENCE_POOL) else f" (#{n})")
+            for n in range(pool_size)]
+    return [" ".join(rng.sample(pool, min(sentences, len(pool)))) for _ in range(count)]
+
+
+def main(argv: list[str] | None = None) -> dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Measure characters saved by the translation memory")
+    parser.add_argument("--messages", type=int, default=300, help="Messages to translate")
+    parser.add_argument("--pool", type=int, default=24, help="Distinct sentences messages are built from")
+    parser.add_argument("--sentences", type=int, default=3, help="Sentences per message")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Mean upstream stub latency")
+    parser.add_argument("--output", help="Write the report as JSON to this path")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    messages = build_messages(args.messages, args.pool, args.sentences, args.seed)
+    with BenchEnvironment(upstream=UpstreamConfig(args.latency_ms, 0.0), firestore=FakeFirestore(seed=args.seed),
+                          seed=args.seed) as env:
+        for i, text in enumerate(messages):
+            env.call("translate_message", {"text": text, "source_language": "en", "target_language": "es"},
+                     uid=f"bench-user-{i % 97}")
+        stats = env.upstream_stats()["translation"]
+
+    # Whole-message caching bills each distinct message once
+    whole_message_chars = sum(len(text) for text in set(messages))
+    billed = stats["charactersBilled"]
+    report = {
+        "messages": len(messages),
+        "distinctMessages": len(set(messages)),
+        "wholeMessageCharsBilled": whole_message_chars,
+        "translationMemoryCharsBilled": billed,
+        "charsSaved": whole_message_chars - billed,
+        "savedPercent": round(100 * (whole_message_chars - billed) / whole_message_chars, 1)
+        if whole_message_chars else 0.0,
+        "translationRequests": stats["requests"],
+    }
+
+    print(f"{report['messages']} messages ({report['distinctMessages']} distinct), "
+          f"{args.sentences} sentences each from a pool of {args.pool}")
+    print(f"  whole-message cache only: {whole_message_chars:9d} chars billed")
+    print(f"  with translation memory:  {billed:9d} chars billed "
+          f"({report['savedPercent']}% saved, {report['translationRequests']} API requests)")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Idiom Lexicon Builder: Re-mine message_context_cache into idiom_lexicon.json
+
+analyze_message_context explains known idioms from a per-language lexicon
+instead of asking GPT-4o-mini again (see idiom_lexicon.py). This script
+streams every message_context_cache entry, keeps the idioms the model
+explained in at least --min-occurrences distinct messages (and that
+actually occur in those messages), and writes the lexicon file that is
+deployed with the functions. Instances pick it up on their next cold
+start after deploy.
+
+Run it periodically (e.g. weekly) as the cache accumulates results; the
+lexicon is rebuilt from scratch each time.
+
+Usage:
+    python3 build_idiom_lexicon.py [--dry-run] [--min-occurrences 2]
+        [--output idiom_lexicon.json] [--from-json cache_export.json]
+
+Arguments:
+    --dry-run: Print what would be written without writing the file
+    --min-occurrences: Distinct messages an idiom must appear in
+    --output: Lexicon file to write (default: next to main.py)
+    --from-json: Mine a JSON list of cache entries instead of Firestore
+"""
+
+import argparse
+import json
+import sys
+from typing import Any, Iterator
+
+import idiom_lexicon
+
+CACHE_COLLECTION = "message_context_cache"
+
+# Cache fields the lexicon is mined from
+MINED_FIELDS = ["text", "language", "idioms"]
+
+
+def initialize_firebase() -> Any:
+    """Initialize Firebase Admin SDK and return Firestore client."""
+    import firebase_admin
+    from firebase_admin import firestore
+
+    if not firebase_admin._apps:
+        # Initialize with default credentials (ADC or service account)
+        firebase_admin.initialize_app()
+    return firestore.client()
+
+
+def stream_cache_entries(db: Any) -> Iterator[dict[str, Any]]:
+    """Every message_context_cache entry, with only the fields the lexicon needs."""
+    for doc in db.collection(CACHE_COLLECTION).select(MINED_FIELDS).stream():
+        yield doc.to_dict() or {}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Rebuild the idiom lexicon from message_context_cache")
+    parser.add_argument("--dry-run", action="store_true", help="Print the summary without writing the lexicon")
+    parser.add_argument(
+        "--min-occurrences",
+        type=int,
+        default=idiom_lexicon.MIN_OCCURRENCES,
+        help="Distinct messages an idiom must appear in",
+    )
+    parser.add_argument("--output", default=idiom_lexicon.LEXICON_PATH, help="Lexicon file to write")
+    parser.add_argument("--from-json", help="JSON file with a list of cache entries to mine instead of Firestore")
+    args = parser.parse_args()
+
+    if args.from_json:
+        with open(args.from_json, encoding="utf-8") as f:
+            entries: Any = json.load(f)
+        source = args.from_json
+    else:
+        try:
+            db = initialize_firebase()
+            print("✅ Connected to Firestore")
+        except Exception as e:
+            print(f"❌ Failed to connect to Firestore: {e}")
+            sys.exit(1)
+        entries = stream_cache_entries(db)
+        source = CACHE_COLLECTION
+
+    # Count as entries stream past, so Firestore documents are not held in memory
+    scanned = 0
+
+    def counted(items: Any) -> Iterator[dict[str, Any]]:
+        nonlocal scanned
+        for item in items:
+            scanned += 1
+            yield item
+
+    lexicon = idiom_lexicon.mine(counted(entries), args.min_occurrences)
+
+    print("\n" + "=" * 60)
+    print("IDIOM LEXICON SUMMARY")
+    print("=" * 60)
+    print(f"Cache entries scanned ({source}): {scanned}")
+    for language, phrases in sorted(lexicon["languages"].items()):
+        top = ", ".join(f"{p['phrase']!r} x{p['occurrences']}" for p in phrases[:3])
+        print(f"  {language}: {len(phrases)} idioms (top: {top})")
+    total = sum(len(phrases) for phrases in lexicon["languages"].values())
+    print(f"Total idioms: {total} (min occurrences: {args.min_occurrences})")
+
+    if args.dry_run:
+        print("\n⚠️  This was a DRY RUN - the lexicon file was not written")
+        return
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(lexicon, f, ensure_ascii=False, indent=1)
+    print(f"\n✅ Wrote {args.output} - deploy the functions to use it")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Cache effectiveness metrics.
+
+CacheStore records every lookup and write into per-instance accumulators,
+one per cache. They are flushed to one sharded counter per cache (see
+sharded_counter.py) at most every FLUSH_INTERVAL_SECONDS, and once more
+when the instance shuts down. A busy instance therefore costs one blind
+write per cache per interval, not one per request:
+
+    cache_metrics/{collection}
+        lastTotals, lastReportAt            (written by report())
+    cache_metrics/{collection}/shards/{0..NUM_SHARDS-1}
+        lookups, hits, misses, stale, hitAgeSeconds, bytesServed,
+        writes, bytesWritten, upstreamCallsAvoided
+
+report() sums the shards and derives, per cache, the hit ratio, average
+entry age at hit, average entry size and the upstream calls avoided (hits
+times the store's calls_per_miss). It does so both over all time and since
+the previous report. Reports are kept in cache_metrics_reports/{reportedAt}
+for tuning TTLs and sizes.
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+from typing import Any
+
+import sharded_counter
+from tracing import INSTANCE_ID
+
+METRICS_COLLECTION = "cache_metrics"
+REPORTS_COLLECTION = "cache_metrics_reports"
+
+# Flush accumulated counts at most this often (0 disables flushing)
+FLUSH_INTERVAL_SECONDS = float(os.environ.get("CACHE_METRICS_FLUSH_SECONDS", "60"))
+
+NUM_SHARDS = 8
+
+FIELDS = (
+    "lookups", "hits", "misses", "stale", "hitAgeSeconds", "bytesServed",
+    "writes", "bytesWritten", "upstreamCallsAvoided",
+)
+
+_lock = threading.Lock()
+# collection -> field -> count since the last flush
+_pending: dict[str, dict[str, float]] = {}
+_last_flush_at = time.monotonic()
+
+
+def entry_bytes(value: dict[str, Any]) -> int:
+    """Approximate stored size of a cache entry (its JSON encoding)."""
+    return len(json.dumps(value, ensure_ascii=False, default=str).encode("utf-8"))
+
+
+def record(collection: str, **counts: float) -> None:
+    """Add counts for one cache and flush if the interval has passed."""
+    with _lock:
+        pending = _pending.setdefault(collection, {})
+        for field, amount in counts.items():
+            pending[field] = pending.get(field, 0) + amount
+        due = FLUSH_INTERVAL_SECONDS > 0 and time.monotonic() - _last_flush_at >= FLUSH_INTERVAL_SECONDS
+    if due:
+        flush()
+
+
+def flush(db: Any = None) -> int:
+    """
+    Write the pending counts to the sharded counters.
+
+    Counts are dropped (and logged) if the write fails: metrics must never
+    fail a request.
+
+    Returns:
+        Number of caches written
+    """
+    global _last_flush_at
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+        _last_flush_at = time.monotonic()
+    if not pending:
+        return 0
+    try:
+        if db is None:
+            from firebase_admin import firestore
+            db = firestore.client()
+        for collection, counts in pending.items():
+            sharded_counter.increment(db.collection(METRICS_COLLECTION).document(collection), counts,
+                                      num_shards=NUM_SHARDS)
+    except Exception as e:
+        print(f"Error flushing cache metrics from instance {INSTANCE_ID}: {e}")
+        return 0
+    return len(pending)
+
+
+def reset() -> None:
+    """Drop pending counts and restart the flush interval."""
+    global _last_flush_at
+    with _lock:
+        _pending.clear()
+        _last_flush_at = time.monotonic()
+
+
+def summarize(counts: dict[str, float], calls_per_miss: int = 1) -> dict[str, Any]:
+    """Derived effectiveness figures for one cache's counts."""
+    lookups = counts.get("lookups", 0)
+    hits = counts.get("hits", 0)
+    writes = counts.get("writes", 0)
+    return {
+        "lookups": lookups,
+        "hits": hits,
+        "misses": counts.get("misses", 0),
+        "stale": counts.get("stale", 0),
+        "hitRatio": round(hits / lookups, 4) if lookups else None,
+        "avgAgeAtHitSeconds": round(counts.get("hitAgeSeconds", 0) / hits, 1) if hits else None,
+        "bytesServed": counts.get("bytesServed", 0),
+        "writes": writes,
+        "avgEntryBytes": round(counts.get("bytesWritten", 0) / writes) if writes else None,
+        "upstreamCallsAvoided": counts.get("upstreamCallsAvoided", hits * calls_per_miss),
+    }
+
+
+def report(db: Any, stores: Any) -> dict[str, Any]:
+    """
+    Aggregate every cache's shards into a report and store it.
+
+    Args:
+        db: Firestore client
+        stores: CacheStore instances to report on
+
+    Returns:
+        {collection: {ttlSeconds, upstream, total, sinceLastReport}}
+    """
+    reported_at = time.time()
+    caches: dict[str, Any] = {}
+    for store in stores:
+        counter_ref = db.collection(METRICS_COLLECTION).document(store.collection)
+        totals = sharded_counter.totals(counter_ref)
+        previous = (counter_ref.get().to_dict() or {})
+        last_totals = previous.get("lastTotals") or {}
+        interval = {field: totals.get(field, 0) - last_totals.get(field, 0) for field in FIELDS}
+
+        caches[store.collection] = {
+            "ttlSeconds": store.ttl_seconds,
+            "upstream": store.upstream,
+            "total": summarize(totals, store.calls_per_miss),
+            "sinceLastReport": {
+                **summarize(interval, store.calls_per_miss),
+                "seconds": round(reported_at - previous["lastReportAt"], 1) if previous.get("lastReportAt") else None,
+            },
+        }
+        counter_ref.set({"lastTotals": totals, "lastReportAt": reported_at}, merge=True)
+
+    db.collection(REPORTS_COLLECTION).document(str(int(reported_at))).set({
+        "reportedAt": reported_at,
+        "caches": caches,
+    })
+    return caches
+
+
+@atexit.register
+def _flush_on_shutdown() -> None:
+    if _pending:
+        flush()
@@ -0,0 +1,204 @@
+"""
+Firestore-backed response caches shared by the callable handlers.
+
+The handlers used to build document IDs from raw user text (e.g.
+f"{text}_{language}"), which fails for text containing "/" or longer than
+Firestore's 1,500-byte ID limit, and misses on whitespace or Unicode
+variants of the same message. Every cache now goes through a CacheStore:
+
+    {collection}/v{version}_{sha256(canonical key)}
+        <value fields>, timestamp, cacheVersion
+
+The canonical key is the JSON list of the key parts after normalization:
+text is NFC-normalized, trimmed, and runs of whitespace are collapsed (one
+newline if the run contains one, otherwise one space). Bumping a store's
+version (for example after a prompt change) moves it to new document IDs;
+entries under the old version are never read again and are removed by
+clean_translation_cache once they expire.
+
+Values are stored as flat document fields, so cached entries stay readable
+in the console and by tools such as build_idiom_lexicon.py. `timestamp`
+and `cacheVersion` are reserved.
+
+Reads return expired entries too (CacheEntry.fresh is False), so handlers
+can serve them while an upstream is unavailable. Hits, misses, stale reads
+and writes are counted per store in the tracing counters
+(cache.<name>.hits, .misses, .stale, .writes) and, with entry sizes and
+ages, in cache_metrics for the aggregated effectiveness report.
+"""
+
+import hashlib
+import json
+import re
+import time
+import unicodedata
+from typing import Any, NamedTuple
+
+import cache_metrics
+from tracing import increment, span
+
+# Fields added to every entry; not part of the cached value
+METADATA_FIELDS = ("timestamp", "cacheVersion")
+
+# Deletes per batch commit (Firestore's limit)
+BATCH_SIZE = 500
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+class CacheEntry(NamedTuple):
+    value: dict[str, Any]
+    age_seconds: float
+    fresh: bool
+
+
+def canonical_text(text: str) -> str:
+    """Normalize text for use in a cache key."""
+    text = unicodedata.normalize("NFC", text).strip()
+    return _WHITESPACE.sub(lambda m: "\n" if "\n" in m.group(0) else " ", text)
+
+
+class CacheStore:
+    """
+    One cache collection: key derivation, TTL, serialization and metrics.
+
+    `upstream` and `calls_per_miss` describe what a miss costs (the
+    upstream calls a hit avoids), for cache_metrics reports.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        collection: str,
+        ttl_seconds: int,
+        upstream: str,
+        calls_per_miss: int = 1,
+        version: int = 1,
+    ) -> None:
+        self.name = name
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self.upstream = upstream
+        self.calls_per_miss = calls_per_miss
+        self.version = version
+
+    @property
+    def prefix(self) -> str:
+        """Document ID prefix of the current version."""
+        return f"v{self.version}_"
+
+    def key(self, *parts: Any) -> str:
+        """
+        Document ID for the key parts.
+
+        Strings are normalized with canonical_text; other parts must be
+        JSON-serializable (numbers, lists, dicts).
+        """
+        canonical = [canonical_text(part) if isinstance(part, str) else part for part in parts]
+        encoded = json.dumps(canonical, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        return self.prefix + hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def document(self, db: Any, *parts: Any) -> Any:
+        """Reference to the cache entry for the key parts."""
+        return db.collection(self.collection).document(self.key(*parts))
+
+    def get(self, ref: Any, timeout: float | None = None) -> CacheEntry | None:
+        """
+        Read a cache entry, expired or not.
+
+        Args:
+            ref: Reference from document()
+            timeout: Firestore read timeout (e.g. deadlines.timeout())
+
+        Returns:
+            The entry, or None if there is none
+        """
+        with span("cache_lookup", cache=self.name) as attrs:
+            attrs["hit"] = False
+            snapshot = ref.get(timeout=timeout) if timeout is not None else ref.get()
+            data = snapshot.to_dict() if snapshot.exists else None
+            timestamp = data.get("timestamp") if data else None
+            if timestamp:
+                age_seconds = time.time() - timestamp
+                fresh = age_seconds < self.ttl_seconds
+                attrs["hit"] = fresh
+                attrs["ageSeconds"] = round(age_seconds, 1)
+
+        # Metrics are recorded outside the span: a periodic flush is not lookup latency
+        if not timestamp:
+            increment(f"cache.{self.name}.misses")
+            cache_metrics.record(self.collection, lookups=1, misses=1)
+            return None
+
+        value = {field: v for field, v in data.items() if field not in METADATA_FIELDS}
+        if fresh:
+            increment(f"cache.{self.name}.hits")
+            cache_metrics.record(
+                self.collection,
+                lookups=1,
+                hits=1,
+                hitAgeSeconds=age_seconds,
+                bytesServed=cache_metrics.entry_bytes(value),
+                upstreamCallsAvoided=self.calls_per_miss,
+            )
+        else:
+            # Expired: a miss unless the handler serves it as a degraded fallback
+            increment(f"cache.{self.name}.stale")
+            cache_metrics.record(self.collection, lookups=1, misses=1, stale=1)
+        return CacheEntry(value, age_seconds, fresh)
+
+    def exists(self, ref: Any) -> bool:
+        """Whether an entry exists, without counting a lookup."""
+        return ref.get().exists
+
+    def set(self, ref: Any, value: dict[str, Any]) -> None:
+        """Write a cache entry, stamped with the current time and version."""
+        with span("cache_write", cache=self.name):
+            ref.set({**value, "timestamp": time.time(), "cacheVersion": self.version})
+        increment(f"cache.{self.name}.writes")
+        cache_metrics.record(self.collection, writes=1, bytesWritten=cache_metrics.entry_bytes(value))
+
+    def purge_expired(self, db: Any) -> tuple[int, int]:
+        """
+        Delete entries older than the TTL, in batches.
+
+        Returns:
+            (deleted, errors)
+        """
+        cutoff_time = time.time() - self.ttl_seconds
+        expired_docs = db.collection(self.collection).where("timestamp", "<", cutoff_time).stream()
+
+        deleted = 0
+        errors = 0
+        batch = db.batch()
+        batch_count = 0
+        for doc in expired_docs:
+            try:
+                batch.delete(doc.reference)
+                batch_count += 1
+                deleted += 1
+
+                if batch_count >= BATCH_SIZE:
+                    batch.commit()
+                    batch = db.batch()
+                    batch_count = 0
+            except Exception as e:
+                errors += 1
+                print(f"Error deleting {self.name} cache entry {doc.id}: {e}")
+
+        if batch_count > 0:
+            batch.commit()
+        return deleted, errors
+
+
+TRANSLATION = CacheStore("translation", "translation_cache", ttl_seconds=86400, upstream="translate")  # 24 hours
+FORMALITY = CacheStore("formality", "formality_cache", ttl_seconds=86400, upstream="openai")  # 24 hours
+MESSAGE_CONTEXT = CacheStore(
+    "message_context", "message_context_cache", ttl_seconds=2592000, upstream="openai"  # 30 days
+)
+SMART_REPLIES = CacheStore("smart_replies", "smart_reply_cache", ttl_seconds=604800, upstream="openai")  # 7 days
+SEMANTIC_SEARCH = CacheStore(
+    "semantic_search", "semantic_search_cache", ttl_seconds=300, upstream="vector_search"  # 5 minutes
+)
+
+STORES = (TRANSLATION, FORMALITY, MESSAGE_CONTEXT, SMART_REPLIES, SEMANTIC_SEARCH)
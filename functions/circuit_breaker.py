@@ -0,0 +1,226 @@
+"""
+Per-upstream circuit breakers for MessageAI Cloud Functions.
+
+When OpenAI, Vertex AI or the Translation API degrades, every request that
+calls it holds a concurrent slot until the call times out, and with
+max_instances=10 that saturates the whole deployment. A breaker watches
+the outcome of recent calls to one upstream and, once too many failed or
+were slow, rejects further calls immediately (CircuitOpenError) so that
+handlers can serve a degraded response instead:
+
+    closed     calls go through; the last WINDOW_SIZE outcomes are tracked
+    open       calls fail fast for OPEN_SECONDS
+    half_open  up to HALF_OPEN_CALLS trial calls; success closes the
+               breaker, a failure opens it again
+
+Usage:
+    try:
+        with circuit_breaker.guard("openai"), span("upstream.openai"):
+            response = client.chat.completions.create(...)
+    except circuit_breaker.CircuitOpenError:
+        ...  # stale cache entry, fallback suggestions, queue for later
+
+Breakers are per instance. State changes are logged as structured
+entries. The state and the trip and rejection counts also appear in the
+tracing histogram dumps (gauges `breaker.<name>.state` and counters
+`breaker.<name>.trips` / `breaker.<name>.rejected`).
+"""
+
+import contextlib
+import threading
+import time
+from collections import deque
+from typing import Any, Iterator
+
+from firebase_functions import logger
+
+from tracing import INSTANCE_ID, current_function, increment, set_gauge
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Outcomes remembered per upstream
+WINDOW_SIZE = 20
+
+# Outcomes needed before the breaker may trip
+MIN_CALLS = 10
+
+# Trip when this share of the window failed, or was slower than slow_call_ms
+FAILURE_RATE_THRESHOLD = 0.5
+SLOW_RATE_THRESHOLD = 0.5
+
+# How long an open breaker rejects calls before letting trial calls through
+OPEN_SECONDS = 30.0
+
+HALF_OPEN_CALLS = 2
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose breaker is open."""
+
+    def __init__(self, name: str, retry_after: float) -> None:
+        super().__init__(f"{name} circuit breaker is open; retry in {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Failure-rate and slow-call-rate breaker for one upstream."""
+
+    def __init__(self, name: str, slow_call_ms: float = 10000.0, open_seconds: float = OPEN_SECONDS) -> None:
+        self.name = name
+        self.slow_call_ms = slow_call_ms
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self.trips = 0
+        self._outcomes: deque[tuple[bool, bool]] = deque(maxlen=WINDOW_SIZE)
+        self._opened_at = 0.0
+        self._trial_calls = 0
+        self._lock = threading.Lock()
+        set_gauge(f"breaker.{name}.state", CLOSED)
+
+    def _transition(self, state: str, reason: str) -> None:
+        # Callers hold self._lock
+        previous, self.state = self.state, state
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+            self.trips += 1
+            increment(f"breaker.{self.name}.trips")
+        if state in (CLOSED, HALF_OPEN):
+            self._trial_calls = 0
+        if state == CLOSED:
+            self._outcomes.clear()
+        set_gauge(f"breaker.{self.name}.state", state)
+        logger.write({  # type: ignore[arg-type]
+            "severity": "WARNING" if state == OPEN else "INFO",
+            "message": f"circuit breaker {self.name} {previous} -> {state} ({reason})",
+            "circuitBreaker": self.name,
+            "state": state,
+            "previousState": previous,
+            "reason": reason,
+            "trips": self.trips,
+            "function": current_function(),
+            "instanceId": INSTANCE_ID,
+        })
+
+    def before_call(self) -> None:
+        """Admit a call or raise CircuitOpenError."""
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self.open_seconds - (time.monotonic() - self._opened_at)
+                if remaining > 0:
+                    increment(f"breaker.{self.name}.rejected")
+                    raise CircuitOpenError(self.name, remaining)
+                self._transition(HALF_OPEN, "open timeout elapsed")
+            if self.state == HALF_OPEN:
+                if self._trial_calls >= HALF_OPEN_CALLS:
+                    increment(f"breaker.{self.name}.rejected")
+                    raise CircuitOpenError(self.name, self.open_seconds)
+                self._trial_calls += 1
+
+    def after_call(self, duration_ms: float, failed: bool) -> None:
+        """Record the outcome of an admitted call."""
+        slow = duration_ms >= self.slow_call_ms
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if failed or slow:
+                    self._transition(OPEN, "trial call failed" if failed else "trial call slow")
+                else:
+                    self._transition(CLOSED, "trial call succeeded")
+                return
+            if self.state == OPEN:
+                # Admitted before another call tripped the breaker
+                return
+
+            self._outcomes.append((failed, slow))
+            if len(self._outcomes) < MIN_CALLS:
+                return
+            failure_rate = sum(1 for f, _ in self._outcomes if f) / len(self._outcomes)
+            slow_rate = sum(1 for _, s in self._outcomes if s) / len(self._outcomes)
+            if failure_rate >= FAILURE_RATE_THRESHOLD:
+                self._transition(OPEN, f"failure rate {failure_rate:.0%}")
+            elif slow_rate >= SLOW_RATE_THRESHOLD:
+                self._transition(OPEN, f"slow call rate {slow_rate:.0%} (>= {self.slow_call_ms:.0f}ms)")
+
+    def reset(self) -> None:
+        """Close the breaker and forget recorded outcomes (trip count is kept)."""
+        with self._lock:
+            self.state = CLOSED
+            self._outcomes.clear()
+            self._trial_calls = 0
+            set_gauge(f"breaker.{self.name}.state", CLOSED)
+
+    def to_dict(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "trips": self.trips,
+                "windowCalls": len(self._outcomes),
+                "windowFailures": sum(1 for f, _ in self._outcomes if f),
+                "windowSlow": sum(1 for _, s in self._outcomes if s),
+            }
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_registry_lock = threading.Lock()
+
+
+def configure(name: str, **settings: Any) -> CircuitBreaker:
+    """
+    Create (or replace) the breaker for an upstream.
+
+    Args:
+        name: Upstream name (e.g. 'openai', 'translate', 'vertex')
+        **settings: CircuitBreaker keyword arguments (slow_call_ms, open_seconds)
+    """
+    with _registry_lock:
+        breaker = _breakers[name] = CircuitBreaker(name, **settings)
+    return breaker
+
+
+def get(name: str) -> CircuitBreaker:
+    """The breaker for an upstream, created with defaults if not configured."""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _registry_lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                breaker = _breakers[name] = CircuitBreaker(name)
+    return breaker
+
+
+@contextlib.contextmanager
+def guard(name: str) -> Iterator[CircuitBreaker]:
+    """
+    Run an upstream call under its breaker.
+
+    Raises CircuitOpenError without running the block while the breaker is
+    open. Any exception from the block counts as a failure.
+    """
+    breaker = get(name)
+    breaker.before_call()
+    start = time.perf_counter()
+    failed = False
+    try:
+        yield breaker
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        breaker.after_call((time.perf_counter() - start) * 1000, failed)
+
+
+def snapshot() -> dict[str, dict[str, Any]]:
+    """State of every breaker on this instance."""
+    with _registry_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.to_dict() for breaker in breakers}
+
+
+def reset() -> None:
+    """Close every breaker on this instance (e.g. between benchmark runs)."""
+    with _registry_lock:
+        breakers = list(_breakers.values())
+    for breaker in breakers:
+        breaker.reset()
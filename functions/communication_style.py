@@ -0,0 +1,243 @@
+"""
+Incremental per-user communication-style profiles.
+
+The message ingest trigger (update_communication_style in main.py) folds
+every new message into running totals kept as a sharded counter:
+
+    communication_style_stats/{userId}/shards/{n}
+        messages:            messages counted
+        lengthMessages:      messages of MIN_LENGTH_CHARS or more
+        lengthTotal:         characters in those messages
+        emojiMessages:       messages containing an emoji
+        exclamationMessages: messages containing '!'
+        casualScored:        messages that got a casual score
+        casualScoredTotal:   sum of those scores (0.0-1.0 each)
+
+Each message costs one blind write; message history is never rescanned.
+The derived profile (the same fields as the app's UserCommunicationStyle)
+is materialized on users/{userId}.communicationStyle roughly every
+STYLE_REFRESH_EVERY messages, which is what smart replies read.
+
+Casual/formal markers are per language. A message in a language without a
+marker list is scored only if it contains a marker of some language;
+otherwise it is left out of the casuality average rather than counted as
+neutral. (Totals written before casualScored existed only have
+casualTotal, averaged over all messages.)
+"""
+
+import re
+import time
+import zlib
+from typing import Any
+
+import sharded_counter
+
+STATS_COLLECTION = "communication_style_stats"
+
+# Shards per user; one user rarely sends more than a few messages per second
+STATS_SHARDS = 4
+
+# Rebuild the materialized profile about once every this many messages
+STYLE_REFRESH_EVERY = 10
+
+# Users with fewer messages keep the default style (as in the app)
+MIN_PROFILE_MESSAGES = 5
+
+# Very short messages ("ok", "k") are left out of the average length
+MIN_LENGTH_CHARS = 5
+
+DEFAULT_STYLE: dict[str, Any] = {
+    "averageMessageLength": 50.0,
+    "emojiUsageRate": 0.0,
+    "exclamationRate": 0.0,
+    "casualityScore": 0.5,
+    "styleDescription": "neutral, conversational",
+}
+
+_EMOJI = re.compile(
+    "["
+    "\U0001F000-\U0001FAFF"  # pictographs, emoticons, transport, supplemental symbols
+    "\u2600-\u27BF"  # miscellaneous symbols and dingbats
+    "\u2B00-\u2BFF"  # arrows and stars
+    "]"
+)
+_WORD = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)*")
+
+# Per language: (casual markers, formal markers)
+_MARKERS: dict[str, tuple[frozenset[str], frozenset[str]]] = {
+    "en": (
+        frozenset({
+            "don't", "won't", "can't", "gonna", "wanna", "gotta", "ain't", "y'all", "kinda", "sorta",
+            "lol", "omg", "tbh", "idk", "nah", "yeah", "yep", "nope", "btw", "brb", "lmao", "haha", "u", "ur",
+            "thx",
+        }),
+        frozenset({
+            "regards", "sincerely", "furthermore", "however", "therefore", "kindly", "please", "appreciate",
+            "dear", "would", "shall",
+        }),
+    ),
+    "es": (
+        frozenset({
+            "jaja", "jajaja", "jajajaja", "xd", "q", "k", "xq", "pq", "tmb", "porfa", "finde", "vale", "guay",
+            "tío", "tía", "wey", "güey", "neta", "chido", "oye", "bro",
+        }),
+        frozenset({
+            "usted", "ustedes", "estimado", "estimada", "atentamente", "cordialmente", "agradecería",
+            "agradezco", "quisiera", "podría", "señor", "señora",
+        }),
+    ),
+    "fr": (
+        frozenset({
+            "mdr", "ptdr", "lol", "bcp", "stp", "slt", "jsp", "tkt", "ouais", "bah", "mec", "wesh", "chui",
+            "oklm", "bref", "ouf",
+        }),
+        frozenset({
+            "vous", "veuillez", "cordialement", "madame", "monsieur", "salutations", "pourriez", "voudriez",
+            "sincèrement", "respectueusement",
+        }),
+    ),
+    "de": (
+        frozenset({
+            "hdl", "hdgdl", "lg", "vlt", "kp", "nö", "jo", "joa", "digga", "alter", "krass", "geil", "haha",
+            "lol", "nee", "gell", "bock",
+        }),
+        frozenset({
+            "geehrte", "geehrter", "freundlichen", "hochachtungsvoll", "verbleibe", "könnten", "würden",
+            "dürfte", "bezüglich",
+        }),
+    ),
+    "pt": (
+        frozenset({
+            "kkk", "kkkk", "kkkkk", "rs", "rsrs", "vc", "vcs", "tb", "tbm", "blz", "pq", "mano", "cara", "tô",
+            "tá", "né", "beleza", "valeu", "haha",
+        }),
+        frozenset({
+            "senhor", "senhora", "prezado", "prezada", "atenciosamente", "cordialmente", "gostaria",
+            "poderia", "agradeço",
+        }),
+    ),
+}
+
+_ALL_CASUAL = frozenset().union(*(casual for casual, _ in _MARKERS.values()))
+_ALL_FORMAL = frozenset().union(*(formal for _, formal in _MARKERS.values()))
+
+
+def casual_score(text: str, language: str | None = None) -> float | None:
+    """
+    Casualness of one message: 0.5 is neutral, each marker moves it by 0.25.
+
+    Args:
+        text: Message text
+        language: Detected language of the message, if known
+
+    Returns:
+        The score, or None when it says nothing: the language has no
+        marker list, or it is unknown and no marker of any language occurs
+    """
+    if language is not None and language not in _MARKERS:
+        return None
+    casual_markers, formal_markers = _MARKERS[language] if language else (_ALL_CASUAL, _ALL_FORMAL)
+    words = _WORD.findall(text.lower().replace("\u2019", "'"))
+    casual = sum(1 for word in words if word in casual_markers)
+    formal = sum(1 for word in words if word in formal_markers)
+    if language is None and not casual and not formal:
+        return None
+    return min(1.0, max(0.0, 0.5 + 0.25 * (casual - formal)))
+
+
+def message_increments(text: str, language: str | None = None) -> dict[str, int | float]:
+    """Counter increments contributed by one message."""
+    text = text.strip()
+    counted_length = len(text) >= MIN_LENGTH_CHARS
+    score = casual_score(text, language)
+    return {
+        "messages": 1,
+        "lengthMessages": 1 if counted_length else 0,
+        "lengthTotal": len(text) if counted_length else 0,
+        "emojiMessages": 1 if _EMOJI.search(text) else 0,
+        "exclamationMessages": 1 if "!" in text else 0,
+        "casualScored": 0 if score is None else 1,
+        "casualScoredTotal": score or 0.0,
+    }
+
+
+def describe(style: dict[str, Any]) -> str:
+    """Human-readable style description, e.g. 'brief, casual, enthusiastic'."""
+    traits = []
+    if style["averageMessageLength"] < 30:
+        traits.append("brief")
+    elif style["averageMessageLength"] > 100:
+        traits.append("detailed")
+    if style["casualityScore"] >= 0.65:
+        traits.append("casual")
+    elif style["casualityScore"] <= 0.35:
+        traits.append("formal")
+    if style["exclamationRate"] >= 0.3:
+        traits.append("enthusiastic")
+    if style["emojiUsageRate"] >= 0.3:
+        traits.append("expressive")
+    return ", ".join(traits) if traits else DEFAULT_STYLE["styleDescription"]
+
+
+def build_profile(totals: dict[str, int | float]) -> dict[str, Any] | None:
+    """
+    Derive the communication style from the running totals.
+
+    Returns:
+        The profile, or None while the user has fewer than MIN_PROFILE_MESSAGES
+    """
+    messages = totals.get("messages", 0)
+    if messages < MIN_PROFILE_MESSAGES:
+        return None
+    length_messages = totals.get("lengthMessages", 0)
+    if totals.get("casualScored"):
+        casuality = totals.get("casualScoredTotal", 0) / totals["casualScored"]
+    elif totals.get("casualTotal"):
+        casuality = totals["casualTotal"] / messages
+    else:
+        casuality = DEFAULT_STYLE["casualityScore"]
+    style = {
+        "averageMessageLength": round(
+            totals.get("lengthTotal", 0) / length_messages if length_messages
+            else DEFAULT_STYLE["averageMessageLength"], 1),
+        "emojiUsageRate": round(totals.get("emojiMessages", 0) / messages, 3),
+        "exclamationRate": round(totals.get("exclamationMessages", 0) / messages, 3),
+        "casualityScore": round(casuality, 2),
+    }
+    style["styleDescription"] = describe(style)
+    style["messageCount"] = int(messages)
+    style["lastAnalyzedAt"] = time.time()
+    return style
+
+
+def should_refresh(message_id: str) -> bool:
+    """
+    Whether this message rebuilds the materialized profile.
+
+    Chosen by hashing the message ID, so a redelivered event makes the same
+    decision and no counter read is needed to decide.
+    """
+    return zlib.crc32(message_id.encode("utf-8")) % STYLE_REFRESH_EVERY == 0
+
+
+def record_message(db: Any, user_id: str, text: str, language: str | None = None) -> None:
+    """Add one message from `user_id` (in `language`, if known) to their running style totals."""
+    stats_ref = db.collection(STATS_COLLECTION).document(user_id)
+    sharded_counter.increment(stats_ref, message_increments(text, language), num_shards=STATS_SHARDS)
+
+
+def refresh_profile(db: Any, user_id: str) -> dict[str, Any] | None:
+    """
+    Rebuild users/{userId}.communicationStyle from the running totals.
+
+    Reads the STATS_SHARDS shard documents (one query) and writes the user
+    document once.
+
+    Returns:
+        The profile written, or None if the user has too few messages yet
+    """
+    totals = sharded_counter.totals(db.collection(STATS_COLLECTION).document(user_id))
+    profile = build_profile(totals)
+    if profile is not None:
+        db.collection("users").document(user_id).set({"communicationStyle": profile}, merge=True)
+    return profile
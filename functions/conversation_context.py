@@ -0,0 +1,212 @@
+"""
+Rolling per-conversation context for smart replies.
+
+The ingest trigger (update_conversation_context in main.py) appends every
+new message to one compact document per conversation:
+
+    conversation_context/{conversationId}
+        recentMessages:       last RECENT_MESSAGE_LIMIT messages (oldest first)
+        summary:              model-written summary of the conversation so far
+        messagesSinceSummary: messages appended since the summary was refreshed
+        messageCount:         messages seen in total
+        summaryClaim:         {messageId, count, claimedAt} while a refresh runs
+
+Smart replies build their prompt from this single read instead of an
+embedding call plus a vector search. The summary is refreshed every
+SUMMARY_REFRESH_EVERY messages; since that is below RECENT_MESSAGE_LIMIT,
+every message is covered by a summary before it drops out of the window.
+
+Only one refresh runs at a time. The append that crosses the threshold
+claims the refresh in the same transaction (summaryClaim), and only the
+trigger of that message calls the model. save_summary subtracts the
+claimed count and clears the claim, so concurrent messages neither start
+duplicate refreshes nor push messagesSinceSummary below zero. A claim
+whose refresh died is taken over after SUMMARY_CLAIM_TTL_SECONDS.
+"""
+
+import datetime
+import time
+from typing import Any
+
+from firebase_admin import firestore
+
+CONTEXT_COLLECTION = "conversation_context"
+
+# Messages kept verbatim on the context document
+RECENT_MESSAGE_LIMIT = 20
+
+# Refresh the summary after this many new messages
+SUMMARY_REFRESH_EVERY = 15
+
+# Per-message text stored (keeps the document far below the 1 MiB limit)
+MAX_MESSAGE_CHARS = 280
+
+# Recent messages included in the smart reply prompt
+PROMPT_MESSAGES = 8
+
+SUMMARY_MAX_CHARS = 600
+
+# A refresh still claimed after this long is assumed to have died
+SUMMARY_CLAIM_TTL_SECONDS = 120
+
+
+def _timestamp_seconds(value: Any) -> float:
+    """Message timestamps are floats or Firestore timestamps; compare as seconds."""
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    if isinstance(value, (int, float)):
+        return float(value)
+    return 0.0
+
+
+def message_entry(message_id: str, message_data: dict[str, Any]) -> dict[str, Any]:
+    """Compact form of a message as stored in recentMessages."""
+    return {
+        "messageId": message_id,
+        "senderId": message_data.get("senderId", ""),
+        "senderName": message_data.get("senderName", ""),
+        "text": (message_data.get("text") or "")[:MAX_MESSAGE_CHARS],
+        "timestamp": _timestamp_seconds(message_data.get("timestamp")) or time.time(),
+    }
+
+
+def append_message(context: dict[str, Any] | None, entry: dict[str, Any]) -> dict[str, Any]:
+    """
+    Return the context with `entry` added.
+
+    Idempotent for redelivered events: a message already in the window is
+    not counted twice. Claims the summary refresh for this message when it
+    crosses the threshold and no other refresh is running.
+    """
+    context = dict(context or {})
+    recent = list(context.get("recentMessages", []))
+    if any(m.get("messageId") == entry["messageId"] for m in recent):
+        return context
+
+    recent.append(entry)
+    # Triggers can fire out of order; keep the window sorted by send time
+    recent.sort(key=lambda m: m.get("timestamp", 0))
+    context["recentMessages"] = recent[-RECENT_MESSAGE_LIMIT:]
+    context["messageCount"] = context.get("messageCount", 0) + 1
+    context["messagesSinceSummary"] = context.get("messagesSinceSummary", 0) + 1
+    context["updatedAt"] = time.time()
+
+    claim = context.get("summaryClaim")
+    claim_live = claim and time.time() - claim.get("claimedAt", 0) < SUMMARY_CLAIM_TTL_SECONDS
+    if context["messagesSinceSummary"] >= SUMMARY_REFRESH_EVERY and not claim_live:
+        context["summaryClaim"] = {
+            "messageId": entry["messageId"],
+            "count": context["messagesSinceSummary"],
+            "claimedAt": context["updatedAt"],
+        }
+    return context
+
+
+@firestore.transactional
+def _append_in_transaction(
+    transaction: Any, context_ref: Any, entry: dict[str, Any],
+) -> tuple[dict[str, Any], bool]:
+    snapshot = context_ref.get(transaction=transaction)
+    current = snapshot.to_dict() if snapshot.exists else None
+    updated = append_message(current, entry)
+    appended = updated != current
+    if appended:
+        transaction.set(context_ref, updated)
+    return updated, appended
+
+
+def record_message(
+    db: Any, conversation_id: str, message_id: str, message_data: dict[str, Any],
+) -> tuple[dict[str, Any], bool]:
+    """
+    Append a new message to the conversation's rolling context.
+
+    Args:
+        db: Firestore client
+        conversation_id: Conversation the message belongs to
+        message_id: Message document ID
+        message_data: Message document data
+
+    Returns:
+        (updated context document, whether the message was new; False
+        for a redelivered event)
+    """
+    context_ref = db.collection(CONTEXT_COLLECTION).document(conversation_id)
+    return _append_in_transaction(db.transaction(), context_ref, message_entry(message_id, message_data))
+
+
+def get_context(db: Any, conversation_id: str, timeout: float | None = None) -> dict[str, Any] | None:
+    """Read the rolling context for a conversation, if one has been built."""
+    snapshot = db.collection(CONTEXT_COLLECTION).document(conversation_id).get(timeout=timeout)
+    return snapshot.to_dict() if snapshot.exists else None
+
+
+def needs_summary(context: dict[str, Any], message_id: str) -> bool:
+    """Whether appending this message claimed the summary refresh (see record_message)."""
+    return (context.get("summaryClaim") or {}).get("messageId") == message_id
+
+
+def summary_prompt(context: dict[str, Any]) -> str:
+    """User prompt asking the model to fold recent messages into the summary."""
+    previous = context.get("summary") or "(none yet)"
+    transcript = "\n".join(
+        f"{m.get('senderName') or m.get('senderId', 'Unknown')}: {m.get('text', '')}"
+        for m in context.get("recentMessages", [])
+    )
+    return f"""Update the running summary of this chat conversation.
+
+Previous summary:
+{previous}
+
+Latest messages (oldest first):
+{transcript}
+
+Write at most {SUMMARY_MAX_CHARS} characters covering the topics, open questions,
+plans and the overall tone. Only return the summary text."""
+
+
+@firestore.transactional
+def _finish_claim(transaction: Any, context_ref: Any, message_id: str, summary: str | None) -> bool:
+    snapshot = context_ref.get(transaction=transaction)
+    claim = (snapshot.to_dict() or {}).get("summaryClaim") if snapshot.exists else None
+    if not claim or claim.get("messageId") != message_id:
+        # Expired and taken over; the newer refresh covers these messages
+        return False
+    updates: dict[str, Any] = {"summaryClaim": firestore.DELETE_FIELD}
+    if summary is not None:
+        updates["summary"] = summary[:SUMMARY_MAX_CHARS]
+        updates["summaryUpdatedAt"] = time.time()
+        updates["messagesSinceSummary"] = firestore.Increment(-claim.get("count", 0))
+    transaction.update(context_ref, updates)
+    return True
+
+
+def save_summary(db: Any, conversation_id: str, message_id: str, summary: str) -> bool:
+    """
+    Store a refreshed summary and release the claim of `message_id`.
+
+    messagesSinceSummary is decremented by the claimed count (rather than
+    reset), so messages appended while the model was running still count
+    towards the next refresh.
+
+    Returns:
+        False if the claim was taken over and the summary was discarded
+    """
+    context_ref = db.collection(CONTEXT_COLLECTION).document(conversation_id)
+    return _finish_claim(db.transaction(), context_ref, message_id, summary)
+
+
+def release_summary_claim(db: Any, conversation_id: str, message_id: str) -> None:
+    """Give up a claimed refresh that failed, so the next message retries it."""
+    context_ref = db.collection(CONTEXT_COLLECTION).document(conversation_id)
+    _finish_claim(db.transaction(), context_ref, message_id, None)
+
+
+def prompt_lines(context: dict[str, Any] | None, limit: int = PROMPT_MESSAGES) -> list[str]:
+    """The most recent messages formatted for the smart reply prompt."""
+    if not context:
+        return []
+    return [
+        f"User {m.get('senderId', 'Unknown')[-4:]}: {m.get('text', '')}"
+        for m in context.get("recentMessages", [])[-limit:]
+    ]
@@ -0,0 +1,250 @@
+"""
+Per-conversation FCM token index for notification fan-out.
+
+Notification fan-out used to read the conversation and then every
+recipient's users document, only to collect fcmTokens. The index keeps
+everything fan-out needs in one server-only document per conversation:
+
+    conversation_tokens/{conversationId}
+        participantIds: participant UIDs
+        name:           conversation name (group title)
+        type:           conversation type
+        tokens:         {uid: [FCM token, ...]}
+        topicDelivery:  messages go to the conversation's FCM topic (fcm_topics.py)
+        updatedAt
+
+It is maintained by triggers in main.py: index_conversation_tokens
+rebuilds a conversation's entry when the conversation is created or its
+participants or name change, and propagate_user_tokens updates the user's
+entry in every conversation they belong to when their fcmTokens change.
+Fan-out builds a missing entry on first use. check() compares the index
+with conversations and users in bulk and repairs drift (missed trigger
+events, races between the two triggers, deleted conversations).
+
+Every change to an entry's tokens is mirrored to the conversation's FCM
+topic subscriptions (fcm_topics.sync) before the entry is written. If FCM
+rejects a call, the entry is left as it was, so it keeps describing the
+subscriptions that exist and check() retries the same change.
+"""
+
+import time
+from typing import Any, Iterable
+
+import fcm_topics
+
+TOKENS_COLLECTION = "conversation_tokens"
+
+# Tokens kept per user (most recently registered last); keeps entries for
+# large groups well below the 1 MiB document limit
+MAX_TOKENS_PER_USER = 10
+
+# Conversations compared per batch by check()
+CHECK_BATCH_SIZE = 100
+
+# Documents per get_all call
+GET_ALL_SIZE = 300
+
+# Fields compared by check(); updatedAt is bookkeeping
+INDEX_FIELDS = ("participantIds", "name", "type", "tokens")
+
+
+def participant_ids(conversation_data: dict[str, Any]) -> list[str]:
+    """Participant UIDs of a conversation document."""
+    ids = [p.get("uid") for p in conversation_data.get("participants", []) if p.get("uid")]
+    return ids or list(conversation_data.get("participantIds", []))
+
+
+def user_tokens(user_data: dict[str, Any] | None) -> list[str]:
+    """FCM tokens of a users document, as stored in the index."""
+    tokens = (user_data or {}).get("fcmTokens") or []
+    return [t for t in tokens if isinstance(t, str) and t][-MAX_TOKENS_PER_USER:]
+
+
+def index_entry(conversation_data: dict[str, Any], users: dict[str, dict[str, Any] | None]) -> dict[str, Any]:
+    """The index fields for a conversation, given its participants' users documents."""
+    ids = participant_ids(conversation_data)
+    return {
+        "participantIds": ids,
+        "name": conversation_data.get("name"),
+        "type": conversation_data.get("type"),
+        "tokens": {uid: user_tokens(users.get(uid)) for uid in ids},
+    }
+
+
+def _read_users(db: Any, uids: Iterable[str]) -> dict[str, dict[str, Any] | None]:
+    uids = list(dict.fromkeys(uids))
+    users: dict[str, dict[str, Any] | None] = {}
+    for i in range(0, len(uids), GET_ALL_SIZE):
+        refs = [db.collection("users").document(uid) for uid in uids[i:i + GET_ALL_SIZE]]
+        for snapshot in db.get_all(refs):
+            users[snapshot.id] = snapshot.to_dict() if snapshot.exists else None
+    return users
+
+
+def get(db: Any, conversation_id: str, timeout: float | None = None) -> dict[str, Any] | None:
+    """Read a conversation's index entry, if it has one."""
+    ref = db.collection(TOKENS_COLLECTION).document(conversation_id)
+    snapshot = ref.get(timeout=timeout) if timeout is not None else ref.get()
+    return snapshot.to_dict() if snapshot.exists else None
+
+
+def build(
+    db: Any,
+    conversation_id: str,
+    conversation_data: dict[str, Any],
+    sync_topics: bool = True,
+) -> dict[str, Any]:
+    """
+    Rebuild a conversation's index entry from its participants' users documents.
+
+    Args:
+        sync_topics: Move the conversation's topic subscriptions along (and
+            switch it to topic delivery if it is large enough). Without it
+            the entry uses per-token delivery until the next rebuild or check.
+
+    Returns:
+        The entry written
+    """
+    entry = index_entry(conversation_data, _read_users(db, participant_ids(conversation_data)))
+    entry["topicDelivery"] = False
+    if sync_topics:
+        entry["topicDelivery"] = fcm_topics.sync(conversation_id, get(db, conversation_id), entry)
+    db.collection(TOKENS_COLLECTION).document(conversation_id).set({**entry, "updatedAt": time.time()})
+    return entry
+
+
+def delete(db: Any, conversation_id: str) -> None:
+    """Remove a deleted conversation's index entry (and its topic subscriptions)."""
+    previous = get(db, conversation_id)
+    if previous is not None:
+        fcm_topics.sync(conversation_id, previous, None)
+    db.collection(TOKENS_COLLECTION).document(conversation_id).delete()
+
+
+def update_user(db: Any, user_id: str, user_data: dict[str, Any] | None) -> int:
+    """
+    Write a user's current tokens into every indexed conversation they are in.
+
+    Conversations without an index entry are skipped (fan-out builds the
+    entry on first use). In topic-delivery conversations the user's added
+    and removed tokens are (un)subscribed first; an entry whose topic could
+    not be updated is left for check() to repair.
+
+    Returns:
+        Number of index entries updated
+    """
+    tokens = user_tokens(user_data)
+    user_topic_added: set[str] = set()
+    user_topic_removed: set[str] = set()
+    conversation_ids = [
+        doc.id for doc in
+        db.collection("conversations").where("participantIds", "array_contains", user_id).select([]).stream()
+    ]
+    updated = 0
+    for i in range(0, len(conversation_ids), GET_ALL_SIZE):
+        refs = [db.collection(TOKENS_COLLECTION).document(cid) for cid in conversation_ids[i:i + GET_ALL_SIZE]]
+        batch = db.batch()
+        batch_count = 0
+        for snapshot in db.get_all(refs):
+            if not snapshot.exists:
+                continue
+            entry = snapshot.to_dict() or {}
+            if entry.get("topicDelivery"):
+                old = set(entry.get("tokens", {}).get(user_id, []))
+                topic = fcm_topics.conversation_topic(snapshot.id)
+                try:
+                    fcm_topics.unsubscribe(old - set(tokens), topic)
+                    fcm_topics.subscribe(set(tokens) - old, topic)
+                except Exception as e:
+                    print(f"Failed to update topic {topic} for {user_id}: {e}")
+                    continue
+                user_topic_added |= set(tokens) - old
+                user_topic_removed |= old - set(tokens)
+            batch.update(snapshot.reference, {f"tokens.{user_id}": tokens, "updatedAt": time.time()})
+            batch_count += 1
+        if batch_count:
+            batch.commit()
+            updated += batch_count
+
+    # Keeps sender exclusion working in the user's topic conversations
+    fcm_topics.unsubscribe(user_topic_removed, fcm_topics.user_topic(user_id))
+    fcm_topics.subscribe(user_topic_added, fcm_topics.user_topic(user_id))
+    return updated
+
+
+def _differs(stored: dict[str, Any] | None, expected: dict[str, Any]) -> bool:
+    if stored is None:
+        return True
+    if bool(stored.get("topicDelivery")) != fcm_topics.wants_topic(expected):
+        return True
+    return any(stored.get(field) != expected[field] for field in INDEX_FIELDS)
+
+
+def check(db: Any, repair: bool = True) -> dict[str, int]:
+    """
+    Compare every conversation's index entry with its source documents.
+
+    Entries that are missing or differ (including conversations that
+    crossed the topic delivery size either way) are rewritten and their
+    topic subscriptions synced, and entries of conversations that no longer
+    exist are deleted (unless repair is False).
+
+    Returns:
+        Counts: conversations checked, missing, stale, orphaned, repaired
+        and errors (FCM rejected a topic change; retried on the next check)
+    """
+    stats = {"checked": 0, "missing": 0, "stale": 0, "orphaned": 0, "repaired": 0, "errors": 0}
+    writer = db.bulk_writer() if repair else None
+    conversation_ids: set[str] = set()
+
+    def check_batch(conversations: list[tuple[str, dict[str, Any]]]) -> None:
+        users = _read_users(db, (uid for _, data in conversations for uid in participant_ids(data)))
+        refs = [db.collection(TOKENS_COLLECTION).document(cid) for cid, _ in conversations]
+        stored = {snapshot.id: snapshot.to_dict() if snapshot.exists else None for snapshot in db.get_all(refs)}
+        for conversation_id, data in conversations:
+            stats["checked"] += 1
+            expected = index_entry(data, users)
+            current = stored.get(conversation_id)
+            if not _differs(current, expected):
+                continue
+            stats["missing" if current is None else "stale"] += 1
+            if writer is None:
+                continue
+            try:
+                expected["topicDelivery"] = fcm_topics.sync(conversation_id, current, expected)
+            except Exception as e:
+                stats["errors"] += 1
+                print(f"Failed to sync topic for {conversation_id}: {e}")
+                continue
+            writer.set(db.collection(TOKENS_COLLECTION).document(conversation_id),
+                       {**expected, "updatedAt": time.time()})
+            stats["repaired"] += 1
+
+    pending: list[tuple[str, dict[str, Any]]] = []
+    for doc in db.collection("conversations").stream():
+        conversation_ids.add(doc.id)
+        pending.append((doc.id, doc.to_dict() or {}))
+        if len(pending) >= CHECK_BATCH_SIZE:
+            check_batch(pending)
+            pending = []
+    if pending:
+        check_batch(pending)
+
+    orphans = [ref for ref in db.collection(TOKENS_COLLECTION).list_documents() if ref.id not in conversation_ids]
+    stats["orphaned"] = len(orphans)
+    if writer is None:
+        orphans = []
+    for i in range(0, len(orphans), GET_ALL_SIZE):
+        for snapshot in db.get_all(orphans[i:i + GET_ALL_SIZE]):
+            try:
+                fcm_topics.sync(snapshot.id, snapshot.to_dict() if snapshot.exists else None, None)
+            except Exception as e:
+                stats["errors"] += 1
+                print(f"Failed to unsubscribe topic of deleted conversation {snapshot.id}: {e}")
+                continue
+            writer.delete(snapshot.reference)
+            stats["repaired"] += 1
+
+    if writer is not None:
+        writer.close()
+    return stats
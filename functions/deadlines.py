@@ -0,0 +1,360 @@
+"""
+Request deadlines, retries and hedged requests for upstream calls.
+
+Each handler runs under a deadline set by the @deadline decorator (below
+@traced). Every upstream call made through call() gets a timeout of at
+most the time the request has left, so no stage can hold a request (and
+its concurrency slot) longer than the handler's budget:
+
+    @https_fn.on_call(...)
+    @traced("generate_smart_replies_complete")
+    @deadline(8)
+    def generate_smart_replies_complete(req):
+        ...
+        embedding = deadlines.call(
+            lambda timeout: generate_vertex_ai_embedding(text, timeout=timeout),
+            name="vertex", idempotent=True, hedge=True,
+        )
+
+Idempotent calls (embeddings, translation, language detection) are
+retried on timeouts, connection errors, 408, 429 and 5xx, after a backoff
+with full jitter. Optionally they are also hedged: if the first attempt
+has not answered once the upstream's recent p95 latency has passed, a
+second identical request is sent and whichever answers first wins. Hedges
+are capped at HEDGE_BUDGET of calls, so the extra cost stays around 5-10%.
+
+Non-idempotent calls (OpenAI completions are billed per request) get a
+single attempt bounded by the deadline.
+
+Attempts run on a shared thread pool so that a call can be abandoned
+when its timeout passes, even for clients that take no timeout argument
+(the Translation v2 client). call_async() is the same for coroutines on
+the async path (see async_core.py): attempts are tasks, and a timed-out or
+losing hedged attempt is cancelled rather than abandoned. Counters:
+deadlines.<name>.retries, .hedges, .hedgeWins and .timeouts.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import functools
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Iterator, TypeVar
+
+from tracing import increment
+
+T = TypeVar("T")
+F = TypeVar("F", bound=Callable[..., Any])
+
+# Timeout per attempt when no request deadline is set (e.g. warm-up)
+DEFAULT_ATTEMPT_TIMEOUT = 30.0
+
+# Backoff between retries: full jitter over min(MAX_BACKOFF, BASE_BACKOFF * 2^n)
+BASE_BACKOFF_SECONDS = 0.1
+MAX_BACKOFF_SECONDS = 2.0
+
+# Hedge after this latency percentile of recent successful calls
+HEDGE_PERCENTILE = 0.95
+
+# Successful calls needed before hedging starts
+HEDGE_MIN_SAMPLES = 20
+
+# At most this share of calls may send a hedged request
+HEDGE_BUDGET = 0.1
+
+RETRYABLE_STATUS = frozenset({408, 429, 500, 502, 503, 504})
+
+_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar("message_ai_deadline", default=None)
+
+# Shared by all requests on the instance; attempts are I/O bound
+_executor = ThreadPoolExecutor(max_workers=64, thread_name_prefix="upstream")
+
+
+class DeadlineExceeded(Exception):
+    """The request deadline passed before the upstream call could complete."""
+
+
+class _LatencyTracker:
+    """Recent successful call latencies and hedge budget for one upstream."""
+
+    def __init__(self) -> None:
+        self.samples: deque[float] = deque(maxlen=200)
+        self.calls = 0
+        self.hedges = 0
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self.lock:
+            self.samples.append(seconds)
+
+    def hedge_delay(self) -> float | None:
+        """Seconds to wait before hedging, or None while there is too little data."""
+        with self.lock:
+            if len(self.samples) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(HEDGE_PERCENTILE * len(ordered)))]
+
+    def try_hedge(self) -> bool:
+        with self.lock:
+            if self.hedges + 1 > HEDGE_BUDGET * self.calls:
+                return False
+            self.hedges += 1
+            return True
+
+
+_trackers: dict[str, _LatencyTracker] = {}
+_trackers_lock = threading.Lock()
+
+
+def _tracker(name: str) -> _LatencyTracker:
+    with _trackers_lock:
+        tracker = _trackers.get(name)
+        if tracker is None:
+            tracker = _trackers[name] = _LatencyTracker()
+        return tracker
+
+
+@contextlib.contextmanager
+def scope(seconds: float) -> Iterator[None]:
+    """Run a block under a deadline `seconds` from now (an outer, earlier deadline wins)."""
+    new_deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(min(current, new_deadline) if current is not None else new_deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def deadline(seconds: float) -> Callable[[F], F]:
+    """
+    Decorator that runs a handler under a request deadline.
+
+    Apply it beneath @traced.
+    """
+    def decorator(func: F) -> F:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with scope(seconds):
+                return func(*args, **kwargs)
+        return wrapper  # type: ignore[return-value]
+    return decorator
+
+
+def remaining() -> float | None:
+    """Seconds left before the current request's deadline (None if there is none)."""
+    current = _deadline.get()
+    return None if current is None else current - time.monotonic()
+
+
+def timeout(cap: float | None = None) -> float:
+    """
+    Timeout for the next blocking call (e.g. a Firestore read).
+
+    Raises:
+        DeadlineExceeded: If the deadline has already passed
+    """
+    left = remaining()
+    if left is None:
+        left = DEFAULT_ATTEMPT_TIMEOUT
+    if left <= 0:
+        raise DeadlineExceeded("request deadline exceeded")
+    return min(left, cap) if cap is not None else left
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Timeouts, connection errors, 408/429 and 5xx responses are worth retrying."""
+    if isinstance(error, DeadlineExceeded):
+        return False
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is None and isinstance(getattr(error, "code", None), int):
+        status = error.code  # google.api_core exceptions carry the HTTP status as .code
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    # OSError covers ConnectionError and the requests exception hierarchy
+    if isinstance(error, (TimeoutError, OSError)):
+        return True
+    # httpx (the async clients) has its own transport error hierarchy
+    import httpx
+    return isinstance(error, httpx.TransportError)
+
+
+def _submit(fn: Callable[[float], T], attempt_timeout: float) -> "Future[T]":
+    context = contextvars.copy_context()
+    return _executor.submit(context.run, fn, attempt_timeout)
+
+
+def _attempt(fn: Callable[[float], T], name: str, attempt_timeout: float, hedge: bool) -> T:
+    """One attempt, possibly hedged; raises the first error if every request failed."""
+    tracker = _tracker(name)
+    started = time.monotonic()
+    futures = [_submit(fn, attempt_timeout)]
+    hedge_delay = tracker.hedge_delay() if hedge else None
+
+    if hedge_delay is not None and hedge_delay < attempt_timeout:
+        done, _ = wait(futures, timeout=hedge_delay)
+        if not done and tracker.try_hedge():
+            increment(f"deadlines.{name}.hedges")
+            futures.append(_submit(fn, attempt_timeout - (time.monotonic() - started)))
+
+    pending = set(futures)
+    first_error: BaseException | None = None
+    while pending:
+        left = attempt_timeout - (time.monotonic() - started)
+        done, pending = wait(pending, timeout=max(0.0, left), return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            error = future.exception()
+            if error is None:
+                if future is not futures[0]:
+                    increment(f"deadlines.{name}.hedgeWins")
+                tracker.record(time.monotonic() - started)
+                return future.result()
+            first_error = first_error or error
+
+    if first_error is not None and not pending:
+        raise first_error
+    # Abandoned attempts finish in the background; their results are dropped
+    increment(f"deadlines.{name}.timeouts")
+    raise TimeoutError(f"{name} call timed out after {attempt_timeout:.2f}s")
+
+
+def call(
+    fn: Callable[[float], T],
+    name: str,
+    idempotent: bool = False,
+    hedge: bool = False,
+    attempts: int = 3,
+    attempt_timeout: float | None = None,
+) -> T:
+    """
+    Call an upstream within the request deadline.
+
+    Args:
+        fn: Performs the call; receives the timeout in seconds for this attempt
+        name: Upstream name, for latency tracking and counters (e.g. 'vertex')
+        idempotent: Whether the call may be retried and hedged
+        hedge: Send a second request when the first is slower than recent p95
+        attempts: Maximum attempts for idempotent calls
+        attempt_timeout: Upper bound for a single attempt (seconds)
+
+    Raises:
+        DeadlineExceeded: If the deadline passed before a successful attempt
+        Exception: The last error from `fn` once retries are exhausted
+    """
+    tracker = _tracker(name)
+    with tracker.lock:
+        tracker.calls += 1
+    max_attempts = attempts if idempotent else 1
+
+    attempt = 0
+    while True:
+        try:
+            this_timeout = timeout(attempt_timeout)
+        except DeadlineExceeded:
+            increment(f"deadlines.{name}.timeouts")
+            raise
+        try:
+            return _attempt(fn, name, this_timeout, hedge and idempotent)
+        except Exception as e:
+            attempt += 1
+            if attempt >= max_attempts or not is_retryable(e):
+                raise
+            backoff = random.uniform(0, min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * 2 ** (attempt - 1)))
+            left = remaining()
+            if left is not None and left <= backoff:
+                raise DeadlineExceeded(f"request deadline exceeded after {attempt} {name} attempts") from e
+            increment(f"deadlines.{name}.retries")
+            time.sleep(backoff)
+
+
+async def _attempt_async(fn: Callable[[float], Awaitable[T]], name: str, attempt_timeout: float, hedge: bool) -> T:
+    """_attempt() for coroutines; attempts still running at the end are cancelled."""
+    tracker = _tracker(name)
+    started = time.monotonic()
+    tasks = [asyncio.ensure_future(fn(attempt_timeout))]
+    hedge_delay = tracker.hedge_delay() if hedge else None
+
+    try:
+        if hedge_delay is not None and hedge_delay < attempt_timeout:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+            if not done and tracker.try_hedge():
+                increment(f"deadlines.{name}.hedges")
+                tasks.append(asyncio.ensure_future(fn(attempt_timeout - (time.monotonic() - started))))
+
+        pending = set(tasks)
+        first_error: BaseException | None = None
+        while pending:
+            left = attempt_timeout - (time.monotonic() - started)
+            done, pending = await asyncio.wait(pending, timeout=max(0.0, left), return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for task in done:
+                error = task.exception()
+                if error is None:
+                    if task is not tasks[0]:
+                        increment(f"deadlines.{name}.hedgeWins")
+                    tracker.record(time.monotonic() - started)
+                    return task.result()
+                first_error = first_error or error
+
+        if first_error is not None and not pending:
+            raise first_error
+        increment(f"deadlines.{name}.timeouts")
+        raise TimeoutError(f"{name} call timed out after {attempt_timeout:.2f}s")
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def call_async(
+    fn: Callable[[float], Awaitable[T]],
+    name: str,
+    idempotent: bool = False,
+    hedge: bool = False,
+    attempts: int = 3,
+    attempt_timeout: float | None = None,
+) -> T:
+    """
+    call() for coroutines: `fn` receives the attempt timeout and returns an awaitable.
+
+    Raises:
+        DeadlineExceeded: If the deadline passed before a successful attempt
+        Exception: The last error from `fn` once retries are exhausted
+    """
+    tracker = _tracker(name)
+    with tracker.lock:
+        tracker.calls += 1
+    max_attempts = attempts if idempotent else 1
+
+    attempt = 0
+    while True:
+        try:
+            this_timeout = timeout(attempt_timeout)
+        except DeadlineExceeded:
+            increment(f"deadlines.{name}.timeouts")
+            raise
+        try:
+            return await _attempt_async(fn, name, this_timeout, hedge and idempotent)
+        except Exception as e:
+            attempt += 1
+            if attempt >= max_attempts or not is_retryable(e):
+                raise
+            backoff = random.uniform(0, min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * 2 ** (attempt - 1)))
+            left = remaining()
+            if left is not None and left <= backoff:
+                raise DeadlineExceeded(f"request deadline exceeded after {attempt} {name} attempts") from e
+            increment(f"deadlines.{name}.retries")
+            await asyncio.sleep(backoff)
+
+
+def reset() -> None:
+    """Forget recorded latencies and hedge counts (e.g. between benchmark runs)."""
+    with _trackers_lock:
+        _trackers.clear()
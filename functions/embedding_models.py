@@ -0,0 +1,117 @@
+"""
+Registry of the Vertex AI embedding models used for message search.
+
+Each model version has its own message field and vector index, and every
+message records which model versions its vectors came from:
+
+    conversations/{conversationId}/messages/{messageId}
+        embedding:                 vector of multilingual-002 (the original field)
+        embedding_gemini_001_v1:   vector of gemini-001
+        embeddingModels:           {registry key: "<model>@<version>"}
+
+Vectors of different models are never mixed in one field, so an index
+only ever holds vectors that are comparable with each other.
+
+Switching models is done with two settings:
+
+    EMBEDDING_WRITE_MODELS  comma-separated keys new messages are embedded
+                            with (dual-write while migrating)
+    EMBEDDING_READ_MODEL    key whose field and model search uses
+
+1. Add the new model to EMBEDDING_WRITE_MODELS. New messages are now
+   embedded with both models, and reembed_messages (main.py) works through
+   the history in throttled batches, filling in every write model a
+   message is missing.
+2. Once reembed_messages reports done, set EMBEDDING_READ_MODEL to the new
+   key. Search switches over in one step, to a fully populated field.
+3. Drop the old key from EMBEDDING_WRITE_MODELS.
+
+Messages embedded before models were tagged carry only `embedding`, which
+was always text-multilingual-embedding-002, so an untagged `embedding`
+counts as multilingual-002@1.
+"""
+
+import os
+from typing import Any, NamedTuple
+
+from google.cloud.firestore_v1.vector import Vector
+
+# Region of the Vertex AI endpoint
+EMBEDDING_LOCATION = os.environ.get("EMBEDDING_LOCATION", "us-central1")
+
+
+class EmbeddingModel(NamedTuple):
+    key: str  # Registry key, as used in settings and embeddingModels
+    model: str  # Vertex AI publisher model
+    version: int  # Bumped whenever vectors stop being comparable (task type, dimension)
+    dimension: int
+    field: str  # Message field holding the vector (one vector index per field)
+
+    @property
+    def tag(self) -> str:
+        return f"{self.model}@{self.version}"
+
+
+MODELS: dict[str, EmbeddingModel] = {
+    model.key: model for model in (
+        EmbeddingModel("multilingual-002", "text-multilingual-embedding-002", 1, 768, "embedding"),
+        EmbeddingModel("gemini-001", "gemini-embedding-001", 1, 768, "embedding_gemini_001_v1"),
+    )
+}
+
+# The model every untagged `embedding` was generated with
+LEGACY_MODEL = MODELS["multilingual-002"]
+
+
+def _lookup(key: str, setting: str) -> EmbeddingModel:
+    if key not in MODELS:
+        raise ValueError(f"{setting}: unknown embedding model '{key}' (known: {', '.join(MODELS)})")
+    return MODELS[key]
+
+
+READ_MODEL = _lookup(os.environ.get("EMBEDDING_READ_MODEL", LEGACY_MODEL.key), "EMBEDDING_READ_MODEL")
+
+# The read model is always written too, so search never misses new messages
+WRITE_MODELS = [READ_MODEL] + [
+    _lookup(key, "EMBEDDING_WRITE_MODELS")
+    for key in dict.fromkeys(k.strip() for k in os.environ.get("EMBEDDING_WRITE_MODELS", "").split(","))
+    if key and key != READ_MODEL.key
+]
+
+
+def predict_payload(model: EmbeddingModel, text: str) -> dict[str, Any]:
+    """:predict request body embedding `text` as a document to retrieve."""
+    # task_type: RETRIEVAL_DOCUMENT optimizes embeddings for semantic search
+    payload: dict[str, Any] = {"instances": [{"content": text, "task_type": "RETRIEVAL_DOCUMENT"}]}
+    if model.model.startswith("gemini-embedding"):
+        # Configurable output size; pinned to the dimension of the model's index
+        payload["parameters"] = {"outputDimensionality": model.dimension}
+    return payload
+
+
+def has_embedding(message_data: dict[str, Any], model: EmbeddingModel) -> bool:
+    """Whether a message already holds a vector from this model version."""
+    if not message_data.get(model.field):
+        return False
+    tags = message_data.get("embeddingModels") or {}
+    if model.key in tags:
+        return tags[model.key] == model.tag
+    # Untagged vectors predate versioning
+    return model == LEGACY_MODEL
+
+
+def missing(message_data: dict[str, Any], models: list[EmbeddingModel] | None = None) -> list[EmbeddingModel]:
+    """Models (the write models by default) a message still needs a vector from."""
+    return [model for model in (WRITE_MODELS if models is None else models)
+            if not has_embedding(message_data, model)]
+
+
+def update_fields(vectors: dict[EmbeddingModel, list[float]]) -> dict[str, Any]:
+    """Message update storing each model's vector with its tag."""
+    fields: dict[str, Any] = {}
+    for model, values in vectors.items():
+        if len(values) != model.dimension:
+            raise ValueError(f"{model.key} returned {len(values)} dimensions, expected {model.dimension}")
+        fields[model.field] = Vector(values)
+        fields[f"embeddingModels.{model.key}"] = model.tag
+    return fields
@@ -0,0 +1,134 @@
+"""
+Local fast path for trivial messages.
+
+analyze_message_context and adjust_formality used to send every message
+to GPT-4o-mini, including "ok", "lol", a thumbs-up or a bare link, for
+which the answer is known in advance. classify() recognises those
+messages locally, with no network or Firestore access:
+
+    punctuation  nothing but punctuation ("?", "...")
+    emoji        emoji only, possibly with punctuation
+    url          one or more links and nothing else
+    filler       at most MAX_FILLER_WORDS words, each an acknowledgement,
+                 greeting, laughter or stopword of the message's language
+                 ("ok", "thanks so much", "jajaja", "d'accord", "danke dir")
+
+For these, analyze_message_context returns an empty analysis (no cultural
+context, no idioms) and adjust_formality returns the text unchanged:
+always for punctuation, emoji and links, and for filler messages when the
+target is casual, since they already are.
+
+Anything not recognised goes to the model as before. False positives cost
+a missed annotation, so the word lists stay conservative. Skip rate and
+accuracy are measured against the labelled sample in
+benchmarks/fast_path.py.
+"""
+
+import re
+from typing import Any
+
+# Longer messages are never filler, whatever their words
+MAX_FILLER_WORDS = 4
+
+PUNCTUATION = "punctuation"
+EMOJI = "emoji"
+URL = "url"
+FILLER = "filler"
+
+_URL = re.compile(r"(?:https?://|www\.)\S+", re.IGNORECASE)
+_EMOJI = re.compile(
+    "["
+    "\U0001F000-\U0001FAFF"  # pictographs, emoticons, transport, supplemental symbols
+    "\u2600-\u27BF"  # miscellaneous symbols and dingbats
+    "\u2B00-\u2BFF"  # arrows and stars
+    "\u200D\uFE0F"  # zero-width joiner and variation selector inside emoji sequences
+    "]"
+)
+_WORD = re.compile(r"[^\W\d_]+(?:['\u2019][^\W\d_]+)*")
+_LAUGHTER = re.compile(r"^(?:(?:h[aeiu]){2,}h?|(?:j[aeiu]){2,}j?|k{3,}|(?:rs){1,}|l+o+l+|lmf?ao+|x+d+|mdr+|ptdr+)$")
+
+# Acknowledgements, greetings and stopwords that carry no cultural content
+# on their own. "en" applies to every language (English fillers are common
+# in all of them).
+_FILLERS: dict[str, frozenset[str]] = {
+    "en": frozenset({
+        "ok", "okay", "okey", "k", "kk", "yes", "yeah", "yep", "yup", "ya", "no", "nope", "nah",
+        "thanks", "thank", "thx", "ty", "tysm", "cool", "nice", "sure", "np", "omg", "wow", "oh", "ah",
+        "hi", "hey", "hello", "bye", "gn", "gm", "good", "great", "fine", "alright", "right", "true",
+        "same", "done", "got", "it", "you", "u", "so", "too", "very", "much", "a", "lot", "the", "and",
+        "me", "see", "soon", "later", "morning", "night", "sounds", "perfect", "awesome", "agreed", "well",
+    }),
+    "es": frozenset({
+        "vale", "sí", "si", "no", "gracias", "hola", "adiós", "adios", "chao", "bueno", "buena",
+        "buenas", "buenos", "días", "dias", "tardes", "noches", "claro", "genial", "dale", "muchas",
+        "muchísimas", "de", "nada", "perfecto", "listo", "bien", "muy", "te", "a", "ti", "igualmente",
+        "okey", "sale", "va",
+    }),
+    "fr": frozenset({
+        "oui", "ouais", "non", "merci", "beaucoup", "d'accord", "daccord", "dac", "salut", "bonjour",
+        "bonsoir", "coucou", "super", "parfait", "bien", "très", "tres", "ça", "ca", "va", "à", "a",
+        "toi", "vous", "bisous", "bonne", "nuit", "journée", "de", "rien", "ok", "oké",
+    }),
+    "de": frozenset({
+        "ja", "jo", "nein", "danke", "dir", "schön", "sehr", "vielen", "dank", "hallo", "hi", "tschüss",
+        "tschüs", "ciao", "genau", "super", "gut", "alles", "klar", "bitte", "gerne", "gern", "prima",
+        "passt", "guten", "morgen", "gute", "nacht", "und", "auch",
+    }),
+    "pt": frozenset({
+        "sim", "não", "nao", "obrigado", "obrigada", "valeu", "oi", "olá", "ola", "tchau", "beleza",
+        "blz", "tá", "ta", "legal", "certo", "claro", "bom", "boa", "dia", "tarde", "noite", "muito",
+        "tudo", "bem", "e", "você", "voce", "perfeito", "de", "nada",
+    }),
+}
+
+
+def classify(text: str, language: str = "en") -> str | None:
+    """
+    Classify a message as trivial, without calling any model.
+
+    Args:
+        text: Message text
+        language: Language code of the message ('en', 'es', 'pt-BR', ...)
+
+    Returns:
+        'punctuation', 'emoji', 'url' or 'filler' for trivial messages,
+        None for messages that need the model
+    """
+    stripped = text.strip()
+    without_urls = _URL.sub(" ", stripped)
+    has_url = without_urls != stripped
+    without_emoji = _EMOJI.sub(" ", without_urls)
+    has_emoji = without_emoji != without_urls
+    words = _WORD.findall(without_emoji.lower().replace("\u2019", "'"))
+
+    if not words:
+        if any(ch.isalnum() for ch in without_emoji):
+            return None  # numbers ("5", "10:30") mean something
+        if has_url:
+            return URL
+        return EMOJI if has_emoji else PUNCTUATION
+
+    if has_url or len(words) > MAX_FILLER_WORDS:
+        return None
+    if any(ch.isdigit() for ch in without_emoji):
+        return None
+
+    fillers = _FILLERS["en"] | _FILLERS.get(language.split("-")[0].lower(), frozenset())
+    if all(word in fillers or _LAUGHTER.match(word) for word in words):
+        return FILLER
+    return None
+
+
+def context_analysis(kind: str) -> dict[str, Any]:
+    """The analyze_message_context result for a trivial message."""
+    return {
+        "culturalHint": None,
+        "formality": "casual" if kind == EMOJI else None,
+        "culturalNote": None,
+        "idioms": [],
+    }
+
+
+def keeps_formality(kind: str, target_formality: str) -> bool:
+    """Whether adjust_formality can return a trivial message unchanged."""
+    return kind in (PUNCTUATION, EMOJI, URL) or (kind == FILLER and target_formality == "casual")
@@ -0,0 +1,116 @@
+"""
+FCM topic delivery for large conversations.
+
+Per-token delivery costs one send per device for every message, so a
+conversation's fan-out grows with its size. Conversations with at least
+TOPIC_MIN_PARTICIPANTS participants publish each message once to a topic
+instead, and FCM fans it out:
+
+    conversation_{conversationId}   every participant's devices
+    user_{uid}                      one user's devices
+
+A message is sent with the condition
+"'conversation_{id}' in topics && !('user_{senderId}' in topics)", so the
+sender's own devices are left out, as with per-token delivery.
+
+Subscriptions follow the conversation_tokens index, which already tracks
+every participant's tokens: whenever an entry is rebuilt or a user's
+tokens change, sync() subscribes the added tokens and unsubscribes the
+removed ones, in calls of up to TOPIC_BATCH_SIZE tokens. The entry's
+topicDelivery flag is set only once the conversation's topic holds all
+of its tokens, and fan-out uses the topic only when the flag is set.
+"""
+
+import os
+from typing import Any, Iterable
+
+from firebase_admin import messaging
+
+# Conversations with at least this many participants use topic delivery
+TOPIC_MIN_PARTICIPANTS = int(os.environ.get("FCM_TOPIC_MIN_PARTICIPANTS", "50"))
+
+# Tokens per subscribe/unsubscribe call (the API's limit)
+TOPIC_BATCH_SIZE = 1000
+
+
+def conversation_topic(conversation_id: str) -> str:
+    return f"conversation_{conversation_id}"
+
+
+def user_topic(user_id: str) -> str:
+    return f"user_{user_id}"
+
+
+def condition(conversation_id: str, sender_id: str | None) -> str:
+    """FCM condition reaching every participant's devices except the sender's."""
+    if not sender_id:
+        return f"'{conversation_topic(conversation_id)}' in topics"
+    return f"'{conversation_topic(conversation_id)}' in topics && !('{user_topic(sender_id)}' in topics)"
+
+
+def wants_topic(entry: dict[str, Any]) -> bool:
+    """Whether a conversation_tokens entry is large enough for topic delivery."""
+    return len(entry.get("participantIds", [])) >= TOPIC_MIN_PARTICIPANTS
+
+
+def all_tokens(entry: dict[str, Any] | None) -> set[str]:
+    return {token for tokens in (entry or {}).get("tokens", {}).values() for token in tokens}
+
+
+def _manage(tokens: Iterable[str], topic: str, subscribe: bool) -> int:
+    """(Un)subscribe tokens in batches; returns the number of token failures."""
+    tokens = sorted(set(tokens))
+    call = messaging.subscribe_to_topic if subscribe else messaging.unsubscribe_from_topic
+    failures = 0
+    for i in range(0, len(tokens), TOPIC_BATCH_SIZE):
+        response = call(tokens[i:i + TOPIC_BATCH_SIZE], topic)
+        # Per-token failures are unregistered or invalid tokens; retrying will not help
+        failures += response.failure_count
+    return failures
+
+
+def subscribe(tokens: Iterable[str], topic: str) -> int:
+    return _manage(tokens, topic, subscribe=True)
+
+
+def unsubscribe(tokens: Iterable[str], topic: str) -> int:
+    return _manage(tokens, topic, subscribe=False)
+
+
+def sync(conversation_id: str, previous: dict[str, Any] | None, current: dict[str, Any] | None) -> bool:
+    """
+    Bring a conversation's topic subscriptions from one index entry to the next.
+
+    Args:
+        conversation_id: Conversation the entries belong to
+        previous: Entry as stored (None if there was none)
+        current: New entry (None if the conversation was deleted)
+
+    Returns:
+        Whether the conversation now uses topic delivery (the value for the
+        new entry's topicDelivery flag)
+
+    Raises:
+        Exception: If FCM rejects a call; the stored entry should then be
+        left unchanged, so the same change is retried from it
+    """
+    was_topic = bool(previous and previous.get("topicDelivery"))
+    use_topic = current is not None and wants_topic(current)
+    topic = conversation_topic(conversation_id)
+
+    old_tokens = all_tokens(previous) if was_topic else set()
+    new_tokens = all_tokens(current) if use_topic else set()
+    # Removed participants and devices lose access first
+    if old_tokens - new_tokens:
+        unsubscribe(old_tokens - new_tokens, topic)
+    if new_tokens - old_tokens:
+        subscribe(new_tokens - old_tokens, topic)
+
+    if use_topic:
+        # Sender exclusion needs every participant's devices in their user topic
+        previous_tokens = (previous or {}).get("tokens", {}) if was_topic else {}
+        for uid, tokens in current.get("tokens", {}).items():
+            added = set(tokens) - set(previous_tokens.get(uid, []))
+            if added:
+                subscribe(added, user_topic(uid))
+    return use_topic
@@ -0,0 +1,271 @@
+"""
+Per-language idiom lexicon for analyze_message_context.
+
+GPT-4o-mini used to explain the same idioms again for every new message
+that contained them ("break a leg", "no pasa nada"), since
+message_context_cache keys on the whole message. The lexicon remembers
+those explanations per language:
+
+    idiom_lexicon.json (deployed with the functions)
+        {"version": 1, "builtAt": ..., "languages": {
+            "en": [{"phrase", "meaning", "culturalNote", "equivalentIn", "occurrences"}, ...]}}
+
+It is mined from accumulated message_context_cache results by
+build_idiom_lexicon.py, which keeps phrases the model explained in at
+least MIN_OCCURRENCES different messages. Each language's phrases are
+compiled into an Aho-Corasick automaton on first use, so a message is
+scanned once in O(length + matches) however large the lexicon grows.
+The lexicon is loaded once per instance.
+
+analyze_message_context returns lexicon entries for known phrases right
+away. When nothing but known idioms is left (after removing them the
+rest is trivial, see fast_path), it skips GPT. Otherwise GPT is told
+which idioms are already explained and only analyzes the rest.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Iterable, NamedTuple
+
+import fast_path
+
+LEXICON_PATH = os.environ.get(
+    "IDIOM_LEXICON_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "idiom_lexicon.json")
+)
+
+# A phrase must have been explained in this many distinct messages
+MIN_OCCURRENCES = 2
+
+# Most frequent phrases kept per language
+MAX_PHRASES_PER_LANGUAGE = 5000
+
+# Languages written without spaces between words: no word-boundary check
+_NO_WORD_BOUNDARIES = frozenset({"ja", "zh", "th"})
+
+
+class IdiomMatch(NamedTuple):
+    start: int
+    end: int
+    entry: dict[str, Any]
+
+
+def normalize(text: str) -> str:
+    """Lowercase text for matching, keeping every character at the same index."""
+    chars = []
+    for ch in text:
+        lower = ch.lower()
+        chars.append(lower if len(lower) == 1 else ch)
+    return "".join(chars).replace("\u2019", "'")
+
+
+class Automaton:
+    """Aho-Corasick automaton over a fixed set of phrases."""
+
+    def __init__(self, phrases: list[str]) -> None:
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        # Indices of the phrases that end at each state (including via failure links)
+        self._out: list[list[int]] = [[]]
+        self._lengths = [len(phrase) for phrase in phrases]
+
+        for index, phrase in enumerate(phrases):
+            state = 0
+            for ch in phrase:
+                next_state = self._goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][ch] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                state = next_state
+            self._out[state].append(index)
+
+        # Breadth-first: failure links point to the longest proper suffix in the trie
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(ch, 0)
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+
+    def find(self, text: str) -> Iterable[tuple[int, int, int]]:
+        """Yield (start, end, phrase index) for every occurrence, overlaps included."""
+        state = 0
+        for position, ch in enumerate(text):
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            for index in self._out[state]:
+                end = position + 1
+                yield end - self._lengths[index], end, index
+
+
+class Lexicon:
+    """Idiom entries per language, with one automaton per language built on first use."""
+
+    def __init__(self, languages: dict[str, list[dict[str, Any]]]) -> None:
+        self._entries = {language: entries for language, entries in languages.items() if entries}
+        self._automata: dict[str, Automaton] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._entries.values())
+
+    def _automaton(self, language: str) -> Automaton | None:
+        automaton = self._automata.get(language)
+        if automaton is None and language in self._entries:
+            with self._lock:
+                automaton = self._automata.get(language)
+                if automaton is None:
+                    phrases = [normalize(entry["phrase"]) for entry in self._entries[language]]
+                    automaton = self._automata[language] = Automaton(phrases)
+        return automaton
+
+    def find(self, text: str, language: str) -> list[IdiomMatch]:
+        """
+        Known idioms in `text`, longest first where they overlap.
+
+        Args:
+            text: Message text
+            language: Language code of the message ('en', 'pt-BR', ...)
+
+        Returns:
+            Non-overlapping matches in text order
+        """
+        language = language.split("-")[0].lower()
+        automaton = self._automaton(language)
+        if automaton is None:
+            return []
+
+        normalized = normalize(text)
+        check_boundaries = language not in _NO_WORD_BOUNDARIES
+        candidates = []
+        for start, end, index in automaton.find(normalized):
+            if check_boundaries and (
+                (start > 0 and normalized[start - 1].isalnum()) or (end < len(normalized) and normalized[end].isalnum())
+            ):
+                continue
+            candidates.append((start, end, index))
+
+        # Prefer longer phrases ("kick the bucket list" over "kick the bucket")
+        candidates.sort(key=lambda c: (c[0] - c[1], c[0]))
+        taken: list[IdiomMatch] = []
+        for start, end, index in candidates:
+            if all(end <= match.start or start >= match.end for match in taken):
+                taken.append(IdiomMatch(start, end, self._entries[language][index]))
+        return sorted(taken, key=lambda match: match.start)
+
+
+_lexicon: Lexicon | None = None
+_lexicon_lock = threading.Lock()
+
+
+def load(path: str = LEXICON_PATH) -> Lexicon:
+    """Read a lexicon file; an absent file is an empty lexicon."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return Lexicon({})
+    return Lexicon(data.get("languages", {}))
+
+
+def get() -> Lexicon:
+    """The instance's lexicon, loaded on first use."""
+    global _lexicon
+    if _lexicon is None:
+        with _lexicon_lock:
+            if _lexicon is None:
+                _lexicon = load()
+                print(f"Loaded idiom lexicon: {len(_lexicon)} phrases")
+    return _lexicon
+
+
+def idioms(text: str, matches: list[IdiomMatch]) -> list[dict[str, Any]]:
+    """analyze_message_context idiom entries for the matches, phrased as in the message."""
+    return [
+        {
+            "phrase": text[match.start:match.end],
+            "meaning": match.entry.get("meaning"),
+            "culturalNote": match.entry.get("culturalNote"),
+            "equivalentIn": match.entry.get("equivalentIn", {}),
+        }
+        for match in matches
+    ]
+
+
+def fully_covered(text: str, matches: list[IdiomMatch], language: str) -> bool:
+    """Whether nothing but known idioms (and trivial filler) is left in the message."""
+    if not matches:
+        return False
+    remainder = []
+    position = 0
+    for match in matches:
+        remainder.append(text[position:match.start])
+        position = match.end
+    remainder.append(text[position:])
+    rest = " ".join(part.strip() for part in remainder).strip()
+    return not rest or fast_path.classify(rest, language) is not None
+
+
+def mine(cache_entries: Iterable[dict[str, Any]], min_occurrences: int = MIN_OCCURRENCES) -> dict[str, Any]:
+    """
+    Build lexicon data from message_context_cache documents.
+
+    Only idioms whose phrase actually occurs in the cached message are
+    counted. Each phrase keeps the explanation given most often.
+
+    Args:
+        cache_entries: message_context_cache document dicts (text, language, idioms)
+        min_occurrences: Distinct messages a phrase must appear in
+
+    Returns:
+        Lexicon file contents
+    """
+    # language -> normalized phrase -> {"texts": set, "explanations": {json: (count, idiom)}}
+    seen: dict[str, dict[str, dict[str, Any]]] = {}
+    for entry in cache_entries:
+        text = entry.get("text")
+        language = (entry.get("language") or "").split("-")[0].lower()
+        if not isinstance(text, str) or not language:
+            continue
+        normalized_text = normalize(text)
+        for idiom in entry.get("idioms") or []:
+            if not isinstance(idiom, dict) or not idiom.get("phrase") or not idiom.get("meaning"):
+                continue
+            phrase = normalize(idiom["phrase"].strip())
+            if len(phrase) < 3 or phrase not in normalized_text:
+                continue
+            stats = seen.setdefault(language, {}).setdefault(phrase, {"texts": set(), "explanations": {}})
+            stats["texts"].add(normalized_text)
+            explanation = {
+                "meaning": idiom.get("meaning"),
+                "culturalNote": idiom.get("culturalNote"),
+                "equivalentIn": idiom.get("equivalentIn") or {},
+            }
+            key = json.dumps(explanation, sort_keys=True, ensure_ascii=False)
+            count, _ = stats["explanations"].get(key, (0, explanation))
+            stats["explanations"][key] = (count + 1, explanation)
+
+    languages: dict[str, list[dict[str, Any]]] = {}
+    for language, phrases in seen.items():
+        kept = []
+        for phrase, stats in phrases.items():
+            occurrences = len(stats["texts"])
+            if occurrences < min_occurrences:
+                continue
+            _, explanation = max(stats["explanations"].values(), key=lambda value: value[0])
+            kept.append({"phrase": phrase, **explanation, "occurrences": occurrences})
+        kept.sort(key=lambda item: (-item["occurrences"], item["phrase"]))
+        if kept:
+            languages[language] = kept[:MAX_PHRASES_PER_LANGUAGE]
+
+    return {"version": 1, "builtAt": time.time(), "minOccurrences": min_occurrences, "languages": languages}
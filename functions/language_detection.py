@@ -0,0 +1,258 @@
+"""
+Offline language detection for chat messages.
+
+Used at ingest (detect_message_language in main.py) and by
+translate_message, so the Translation API only has to auto-detect when
+the local result is not confident.
+
+Languages with their own script (zh, ja, ar, ru, hi) are identified from
+Unicode ranges. Latin-script languages (en, es, fr, de, pt) are scored
+with character trigram profiles built from the bundled sample text below,
+using a naive Bayes model with add-one smoothing. Profiles are built
+once per instance, on first use (a few milliseconds).
+
+Confidence is the posterior of the best language. Short messages ("ok",
+"jaja") rarely reach MIN_CONFIDENCE; callers then fall back to the API.
+
+The posterior is normalised over the five profiles only, so text in any
+other Latin-script language (Italian, Dutch, Turkish, ...) would come back
+as a confident wrong answer. detect() therefore rejects text that fits its
+best profile poorly: too many trigrams the profile has never seen
+(MAX_UNSEEN_SHARE), or too low an average log-probability per trigram
+(MIN_TRIGRAM_SCORE). That catches most, but not all, unsupported
+languages; Italian in particular still passes as es/pt/fr. Until the
+profiles are calibrated against such text, is_reliable() (and
+detect_confident()) trust only script-range detections, unless
+LANGUAGE_DETECTION_TRUST_TRIGRAMS=1.
+"""
+
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+from typing import NamedTuple
+
+# Below this posterior the local result is not trusted
+MIN_CONFIDENCE = 0.9
+
+# Letters needed before the trigram model is consulted at all
+MIN_LETTERS = 8
+
+# Share of letters that must belong to one script to decide by script
+SCRIPT_SHARE = 0.5
+
+# Unknown-language rejection against the best profile: supported sample
+# sentences stay below 0.5 unseen and above -7.2 per trigram
+MAX_UNSEEN_SHARE = 0.5
+MIN_TRIGRAM_SCORE = -7.2
+
+# Whether trigram (Latin-script) detections count as reliable
+TRUST_TRIGRAMS = os.environ.get("LANGUAGE_DETECTION_TRUST_TRIGRAMS", "0") == "1"
+
+
+class Detection(NamedTuple):
+    language: str | None
+    confidence: float
+    method: str | None = None  # "script" or "trigram"
+
+
+_SCRIPT_RANGES = {
+    "hiragana_katakana": [(0x3040, 0x30FF), (0x31F0, 0x31FF), (0xFF66, 0xFF9F)],
+    "han": [(0x3400, 0x4DBF), (0x4E00, 0x9FFF), (0xF900, 0xFAFF)],
+    "arabic": [(0x0600, 0x06FF), (0x0750, 0x077F), (0x08A0, 0x08FF), (0xFB50, 0xFDFF), (0xFE70, 0xFEFF)],
+    "cyrillic": [(0x0400, 0x04FF), (0x0500, 0x052F)],
+    "devanagari": [(0x0900, 0x097F)],
+}
+
+_NON_LETTERS = re.compile(r"[^\w\s]|[\d_]", re.UNICODE)
+_WHITESPACE = re.compile(r"\s+")
+
+# Representative everyday text per Latin-script language. Profiles only
+# need relative trigram frequencies, so a few hundred words each suffice.
+_SAMPLES: dict[str, str] = {
+    "en": """
+        Hey, how are you doing today? I'm fine, thanks for asking. What are you up to this weekend?
+        We should get dinner with the others on Friday night if you are free. Did you see the message
+        I sent you yesterday about the meeting? I think we need to talk about the project before the
+        deadline. Sorry I'm late, the traffic was really bad this morning. Let me know when you get
+        home. That sounds great, I would love to come. Can you call me back when you have a minute?
+        Thank you so much for your help, I really appreciate it. Where should we meet? I'll be there
+        in ten minutes. Have you already eaten? Don't worry about it, it's not a big deal. Happy
+        birthday! I hope you have a wonderful day with your family. What time does the movie start?
+        I can't wait to see you again. The weather is nice, let's go for a walk in the park. Please
+        send me the address and the photos from the trip. Good night, see you tomorrow. Which one
+        do you want, this or that? They said they would be here soon but nobody knows when.
+    """,
+    "es": """
+        Hola, ¿cómo estás hoy? Estoy bien, gracias por preguntar. ¿Qué vas a hacer este fin de semana?
+        Deberíamos cenar con los demás el viernes por la noche si estás libre. ¿Viste el mensaje que te
+        mandé ayer sobre la reunión? Creo que tenemos que hablar del proyecto antes de la fecha límite.
+        Perdón por llegar tarde, el tráfico estaba muy mal esta mañana. Avísame cuando llegues a casa.
+        Me parece genial, me encantaría ir. ¿Puedes llamarme cuando tengas un momento? Muchas gracias
+        por tu ayuda, de verdad lo agradezco. ¿Dónde nos vemos? Llego en diez minutos. ¿Ya comiste?
+        No te preocupes, no pasa nada. ¡Feliz cumpleaños! Espero que tengas un día maravilloso con tu
+        familia. ¿A qué hora empieza la película? Tengo muchas ganas de verte otra vez. Hace buen
+        tiempo, vamos a caminar por el parque. Por favor mándame la dirección y las fotos del viaje.
+        Buenas noches, nos vemos mañana. ¿Cuál quieres, este o ese? Dijeron que llegarían pronto
+        pero nadie sabe cuándo. Bueno, entonces quedamos así, también puedo llevar algo de comer.
+    """,
+    "fr": """
+        Salut, comment ça va aujourd'hui ? Ça va bien, merci de demander. Qu'est-ce que tu fais ce
+        week-end ? On devrait dîner avec les autres vendredi soir si tu es libre. Tu as vu le message
+        que je t'ai envoyé hier à propos de la réunion ? Je pense qu'il faut parler du projet avant la
+        date limite. Désolé pour le retard, il y avait beaucoup de circulation ce matin. Préviens-moi
+        quand tu rentres à la maison. Ça a l'air génial, j'aimerais beaucoup venir. Tu peux me rappeler
+        quand tu as une minute ? Merci beaucoup pour ton aide, je l'apprécie vraiment. On se retrouve
+        où ? J'arrive dans dix minutes. Tu as déjà mangé ? Ne t'inquiète pas, ce n'est pas grave.
+        Joyeux anniversaire ! J'espère que tu passes une journée merveilleuse avec ta famille. À
+        quelle heure commence le film ? J'ai hâte de te revoir. Il fait beau, allons nous promener
+        dans le parc. Envoie-moi l'adresse et les photos du voyage s'il te plaît. Bonne nuit, à
+        demain. Lequel tu veux, celui-ci ou celui-là ? Ils ont dit qu'ils seraient bientôt là mais
+        personne ne sait quand. Bon, alors c'est d'accord, je peux aussi apporter quelque chose.
+    """,
+    "de": """
+        Hallo, wie geht es dir heute? Mir geht es gut, danke der Nachfrage. Was machst du am
+        Wochenende? Wir sollten am Freitagabend mit den anderen essen gehen, wenn du Zeit hast. Hast
+        du die Nachricht gesehen, die ich dir gestern wegen des Treffens geschickt habe? Ich glaube,
+        wir müssen vor der Frist über das Projekt sprechen. Entschuldige die Verspätung, heute Morgen
+        war sehr viel Verkehr. Sag mir Bescheid, wenn du zu Hause bist. Das klingt super, ich würde
+        gerne kommen. Kannst du mich zurückrufen, wenn du kurz Zeit hast? Vielen Dank für deine Hilfe,
+        ich weiß das wirklich zu schätzen. Wo treffen wir uns? Ich bin in zehn Minuten da. Hast du
+        schon gegessen? Mach dir keine Sorgen, das ist nicht schlimm. Alles Gute zum Geburtstag! Ich
+        hoffe, du hast einen wunderschönen Tag mit deiner Familie. Um wie viel Uhr fängt der Film an?
+        Ich freue mich darauf, dich wiederzusehen. Das Wetter ist schön, lass uns im Park spazieren
+        gehen. Bitte schick mir die Adresse und die Fotos von der Reise. Gute Nacht, bis morgen.
+        Welchen willst du, diesen oder den da? Sie haben gesagt, dass sie bald kommen, aber niemand
+        weiß wann. Also gut, abgemacht, ich kann auch etwas zu essen mitbringen.
+    """,
+    "pt": """
+        Oi, tudo bem com você hoje? Estou bem, obrigado por perguntar. O que você vai fazer neste fim
+        de semana? A gente devia jantar com os outros na sexta à noite se você estiver livre. Você viu
+        a mensagem que eu te mandei ontem sobre a reunião? Acho que precisamos falar do projeto antes
+        do prazo. Desculpa o atraso, o trânsito estava muito ruim hoje de manhã. Me avisa quando
+        chegar em casa. Parece ótimo, eu adoraria ir. Você pode me ligar quando tiver um minuto?
+        Muito obrigado pela sua ajuda, eu agradeço de verdade. Onde a gente se encontra? Chego em dez
+        minutos. Você já comeu? Não se preocupe, não tem problema. Feliz aniversário! Espero que você
+        tenha um dia maravilhoso com a sua família. Que horas começa o filme? Estou com muita saudade
+        e não vejo a hora de te ver de novo. O tempo está bom, vamos caminhar no parque. Por favor me
+        manda o endereço e as fotos da viagem. Boa noite, até amanhã. Qual você quer, este ou esse?
+        Eles disseram que chegariam logo, mas ninguém sabe quando. Então tá combinado, também posso
+        levar alguma coisa para comer. Não consigo, não dá, estão aqui com a gente ainda.
+    """,
+}
+
+_profiles: dict[str, tuple[dict[str, float], float]] | None = None
+_profiles_lock = threading.Lock()
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize("NFC", text.lower())
+    text = _NON_LETTERS.sub(" ", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def _trigrams(text: str) -> list[str]:
+    grams = []
+    for word in text.split(" "):
+        padded = f" {word} "
+        grams.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def _build_profiles() -> dict[str, tuple[dict[str, float], float]]:
+    """Per language: log-probability of each seen trigram, and of an unseen one."""
+    counts = {language: Counter(_trigrams(_normalize(sample))) for language, sample in _SAMPLES.items()}
+    vocabulary = len(set().union(*counts.values()))
+    profiles = {}
+    for language, counter in counts.items():
+        denominator = sum(counter.values()) + vocabulary
+        log_probs = {gram: math.log((count + 1) / denominator) for gram, count in counter.items()}
+        profiles[language] = (log_probs, math.log(1 / denominator))
+    return profiles
+
+
+def _get_profiles() -> dict[str, tuple[dict[str, float], float]]:
+    global _profiles
+    if _profiles is None:
+        with _profiles_lock:
+            if _profiles is None:
+                _profiles = _build_profiles()
+    return _profiles
+
+
+def _script_counts(text: str) -> tuple[Counter, int]:
+    scripts: Counter = Counter()
+    letters = 0
+    for char in text:
+        if not char.isalpha():
+            continue
+        letters += 1
+        code = ord(char)
+        for script, ranges in _SCRIPT_RANGES.items():
+            if any(low <= code <= high for low, high in ranges):
+                scripts[script] += 1
+                break
+    return scripts, letters
+
+
+def detect(text: str) -> Detection:
+    """
+    Detect the language of `text`.
+
+    Returns:
+        Detection(language, confidence, method); language is None when the
+        text has too few letters to say anything, or does not look like any
+        of the profiled languages
+    """
+    scripts, letters = _script_counts(text)
+    if letters == 0:
+        return Detection(None, 0.0)
+
+    # Japanese mixes kana with Han characters; any kana rules out Chinese
+    if scripts["hiragana_katakana"]:
+        if (scripts["hiragana_katakana"] + scripts["han"]) / letters >= SCRIPT_SHARE:
+            return Detection("ja", 1.0, "script")
+    script_languages = {"han": "zh", "arabic": "ar", "cyrillic": "ru", "devanagari": "hi"}
+    for script, language in script_languages.items():
+        if scripts[script] / letters >= SCRIPT_SHARE:
+            # Short Han-only text could still be Japanese
+            confidence = 1.0 if script != "han" or scripts[script] >= 4 else 0.8
+            return Detection(language, confidence, "script")
+
+    normalized = _normalize(text)
+    if sum(1 for char in normalized if char.isalpha()) < MIN_LETTERS:
+        return Detection(None, 0.0)
+
+    grams = _trigrams(normalized)
+    scores = {
+        language: sum(log_probs.get(gram, unseen) for gram in grams)
+        for language, (log_probs, unseen) in _get_profiles().items()
+    }
+    best = max(scores, key=scores.__getitem__)
+
+    # No "unknown" class: reject text the best profile explains poorly
+    best_log_probs, _ = _get_profiles()[best]
+    unseen_share = sum(1 for gram in grams if gram not in best_log_probs) / len(grams)
+    if unseen_share > MAX_UNSEEN_SHARE or scores[best] / len(grams) < MIN_TRIGRAM_SCORE:
+        return Detection(None, 0.0, "trigram")
+
+    # Posterior with uniform priors, computed stably from log-likelihoods
+    total = sum(math.exp(score - scores[best]) for score in scores.values())
+    return Detection(best, 1.0 / total, "trigram")
+
+
+def is_reliable(detection: Detection, min_confidence: float = MIN_CONFIDENCE) -> bool:
+    """Whether a detection may be used as the source language (see module docstring)."""
+    return (
+        detection.language is not None
+        and detection.confidence >= min_confidence
+        and (detection.method == "script" or TRUST_TRIGRAMS)
+    )
+
+
+def detect_confident(text: str, min_confidence: float = MIN_CONFIDENCE) -> str | None:
+    """The detected language if the local result is reliable, else None."""
+    detection = detect(text)
+    return detection.language if is_reliable(detection, min_confidence) else None
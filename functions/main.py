@@ -6,21 +6,50 @@ Currently implements:
 - Push notification delivery when new messages are created
 - Translation API for real-time message translation
 - Display name propagation when users update their profile
+- Delivery/read counts on messages and unread counts on conversations
 """
 
-from firebase_functions import firestore_fn, https_fn, options
-from firebase_functions.params import SecretParam
-from firebase_admin import initialize_app, firestore, messaging
-from google.cloud import translate_v2 as translate
-from google.cloud import secretmanager
-import google.cloud.firestore
+# Imported first so instance init time covers the Firebase SDK imports too
+from startup import WARM_UP, lazy_import, mark_initialized
+from firebase_functions import firestore_fn, https_fn, options, tasks_fn
+from firebase_functions.params import IntParam, SecretParam
+from firebase_admin import initialize_app, firestore, functions, messaging
+from firebase_admin import exceptions as firebase_exceptions
 from typing import Any
+import asyncio
 import time
 import os
-from openai import OpenAI
-from google.auth import default
-from google.auth.transport.requests import Request
 import json
+import threading
+
+import async_core
+import cache_metrics
+import cache_store
+import circuit_breaker
+import communication_style
+import conversation_context
+import conversation_tokens
+import deadlines
+import embedding_models
+import fast_path
+import fcm_topics
+import idiom_lexicon
+import language_detection
+import message_status
+import notification_coalescing
+import rate_limit
+import translation_memory
+from deadlines import deadline
+from tracing import increment, span, traced
+
+# Heavy SDKs are imported on first use so that each function only pays for
+# what it calls at cold start (see startup.py)
+openai = lazy_import("openai")
+translate = lazy_import("google.cloud.translate_v2")
+secretmanager = lazy_import("google.cloud.secretmanager")
+google_auth = lazy_import("google.auth")
+google_auth_requests = lazy_import("google.auth.transport.requests")
+requests = lazy_import("requests")
 
 # Initialize Firebase Admin SDK
 app = initialize_app()
@@ -32,14 +61,28 @@ OPENAI_API_KEY = SecretParam('OPENAI_API_KEY')
 # Note: Uses Application Default Credentials by default (recommended for Cloud Functions)
 # If TRANSLATION_API_KEY_SECRET env var is set, will fetch API key from Secret Manager
 translate_client = None
+_translate_client_lock = threading.Lock()
+
+# OpenAI clients are thread-safe and pool connections, so one is shared per
+# API key (and base URL) instead of creating a client per request
+_openai_clients: dict[tuple[str, str | None], Any] = {}
+_openai_clients_lock = threading.Lock()
+
 
 def get_translate_client():
     """
     Get Translation API client, initializing it if needed.
     Supports both Application Default Credentials and Secret Manager.
+    Safe to call from concurrent requests; the client is created once.
     """
     global translate_client
-    if translate_client is None:
+    if translate_client is not None:
+        return translate_client
+
+    with _translate_client_lock:
+        if translate_client is not None:
+            return translate_client
+
         secret_name = os.environ.get("TRANSLATION_API_KEY_SECRET")
         if secret_name:
             # Use Secret Manager to get API key
@@ -67,73 +110,136 @@ def get_translate_client():
 def get_openai_client(api_key: str):
     """
     Get OpenAI client with the provided API key.
+    Clients are cached per key and shared between concurrent requests.
     """
-    return OpenAI(api_key=api_key)
-
-
-def generate_vertex_ai_embedding(text: str) -> list[float]:
+    cache_key = (api_key, os.environ.get("OPENAI_BASE_URL"))
+    client = _openai_clients.get(cache_key)
+    if client is None:
+        with _openai_clients_lock:
+            client = _openai_clients.get(cache_key)
+            if client is None:
+                client = _openai_clients[cache_key] = openai.OpenAI(api_key=api_key)
+    return client
+
+
+def generate_vertex_ai_embedding(
+    text: str,
+    timeout: float | None = None,
+    model: embedding_models.EmbeddingModel | None = None,
+) -> list[float]:
     """
     Generate text embedding using Vertex AI REST API.
 
-    Uses text-multilingual-embedding-002 model which produces 768-dimensional vectors.
-    This model supports 100+ languages and is optimized for semantic search/retrieval.
+    Uses the search model (EMBEDDING_READ_MODEL, text-multilingual-embedding-002
+    by default: 768 dimensions, 100+ languages) unless another registered
+    model is given; see embedding_models.py.
 
     This approach uses the REST API instead of the heavy google-cloud-aiplatform SDK
     to avoid dependency conflicts and reduce Cloud Build times.
 
     Args:
         text: The text to generate an embedding for
+        timeout: Seconds to wait for the response (None waits indefinitely)
+        model: Registered model to use (default: the read model)
 
     Returns:
-        List of 768 floats representing the embedding vector
+        The embedding vector (model.dimension floats)
 
     Raises:
         Exception: If the API call fails
     """
-    import requests
+    url, headers, payload = _vertex_embedding_request(text, model or embedding_models.READ_MODEL)
+    response = requests.post(url, headers=headers, json=payload, timeout=timeout)
+    response.raise_for_status()
+
+    # Parse response
+    return response.json()['predictions'][0]['embeddings']['values']
+
+
+async def generate_vertex_ai_embedding_async(
+    text: str,
+    timeout: float | None = None,
+    model: embedding_models.EmbeddingModel | None = None,
+) -> list[float]:
+    """generate_vertex_ai_embedding() on the async path (shared httpx client)."""
+    # Only the hourly credential refresh blocks the loop
+    url, headers, payload = _vertex_embedding_request(text, model or embedding_models.READ_MODEL)
+    response = await async_core.http().post(url, headers=headers, json=payload, timeout=timeout)
+    response.raise_for_status()
+    return response.json()['predictions'][0]['embeddings']['values']
 
+
+def _vertex_embedding_request(
+    text: str,
+    model: embedding_models.EmbeddingModel,
+) -> tuple[str, dict[str, str], dict[str, Any]]:
+    """URL, headers and payload of a Vertex AI embedding request for `text`."""
     # Get Application Default Credentials
-    credentials, project = default()
+    credentials, project = google_auth.default()
 
     # Refresh credentials if needed
     if not credentials.valid:
-        credentials.refresh(Request())
+        credentials.refresh(google_auth_requests.Request())
 
-    # Vertex AI endpoint
+    # Vertex AI endpoint (VERTEX_AI_ENDPOINT overrides the host, e.g. for local benchmarks)
     project_id = project or os.environ.get('GCP_PROJECT') or os.environ.get('GCLOUD_PROJECT')
-    location = 'us-central1'
-    model = 'text-multilingual-embedding-002'
-    url = f'https://{location}-aiplatform.googleapis.com/v1/projects/{project_id}/locations/{location}/publishers/google/models/{model}:predict'
+    location = embedding_models.EMBEDDING_LOCATION
+    endpoint = os.environ.get('VERTEX_AI_ENDPOINT', f'https://{location}-aiplatform.googleapis.com')
+    url = (f'{endpoint}/v1/projects/{project_id}/locations/{location}'
+           f'/publishers/google/models/{model.model}:predict')
 
     # Request payload
-    # task_type: RETRIEVAL_DOCUMENT optimizes embeddings for semantic search
-    payload = {
-        'instances': [
-            {
-                'content': text,
-                'task_type': 'RETRIEVAL_DOCUMENT'
-            }
-        ]
-    }
+    payload = embedding_models.predict_payload(model, text)
 
-    # Make the API call
     headers = {
         'Authorization': f'Bearer {credentials.token}',
         'Content-Type': 'application/json'
     }
+    return url, headers, payload
 
-    response = requests.post(url, headers=headers, json=payload)
-    response.raise_for_status()
 
-    # Parse response
-    result = response.json()
-    embedding = result['predictions'][0]['embeddings']['values']
+# Cost control: Limit concurrent function instances
+options.set_global_options(max_instances=10)
 
-    return embedding
+# Upstream circuit breakers: with at most 10 instances, a slow or failing
+# upstream must not hold every concurrent slot until it times out. Calls
+# fail fast while a breaker is open and handlers serve a degraded response
+# (see circuit_breaker.py). slow_call_ms is what counts as a slow call.
+circuit_breaker.configure("openai", slow_call_ms=15000)
+circuit_breaker.configure("translate", slow_call_ms=5000)
+circuit_breaker.configure("vertex", slow_call_ms=5000)
 
+# Run fan-out stages (notification fan-out, the smart reply pipeline and its
+# precompute ingest stage) as coroutines on the instance's event loop, with
+# independent calls issued together (see async_core.py)
+ASYNC_HANDLERS = os.environ.get("ASYNC_HANDLERS", "0") == "1"
 
-# Cost control: Limit concurrent function instances
-options.set_global_options(max_instances=10)
+# Messages per FCM send_each_async call (the API's limit)
+FCM_BATCH_SIZE = 500
+
+# Collapse message bursts into one push per recipient per window (see
+# notification_coalescing.py and flush_notification_bursts)
+NOTIFICATION_COALESCING = os.environ.get("NOTIFICATION_COALESCING", "0") == "1"
+
+
+def concurrency_options(function_name: str, default: int) -> dict[str, Any]:
+    """
+    Per-function request concurrency options for a trigger decorator.
+
+    Handlers spend most of their time waiting on Firestore and upstream APIs,
+    so one instance can serve several requests at once. Concurrency above 1
+    requires at least one vCPU. Override per deployment with the
+    <FUNCTION_NAME>_CONCURRENCY parameter (e.g. in functions/.env);
+    setting it to 1 restores one request per instance.
+
+    Args:
+        function_name: Function name, used for the parameter name
+        default: Concurrent requests per instance when not overridden
+    """
+    return {
+        "concurrency": IntParam(f"{function_name.upper()}_CONCURRENCY", default=default),
+        "cpu": 1,
+    }
 
 # Supported languages for translation (10 required languages)
 SUPPORTED_LANGUAGES = {
@@ -153,7 +259,9 @@ SUPPORTED_LANGUAGES = {
 FORMALITY_LEVELS = ["casual", "neutral", "formal"]
 
 
-@https_fn.on_call(secrets=[OPENAI_API_KEY])
+@https_fn.on_call(secrets=[OPENAI_API_KEY], **concurrency_options("adjust_formality", 40))
+@traced("adjust_formality")
+@deadline(20)
 def adjust_formality(req: https_fn.CallableRequest) -> dict[str, Any]:
     """
     Adjusts the formality level of a message using GPT-4o-mini.
@@ -172,6 +280,7 @@ def adjust_formality(req: https_fn.CallableRequest) -> dict[str, Any]:
             'detectedFormality': str,
             'language': str,
             'cached': bool,
+            'fastPath': bool,  # Only present when the text was returned unchanged locally
             'rateLimit': {
                 'limit': int,
                 'remaining': int,
@@ -183,138 +292,143 @@ def adjust_formality(req: https_fn.CallableRequest) -> dict[str, Any]:
         https_fn.HttpsError: If validation fails or adjustment errors occur
     """
     # Extract and validate request data
-    data = req.data
+    with span("validation"):
+        data = req.data
 
-    if not isinstance(data, dict):
-        raise https_fn.HttpsError(
-            code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
-            message="Request data must be a dictionary"
-        )
+        if not isinstance(data, dict):
+            raise https_fn.HttpsError(
+                code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+                message="Request data must be a dictionary"
+            )
 
-    text = data.get("text")
-    target_formality = data.get("target_formality")
-    language = data.get("language", "en")
-    current_formality = data.get("current_formality", "neutral")
+        text = data.get("text")
+        target_formality = data.get("target_formality")
+        language = data.get("language", "en")
+        current_formality = data.get("current_formality", "neutral")
 
-    # Validate required fields
-    if not text or not isinstance(text, str):
-        raise https_fn.HttpsError(
-            code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
-            message="'text' field is required and must be a string"
-        )
+        # Validate required fields
+        if not text or not isinstance(text, str):
+            raise https_fn.HttpsError(
+                code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+                message="'text' field is required and must be a string"
+            )
 
-    if len(text.strip()) == 0:
-        raise https_fn.HttpsError(
-            code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
-            message="'text' cannot be empty"
-        )
+        if len(text.strip()) == 0:
+            raise https_fn.HttpsError(
+                code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+                message="'text' cannot be empty"
+            )
 
-    if not target_formality or not isinstance(target_formality, str):
-        raise https_fn.HttpsError(
-            code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
-            message="'target_formality' field is required and must be a string"
-        )
+        if not target_formality or not isinstance(target_formality, str):
+            raise https_fn.HttpsError(
+                code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+                message="'target_formality' field is required and must be a string"
+            )
 
-    # Validate formality levels
-    if target_formality not in FORMALITY_LEVELS:
-        raise https_fn.HttpsError(
-            code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
-            message=f"Target formality '{target_formality}' is not supported. "
-                   f"Supported levels: {', '.join(FORMALITY_LEVELS)}"
-        )
+        # Validate formality levels
+        if target_formality not in FORMALITY_LEVELS:
+            raise https_fn.HttpsError(
+                code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+                message=f"Target formality '{target_formality}' is not supported. "
+                       f"Supported levels: {', '.join(FORMALITY_LEVELS)}"
+            )
 
-    if current_formality not in FORMALITY_LEVELS:
-        raise https_fn.HttpsError(
-            code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
-            message=f"Current formality '{current_formality}' is not supported. "
-                   f"Supported levels: {', '.join(FORMALITY_LEVELS)}"
-        )
+        if current_formality not in FORMALITY_LEVELS:
+            raise https_fn.HttpsError(
+                code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+                message=f"Current formality '{current_formality}' is not supported. "
+                       f"Supported levels: {', '.join(FORMALITY_LEVELS)}"
+            )
 
     # Log formality adjustment request
     print(f"Formality adjustment request: '{text[:50]}...' from '{current_formality}' to '{target_formality}' (lang: {language})")
 
     try:
-        start_time = time.time()
-
         # Step 0: Check rate limit (100 requests per hour per user)
         db = firestore.client()
 
-        # Get user ID from request context (authenticated user)
-        user_id = req.auth.uid if req.auth else "anonymous"
+        # Get user ID from request context (signed-out callers are keyed by IP)
+        user_id = rate_limit.caller_key(req)
 
         # Calculate current hour window (truncate timestamp to hour)
-        current_hour = int(time.time() // 3600)  # Unix timestamp divided by 3600 seconds
-        rate_limit_key = f"{user_id}_{current_hour}"
-
-        # Check rate limit
-        rate_limit_ref = db.collection("formality_rate_limits").document(rate_limit_key)
-        rate_limit_doc = rate_limit_ref.get()
-
-        request_count = 0
-        if rate_limit_doc.exists:
-            rate_limit_data = rate_limit_doc.to_dict()
-            request_count = rate_limit_data.get("count", 0)
-
-        # Rate limit: 100 requests per hour per user
-        RATE_LIMIT = 100
-        if request_count >= RATE_LIMIT:
-            # Calculate when the limit resets (next hour)
-            next_hour = (current_hour + 1) * 3600
-            reset_seconds = next_hour - time.time()
-
-            print(f"Rate limit exceeded for user {user_id}: {request_count}/{RATE_LIMIT}")
+        with span("rate_limit"):
+            current_hour = int(time.time() // 3600)  # Unix timestamp divided by 3600 seconds
+
+            # Rate limit: 100 requests per hour per user
+            RATE_LIMIT = 100
+
+            # Sharded counter: concurrent requests from one caller spread over
+            # rate_limit.NUM_SHARDS documents, and the limit is still exact
+            request_count = rate_limit.consume(db, "formality_rate_limits", user_id, current_hour, RATE_LIMIT)
+            if request_count >= RATE_LIMIT:
+                # Calculate when the limit resets (next hour)
+                next_hour = (current_hour + 1) * 3600
+                reset_seconds = next_hour - time.time()
+
+                print(f"Rate limit exceeded for user {user_id}: {request_count}/{RATE_LIMIT}")
+
+                raise https_fn.HttpsError(
+                    code=https_fn.FunctionsErrorCode.RESOURCE_EXHAUSTED,
+                    message=f"Formality adjustment rate limit exceeded. Limit: {RATE_LIMIT} requests per hour. "
+                           f"Try again in {int(reset_seconds/60)} minutes."
+                )
 
-            raise https_fn.HttpsError(
-                code=https_fn.FunctionsErrorCode.RESOURCE_EXHAUSTED,
-                message=f"Formality adjustment rate limit exceeded. Limit: {RATE_LIMIT} requests per hour. "
-                       f"Try again in {int(reset_seconds/60)} minutes."
-            )
+            # Signed-out callers also share one ceiling: new addresses are cheap
+            if not req.auth and (
+                rate_limit.consume_anonymous(db, "formality_rate_limits", current_hour) >= rate_limit.ANONYMOUS_LIMIT
+            ):
+                # Not served, so it does not count against the caller's own quota
+                rate_limit.refund(db, "formality_rate_limits", user_id, current_hour)
+                reset_seconds = (current_hour + 1) * 3600 - time.time()
+                print(f"Anonymous rate limit exceeded: {rate_limit.ANONYMOUS_LIMIT} requests this hour")
+                raise https_fn.HttpsError(
+                    code=https_fn.FunctionsErrorCode.RESOURCE_EXHAUSTED,
+                    message=f"Formality adjustment limit for signed-out requests exceeded. "
+                           f"Sign in or try again in {int(reset_seconds/60)} minutes."
+                )
 
-        # Increment request count
-        rate_limit_ref.set({
-            "userId": user_id,
-            "hourWindow": current_hour,
-            "count": request_count + 1,
-            "lastRequest": time.time(),
-        })
+            remaining_requests = RATE_LIMIT - (request_count + 1)
+            print(f"Rate limit check passed: {request_count + 1}/{RATE_LIMIT} requests (user: {user_id})")
+
+        # Step 0a: Emoji, links and casual filler ("ok", "lol") stay as they are
+        trivial = fast_path.classify(text, language)
+        if trivial is not None and fast_path.keeps_formality(trivial, target_formality):
+            increment(f"fast_path.adjust_formality.{trivial}")
+            print(f"Formality fast path ({trivial}) - returning text unchanged")
+            return {
+                "adjustedText": text,
+                "targetFormality": target_formality,
+                "detectedFormality": "casual" if trivial == fast_path.FILLER else current_formality,
+                "language": language,
+                "cached": False,
+                "fastPath": True,
+                "rateLimit": {
+                    "limit": RATE_LIMIT,
+                    "remaining": remaining_requests,
+                    "resetInSeconds": int((current_hour + 1) * 3600 - time.time()),
+                },
+            }
 
-        remaining_requests = RATE_LIMIT - (request_count + 1)
-        print(f"Rate limit check passed: {request_count + 1}/{RATE_LIMIT} requests (user: {user_id})")
-
-        # Step 1: Check cache first (reduces API costs)
-        cache_collection = db.collection("formality_cache")
-
-        # Create cache key from text + current + target + language
-        cache_key = f"{text}_{current_formality}_{target_formality}_{language}"
-        cache_ref = cache_collection.document(cache_key)
-        cache_doc = cache_ref.get()
-
-        # Check if cache entry exists and is not expired (24-hour TTL)
-        if cache_doc.exists:
-            cache_data = cache_doc.to_dict()
-            timestamp = cache_data.get("timestamp")
-
-            if timestamp:
-                # Check if cache is still valid (24 hours = 86400 seconds)
-                age_seconds = time.time() - timestamp
-                if age_seconds < 86400:  # 24 hours
-                    # Cache hit!
-                    elapsed_time = time.time() - start_time
-                    print(f"Cache HIT in {elapsed_time:.3f}s (age: {age_seconds/3600:.1f}h)")
-
-                    return {
-                        "adjustedText": cache_data["adjustedText"],
-                        "targetFormality": cache_data["targetFormality"],
-                        "detectedFormality": cache_data.get("detectedFormality", current_formality),
-                        "language": cache_data["language"],
-                        "cached": True,
-                        "cacheAge": age_seconds,
-                        "rateLimit": {
-                            "limit": RATE_LIMIT,
-                            "remaining": remaining_requests,
-                            "resetInSeconds": int((current_hour + 1) * 3600 - time.time()),
-                        },
-                    }
+        # Step 1: Check cache first (reduces API costs, 24-hour TTL)
+        cache_ref = cache_store.FORMALITY.document(db, text, current_formality, target_formality, language)
+        cache_entry = cache_store.FORMALITY.get(cache_ref, timeout=deadlines.timeout())
+
+        # Expired entries are kept as a fallback if OpenAI is unavailable
+        if cache_entry is not None and cache_entry.fresh:
+            cache_data = cache_entry.value
+            return {
+                "adjustedText": cache_data["adjustedText"],
+                "targetFormality": cache_data["targetFormality"],
+                "detectedFormality": cache_data.get("detectedFormality", current_formality),
+                "language": cache_data["language"],
+                "cached": True,
+                "cacheAge": cache_entry.age_seconds,
+                "rateLimit": {
+                    "limit": RATE_LIMIT,
+                    "remaining": remaining_requests,
+                    "resetInSeconds": int((current_hour + 1) * 3600 - time.time()),
+                },
+            }
 
         # Step 2: Cache miss - call OpenAI API
         print("Cache MISS - calling OpenAI API")
@@ -345,18 +459,41 @@ Message: "{text}"
 
 Return ONLY the rewritten message."""
 
-        # Call OpenAI API (GPT-4o-mini)
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.7,
-            max_tokens=500,
-        )
-
-        elapsed_time = time.time() - start_time
+        # Call OpenAI API (GPT-4o-mini); fails fast while the breaker is open
+        try:
+            with circuit_breaker.guard("openai"), span("upstream.openai"):
+                response = deadlines.call(
+                    lambda timeout: client.with_options(timeout=timeout, max_retries=0).chat.completions.create(
+                        model="gpt-4o-mini",
+                        messages=[
+                            {"role": "system", "content": system_prompt},
+                            {"role": "user", "content": user_prompt}
+                        ],
+                        temperature=0.7,
+                        max_tokens=500,
+                    ),
+                    name="openai",
+                )
+        except Exception as e:
+            if cache_entry is None:
+                raise
+            # Degraded: serve the expired cache entry rather than failing
+            print(f"OpenAI unavailable ({e}) - serving stale formality cache entry")
+            stale_data = cache_entry.value
+            return {
+                "adjustedText": stale_data["adjustedText"],
+                "targetFormality": stale_data["targetFormality"],
+                "detectedFormality": stale_data.get("detectedFormality", current_formality),
+                "language": stale_data["language"],
+                "cached": True,
+                "stale": True,
+                "cacheAge": cache_entry.age_seconds,
+                "rateLimit": {
+                    "limit": RATE_LIMIT,
+                    "remaining": remaining_requests,
+                    "resetInSeconds": int((current_hour + 1) * 3600 - time.time()),
+                },
+            }
 
         # Extract adjusted text
         adjusted_text = response.choices[0].message.content.strip()
@@ -368,17 +505,16 @@ Return ONLY the rewritten message."""
             adjusted_text = adjusted_text[1:-1]
 
         # Step 3: Store in cache for future requests
-        cache_ref.set({
+        cache_store.FORMALITY.set(cache_ref, {
             "originalText": text,
             "currentFormality": current_formality,
             "targetFormality": target_formality,
             "adjustedText": adjusted_text,
             "detectedFormality": current_formality,
             "language": language,
-            "timestamp": time.time(),
         })
 
-        print(f"Formality adjustment successful in {elapsed_time:.2f}s: "
+        print(f"Formality adjustment successful: "
               f"{current_formality} -> {target_formality}")
 
         return {
@@ -394,6 +530,21 @@ Return ONLY the rewritten message."""
             },
         }
 
+    except circuit_breaker.CircuitOpenError as e:
+        # Upstream unavailable and nothing stale to serve
+        print(f"Formality adjustment unavailable: {e}")
+        raise https_fn.HttpsError(
+            code=https_fn.FunctionsErrorCode.UNAVAILABLE,
+            message=f"Formality adjustment is temporarily unavailable. Try again in {int(e.retry_after) + 1} seconds."
+        )
+
+    except deadlines.DeadlineExceeded as e:
+        print(f"Formality adjustment deadline exceeded: {e}")
+        raise https_fn.HttpsError(
+            code=https_fn.FunctionsErrorCode.DEADLINE_EXCEEDED,
+            message="Formality adjustment took too long. Please try again."
+        )
+
     except Exception as e:
         print(f"Formality adjustment error: {e}")
         raise https_fn.HttpsError(
@@ -402,7 +553,9 @@ Return ONLY the rewritten message."""
         )
 
 
-@https_fn.on_call()
+@https_fn.on_call(**concurrency_options("translate_message", 80))
+@traced("translate_message")
+@deadline(10)
 def translate_message(req: https_fn.CallableRequest) -> dict[str, Any]:
     """
     Translates a message from one language to another using Google Cloud Translation API.
@@ -421,169 +574,224 @@ def translate_message(req: https_fn.CallableRequest) -> dict[str, Any]:
             'detectedLanguage': str (if source was auto-detected)
         }
 
+        An empty source_language is first detected locally (see
+        language_detection.py); the Translation API only auto-detects when
+        the local result is not reliable. Text already in the target
+        language is returned unchanged.
+
     Raises:
         https_fn.HttpsError: If validation fails or translation errors occur
     """
     # Extract and validate request data
-    data = req.data
+    with span("validation"):
+        data = req.data
 
-    if not isinstance(data, dict):
-        raise https_fn.HttpsError(
-            code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
-            message="Request data must be a dictionary"
-        )
+        if not isinstance(data, dict):
+            raise https_fn.HttpsError(
+                code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+                message="Request data must be a dictionary"
+            )
 
-    text = data.get("text")
-    source_language = data.get("source_language", "")  # Empty string = auto-detect
-    target_language = data.get("target_language")
+        text = data.get("text")
+        source_language = data.get("source_language", "")  # Empty string = auto-detect
+        target_language = data.get("target_language")
 
-    # Validate required fields
-    if not text or not isinstance(text, str):
-        raise https_fn.HttpsError(
-            code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
-            message="'text' field is required and must be a string"
-        )
+        # Validate required fields
+        if not text or not isinstance(text, str):
+            raise https_fn.HttpsError(
+                code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+                message="'text' field is required and must be a string"
+            )
 
-    if not target_language or not isinstance(target_language, str):
-        raise https_fn.HttpsError(
-            code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
-            message="'target_language' field is required and must be a string"
-        )
+        if not target_language or not isinstance(target_language, str):
+            raise https_fn.HttpsError(
+                code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+                message="'target_language' field is required and must be a string"
+            )
 
-    # Validate target language is supported
-    if target_language not in SUPPORTED_LANGUAGES:
-        raise https_fn.HttpsError(
-            code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
-            message=f"Target language '{target_language}' is not supported. "
-                   f"Supported languages: {', '.join(SUPPORTED_LANGUAGES.keys())}"
-        )
+        # Validate target language is supported
+        if target_language not in SUPPORTED_LANGUAGES:
+            raise https_fn.HttpsError(
+                code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+                message=f"Target language '{target_language}' is not supported. "
+                       f"Supported languages: {', '.join(SUPPORTED_LANGUAGES.keys())}"
+            )
 
-    # Validate source language if provided
-    if source_language and source_language not in SUPPORTED_LANGUAGES:
-        raise https_fn.HttpsError(
-            code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
-            message=f"Source language '{source_language}' is not supported. "
-                   f"Supported languages: {', '.join(SUPPORTED_LANGUAGES.keys())}"
-        )
+        # Validate source language if provided
+        if source_language and source_language not in SUPPORTED_LANGUAGES:
+            raise https_fn.HttpsError(
+                code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+                message=f"Source language '{source_language}' is not supported. "
+                       f"Supported languages: {', '.join(SUPPORTED_LANGUAGES.keys())}"
+            )
+
+    # Detect the source language locally when the caller did not send one.
+    # Only a reliable result is sent as the source; otherwise the Translation
+    # API auto-detects (a wrong explicit source mistranslates and is cached
+    # under the wrong language pair)
+    locally_detected = None
+    if not source_language:
+        with span("language_detection") as detection_attrs:
+            locally_detected = language_detection.detect_confident(text)
+            detection_attrs["local"] = locally_detected is not None
+        source_language = locally_detected or ""
 
     # Log translation request
     print(f"Translation request: '{text[:50]}...' from '{source_language or 'auto'}' to '{target_language}'")
 
     try:
-        start_time = time.time()
-
         # Step 0: Check rate limit (100 requests per hour per user)
         db = firestore.client()
 
-        # Get user ID from request context (authenticated user)
-        user_id = req.auth.uid if req.auth else "anonymous"
+        # Get user ID from request context (signed-out callers are keyed by IP)
+        user_id = rate_limit.caller_key(req)
 
         # Calculate current hour window (truncate timestamp to hour)
-        current_hour = int(time.time() // 3600)  # Unix timestamp divided by 3600 seconds
-        rate_limit_key = f"{user_id}_{current_hour}"
-
-        # Check rate limit
-        rate_limit_ref = db.collection("translation_rate_limits").document(rate_limit_key)
-        rate_limit_doc = rate_limit_ref.get()
-
-        request_count = 0
-        if rate_limit_doc.exists:
-            rate_limit_data = rate_limit_doc.to_dict()
-            request_count = rate_limit_data.get("count", 0)
-
-        # Rate limit: 100 requests per hour per user
-        RATE_LIMIT = 100
-        if request_count >= RATE_LIMIT:
-            # Calculate when the limit resets (next hour)
-            next_hour = (current_hour + 1) * 3600
-            reset_seconds = next_hour - time.time()
-
-            print(f"Rate limit exceeded for user {user_id}: {request_count}/{RATE_LIMIT}")
-
-            raise https_fn.HttpsError(
-                code=https_fn.FunctionsErrorCode.RESOURCE_EXHAUSTED,
-                message=f"Translation rate limit exceeded. Limit: {RATE_LIMIT} requests per hour. "
-                       f"Try again in {int(reset_seconds/60)} minutes."
-            )
+        with span("rate_limit"):
+            current_hour = int(time.time() // 3600)  # Unix timestamp divided by 3600 seconds
+
+            # Rate limit: 100 requests per hour per user
+            RATE_LIMIT = 100
+
+            # Sharded counter: concurrent requests from one caller spread over
+            # rate_limit.NUM_SHARDS documents, and the limit is still exact
+            request_count = rate_limit.consume(db, "translation_rate_limits", user_id, current_hour, RATE_LIMIT)
+            if request_count >= RATE_LIMIT:
+                # Calculate when the limit resets (next hour)
+                next_hour = (current_hour + 1) * 3600
+                reset_seconds = next_hour - time.time()
+
+                print(f"Rate limit exceeded for user {user_id}: {request_count}/{RATE_LIMIT}")
+
+                raise https_fn.HttpsError(
+                    code=https_fn.FunctionsErrorCode.RESOURCE_EXHAUSTED,
+                    message=f"Translation rate limit exceeded. Limit: {RATE_LIMIT} requests per hour. "
+                           f"Try again in {int(reset_seconds/60)} minutes."
+                )
 
-        # Increment request count
-        rate_limit_ref.set({
-            "userId": user_id,
-            "hourWindow": current_hour,
-            "count": request_count + 1,
-            "lastRequest": time.time(),
-        })
+            # Signed-out callers also share one ceiling: new addresses are cheap
+            if not req.auth and (
+                rate_limit.consume_anonymous(db, "translation_rate_limits", current_hour) >= rate_limit.ANONYMOUS_LIMIT
+            ):
+                # Not served, so it does not count against the caller's own quota
+                rate_limit.refund(db, "translation_rate_limits", user_id, current_hour)
+                reset_seconds = (current_hour + 1) * 3600 - time.time()
+                print(f"Anonymous rate limit exceeded: {rate_limit.ANONYMOUS_LIMIT} requests this hour")
+                raise https_fn.HttpsError(
+                    code=https_fn.FunctionsErrorCode.RESOURCE_EXHAUSTED,
+                    message=f"Translation limit for signed-out requests exceeded. "
+                           f"Sign in or try again in {int(reset_seconds/60)} minutes."
+                )
 
-        remaining_requests = RATE_LIMIT - (request_count + 1)
-        print(f"Rate limit check passed: {request_count + 1}/{RATE_LIMIT} requests (user: {user_id})")
+            remaining_requests = RATE_LIMIT - (request_count + 1)
+            print(f"Rate limit check passed: {request_count + 1}/{RATE_LIMIT} requests (user: {user_id})")
+
+        # Step 0a: Text already in the target language needs no (billed) translation
+        if source_language == target_language:
+            increment("fast_path.translate_message.same_language")
+            print(f"Source language is the target ({target_language}) - returning text unchanged")
+            return {
+                "translatedText": text,
+                "sourceLanguage": source_language,
+                "targetLanguage": target_language,
+                "detectedLanguage": source_language,
+                "cached": False,
+                "fastPath": True,
+                "rateLimit": {
+                    "limit": RATE_LIMIT,
+                    "remaining": remaining_requests,
+                    "resetInSeconds": int((current_hour + 1) * 3600 - time.time()),
+                },
+            }
 
-        # Step 1: Check cache first (reduces API costs by 70%)
+        # Step 1: Check cache first (reduces API costs by 70%, 24-hour TTL)
         db = firestore.client()
-        cache_collection = db.collection("translation_cache")
-
-        # Create cache key from text + source + target
-        cache_key = f"{text}_{source_language or 'auto'}_{target_language}"
-        cache_ref = cache_collection.document(cache_key)
-        cache_doc = cache_ref.get()
-
-        # Check if cache entry exists and is not expired (24-hour TTL)
-        if cache_doc.exists:
-            cache_data = cache_doc.to_dict()
-            timestamp = cache_data.get("timestamp")
-
-            if timestamp:
-                # Check if cache is still valid (24 hours = 86400 seconds)
-                age_seconds = time.time() - timestamp
-                if age_seconds < 86400:  # 24 hours
-                    # Cache hit!
-                    elapsed_time = time.time() - start_time
-                    print(f"Cache HIT in {elapsed_time:.3f}s (age: {age_seconds/3600:.1f}h)")
-
-                    return {
-                        "translatedText": cache_data["translatedText"],
-                        "sourceLanguage": cache_data["sourceLanguage"],
-                        "targetLanguage": cache_data["targetLanguage"],
-                        "detectedLanguage": cache_data["detectedLanguage"],
-                        "cached": True,
-                        "cacheAge": age_seconds,
-                        "rateLimit": {
-                            "limit": RATE_LIMIT,
-                            "remaining": remaining_requests,
-                            "resetInSeconds": int((current_hour + 1) * 3600 - time.time()),
-                        },
-                    }
+        cache_ref = cache_store.TRANSLATION.document(db, text, source_language or "auto", target_language)
+        cache_entry = cache_store.TRANSLATION.get(cache_ref, timeout=deadlines.timeout())
+
+        # Expired entries are kept as a fallback if the Translation API is unavailable
+        if cache_entry is not None and cache_entry.fresh:
+            cache_data = cache_entry.value
+            return {
+                "translatedText": cache_data["translatedText"],
+                "sourceLanguage": cache_data["sourceLanguage"],
+                "targetLanguage": cache_data["targetLanguage"],
+                "detectedLanguage": cache_data["detectedLanguage"],
+                "cached": True,
+                "cacheAge": cache_entry.age_seconds,
+                "rateLimit": {
+                    "limit": RATE_LIMIT,
+                    "remaining": remaining_requests,
+                    "resetInSeconds": int((current_hour + 1) * 3600 - time.time()),
+                },
+            }
 
         # Step 2: Cache miss - call Translation API
         print("Cache MISS - calling Translation API")
 
-        # Get Translation API client (supports Secret Manager or Application Default Credentials)
-        client = get_translate_client()
-
-        # Call Google Cloud Translation API
-        result = client.translate(
-            text,
-            target_language=target_language,
-            source_language=source_language if source_language else None,
-            format_="text"
-        )
-
-        elapsed_time = time.time() - start_time
-
-        # Extract results
-        translated_text = result["translatedText"]
-        detected_language = result.get("detectedSourceLanguage", source_language)
+        try:
+            # Get Translation API client (supports Secret Manager or Application Default Credentials)
+            client = get_translate_client()
+
+            if source_language:
+                # Step 2a: Known source language - translate sentence by sentence,
+                # reusing sentences already in the translation memory
+                memory_result = translation_memory.translate(
+                    db, client, text, source_language, target_language
+                )
+                translated_text = memory_result.translated_text
+                detected_language = source_language
+                print(f"Translation memory: reused {memory_result.reused}/{memory_result.segments} sentences, "
+                      f"billed {memory_result.characters_billed} chars, saved {memory_result.characters_saved}")
+            else:
+                # Step 2b: Unknown source language - let the API auto-detect
+                with circuit_breaker.guard("translate"), span("upstream.translate"):
+                    result = deadlines.call(
+                        lambda _timeout: client.translate(
+                            text,
+                            target_language=target_language,
+                            source_language=None,
+                            format_="text"
+                        ),
+                        name="translate",
+                        idempotent=True,
+                        hedge=True,
+                    )
+
+                # Extract results
+                translated_text = result["translatedText"]
+                detected_language = result.get("detectedSourceLanguage", source_language)
+        except Exception as e:
+            if cache_entry is None:
+                raise
+            # Degraded: serve the expired cache entry rather than failing
+            print(f"Translation API unavailable ({e}) - serving stale translation cache entry")
+            stale_data = cache_entry.value
+            return {
+                "translatedText": stale_data["translatedText"],
+                "sourceLanguage": stale_data["sourceLanguage"],
+                "targetLanguage": stale_data["targetLanguage"],
+                "detectedLanguage": stale_data["detectedLanguage"],
+                "cached": True,
+                "stale": True,
+                "cacheAge": cache_entry.age_seconds,
+                "rateLimit": {
+                    "limit": RATE_LIMIT,
+                    "remaining": remaining_requests,
+                    "resetInSeconds": int((current_hour + 1) * 3600 - time.time()),
+                },
+            }
 
         # Step 3: Store in cache for future requests
-        cache_ref.set({
+        cache_store.TRANSLATION.set(cache_ref, {
             "sourceText": text,
             "sourceLanguage": source_language or detected_language,
             "targetLanguage": target_language,
             "translatedText": translated_text,
             "detectedLanguage": detected_language,
-            "timestamp": time.time(),
         })
 
-        print(f"Translation successful in {elapsed_time:.2f}s: "
+        print(f"Translation successful: "
               f"detected={detected_language}, target={target_language}")
 
         return {
@@ -599,6 +807,21 @@ def translate_message(req: https_fn.CallableRequest) -> dict[str, Any]:
             },
         }
 
+    except circuit_breaker.CircuitOpenError as e:
+        # Upstream unavailable and nothing stale to serve
+        print(f"Translation unavailable: {e}")
+        raise https_fn.HttpsError(
+            code=https_fn.FunctionsErrorCode.UNAVAILABLE,
+            message=f"Translation is temporarily unavailable. Try again in {int(e.retry_after) + 1} seconds."
+        )
+
+    except deadlines.DeadlineExceeded as e:
+        print(f"Translation deadline exceeded: {e}")
+        raise https_fn.HttpsError(
+            code=https_fn.FunctionsErrorCode.DEADLINE_EXCEEDED,
+            message="Translation took too long. Please try again."
+        )
+
     except Exception as e:
         print(f"Translation error: {e}")
         raise https_fn.HttpsError(
@@ -608,6 +831,7 @@ def translate_message(req: https_fn.CallableRequest) -> dict[str, Any]:
 
 
 @https_fn.on_request()
+@traced("clean_translation_cache")
 def clean_translation_cache(req: https_fn.Request) -> https_fn.Response:
     """
     Scheduled function to clean up expired cache and rate limit entries.
@@ -617,6 +841,9 @@ def clean_translation_cache(req: https_fn.Request) -> https_fn.Response:
     - Formality cache entries older than 24 hours
     - Translation rate limit entries older than 2 hours
     - Formality rate limit entries older than 2 hours
+    - Translation memory sentences older than 30 days
+    - Message context (30 days), smart reply (7 days) and semantic search
+      (5 minutes) cache entries past their TTL
 
     Should be triggered via Cloud Scheduler (e.g., daily at 2 AM).
 
@@ -625,179 +852,181 @@ def clean_translation_cache(req: https_fn.Request) -> https_fn.Response:
 
     Returns:
         JSON with cleanup stats: { translationCacheDeleted, formalityCacheDeleted,
-                                   translationRateLimitDeleted, formalityRateLimitDeleted, errors }
+                                   translationRateLimitDeleted, formalityRateLimitDeleted,
+                                   translationMemoryDeleted, messageContextCacheDeleted,
+                                   smartReplyCacheDeleted, semanticSearchCacheDeleted, errors }
     """
     try:
         db = firestore.client()
 
         # === Clean translation cache (24-hour TTL) ===
-        cache_collection = db.collection("translation_cache")
-        cache_cutoff_time = time.time() - 86400  # 24 hours ago
-
-        expired_cache_query = cache_collection.where("timestamp", "<", cache_cutoff_time)
-        expired_cache_docs = expired_cache_query.stream()
+        with span("cleanup.translation_cache"):
+            cache_deleted, error_count = cache_store.TRANSLATION.purge_expired(db)
+            print(f"Cache cleanup: deleted {cache_deleted} entries")
 
-        cache_deleted = 0
-        error_count = 0
+        # === Clean rate limit entries (2-hour retention) ===
+        with span("cleanup.translation_rate_limits"):
+            rate_limit_collection = db.collection("translation_rate_limits")
 
-        # Delete expired cache entries in batches
-        batch = db.batch()
-        batch_count = 0
+            # Delete rate limit entries older than 2 hours (well past their hour window)
+            rate_limit_cutoff_time = time.time() - 7200  # 2 hours ago
 
-        for doc in expired_cache_docs:
-            try:
-                batch.delete(doc.reference)
-                batch_count += 1
-                cache_deleted += 1
-
-                # Firestore batches can only contain 500 operations
-                if batch_count >= 500:
-                    batch.commit()
-                    batch = db.batch()
-                    batch_count = 0
-            except Exception as e:
-                error_count += 1
-                print(f"Error deleting cache entry {doc.id}: {e}")
+            expired_rate_limit_query = rate_limit_collection.where("lastRequest", "<", rate_limit_cutoff_time)
+            expired_rate_limit_docs = expired_rate_limit_query.stream()
 
-        # Commit remaining cache deletions
-        if batch_count > 0:
-            batch.commit()
+            rate_limit_deleted = 0
+            batch = db.batch()
             batch_count = 0
 
-        print(f"Cache cleanup: deleted {cache_deleted} entries")
-
-        # === Clean rate limit entries (2-hour retention) ===
-        rate_limit_collection = db.collection("translation_rate_limits")
-
-        # Delete rate limit entries older than 2 hours (well past their hour window)
-        rate_limit_cutoff_time = time.time() - 7200  # 2 hours ago
+            for doc in expired_rate_limit_docs:
+                try:
+                    batch.delete(doc.reference)
+                    batch_count += 1
+                    rate_limit_deleted += 1
 
-        expired_rate_limit_query = rate_limit_collection.where("lastRequest", "<", rate_limit_cutoff_time)
-        expired_rate_limit_docs = expired_rate_limit_query.stream()
+                    if batch_count >= 500:
+                        batch.commit()
+                        batch = db.batch()
+                        batch_count = 0
+                except Exception as e:
+                    error_count += 1
+                    print(f"Error deleting rate limit entry {doc.id}: {e}")
 
-        rate_limit_deleted = 0
-        batch = db.batch()
+            # Commit remaining rate limit deletions
+            if batch_count > 0:
+                batch.commit()
 
-        for doc in expired_rate_limit_docs:
-            try:
-                batch.delete(doc.reference)
-                batch_count += 1
-                rate_limit_deleted += 1
-
-                if batch_count >= 500:
-                    batch.commit()
-                    batch = db.batch()
-                    batch_count = 0
-            except Exception as e:
-                error_count += 1
-                print(f"Error deleting rate limit entry {doc.id}: {e}")
+            print(f"Translation rate limit cleanup: deleted {rate_limit_deleted} entries")
 
-        # Commit remaining rate limit deletions
-        if batch_count > 0:
-            batch.commit()
+        # === Clean formality cache (24-hour TTL) ===
+        with span("cleanup.formality_cache"):
+            formality_cache_deleted, errors = cache_store.FORMALITY.purge_expired(db)
+            error_count += errors
+            print(f"Formality cache cleanup: deleted {formality_cache_deleted} entries")
 
-        print(f"Translation rate limit cleanup: deleted {rate_limit_deleted} entries")
+        # === Clean formality rate limit entries (2-hour retention) ===
+        with span("cleanup.formality_rate_limits"):
+            formality_rate_limit_collection = db.collection("formality_rate_limits")
+            formality_rate_limit_cutoff_time = time.time() - 7200  # 2 hours ago
 
-        # === Clean formality cache (24-hour TTL) ===
-        formality_cache_collection = db.collection("formality_cache")
-        formality_cache_cutoff_time = time.time() - 86400  # 24 hours ago
+            expired_formality_rate_limit_query = formality_rate_limit_collection.where("lastRequest", "<", formality_rate_limit_cutoff_time)
+            expired_formality_rate_limit_docs = expired_formality_rate_limit_query.stream()
 
-        expired_formality_cache_query = formality_cache_collection.where("timestamp", "<", formality_cache_cutoff_time)
-        expired_formality_cache_docs = expired_formality_cache_query.stream()
+            formality_rate_limit_deleted = 0
+            batch = db.batch()
+            batch_count = 0
 
-        formality_cache_deleted = 0
-        batch = db.batch()
-        batch_count = 0
+            for doc in expired_formality_rate_limit_docs:
+                try:
+                    batch.delete(doc.reference)
+                    batch_count += 1
+                    formality_rate_limit_deleted += 1
 
-        for doc in expired_formality_cache_docs:
-            try:
-                batch.delete(doc.reference)
-                batch_count += 1
-                formality_cache_deleted += 1
-
-                if batch_count >= 500:
-                    batch.commit()
-                    batch = db.batch()
-                    batch_count = 0
-            except Exception as e:
-                error_count += 1
-                print(f"Error deleting formality cache entry {doc.id}: {e}")
+                    if batch_count >= 500:
+                        batch.commit()
+                        batch = db.batch()
+                        batch_count = 0
+                except Exception as e:
+                    error_count += 1
+                    print(f"Error deleting formality rate limit entry {doc.id}: {e}")
 
-        # Commit remaining formality cache deletions
-        if batch_count > 0:
-            batch.commit()
-            batch_count = 0
+            # Commit remaining formality rate limit deletions
+            if batch_count > 0:
+                batch.commit()
 
-        print(f"Formality cache cleanup: deleted {formality_cache_deleted} entries")
+            print(f"Formality rate limit cleanup: deleted {formality_rate_limit_deleted} entries")
 
-        # === Clean formality rate limit entries (2-hour retention) ===
-        formality_rate_limit_collection = db.collection("formality_rate_limits")
-        formality_rate_limit_cutoff_time = time.time() - 7200  # 2 hours ago
+        # === Clean cultural context cache (30-day TTL) ===
+        with span("cleanup.cultural_context_cache"):
+            cultural_cache_collection = db.collection("cultural_context_cache")
+            cultural_cache_cutoff_time = time.time() - 2592000  # 30 days ago
 
-        expired_formality_rate_limit_query = formality_rate_limit_collection.where("lastRequest", "<", formality_rate_limit_cutoff_time)
-        expired_formality_rate_limit_docs = expired_formality_rate_limit_query.stream()
+            expired_cultural_cache_query = cultural_cache_collection.where("timestamp", "<", cultural_cache_cutoff_time)
+            expired_cultural_cache_docs = expired_cultural_cache_query.stream()
 
-        formality_rate_limit_deleted = 0
-        batch = db.batch()
+            cultural_cache_deleted = 0
+            batch = db.batch()
+            batch_count = 0
 
-        for doc in expired_formality_rate_limit_docs:
-            try:
-                batch.delete(doc.reference)
-                batch_count += 1
-                formality_rate_limit_deleted += 1
-
-                if batch_count >= 500:
-                    batch.commit()
-                    batch = db.batch()
-                    batch_count = 0
-            except Exception as e:
-                error_count += 1
-                print(f"Error deleting formality rate limit entry {doc.id}: {e}")
+            for doc in expired_cultural_cache_docs:
+                try:
+                    batch.delete(doc.reference)
+                    batch_count += 1
+                    cultural_cache_deleted += 1
 
-        # Commit remaining formality rate limit deletions
-        if batch_count > 0:
-            batch.commit()
+                    if batch_count >= 500:
+                        batch.commit()
+                        batch = db.batch()
+                        batch_count = 0
+                except Exception as e:
+                    error_count += 1
+                    print(f"Error deleting cultural context cache entry {doc.id}: {e}")
 
-        print(f"Formality rate limit cleanup: deleted {formality_rate_limit_deleted} entries")
+            # Commit remaining cultural context cache deletions
+            if batch_count > 0:
+                batch.commit()
 
-        # === Clean cultural context cache (30-day TTL) ===
-        cultural_cache_collection = db.collection("cultural_context_cache")
-        cultural_cache_cutoff_time = time.time() - 2592000  # 30 days ago
+            print(f"Cultural context cache cleanup: deleted {cultural_cache_deleted} entries")
 
-        expired_cultural_cache_query = cultural_cache_collection.where("timestamp", "<", cultural_cache_cutoff_time)
-        expired_cultural_cache_docs = expired_cultural_cache_query.stream()
+        # === Clean translation memory (30-day TTL) ===
+        with span("cleanup.translation_memory"):
+            memory_collection = db.collection(translation_memory.MEMORY_COLLECTION)
+            memory_cutoff_time = time.time() - translation_memory.MEMORY_TTL_SECONDS
 
-        cultural_cache_deleted = 0
-        batch = db.batch()
-        batch_count = 0
+            expired_memory_query = memory_collection.where("timestamp", "<", memory_cutoff_time)
+            expired_memory_docs = expired_memory_query.stream()
 
-        for doc in expired_cultural_cache_docs:
-            try:
-                batch.delete(doc.reference)
-                batch_count += 1
-                cultural_cache_deleted += 1
-
-                if batch_count >= 500:
-                    batch.commit()
-                    batch = db.batch()
-                    batch_count = 0
-            except Exception as e:
-                error_count += 1
-                print(f"Error deleting cultural context cache entry {doc.id}: {e}")
+            memory_deleted = 0
+            batch = db.batch()
+            batch_count = 0
 
-        # Commit remaining cultural context cache deletions
-        if batch_count > 0:
-            batch.commit()
+            for doc in expired_memory_docs:
+                try:
+                    batch.delete(doc.reference)
+                    batch_count += 1
+                    memory_deleted += 1
+
+                    if batch_count >= 500:
+                        batch.commit()
+                        batch = db.batch()
+                        batch_count = 0
+                except Exception as e:
+                    error_count += 1
+                    print(f"Error deleting translation memory entry {doc.id}: {e}")
+
+            # Commit remaining translation memory deletions
+            if batch_count > 0:
+                batch.commit()
+
+            print(f"Translation memory cleanup: deleted {memory_deleted} entries")
+
+        # === Clean message context (30-day), smart reply (7-day) and semantic search (5-minute) caches ===
+        with span("cleanup.message_context_cache"):
+            message_context_cache_deleted, errors = cache_store.MESSAGE_CONTEXT.purge_expired(db)
+            error_count += errors
+        with span("cleanup.smart_reply_cache"):
+            smart_reply_cache_deleted, errors = cache_store.SMART_REPLIES.purge_expired(db)
+            error_count += errors
+        with span("cleanup.semantic_search_cache"):
+            semantic_search_cache_deleted, errors = cache_store.SEMANTIC_SEARCH.purge_expired(db)
+            error_count += errors
+        print(f"Response cache cleanup: deleted messageContext={message_context_cache_deleted}, "
+              f"smartReply={smart_reply_cache_deleted}, semanticSearch={semantic_search_cache_deleted} entries")
 
-        print(f"Cultural context cache cleanup: deleted {cultural_cache_deleted} entries")
         print(f"Total cleanup complete: translationCache={cache_deleted}, formalityCache={formality_cache_deleted}, "
-              f"culturalContextCache={cultural_cache_deleted}, "
+              f"culturalContextCache={cultural_cache_deleted}, translationMemory={memory_deleted}, "
+              f"messageContextCache={message_context_cache_deleted}, smartReplyCache={smart_reply_cache_deleted}, "
+              f"semanticSearchCache={semantic_search_cache_deleted}, "
               f"translationRateLimit={rate_limit_deleted}, formalityRateLimit={formality_rate_limit_deleted}, "
               f"errors={error_count}")
 
         return https_fn.Response(
             response=f'{{"translationCacheDeleted": {cache_deleted}, "formalityCacheDeleted": {formality_cache_deleted}, '
                     f'"culturalContextCacheDeleted": {cultural_cache_deleted}, '
+                    f'"translationMemoryDeleted": {memory_deleted}, '
+                    f'"messageContextCacheDeleted": {message_context_cache_deleted}, '
+                    f'"smartReplyCacheDeleted": {smart_reply_cache_deleted}, '
+                    f'"semanticSearchCacheDeleted": {semantic_search_cache_deleted}, '
                     f'"translationRateLimitDeleted": {rate_limit_deleted}, "formalityRateLimitDeleted": {formality_rate_limit_deleted}, '
                     f'"errors": {error_count}}}',
             status=200,
@@ -813,6 +1042,219 @@ def clean_translation_cache(req: https_fn.Request) -> https_fn.Response:
         )
 
 
+@https_fn.on_request()
+@traced("aggregate_cache_metrics")
+def aggregate_cache_metrics(req: https_fn.Request) -> https_fn.Response:
+    """
+    Scheduled function that reports how effective each response cache is.
+
+    Sums the sharded cache_metrics counters flushed by every instance and,
+    per cache collection, reports the hit ratio, average entry age at hit,
+    average entry size and upstream calls avoided, over all time and since
+    the previous report. Each report is also stored in cache_metrics_reports.
+
+    Should be triggered via Cloud Scheduler (e.g., hourly).
+
+    Returns:
+        JSON: { collection: { ttlSeconds, upstream, total, sinceLastReport } }
+    """
+    try:
+        db = firestore.client()
+
+        # Step 1: Include this instance's own pending counts
+        cache_metrics.flush(db)
+
+        # Step 2: Aggregate every cache's shards
+        with span("aggregate"):
+            caches = cache_metrics.report(db, cache_store.STORES)
+
+        for collection, stats in caches.items():
+            interval = stats["sinceLastReport"]
+            print(f"Cache {collection}: hitRatio={interval['hitRatio']}, lookups={interval['lookups']}, "
+                  f"avgAgeAtHit={interval['avgAgeAtHitSeconds']}s, avgEntryBytes={interval['avgEntryBytes']}, "
+                  f"{stats['upstream']}CallsAvoided={interval['upstreamCallsAvoided']}")
+
+        return https_fn.Response(
+            response=json.dumps(caches),
+            status=200,
+            headers={"Content-Type": "application/json"}
+        )
+
+    except Exception as e:
+        print(f"Cache metrics aggregation failed: {e}")
+        return https_fn.Response(
+            response=json.dumps({"error": str(e)}),
+            status=500,
+            headers={"Content-Type": "application/json"}
+        )
+
+
+def _notification_message(
+    token: str | None,
+    title: str,
+    body: str,
+    data: dict[str, str],
+    collapse_key: str | None = None,
+    condition: str | None = None,
+) -> Any:
+    """
+    FCM message for one device token, or for a topic condition.
+
+    With a collapse_key, the notification replaces any earlier one with the
+    same key on the device (and in FCM's queue while the device is offline).
+    """
+    return messaging.Message(
+        notification=messaging.Notification(
+            title=title,
+            body=body,
+        ),
+        data=data,
+        token=token,
+        condition=condition,
+        android=messaging.AndroidConfig(
+            priority="high",
+            collapse_key=collapse_key,
+            notification=messaging.AndroidNotification(
+                color="#2196F3",
+                sound="default",
+                channel_id="messages",
+                tag=collapse_key,
+            ),
+        ),
+        apns=messaging.APNSConfig(
+            headers={"apns-collapse-id": collapse_key} if collapse_key else None,
+            payload=messaging.APNSPayload(
+                aps=messaging.Aps(
+                    sound="default",
+                    badge=1,
+                    content_available=True,
+                ),
+            ),
+        ),
+    )
+
+
+async def _send_notifications_async(
+    recipient_ids: list[str],
+    title: str,
+    body: str,
+    data: dict[str, str],
+    collapse_key: str | None = None,
+    fcm_tokens: dict[str, list[str]] | None = None,
+) -> int:
+    """
+    Notification fan-out on the async path.
+
+    All recipients' user documents are read in one batched call (unless
+    their tokens are given), and every token's message goes out through
+    send_each_async (up to 500 messages per call, sent concurrently).
+
+    Returns:
+        Number of notifications sent
+    """
+    if fcm_tokens is None:
+        adb = async_core.firestore()
+        refs = [adb.collection("users").document(participant_id) for participant_id in recipient_ids]
+        fcm_tokens = {}
+        async for user_doc in adb.get_all(refs):
+            user_data = user_doc.to_dict() if user_doc.exists else None
+            fcm_tokens[user_doc.id] = (user_data or {}).get("fcmTokens", [])
+
+    messages = []
+    for participant_id in recipient_ids:
+        tokens = fcm_tokens.get(participant_id) or []
+        if not tokens:
+            print(f"No FCM tokens for user {participant_id}")
+            continue
+        messages.extend(_notification_message(token, title, body, data, collapse_key) for token in tokens)
+
+    batches = [messages[i:i + FCM_BATCH_SIZE] for i in range(0, len(messages), FCM_BATCH_SIZE)]
+    responses = await asyncio.gather(*(messaging.send_each_async(batch) for batch in batches), return_exceptions=True)
+    notification_count = 0
+    for response in responses:
+        if isinstance(response, Exception):
+            print(f"Failed to send notification batch: {response}")
+            continue
+        notification_count += response.success_count
+        for send_response in response.responses:
+            if not send_response.success:
+                print(f"Failed to send notification: {send_response.exception}")
+    return notification_count
+
+
+def _notify_recipients(
+    db: Any,
+    recipient_ids: list[str],
+    title: str,
+    body: str,
+    data: dict[str, str],
+    collapse_key: str | None = None,
+    fcm_tokens: dict[str, list[str]] | None = None,
+) -> int:
+    """
+    Push one notification to every registered device of the recipients.
+
+    Args:
+        fcm_tokens: Recipients' tokens from conversation_tokens; read from
+            their users documents if not given
+
+    Returns:
+        Number of notifications sent
+    """
+    if ASYNC_HANDLERS:
+        return async_core.run(_send_notifications_async(recipient_ids, title, body, data, collapse_key, fcm_tokens))
+
+    notification_count = 0
+    for participant_id in recipient_ids:
+        if fcm_tokens is not None:
+            tokens = fcm_tokens.get(participant_id) or []
+        else:
+            # Get user's FCM tokens
+            user_ref = db.collection("users").document(participant_id)
+            user_doc = user_ref.get()
+
+            if not user_doc.exists:
+                print(f"User {participant_id} not found")
+                continue
+
+            user_data = user_doc.to_dict()
+            if user_data is None:
+                continue
+
+            tokens = user_data.get("fcmTokens", [])
+
+        if not tokens:
+            print(f"No FCM tokens for user {participant_id}")
+            continue
+
+        # Send notification to each token
+        for token in tokens:
+            try:
+                message = _notification_message(token, title, body, data, collapse_key)
+                response = messaging.send(message)
+                notification_count += 1
+                print(f"Sent notification to {participant_id}: {response}")
+
+            except Exception as e:
+                print(f"Failed to send notification to {participant_id}: {e}")
+                # Continue to next token even if one fails
+
+    return notification_count
+
+
+def _schedule_notification_flush(conversation_id: str, recipient_ids: list[str], delay_seconds: float) -> None:
+    """Queue flush_notification_bursts for recipients whose messages are being held."""
+    try:
+        functions.task_queue("flush_notification_bursts").enqueue(
+            {"conversationId": conversation_id, "recipientIds": recipient_ids},
+            functions.TaskOptions(schedule_delay_seconds=max(1, int(delay_seconds + 0.999))),
+        )
+        increment("notifications.flushesScheduled")
+    except Exception as e:
+        # The held messages are counted into the next push instead
+        print(f"Failed to schedule notification flush for {conversation_id}: {e}")
+
+
 def _send_notification_for_message(
     event: firestore_fn.Event[firestore_fn.DocumentSnapshot | None],
     conversation_collection: str,
@@ -846,108 +1288,123 @@ def _send_notification_for_message(
 
     print(f"New {message_type} message from {sender_name} in {conversation_id}")
 
-    # Get conversation to find participants
-    db = firestore.client()
-    conversation_ref = db.collection(conversation_collection).document(conversation_id)
-    conversation = conversation_ref.get()
-
-    if not conversation.exists:
-        print(f"Conversation {conversation_id} not found in {conversation_collection}")
-        return
-
-    conversation_data = conversation.to_dict()
-    if conversation_data is None:
-        print("Could not convert conversation to dict")
-        return
-
-    participants = conversation_data.get("participants", [])
-    if not participants:
+    # Get participants and their FCM tokens: one read of the token index
+    with span("conversation_lookup") as lookup_attrs:
+        db = firestore.client()
+        token_index = None
+        if conversation_collection == "conversations":
+            token_index = conversation_tokens.get(db, conversation_id)
+        lookup_attrs["tokenIndex"] = token_index is not None
+
+        if token_index is None:
+            conversation_ref = db.collection(conversation_collection).document(conversation_id)
+            conversation = conversation_ref.get()
+
+            if not conversation.exists:
+                print(f"Conversation {conversation_id} not found in {conversation_collection}")
+                return
+
+            conversation_data = conversation.to_dict()
+            if conversation_data is None:
+                print("Could not convert conversation to dict")
+                return
+
+            # Not indexed yet: build the entry (one batched users read) so later messages need one read
+            if conversation_collection == "conversations":
+                try:
+                    token_index = conversation_tokens.build(db, conversation_id, conversation_data, sync_topics=False)
+                except Exception as e:
+                    print(f"Failed to index tokens for {conversation_id} ({e}) - reading users individually")
+
+    if token_index is not None:
+        participant_ids = token_index.get("participantIds", [])
+        conversation_name = token_index.get("name")
+        fcm_tokens = token_index.get("tokens", {})
+    else:
+        participant_ids = conversation_tokens.participant_ids(conversation_data)
+        conversation_name = conversation_data.get("name")
+        fcm_tokens = None
+
+    if not participant_ids:
         print("No participants found in conversation")
         return
 
-    # Extract participant IDs
-    participant_ids = [p.get("uid") for p in participants if p.get("uid")]
-
     # Get group name for group messages
-    group_name = conversation_data.get("name", "Group") if is_group else None
+    group_name = (conversation_name or "Group") if is_group else None
 
     print(f"Sending notifications to {len(participant_ids) - 1} participants (excluding sender)")
 
-    # Send notification to each participant (except sender)
-    notification_count = 0
-    for participant_id in participant_ids:
-        if participant_id == sender_id:
-            continue  # Don't notify the sender
+    # Customize notification title for groups
+    notification_title = f"{sender_name} in {group_name}" if is_group else sender_name
+    notification_data = {
+        "conversationId": conversation_id,
+        "senderId": sender_id,
+        "messageId": message_id,
+        "type": "group_message" if is_group else "direct_message",
+        "isGroup": "true" if is_group else "false",
+    }
+    recipient_ids = [participant_id for participant_id in participant_ids if participant_id != sender_id]
 
-        # Get user's FCM tokens
-        user_ref = db.collection("users").document(participant_id)
-        user_doc = user_ref.get()
+    # Large groups: one publish to the conversation's topic, FCM fans it out
+    # (see fcm_topics.py). Not coalesced: per-recipient burst state would cost
+    # a write per participant for every message.
+    if token_index is not None and token_index.get("topicDelivery"):
+        try:
+            with span("fanout") as fanout_attrs:
+                fanout_attrs["topic"] = True
+                fanout_attrs["recipients"] = len(recipient_ids)
+                message = _notification_message(
+                    None, notification_title, message_text[:100], notification_data,
+                    notification_coalescing.collapse_key(conversation_id) if NOTIFICATION_COALESCING else None,
+                    condition=fcm_topics.condition(conversation_id, sender_id),
+                )
+                response = messaging.send(message)
+            increment("notifications.topicPublishes")
+            print(f"Published notification to topic for {len(recipient_ids)} participants: {response}")
+            return
+        except Exception as e:
+            print(f"Topic publish failed for {conversation_id} ({e}) - sending per token")
+
+    # Coalescing: recipients inside a burst window are held for the trailing push
+    if NOTIFICATION_COALESCING:
+        with span("coalesce") as coalesce_attrs:
+            coalesced = notification_coalescing.record_message(db, conversation_id, recipient_ids, message_id, {
+                "title": notification_title,
+                "text": message_text,
+                "data": notification_data,
+            })
+            coalesce_attrs["held"] = len(coalesced.held)
+        increment("notifications.held", len(coalesced.held))
+        if coalesced.flush_recipients:
+            _schedule_notification_flush(conversation_id, coalesced.flush_recipients, coalesced.flush_delay_seconds)
+        pushes = coalesced.send_now
+        collapse_key = notification_coalescing.collapse_key(conversation_id)
+    else:
+        pushes = {1: recipient_ids}
+        collapse_key = None
 
-        if not user_doc.exists:
-            print(f"User {participant_id} not found")
-            continue
+    # Send notification to each participant (except sender)
+    with span("fanout") as fanout_attrs:
+        notification_count = 0
+        for count, push_recipient_ids in pushes.items():
+            data = notification_data if count == 1 else {**notification_data, "messageCount": str(count)}
+            notification_count += _notify_recipients(
+                db, push_recipient_ids, notification_title,
+                notification_coalescing.summary_body(count, message_text),  # Truncates long messages
+                data, collapse_key, fcm_tokens,
+            )
 
-        user_data = user_doc.to_dict()
-        if user_data is None:
-            continue
+        fanout_attrs["recipients"] = len(recipient_ids)
+        fanout_attrs["sent"] = notification_count
 
-        fcm_tokens = user_data.get("fcmTokens", [])
-        if not fcm_tokens:
-            print(f"No FCM tokens for user {participant_id}")
-            continue
-
-        # Customize notification title for groups
-        notification_title = f"{sender_name} in {group_name}" if is_group else sender_name
-
-        # Send notification to each token
-        for token in fcm_tokens:
-            try:
-                message = messaging.Message(
-                    notification=messaging.Notification(
-                        title=notification_title,
-                        body=message_text[:100],  # Truncate long messages
-                    ),
-                    data={
-                        "conversationId": conversation_id,
-                        "senderId": sender_id,
-                        "messageId": message_id,
-                        "type": "group_message" if is_group else "direct_message",
-                        "isGroup": "true" if is_group else "false",
-                    },
-                    token=token,
-                    android=messaging.AndroidConfig(
-                        priority="high",
-                        notification=messaging.AndroidNotification(
-                            color="#2196F3",
-                            sound="default",
-                            channel_id="messages",
-                        ),
-                    ),
-                    apns=messaging.APNSConfig(
-                        payload=messaging.APNSPayload(
-                            aps=messaging.Aps(
-                                sound="default",
-                                badge=1,
-                                content_available=True,
-                            ),
-                        ),
-                    ),
-                )
-
-                response = messaging.send(message)
-                notification_count += 1
-                print(f"Sent notification to {participant_id}: {response}")
-
-            except Exception as e:
-                print(f"Failed to send notification to {participant_id}: {e}")
-                # Continue to next token even if one fails
-
-    print(f"Notification batch complete: {notification_count} notifications sent")
+    print(f"Notification batch complete: {notification_count} notifications sent")
 
 
 @firestore_fn.on_document_created(
-    document="conversations/{conversationId}/messages/{messageId}"
+    document="conversations/{conversationId}/messages/{messageId}",
+    **concurrency_options("send_message_notification", 20),
 )
+@traced("send_message_notification")
 def send_message_notification(
     event: firestore_fn.Event[firestore_fn.DocumentSnapshot | None],
 ) -> None:
@@ -964,12 +1421,371 @@ def send_message_notification(
 # Both direct and group messages trigger the same function above
 
 
+@tasks_fn.on_task_dispatched(**concurrency_options("flush_notification_bursts", 20))
+@traced("flush_notification_bursts")
+@deadline(60)
+def flush_notification_bursts(req: tasks_fn.CallableRequest) -> None:
+    """
+    Sends the trailing "N new messages" push for held notifications.
+
+    Enqueued by: _send_notification_for_message when a message is held
+    inside a recipient's coalescing window (NOTIFICATION_COALESCING=1)
+    Action: For each recipient that still has held messages, sends one
+    push summarizing them, under the conversation's collapse key
+
+    Note: Errors are logged but don't throw; held messages that were not
+    claimed are counted into the recipient's next push
+    """
+    try:
+        conversation_id = req.data.get("conversationId")
+        recipient_ids = req.data.get("recipientIds") or []
+        if not conversation_id or not recipient_ids:
+            print("Warning: flush task without conversationId or recipientIds, skipping")
+            return
+
+        db = firestore.client()
+        with span("coalesce") as coalesce_attrs:
+            claimed = notification_coalescing.claim_pending(db, conversation_id, recipient_ids)
+            coalesce_attrs["claimed"] = len(claimed)
+        if not claimed:
+            return
+
+        with span("conversation_lookup"):
+            token_index = conversation_tokens.get(db, conversation_id)
+        fcm_tokens = token_index.get("tokens", {}) if token_index is not None else None
+
+        # Recipients held for the same messages get the same push
+        pushes: dict[tuple[int, str], tuple[dict[str, Any], list[str]]] = {}
+        for recipient_id, count, notice in claimed:
+            key = (count, json.dumps(notice, sort_keys=True))
+            pushes.setdefault(key, (notice, []))[1].append(recipient_id)
+
+        notification_count = 0
+        with span("fanout") as fanout_attrs:
+            for (count, _), (notice, push_recipient_ids) in pushes.items():
+                notification_count += _notify_recipients(
+                    db,
+                    push_recipient_ids,
+                    notice.get("title", ""),
+                    notification_coalescing.summary_body(count, notice.get("text", "")),
+                    {**notice.get("data", {}), "messageCount": str(count)},
+                    notification_coalescing.collapse_key(conversation_id),
+                    fcm_tokens,
+                )
+            fanout_attrs["recipients"] = len(claimed)
+            fanout_attrs["sent"] = notification_count
+
+        increment("notifications.flushed", len(claimed))
+        print(f"Flushed held notifications for {len(claimed)}/{len(recipient_ids)} recipient(s) "
+              f"in {conversation_id}: {notification_count} sent")
+
+    except Exception as e:
+        # Log error but don't throw to avoid retry loops
+        print(f"Error flushing held notifications: {e}")
+
+
+@firestore_fn.on_document_written(
+    document="conversations/{conversationId}",
+    **concurrency_options("index_conversation_tokens", 40),
+)
+@traced("index_conversation_tokens")
+def index_conversation_tokens(
+    event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot | None]],
+) -> None:
+    """
+    Keeps a conversation's conversation_tokens entry in step with its participants.
+
+    Triggered by: Any write to conversations/{conversationId}
+    Action: Rebuilds the entry when the conversation is created or its
+    participants or name change; deletes it with the conversation.
+    Other updates (lastMessage, lastUpdatedAt, ...) are ignored. The
+    conversation's FCM topic subscriptions move with the entry, and groups
+    of FCM_TOPIC_MIN_PARTICIPANTS or more switch to topic delivery.
+
+    Note: Errors are logged but don't throw; check_conversation_tokens
+    repairs missed updates
+    """
+    try:
+        conversation_id = event.params["conversationId"]
+        before = event.data.before.to_dict() if event.data.before is not None else None
+        after = event.data.after.to_dict() if event.data.after is not None else None
+        db = firestore.client()
+
+        if after is None:
+            conversation_tokens.delete(db, conversation_id)
+            return
+
+        if before is not None and (
+            conversation_tokens.participant_ids(before) == conversation_tokens.participant_ids(after)
+            and before.get("name") == after.get("name")
+            and before.get("type") == after.get("type")
+        ):
+            return
+
+        with span("index"):
+            entry = conversation_tokens.build(db, conversation_id, after)
+        print(f"Indexed FCM tokens for {len(entry['participantIds'])} participant(s) of {conversation_id}"
+              f"{' (topic delivery)' if entry.get('topicDelivery') else ''}")
+
+    except Exception as e:
+        # Log error but don't throw to avoid retry loops
+        print(f"Error indexing conversation tokens: {e}")
+
+
+@firestore_fn.on_document_updated(
+    document="users/{userId}",
+    **concurrency_options("propagate_user_tokens", 40),
+)
+@traced("propagate_user_tokens")
+def propagate_user_tokens(
+    event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot | None]],
+) -> None:
+    """
+    Copies a user's FCM tokens into the token index of their conversations.
+
+    Triggered by: Update of users/{userId}
+    Action: When fcmTokens changed, updates the user's tokens in every
+    indexed conversation they participate in
+
+    Note: Errors are logged but don't throw; check_conversation_tokens
+    repairs missed updates
+    """
+    try:
+        user_id = event.params["userId"]
+        before = event.data.before.to_dict() if event.data.before is not None else None
+        after = event.data.after.to_dict() if event.data.after is not None else None
+        if conversation_tokens.user_tokens(before) == conversation_tokens.user_tokens(after):
+            return
+
+        db = firestore.client()
+        with span("index"):
+            updated = conversation_tokens.update_user(db, user_id, after)
+        print(f"Updated FCM tokens of {user_id} in {updated} conversation(s)")
+
+    except Exception as e:
+        # Log error but don't throw to avoid retry loops
+        print(f"Error propagating user tokens: {e}")
+
+
+@https_fn.on_request()
+@traced("check_conversation_tokens")
+def check_conversation_tokens(req: https_fn.Request) -> https_fn.Response:
+    """
+    Scheduled consistency check of the conversation_tokens index.
+
+    Recomputes every conversation's entry from the conversation and its
+    participants' users documents and rewrites entries that are missing or
+    differ; entries of deleted conversations are removed. Pass
+    ?dryRun=1 to only count the drift.
+
+    Should be triggered via Cloud Scheduler (e.g., daily).
+
+    Returns:
+        JSON: { checked, missing, stale, orphaned, repaired }
+    """
+    try:
+        db = firestore.client()
+        dry_run = req.args.get("dryRun") == "1"
+
+        with span("check"):
+            stats = conversation_tokens.check(db, repair=not dry_run)
+
+        print(f"Token index check: {stats['checked']} conversations, {stats['missing']} missing, "
+              f"{stats['stale']} stale, {stats['orphaned']} orphaned, {stats['repaired']} repaired")
+
+        return https_fn.Response(
+            response=json.dumps(stats),
+            status=200,
+            headers={"Content-Type": "application/json"}
+        )
+
+    except Exception as e:
+        print(f"Token index check failed: {e}")
+        return https_fn.Response(
+            response=json.dumps({"error": str(e)}),
+            status=500,
+            headers={"Content-Type": "application/json"}
+        )
+
+
+# ========== Delivery / Read Aggregates ==========
+
+
+def _schedule_status_rollup(conversation_id: str, message_id: str | None = None) -> None:
+    """Queue rollup_message_status for a message's counts or a conversation's unread counts."""
+    task_id, delay_seconds = message_status.rollup_task(conversation_id, message_id)
+    try:
+        functions.task_queue("rollup_message_status").enqueue(
+            {"conversationId": conversation_id, "messageId": message_id},
+            functions.TaskOptions(schedule_delay_seconds=max(1, int(delay_seconds + 0.999)), task_id=task_id),
+        )
+        increment("messageStatus.rollupsScheduled")
+    except firebase_exceptions.AlreadyExistsError:
+        pass  # This window's rollup is already queued
+    except Exception as e:
+        # The next event for the same document schedules another rollup
+        print(f"Failed to schedule status rollup for {conversation_id}/{message_id}: {e}")
+
+
+@firestore_fn.on_document_written(
+    document="conversations/{conversationId}/messages/{messageId}/status/{userId}",
+    **concurrency_options("aggregate_message_status", 80),
+)
+@traced("aggregate_message_status")
+def aggregate_message_status(
+    event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot | None]],
+) -> None:
+    """
+    Keeps a message's delivered/read counts and its readers' unread counts current.
+
+    Triggered by: Any write to conversations/{conversationId}/messages/{messageId}/status/{userId}
+    Action: Counts the status change in the message's sharded counter (and
+    the conversation's unread counter when the message was read), then
+    queues the rollup that writes deliveredCount/readCount to the message
+    and unreadCount to the conversation
+
+    Note: Errors are logged but don't throw to avoid retry loops
+    """
+    try:
+        conversation_id = event.params["conversationId"]
+        message_id = event.params["messageId"]
+        user_id = event.params["userId"]
+        before = event.data.before.to_dict() if event.data.before is not None else None
+        after = event.data.after.to_dict() if event.data.after is not None else None
+
+        increments = message_status.status_increments(before, after)
+        if not any(increments.values()):
+            return  # Timestamp refresh or a downgrade the app ignores
+
+        db = firestore.client()
+
+        # Step 1: The sender's own status does not count towards their message
+        with span("message_lookup"):
+            message = message_status.message_counter_ref(db, conversation_id, message_id).get()
+        if not message.exists or (message.to_dict() or {}).get("senderId") == user_id:
+            return
+
+        # Step 2: Count the change (blind shard writes, no contention)
+        with span("count"):
+            message_status.record_status(db, conversation_id, message_id, user_id, increments)
+
+        # Step 3: Roll the counts up onto the message (and the conversation's unread counts)
+        _schedule_status_rollup(conversation_id, message_id)
+        if increments["read"]:
+            _schedule_status_rollup(conversation_id)
+
+    except Exception as e:
+        # Log error but don't throw to avoid retry loops
+        print(f"Error aggregating message status: {e}")
+
+
+@firestore_fn.on_document_created(
+    document="conversations/{conversationId}/messages/{messageId}",
+    **concurrency_options("count_unread_message", 80),
+)
+@traced("count_unread_message")
+def count_unread_message(
+    event: firestore_fn.Event[firestore_fn.DocumentSnapshot | None],
+) -> None:
+    """
+    Counts a new message as unread for its recipients.
+
+    Triggered by: New document in conversations/{conversationId}/messages/
+    Action: Adds one to every recipient's unread counter (one sharded
+    counter write) and queues the rollup that writes unreadCount and
+    lastUpdatedAt to the conversation
+
+    Note: Errors are logged but don't throw to avoid retry loops
+    """
+    try:
+        if event.data is None:
+            print("Warning: Event data is None, skipping unread count")
+            return
+
+        message_data = event.data.to_dict()
+        if message_data is None:
+            print("Warning: Message data is None, skipping unread count")
+            return
+
+        conversation_id = event.params["conversationId"]
+        sender_id = message_data.get("senderId")
+        db = firestore.client()
+
+        # Step 1: Participants from the token index, else the conversation
+        with span("conversation_lookup"):
+            token_index = conversation_tokens.get(db, conversation_id)
+            if token_index is not None:
+                participant_ids = token_index.get("participantIds", [])
+            else:
+                conversation = db.collection("conversations").document(conversation_id).get()
+                participant_ids = conversation_tokens.participant_ids(conversation.to_dict() or {})
+
+        # Step 2: Count it unread for everyone but the sender
+        recipient_ids = [uid for uid in participant_ids if uid != sender_id]
+        if recipient_ids:
+            with span("count"):
+                message_status.record_message(db, conversation_id, recipient_ids)
+
+        _schedule_status_rollup(conversation_id)
+
+    except Exception as e:
+        # Log error but don't throw to avoid retry loops
+        print(f"Error counting unread message: {e}")
+
+
+@tasks_fn.on_task_dispatched(**concurrency_options("rollup_message_status", 40))
+@traced("rollup_message_status")
+@deadline(30)
+def rollup_message_status(req: tasks_fn.CallableRequest) -> None:
+    """
+    Writes rolled-up delivery/read aggregates from their sharded counters.
+
+    Enqueued by: aggregate_message_status and count_unread_message, at most
+    once per document and MESSAGE_STATUS_ROLLUP_SECONDS window
+    Action: With a messageId, writes the message's deliveredCount and
+    readCount; without, writes the conversation's unreadCount map and
+    lastUpdatedAt
+
+    Note: Errors are logged but don't throw; the next event for the same
+    document queues another rollup
+    """
+    try:
+        conversation_id = req.data.get("conversationId")
+        message_id = req.data.get("messageId")
+        if not conversation_id:
+            print("Warning: status rollup without conversationId, skipping")
+            return
+
+        db = firestore.client()
+        with span("rollup") as rollup_attrs:
+            if message_id:
+                written = message_status.rollup_message(db, conversation_id, message_id)
+            else:
+                written = message_status.rollup_conversation(db, conversation_id)
+            rollup_attrs["written"] = written is not None
+
+        if written is None:
+            print(f"Skipped status rollup for deleted {conversation_id}/{message_id or ''}")
+        elif message_id:
+            print(f"Rolled up {conversation_id}/{message_id}: "
+                  f"{written['deliveredCount']} delivered, {written['readCount']} read")
+        else:
+            print(f"Rolled up unread counts for {len(written['unreadCount'])} participant(s) of {conversation_id}")
+
+    except Exception as e:
+        # Log error but don't throw to avoid retry loops
+        print(f"Error rolling up message status: {e}")
+
+
 # ========== Automatic Embedding Generation ==========
 
 
 @firestore_fn.on_document_created(
-    document="conversations/{conversationId}/messages/{messageId}"
+    document="conversations/{conversationId}/messages/{messageId}",
+    **concurrency_options("generate_message_embedding", 40),
 )
+@traced("generate_message_embedding")
+@deadline(30)
 def generate_message_embedding(
     event: firestore_fn.Event[firestore_fn.DocumentSnapshot | None],
 ) -> None:
@@ -977,8 +1793,9 @@ def generate_message_embedding(
     Automatically generates embeddings for direct conversation messages.
 
     This trigger fires when a new message is created in a direct conversation.
-    It uses Vertex AI's textembedding-gecko model to generate a 768-dimensional
-    embedding vector and writes it back to the message document.
+    It embeds the message with every model in EMBEDDING_WRITE_MODELS (two
+    while a model migration is dual-writing) and writes each vector, tagged
+    with its model version, back to the message document.
 
     Benefits:
     - Zero phone involvement (server-side only)
@@ -987,7 +1804,7 @@ def generate_message_embedding(
     - Automatic indexing by Firestore vector search
 
     Triggered by: New document in conversations/{conversationId}/messages/
-    Action: Generate 768D embedding using Vertex AI and update document
+    Action: Generate embeddings using Vertex AI and update document
 
     Note: Works for both direct and group conversations (single collection architecture)
     """
@@ -1003,8 +1820,8 @@ def _generate_embedding_for_message(
     This function:
     1. Extracts the message text from the document
     2. Validates it's long enough (>= 5 chars)
-    3. Generates embedding using Vertex AI textembedding-gecko
-    4. Updates the message document with the embedding
+    3. Generates an embedding per write model using Vertex AI
+    4. Updates the message document with the embeddings and their model tags
 
     Args:
         event: Firestore document creation event
@@ -1021,50 +1838,913 @@ def _generate_embedding_for_message(
             print("Warning: Message data is None, skipping embedding generation")
             return
 
-        text = message_data.get('text', '')
-        message_id = event.data.id
+        text = message_data.get('text', '')
+        message_id = event.data.id
+
+        # Skip if text is too short
+        if len(text.strip()) < 5:
+            print(f"Skipping embedding for message {message_id}: text too short ({len(text)} chars)")
+            return
+
+        # Skip models the message already has a vector from (shouldn't happen, but defensive)
+        models = embedding_models.missing(message_data)
+        if not models:
+            print(f"Skipping embedding for message {message_id}: embedding already exists")
+            return
+
+        print(f"Generating embedding for message {message_id}: '{text[:50]}...'")
+
+        # Generate one embedding per write model (via REST API)
+        vectors = {}
+        for model in models:
+            try:
+                with circuit_breaker.guard("vertex"), span("upstream.vertex"):
+                    vectors[model] = deadlines.call(
+                        lambda timeout: generate_vertex_ai_embedding(text, timeout=timeout, model=model),
+                        name="vertex",
+                        idempotent=True,
+                    )
+            except Exception as e:
+                # Degraded: skip for now, retry_queued_embeddings adds the missing models later
+                print(f"Vertex AI unavailable ({e}) - queueing embedding for message {message_id}")
+                _queue_embedding(event.data.reference, str(e))
+                break
+
+        # Update message document with the embeddings that succeeded
+        if vectors:
+            with span("write_embedding"):
+                event.data.reference.update(embedding_models.update_fields(vectors))
+            print(f"Successfully generated embeddings for message {message_id}: "
+                  f"{', '.join(model.tag for model in vectors)}")
+
+    except Exception as e:
+        # Log error but don't throw to avoid retry loops
+        print(f"Error generating embedding for message: {e}")
+        import traceback
+        traceback.print_exc()
+
+
+# Messages whose embedding was skipped while Vertex AI was unavailable
+EMBEDDING_QUEUE_COLLECTION = "embedding_queue"
+
+# Give up on a queued message after this many failed retries
+EMBEDDING_QUEUE_MAX_ATTEMPTS = 5
+
+
+def _queue_embedding(message_ref: Any, reason: str) -> None:
+    """Record a message whose embedding should be generated later."""
+    db = firestore.client()
+    queue_id = message_ref.path.replace("/", "_")
+    db.collection(EMBEDDING_QUEUE_COLLECTION).document(queue_id).set({
+        "messagePath": message_ref.path,
+        "reason": reason[:500],
+        "attempts": 0,
+        "queuedAt": time.time(),
+    })
+
+
+@https_fn.on_request()
+@traced("retry_queued_embeddings")
+@deadline(50)
+def retry_queued_embeddings(req: https_fn.Request) -> https_fn.Response:
+    """
+    Scheduled function that generates embeddings skipped during Vertex AI outages.
+
+    Processes up to 200 queued messages, oldest first, and stops early while
+    the Vertex AI circuit breaker is open or once the run's deadline is reached. Entries are dropped after 5
+    failed attempts.
+
+    Should be triggered via Cloud Scheduler (e.g., every 10 minutes).
+
+    Returns:
+        JSON with stats: { embedded, failed, dropped, skipped, breakerOpen }
+    """
+    db = firestore.client()
+    embedded = failed = dropped = skipped = 0
+    breaker_open = False
+
+    queued = (
+        db.collection(EMBEDDING_QUEUE_COLLECTION)
+        .order_by("queuedAt")
+        .limit(200)
+        .stream()
+    )
+    for entry in queued:
+        entry_data = entry.to_dict() or {}
+        try:
+            message_ref = db.document(entry_data["messagePath"])
+            message_doc = message_ref.get()
+            message_data = message_doc.to_dict() if message_doc.exists else None
+            text = (message_data or {}).get("text", "")
+            models = embedding_models.missing(message_data) if message_data else []
+            if not models or len(text.strip()) < 5:
+                # Deleted, already embedded or too short - nothing left to do
+                entry.reference.delete()
+                skipped += 1
+                continue
+
+            vectors = {}
+            for model in models:
+                with circuit_breaker.guard("vertex"), span("upstream.vertex"):
+                    vectors[model] = deadlines.call(
+                        lambda timeout: generate_vertex_ai_embedding(text, timeout=timeout, model=model),
+                        name="vertex",
+                        idempotent=True,
+                    )
+            with span("write_embedding"):
+                message_ref.update(embedding_models.update_fields(vectors))
+            entry.reference.delete()
+            embedded += 1
+
+        except circuit_breaker.CircuitOpenError as e:
+            print(f"Stopping embedding retries: {e}")
+            breaker_open = True
+            break
+        except deadlines.DeadlineExceeded:
+            # Out of time for this run; the rest stays queued for the next one
+            print("Stopping embedding retries: run deadline reached")
+            break
+        except Exception as e:
+            attempts = entry_data.get("attempts", 0) + 1
+            if attempts >= EMBEDDING_QUEUE_MAX_ATTEMPTS:
+                print(f"Dropping queued embedding {entry.id} after {attempts} attempts: {e}")
+                entry.reference.delete()
+                dropped += 1
+            else:
+                entry.reference.update({"attempts": attempts, "reason": str(e)[:500]})
+                failed += 1
+
+    print(f"Embedding queue: embedded={embedded}, failed={failed}, dropped={dropped}, "
+          f"skipped={skipped}, breakerOpen={breaker_open}")
+
+    return https_fn.Response(
+        response=json.dumps({
+            "embedded": embedded,
+            "failed": failed,
+            "dropped": dropped,
+            "skipped": skipped,
+            "breakerOpen": breaker_open,
+        }),
+        status=200,
+        headers={"Content-Type": "application/json"}
+    )
+
+
+# Backfill progress per set of write models (see reembed_messages)
+EMBEDDING_MIGRATIONS_COLLECTION = "embedding_migrations"
+
+# Messages scanned per reembed_messages run
+REEMBED_BATCH_SIZE = 200
+
+# Vertex AI calls per second the backfill may make, leaving quota for live traffic
+REEMBED_MAX_PER_SECOND = float(os.environ.get("EMBEDDING_REEMBED_QPS", "5"))
+
+
+@https_fn.on_request()
+@traced("reembed_messages")
+@deadline(50)
+def reembed_messages(req: https_fn.Request) -> https_fn.Response:
+    """
+    Scheduled backfill that embeds message history with every write model.
+
+    Scans up to 200 messages per run in document order, resuming from the
+    cursor saved in embedding_migrations/{write model tags}, and embeds each
+    message with the EMBEDDING_WRITE_MODELS it has no vector from. Vertex AI
+    calls are paced to EMBEDDING_REEMBED_QPS; the run stops early while the
+    Vertex AI circuit breaker is open or once its deadline is near, and the
+    next run continues from the last message finished. When the scan reaches
+    the end, the migration is marked done and search can be switched to the
+    new model (EMBEDDING_READ_MODEL, see embedding_models.py).
+
+    Should be triggered via Cloud Scheduler (e.g., every 5 minutes) while a
+    migration is running.
+
+    Returns:
+        JSON with stats: { migration, scanned, embedded, skipped, failed,
+                           breakerOpen, done, totalEmbedded }
+    """
+    db = firestore.client()
+    models = embedding_models.WRITE_MODELS
+    migration_id = "+".join(sorted(model.tag for model in models))
+    migration_ref = db.collection(EMBEDDING_MIGRATIONS_COLLECTION).document(migration_id)
+    scanned = embedded = skipped = failed = 0
+    breaker_open = out_of_time = False
+
+    try:
+        migration = migration_ref.get()
+        state = (migration.to_dict() or {}) if migration.exists else {}
+        if state.get("done"):
+            print(f"Re-embedding {migration_id} already done")
+            return https_fn.Response(
+                response=json.dumps({"migration": migration_id, "done": True,
+                                     "totalEmbedded": state.get("embedded", 0)}),
+                status=200,
+                headers={"Content-Type": "application/json"}
+            )
+
+        # Step 1: Next page of message history, in document order
+        cursor = state.get("cursor")
+        query = db.collection_group("messages").order_by("__name__").limit(REEMBED_BATCH_SIZE)
+        if cursor:
+            query = query.start_after({"__name__": db.document(cursor)})
+
+        next_call_at = time.monotonic()
+        for message in query.stream():
+            message_data = message.to_dict() or {}
+            text = message_data.get("text", "")
+            missing_models = embedding_models.missing(message_data, models)
+            if not missing_models or len(text.strip()) < 5:
+                skipped += 1
+                scanned += 1
+                cursor = message.reference.path
+                continue
+
+            # Step 2: Embed with the missing models, paced to leave quota for live traffic
+            try:
+                vectors = {}
+                for model in missing_models:
+                    wait = next_call_at - time.monotonic()
+                    remaining = deadlines.remaining()
+                    if remaining is not None and remaining < max(wait, 0) + 5:
+                        raise deadlines.DeadlineExceeded("reembed_messages run deadline reached")
+                    if wait > 0:
+                        time.sleep(wait)
+                    next_call_at = time.monotonic() + 1 / REEMBED_MAX_PER_SECOND
+                    with circuit_breaker.guard("vertex"), span("upstream.vertex"):
+                        vectors[model] = deadlines.call(
+                            lambda timeout: generate_vertex_ai_embedding(text, timeout=timeout, model=model),
+                            name="vertex",
+                            idempotent=True,
+                        )
+                with span("write_embedding"):
+                    message.reference.update(embedding_models.update_fields(vectors))
+                embedded += 1
+            except circuit_breaker.CircuitOpenError as e:
+                print(f"Stopping re-embedding: {e}")
+                breaker_open = True
+                break
+            except deadlines.DeadlineExceeded:
+                # Out of time for this run; the next one resumes at this message
+                print("Stopping re-embedding: run deadline reached")
+                out_of_time = True
+                break
+            except Exception as e:
+                # retry_queued_embeddings adds the missing models later
+                print(f"Failed to re-embed {message.reference.path}: {e}")
+                _queue_embedding(message.reference, str(e))
+                failed += 1
+            scanned += 1
+            cursor = message.reference.path
+
+        # Step 3: Save progress; a short page with no early stop is the end of history
+        done = scanned < REEMBED_BATCH_SIZE and not (breaker_open or out_of_time)
+        migration_ref.set({
+            "models": [model.tag for model in models],
+            "cursor": cursor,
+            "embedded": firestore.Increment(embedded),
+            "failed": firestore.Increment(failed),
+            "done": done,
+            "updatedAt": time.time(),
+        }, merge=True)
+
+        print(f"Re-embedding {migration_id}: scanned={scanned}, embedded={embedded}, skipped={skipped}, "
+              f"failed={failed}, breakerOpen={breaker_open}, done={done}")
+
+        return https_fn.Response(
+            response=json.dumps({
+                "migration": migration_id,
+                "scanned": scanned,
+                "embedded": embedded,
+                "skipped": skipped,
+                "failed": failed,
+                "breakerOpen": breaker_open,
+                "done": done,
+                "totalEmbedded": state.get("embedded", 0) + embedded,
+            }),
+            status=200,
+            headers={"Content-Type": "application/json"}
+        )
+
+    except Exception as e:
+        print(f"Re-embedding failed: {e}")
+        return https_fn.Response(
+            response=json.dumps({"error": str(e)}),
+            status=500,
+            headers={"Content-Type": "application/json"}
+        )
+
+
+# ========== Rolling Conversation Context ==========
+
+
+@firestore_fn.on_document_created(
+    document="conversations/{conversationId}/messages/{messageId}",
+    secrets=[OPENAI_API_KEY],
+    **concurrency_options("update_conversation_context", 40),
+)
+@traced("update_conversation_context")
+@deadline(45)
+def update_conversation_context(
+    event: firestore_fn.Event[firestore_fn.DocumentSnapshot | None],
+) -> None:
+    """
+    Maintains the rolling context document used by smart replies.
+
+    Triggered by: New document in conversations/{conversationId}/messages/
+    Action: Appends the message to conversation_context/{conversationId}
+    (last 20 messages) and refreshes the conversation summary with
+    GPT-4o-mini every 15 messages.
+
+    Note: Errors are logged but don't throw to avoid retry loops
+    """
+    try:
+        if event.data is None:
+            print("Warning: Event data is None, skipping context update")
+            return
+
+        message_data = event.data.to_dict()
+        if message_data is None:
+            print("Warning: Message data is None, skipping context update")
+            return
+
+        conversation_id = event.params["conversationId"]
+        message_id = event.params["messageId"]
+        db = firestore.client()
+
+        # Step 1: Append the message (transaction; idempotent on redelivery)
+        with span("context_update") as context_attrs:
+            context, appended = conversation_context.record_message(db, conversation_id, message_id, message_data)
+            context_attrs["messages"] = len(context.get("recentMessages", []))
+
+        # A redelivered event leaves a claimed refresh to the first delivery
+        if not appended or not conversation_context.needs_summary(context, message_id):
+            return
+
+        # Step 2: Fold the recent messages into the running summary. Only the
+        # message that claimed the refresh gets here; if it fails the claim is
+        # released and the next message retries (messagesSinceSummary keeps counting)
+        try:
+            client = get_openai_client(OPENAI_API_KEY.value)
+            with circuit_breaker.guard("openai"), span("upstream.openai"):
+                response = deadlines.call(
+                    lambda timeout: client.with_options(timeout=timeout, max_retries=0).chat.completions.create(
+                        model="gpt-4o-mini",
+                        messages=[
+                            {
+                                "role": "system",
+                                "content": "You maintain short running summaries of chat conversations.",
+                            },
+                            {"role": "user", "content": conversation_context.summary_prompt(context)},
+                        ],
+                        temperature=0.3,
+                        max_tokens=200,
+                    ),
+                    name="openai",
+                )
+            summary = response.choices[0].message.content.strip()
+        except Exception:
+            conversation_context.release_summary_claim(db, conversation_id, message_id)
+            raise
+
+        # Step 3: Store it, subtracting only the claimed messages
+        with span("summary_write"):
+            saved = conversation_context.save_summary(db, conversation_id, message_id, summary)
+        if saved:
+            print(f"Refreshed conversation summary for {conversation_id} ({len(summary)} chars)")
+        else:
+            print(f"Summary refresh for {conversation_id} was taken over; discarded")
+
+    except Exception as e:
+        # Log error but don't throw to avoid retry loops
+        print(f"Error updating conversation context: {e}")
+
+
+# ========== Communication Style Profiles ==========
+
+
+@firestore_fn.on_document_created(
+    document="conversations/{conversationId}/messages/{messageId}",
+    **concurrency_options("update_communication_style", 80),
+)
+@traced("update_communication_style")
+def update_communication_style(
+    event: firestore_fn.Event[firestore_fn.DocumentSnapshot | None],
+) -> None:
+    """
+    Keeps the sender's communication style profile current.
+
+    Triggered by: New document in conversations/{conversationId}/messages/
+    Action: Adds the message to the sender's running style totals (one
+    sharded counter write) and about every 10 messages rebuilds
+    users/{senderId}.communicationStyle from the totals.
+
+    Note: Errors are logged but don't throw to avoid retry loops
+    """
+    try:
+        if event.data is None:
+            print("Warning: Event data is None, skipping style update")
+            return
+
+        message_data = event.data.to_dict()
+        if message_data is None:
+            print("Warning: Message data is None, skipping style update")
+            return
+
+        sender_id = message_data.get("senderId")
+        text = message_data.get("text", "")
+        if not sender_id or not text.strip():
+            return
+
+        db = firestore.client()
+
+        # Step 1: Count the message (blind write to one shard, no read); the
+        # casual/formal markers depend on the language
+        language = message_data.get("detectedLanguage") or language_detection.detect_confident(text)
+        with span("style_update"):
+            communication_style.record_message(db, sender_id, text, language)
+
+        # Step 2: Periodically materialize the profile read by smart replies
+        if communication_style.should_refresh(event.params["messageId"]):
+            with span("style_refresh") as refresh_attrs:
+                profile = communication_style.refresh_profile(db, sender_id)
+                refresh_attrs["written"] = profile is not None
+            if profile is not None:
+                print(f"Refreshed communication style for {sender_id}: {profile['styleDescription']}")
+
+    except Exception as e:
+        # Log error but don't throw to avoid retry loops
+        print(f"Error updating communication style: {e}")
+
+
+# ========== Language Detection ==========
+
+
+@firestore_fn.on_document_created(
+    document="conversations/{conversationId}/messages/{messageId}",
+    **concurrency_options("detect_message_language", 80),
+)
+@traced("detect_message_language")
+@deadline(20)
+def detect_message_language(
+    event: firestore_fn.Event[firestore_fn.DocumentSnapshot | None],
+) -> None:
+    """
+    Stores the language of new messages as detectedLanguage.
+
+    Triggered by: New document in conversations/{conversationId}/messages/
+    Action: Detects the language with the local detector (see
+    language_detection.py) and only calls the Translation API when the
+    local result is not reliable. Messages the app already tagged
+    are left alone; without a reliable result the field stays unset.
+
+    Note: Errors are logged but don't throw to avoid retry loops
+    """
+    try:
+        if event.data is None:
+            print("Warning: Event data is None, skipping language detection")
+            return
+
+        message_data = event.data.to_dict()
+        if message_data is None:
+            print("Warning: Message data is None, skipping language detection")
+            return
+
+        text = message_data.get("text", "")
+        if message_data.get("detectedLanguage") or not any(char.isalpha() for char in text):
+            return
+
+        # Step 1: Local detection
+        with span("language_detection") as detection_attrs:
+            detection = language_detection.detect(text)
+            detection_attrs["confidence"] = round(detection.confidence, 3)
+        # The app's auto-translation uses detectedLanguage as the source
+        # language, so an unreliable local guess is never stored
+        language = detection.language if language_detection.is_reliable(detection) else None
+        confidence = detection.confidence
+        source = "local"
+
+        # Step 2: Fall back to the Translation API for unreliable results
+        if language is None:
+            try:
+                with circuit_breaker.guard("translate"), span("upstream.translate"):
+                    result = deadlines.call(
+                        lambda _timeout: get_translate_client().detect_language(text),
+                        name="translate",
+                        idempotent=True,
+                    )
+            except circuit_breaker.CircuitOpenError as e:
+                # Degraded: leave the message untagged rather than guess
+                print(f"Skipping language detection API: {e}")
+                result = {}
+            if result.get("language") and result["language"] != "und":
+                language = result["language"]
+                confidence = float(result.get("confidence", 0.0))
+                source = "api"
+
+        if language is None:
+            print(f"Could not detect language for message {event.params['messageId']}")
+            return
+
+        # Step 3: Store the result on the message
+        event.data.reference.update({
+            "detectedLanguage": language,
+            "detectedLanguageConfidence": round(confidence, 3),
+            "languageDetectionSource": source,
+        })
+        print(f"Detected language {language} ({source}) for message {event.params['messageId']}")
+
+    except Exception as e:
+        # Log error but don't throw to avoid retry loops
+        print(f"Error detecting message language: {e}")
+
+
+# ========== Smart Replies ==========
+
+# Add vector search results to the rolling context on every request (costs an
+# embedding call and a find_nearest query per cache miss)
+SMART_REPLY_VECTOR_SEARCH = os.environ.get("SMART_REPLY_VECTOR_SEARCH", "0") == "1"
+
+# Precompute suggestions for recipients when a message arrives (see
+# precompute_smart_replies), so that opening the chat is a cache hit
+SMART_REPLY_PRECOMPUTE = os.environ.get("SMART_REPLY_PRECOMPUTE", "0") == "1"
+
+# Only direct conversations and small groups are precomputed
+SMART_REPLY_PRECOMPUTE_MAX_RECIPIENTS = 4
+
+# Speculative generations per recipient per hour; beyond this, suggestions
+# are generated on demand as before
+SMART_REPLY_PRECOMPUTE_BUDGET = 20
+
+
+# Generic suggestions used when the model output is unusable or OpenAI is unavailable
+FALLBACK_SMART_REPLIES = [
+    {"text": "Thanks!", "intent": "positive"},
+    {"text": "Got it", "intent": "neutral"},
+    {"text": "Can you clarify?", "intent": "question"},
+]
+
+
+def _find_relevant_messages(db: Any, conversation_id: str, text: str) -> list[dict[str, Any]]:
+    """
+    Find messages semantically related to `text` with Vertex AI + find_nearest().
+
+    Args:
+        db: Firestore client
+        conversation_id: Conversation to search
+        text: Text to embed as the query
+
+    Returns:
+        Up to 10 messages as dicts with text, senderId and timestamp; empty
+        if Vertex AI is unavailable (replies then use the rolling context only)
+    """
+    # Generate embedding for incoming message using Vertex AI (via REST API)
+    try:
+        with circuit_breaker.guard("vertex"), span("upstream.vertex"):
+            query_embedding = deadlines.call(
+                lambda timeout: generate_vertex_ai_embedding(text, timeout=timeout),
+                name="vertex",
+                idempotent=True,
+                hedge=True,
+            )
+    except Exception as e:
+        print(f"Vertex AI unavailable ({e}) - skipping semantic context")
+        return []
+
+    # Perform vector search using find_nearest()
+    # Single collection architecture - all conversations in 'conversations' collection
+    with span("upstream.vector_search") as search_attrs:
+        messages_ref = db.collection('conversations').document(conversation_id).collection('messages')
+
+        # Perform vector search (find_nearest requires firestore-admin SDK)
+        from google.cloud.firestore_v1.base_vector_query import DistanceMeasure
+
+        vector_query = messages_ref.find_nearest(
+            vector_field=embedding_models.READ_MODEL.field,
+            query_vector=query_embedding,
+            distance_measure=DistanceMeasure.COSINE,
+            limit=10  # Get top 10 most relevant messages
+        )
+
+        search_results = vector_query.stream()
+        relevant_messages = []
+        for doc in search_results:
+            msg_data = doc.to_dict()
+            relevant_messages.append({
+                'text': msg_data.get('text', ''),
+                'senderId': msg_data.get('senderId', ''),
+                'timestamp': msg_data.get('timestamp', ''),
+            })
+
+        search_attrs["results"] = len(relevant_messages)
+
+    return relevant_messages
+
+
+async def _find_relevant_messages_async(adb: Any, conversation_id: str, text: str) -> list[dict[str, Any]]:
+    """_find_relevant_messages() on the async path (adb is the async Firestore client)."""
+    try:
+        with circuit_breaker.guard("vertex"), span("upstream.vertex"):
+            query_embedding = await deadlines.call_async(
+                lambda timeout: generate_vertex_ai_embedding_async(text, timeout=timeout),
+                name="vertex",
+                idempotent=True,
+                hedge=True,
+            )
+    except Exception as e:
+        print(f"Vertex AI unavailable ({e}) - skipping semantic context")
+        return []
+
+    with span("upstream.vector_search") as search_attrs:
+        from google.cloud.firestore_v1.base_vector_query import DistanceMeasure
+
+        vector_query = adb.collection('conversations').document(conversation_id).collection('messages').find_nearest(
+            vector_field=embedding_models.READ_MODEL.field,
+            query_vector=query_embedding,
+            distance_measure=DistanceMeasure.COSINE,
+            limit=10
+        )
+        relevant_messages = []
+        async for doc in vector_query.stream():
+            msg_data = doc.to_dict()
+            relevant_messages.append({
+                'text': msg_data.get('text', ''),
+                'senderId': msg_data.get('senderId', ''),
+                'timestamp': msg_data.get('timestamp', ''),
+            })
+
+        search_attrs["results"] = len(relevant_messages)
+
+    return relevant_messages
+
+
+def _smart_reply_cache_ref(db: Any, conversation_id: str, incoming_message_text: str, user_id: str) -> Any:
+    """smart_reply_cache document for a message and the user replying to it."""
+    return cache_store.SMART_REPLIES.document(db, conversation_id, incoming_message_text, user_id)
+
+
+def _generate_smart_replies(
+    db: Any,
+    conversation_id: str,
+    incoming_message_text: str,
+    user_id: str,
+) -> list[dict[str, str]] | None:
+    """
+    Run the smart reply RAG pipeline for one message and one recipient.
+
+    Args:
+        db: Firestore client
+        conversation_id: Conversation the message belongs to
+        incoming_message_text: The message to generate replies for
+        user_id: The user the replies are for (their communication style is used)
+
+    Returns:
+        Three suggestions (the generic fallback ones if the model output is
+        unusable), or None if OpenAI is unavailable
+    """
+    # Step 1: Read the rolling conversation context (single document read)
+    with span("context_lookup") as context_attrs:
+        rolling_context = conversation_context.get_context(db, conversation_id, timeout=deadlines.timeout())
+        recent_lines = conversation_context.prompt_lines(rolling_context)
+        conversation_summary = (rolling_context or {}).get("summary")
+        context_attrs["messages"] = len(recent_lines)
+        context_attrs["hasSummary"] = bool(conversation_summary)
+
+    # Step 2: Optional semantic enrichment - embedding + vector search.
+    # Always used for conversations without a rolling context yet.
+    relevant_messages = []
+    if SMART_REPLY_VECTOR_SEARCH or not recent_lines:
+        relevant_messages = _find_relevant_messages(db, conversation_id, incoming_message_text)
+
+    # Step 3: Fetch user communication style from Firestore
+    with span("style_lookup"):
+        user_ref = db.collection('users').document(user_id)
+        user_style = _smart_reply_user_style(user_ref.get(timeout=deadlines.timeout()))
+
+    # Step 4: Generate smart replies with GPT-4o-mini
+    completion_args = _smart_reply_completion_args(
+        incoming_message_text, recent_lines, conversation_summary, relevant_messages, user_style
+    )
+
+    # Get OpenAI client
+    client = get_openai_client(OPENAI_API_KEY.value)
+
+    # Call OpenAI API (GPT-4o-mini); fails fast while the breaker is open
+    try:
+        with circuit_breaker.guard("openai"), span("upstream.openai"):
+            response = deadlines.call(
+                lambda timeout: client.with_options(timeout=timeout, max_retries=0).chat.completions.create(
+                    **completion_args
+                ),
+                name="openai",
+            )
+    except Exception as e:
+        print(f"OpenAI unavailable ({e}) - no smart replies generated")
+        return None
+
+    return _parse_smart_replies(response.choices[0].message.content.strip())
+
+
+async def _generate_smart_replies_async(
+    conversation_id: str,
+    incoming_message_text: str,
+    user_id: str,
+) -> list[dict[str, str]] | None:
+    """
+    _generate_smart_replies() on the async path.
+
+    The rolling context and style reads (and, with SMART_REPLY_VECTOR_SEARCH,
+    the embedding and vector search) are issued together, so the pipeline
+    waits for the slowest of them instead of their sum.
+    """
+    adb = async_core.firestore()
+    timeout = deadlines.timeout()
+
+    async def read_context() -> Any:
+        with span("context_lookup") as context_attrs:
+            snapshot = await adb.collection(conversation_context.CONTEXT_COLLECTION).document(
+                conversation_id).get(timeout=timeout)
+            rolling_context = snapshot.to_dict() if snapshot.exists else None
+            context_attrs["messages"] = len(conversation_context.prompt_lines(rolling_context))
+            context_attrs["hasSummary"] = bool((rolling_context or {}).get("summary"))
+            return rolling_context
+
+    async def read_style() -> dict[str, str]:
+        with span("style_lookup"):
+            user_doc = await adb.collection('users').document(user_id).get(timeout=timeout)
+            return _smart_reply_user_style(user_doc)
+
+    stages = [read_context(), read_style()]
+    if SMART_REPLY_VECTOR_SEARCH:
+        stages.append(_find_relevant_messages_async(adb, conversation_id, incoming_message_text))
+    rolling_context, user_style, *searched = await asyncio.gather(*stages)
+
+    recent_lines = conversation_context.prompt_lines(rolling_context)
+    conversation_summary = (rolling_context or {}).get("summary")
+    relevant_messages = searched[0] if searched else []
+    if not recent_lines and not SMART_REPLY_VECTOR_SEARCH:
+        # No rolling context yet: semantic context is all there is
+        relevant_messages = await _find_relevant_messages_async(adb, conversation_id, incoming_message_text)
+
+    completion_args = _smart_reply_completion_args(
+        incoming_message_text, recent_lines, conversation_summary, relevant_messages, user_style
+    )
+    client = async_core.openai_client(OPENAI_API_KEY.value)
+    try:
+        with circuit_breaker.guard("openai"), span("upstream.openai"):
+            response = await deadlines.call_async(
+                lambda timeout: client.with_options(timeout=timeout, max_retries=0).chat.completions.create(
+                    **completion_args
+                ),
+                name="openai",
+            )
+    except Exception as e:
+        print(f"OpenAI unavailable ({e}) - no smart replies generated")
+        return None
+
+    return _parse_smart_replies(response.choices[0].message.content.strip())
+
+
+def _smart_reply_user_style(user_doc: Any) -> dict[str, str]:
+    """Prompt style fields from a users/{uid} snapshot (neutral defaults if unset)."""
+    # Default style if user doc doesn't exist
+    user_style = {
+        'styleDescription': 'neutral, conversational',
+        'averageMessageLength': '50',
+        'emojiUsageRate': '10%',
+        'casualityScore': '0.5',
+    }
+
+    if user_doc.exists:
+        user_data = user_doc.to_dict()
+        communication_style = user_data.get('communicationStyle', {})
+        if communication_style:
+            user_style = {
+                'styleDescription': communication_style.get('styleDescription', user_style['styleDescription']),
+                'averageMessageLength': str(communication_style.get('averageMessageLength', 50)),
+                'emojiUsageRate': f"{int(communication_style.get('emojiUsageRate', 0.1) * 100)}%",
+                'casualityScore': str(communication_style.get('casualityScore', 0.5)),
+            }
+    return user_style
+
+
+def _smart_reply_completion_args(
+    incoming_message_text: str,
+    recent_lines: list[str],
+    conversation_summary: str | None,
+    relevant_messages: list[dict[str, Any]],
+    user_style: dict[str, str],
+) -> dict[str, Any]:
+    """chat.completions.create() arguments for the smart reply prompt."""
+    # Build context messages string: recent messages, then related older ones
+    context_messages = list(recent_lines)
+    for msg in relevant_messages[:5]:  # Limit to top 5 for prompt size
+        sender_id = msg.get("senderId", "Unknown")
+        text = msg.get("text", "")
+        line = f"User {sender_id[-4:]}: {text}"
+        if line not in context_messages:
+            context_messages.append(line)
+    context_str = "\n".join(context_messages) if context_messages else "(No recent context available)"
+    summary_str = f"Conversation summary:\n{conversation_summary}\n\n" if conversation_summary else ""
+
+    # Build user style string
+    style_description = user_style.get("styleDescription", "neutral, conversational")
+    avg_length = user_style.get("averageMessageLength", "50")
+    emoji_rate = user_style.get("emojiUsageRate", "10%")
+    casualty = user_style.get("casualityScore", "0.5")
+
+    # Construct the prompt for GPT-4o-mini
+    system_prompt = (
+        "You are an AI assistant that generates smart reply suggestions. "
+        "Create 3 brief reply suggestions (<50 chars each) that match the user's communication style. "
+        "Each reply should have a different intent: positive (affirmative/friendly), "
+        "neutral (balanced/informational), and question (follow-up/clarification). "
+        "Always return valid JSON in the exact format specified."
+    )
+
+    user_prompt = f"""Generate 3 smart reply suggestions for this incoming message.
+
+Incoming message: "{incoming_message_text}"
+
+{summary_str}Recent conversation context:
+{context_str}
+
+User's communication style:
+- Description: {style_description}
+- Average message length: {avg_length} chars
+- Emoji usage rate: {emoji_rate}
+- Casualty score: {casualty} (0=formal, 1=casual)
+
+Requirements:
+- Each reply must be <50 characters
+- Match the user's style (emoji usage, casualty, message length)
+- Provide 3 different intents: positive, neutral, question
+- Be contextually relevant to the incoming message
+- Sound natural and conversational
+
+Return JSON in this exact format:
+{{
+  "suggestions": [
+{{"text": "positive reply here", "intent": "positive"}},
+{{"text": "neutral reply here", "intent": "neutral"}},
+{{"text": "question reply here", "intent": "question"}}
+  ]
+}}
 
-        # Skip if text is too short
-        if len(text.strip()) < 5:
-            print(f"Skipping embedding for message {message_id}: text too short ({len(text)} chars)")
-            return
+Only return the JSON, no additional text."""
 
-        # Skip if embedding already exists (shouldn't happen, but defensive)
-        if 'embedding' in message_data and message_data['embedding']:
-            print(f"Skipping embedding for message {message_id}: embedding already exists")
-            return
+    return {
+        "model": "gpt-4o-mini",
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ],
+        "temperature": 0.7,
+        "max_tokens": 300,
+        "response_format": {"type": "json_object"},
+    }
 
-        print(f"Generating embedding for message {message_id}: '{text[:50]}...'")
-        start_time = time.time()
 
-        # Generate embedding using Vertex AI textembedding-gecko (via REST API)
-        # This model produces 768-dimensional vectors
-        embedding_vector = generate_vertex_ai_embedding(text)
+def _parse_smart_replies(response_text: str) -> list[dict[str, str]]:
+    """Validated suggestions from the model output, or the generic fallback ones."""
+    # Parse JSON response
+    try:
+        result = json.loads(response_text)
+        suggestions = result.get("suggestions", [])
 
-        # Update message document with embedding
-        event.data.reference.update({'embedding': embedding_vector})
+        # Validate suggestions
+        if not suggestions or len(suggestions) != 3:
+            raise ValueError(f"Expected 3 suggestions, got {len(suggestions)}")
 
-        elapsed_ms = (time.time() - start_time) * 1000
-        print(f"Successfully generated 768D embedding for message {message_id} in {elapsed_ms:.0f}ms")
+        # Validate each suggestion
+        for suggestion in suggestions:
+            if "text" not in suggestion or "intent" not in suggestion:
+                raise ValueError("Each suggestion must have 'text' and 'intent' fields")
+            if suggestion["intent"] not in ["positive", "neutral", "question"]:
+                raise ValueError(f"Invalid intent: {suggestion['intent']}")
 
-    except Exception as e:
-        # Log error but don't throw to avoid retry loops
-        print(f"Error generating embedding for message: {e}")
-        import traceback
-        traceback.print_exc()
+    except (json.JSONDecodeError, ValueError) as e:
+        print(f"Failed to parse or validate JSON response: {e}")
+        print(f"Response was: {response_text}")
 
+        # Return fallback suggestions
+        suggestions = list(FALLBACK_SMART_REPLIES)
 
-# ========== Smart Replies ==========
+    return suggestions
 
 
-@https_fn.on_call(secrets=[OPENAI_API_KEY])
+@https_fn.on_call(secrets=[OPENAI_API_KEY], **concurrency_options("generate_smart_replies_complete", 40))
+@traced("generate_smart_replies_complete")
+@deadline(8)
 def generate_smart_replies_complete(req: https_fn.CallableRequest) -> dict[str, Any]:
     """
     Unified smart reply generation with complete RAG pipeline server-side.
 
     This function implements the entire Smart Replies RAG pipeline in one call:
-    1. Generates embedding for incoming message using Vertex AI (768D)
-    2. Performs vector search using Firestore find_nearest()
+    1. Reads the rolling conversation context (recent messages + summary),
+       maintained at ingest by update_conversation_context
+    2. Optionally enriches it with a vector search (Vertex AI embedding +
+       Firestore find_nearest()) when SMART_REPLY_VECTOR_SEARCH=1, or when
+       the conversation has no rolling context yet
     3. Fetches user communication style from Firestore
     4. Generates 3 reply suggestions with GPT-4o-mini
 
@@ -1091,49 +2771,53 @@ def generate_smart_replies_complete(req: https_fn.CallableRequest) -> dict[str,
     Raises:
         https_fn.HttpsError: If validation fails or generation errors occur
 
-    Performance: Target <2 seconds response time (embedding + search + LLM)
-    Cost: ~$0.001 embedding + ~$0.0001 GPT-4o-mini = ~$0.0011 per request
+    With SMART_REPLY_PRECOMPUTE=1, precompute_smart_replies usually fills the
+    cache when the message arrives, so this is a cache hit.
+
+    Performance: Target <2 seconds response time (one context read + LLM)
+    Cost: ~$0.0001 GPT-4o-mini per request (+ ~$0.001 embedding with vector search)
     """
     start_time = time.time()
 
     # Validate authentication
-    if req.auth is None:
-        raise https_fn.HttpsError(
-            code=https_fn.FunctionsErrorCode.UNAUTHENTICATED,
-            message="User must be authenticated to generate smart replies"
-        )
+    with span("validation"):
+        if req.auth is None:
+            raise https_fn.HttpsError(
+                code=https_fn.FunctionsErrorCode.UNAUTHENTICATED,
+                message="User must be authenticated to generate smart replies"
+            )
 
-    # Extract and validate request data
-    data = req.data
+        # Extract and validate request data
+        data = req.data
 
-    if not isinstance(data, dict):
-        raise https_fn.HttpsError(
-            code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
-            message="Request data must be a dictionary"
-        )
+        if not isinstance(data, dict):
+            raise https_fn.HttpsError(
+                code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+                message="Request data must be a dictionary"
+            )
 
-    conversation_id = data.get("conversationId")
-    incoming_message_text = data.get("incomingMessageText")
-    user_id = data.get("userId")
+        conversation_id = data.get("conversationId")
+        incoming_message_text = data.get("incomingMessageText")
+        user_id = data.get("userId")
 
-    # Validate required fields
-    if not conversation_id or not isinstance(conversation_id, str):
-        raise https_fn.HttpsError(
-            code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
-            message="'conversationId' field is required and must be a string"
-        )
+        # Validate required fields
+        if not conversation_id or not isinstance(conversation_id, str):
+            raise https_fn.HttpsError(
+                code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+                message="'conversationId' field is required and must be a string"
+            )
 
-    if not incoming_message_text or not isinstance(incoming_message_text, str):
-        raise https_fn.HttpsError(
-            code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
-            message="'incomingMessageText' field is required and must be a string"
-        )
+        if not incoming_message_text or not isinstance(incoming_message_text, str):
+            raise https_fn.HttpsError(
+                code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+                message="'incomingMessageText' field is required and must be a string"
+            )
 
-    if not user_id or not isinstance(user_id, str):
-        raise https_fn.HttpsError(
-            code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
-            message="'userId' field is required and must be a string"
-        )
+        if not user_id or not isinstance(user_id, str):
+            raise https_fn.HttpsError(
+                code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+                message="'userId' field is required and must be a string"
+            )
 
     # Log smart reply request
     print(f"Smart reply complete request: '{incoming_message_text[:50]}...' in conversation {conversation_id}")
@@ -1142,250 +2826,62 @@ def generate_smart_replies_complete(req: https_fn.CallableRequest) -> dict[str,
         db = firestore.client()
 
         # Step 0: Rate limiting (50 requests per hour per user)
-        current_hour = int(time.time() // 3600)
-        rate_limit_key = f"{user_id}_{current_hour}"
-        rate_limit_ref = db.collection("smart_reply_rate_limits").document(rate_limit_key)
-        rate_limit_doc = rate_limit_ref.get()
-
-        request_count = 0
-        if rate_limit_doc.exists:
-            rate_limit_data = rate_limit_doc.to_dict()
-            request_count = rate_limit_data.get("count", 0)
-
-        RATE_LIMIT = 50
-        if request_count >= RATE_LIMIT:
-            next_hour = (current_hour + 1) * 3600
-            reset_seconds = next_hour - time.time()
-            print(f"Rate limit exceeded for user {user_id}: {request_count}/{RATE_LIMIT}")
-            raise https_fn.HttpsError(
-                code=https_fn.FunctionsErrorCode.RESOURCE_EXHAUSTED,
-                message=f"Smart reply rate limit exceeded. Limit: {RATE_LIMIT} requests per hour. "
-                       f"Try again in {int(reset_seconds/60)} minutes."
-            )
-
-        # Increment request count
-        rate_limit_ref.set({
-            "userId": user_id,
-            "hourWindow": current_hour,
-            "count": request_count + 1,
-            "lastRequest": time.time(),
-        })
+        with span("rate_limit"):
+            current_hour = int(time.time() // 3600)
+
+            RATE_LIMIT = 50
+            request_count = rate_limit.consume(db, "smart_reply_rate_limits", user_id, current_hour, RATE_LIMIT)
+            if request_count >= RATE_LIMIT:
+                next_hour = (current_hour + 1) * 3600
+                reset_seconds = next_hour - time.time()
+                print(f"Rate limit exceeded for user {user_id}: {request_count}/{RATE_LIMIT}")
+                raise https_fn.HttpsError(
+                    code=https_fn.FunctionsErrorCode.RESOURCE_EXHAUSTED,
+                    message=f"Smart reply rate limit exceeded. Limit: {RATE_LIMIT} requests per hour. "
+                           f"Try again in {int(reset_seconds/60)} minutes."
+                )
 
-        print(f"Rate limit check passed: {request_count + 1}/{RATE_LIMIT} requests")
+            print(f"Rate limit check passed: {request_count + 1}/{RATE_LIMIT} requests")
 
         # Step 1: Check cache first (7-day TTL)
-        import hashlib
-        import json
-
-        # Create cache key from incoming message text and conversation ID
-        cache_key_data = f"{conversation_id}_{incoming_message_text}_{user_id}"
-        cache_key_hash = hashlib.sha256(cache_key_data.encode('utf-8')).hexdigest()
-        cache_collection = db.collection("smart_reply_cache")
-        cache_ref = cache_collection.document(cache_key_hash)
-        cache_doc = cache_ref.get()
-
-        # Check if cache entry exists and is not expired (7 days = 604800 seconds)
-        if cache_doc.exists:
-            cache_data = cache_doc.to_dict()
-            timestamp = cache_data.get("timestamp")
-
-            if timestamp:
-                age_seconds = time.time() - timestamp
-                if age_seconds < 604800:  # 7 days
-                    elapsed_time = (time.time() - start_time) * 1000
-                    print(f"Smart reply cache HIT in {elapsed_time:.0f}ms (age: {age_seconds/86400:.1f} days)")
-                    return {
-                        "suggestions": cache_data["suggestions"],
-                        "cached": True,
-                        "latency": elapsed_time,
-                    }
+        cache_ref = _smart_reply_cache_ref(db, conversation_id, incoming_message_text, user_id)
+        cache_entry = cache_store.SMART_REPLIES.get(cache_ref, timeout=deadlines.timeout())
+        if cache_entry is not None and cache_entry.fresh:
+            if cache_entry.value.get("precomputed"):
+                increment("smart_replies.precomputedHits")
+            return {
+                "suggestions": cache_entry.value["suggestions"],
+                "cached": True,
+                "latency": (time.time() - start_time) * 1000,
+            }
 
         # Step 2: Cache miss - run full RAG pipeline
         print("Smart reply cache MISS - running full RAG pipeline")
 
-        # Step 2a: Generate embedding for incoming message using Vertex AI (via REST API)
-        embedding_start = time.time()
-        query_embedding = generate_vertex_ai_embedding(incoming_message_text)
-        embedding_ms = (time.time() - embedding_start) * 1000
-        print(f"Generated 768D embedding in {embedding_ms:.0f}ms")
-
-        # Step 2b: Perform vector search using find_nearest()
-        # Single collection architecture - all conversations in 'conversations' collection
-        search_start = time.time()
-        messages_ref = db.collection('conversations').document(conversation_id).collection('messages')
-
-        # Perform vector search (find_nearest requires firestore-admin SDK)
-        from google.cloud.firestore_v1.base_vector_query import DistanceMeasure
-
-        vector_query = messages_ref.find_nearest(
-            vector_field='embedding',
-            query_vector=query_embedding,
-            distance_measure=DistanceMeasure.COSINE,
-            limit=10  # Get top 10 most relevant messages
-        )
-
-        search_results = vector_query.stream()
-        relevant_messages = []
-        for doc in search_results:
-            msg_data = doc.to_dict()
-            relevant_messages.append({
-                'text': msg_data.get('text', ''),
-                'senderId': msg_data.get('senderId', ''),
-                'timestamp': msg_data.get('timestamp', ''),
-            })
-
-        search_ms = (time.time() - search_start) * 1000
-        print(f"Vector search completed in {search_ms:.0f}ms, found {len(relevant_messages)} results")
-
-        # Step 2c: Fetch user communication style from Firestore
-        style_start = time.time()
-        user_ref = db.collection('users').document(user_id)
-        user_doc = user_ref.get()
-
-        # Default style if user doc doesn't exist
-        user_style = {
-            'styleDescription': 'neutral, conversational',
-            'averageMessageLength': '50',
-            'emojiUsageRate': '10%',
-            'casualityScore': '0.5',
-        }
-
-        if user_doc.exists:
-            user_data = user_doc.to_dict()
-            communication_style = user_data.get('communicationStyle', {})
-            if communication_style:
-                user_style = {
-                    'styleDescription': communication_style.get('styleDescription', user_style['styleDescription']),
-                    'averageMessageLength': str(communication_style.get('averageMessageLength', 50)),
-                    'emojiUsageRate': f"{int(communication_style.get('emojiUsageRate', 0.1) * 100)}%",
-                    'casualityScore': str(communication_style.get('casualityScore', 0.5)),
-                }
-
-        style_ms = (time.time() - style_start) * 1000
-        print(f"Fetched user style in {style_ms:.0f}ms")
-
-        # Step 2d: Generate smart replies with GPT-4o-mini
-        llm_start = time.time()
-
-        # Build context messages string
-        context_str = ""
-        if relevant_messages:
-            context_messages = []
-            for msg in relevant_messages[:5]:  # Limit to top 5 for prompt size
-                sender_id = msg.get("senderId", "Unknown")
-                text = msg.get("text", "")
-                context_messages.append(f"User {sender_id[-4:]}: {text}")
-            context_str = "\n".join(context_messages)
+        if ASYNC_HANDLERS:
+            suggestions = async_core.run(
+                _generate_smart_replies_async(conversation_id, incoming_message_text, user_id)
+            )
         else:
-            context_str = "(No recent context available)"
-
-        # Build user style string
-        style_description = user_style.get("styleDescription", "neutral, conversational")
-        avg_length = user_style.get("averageMessageLength", "50")
-        emoji_rate = user_style.get("emojiUsageRate", "10%")
-        casualty = user_style.get("casualityScore", "0.5")
-
-        # Construct the prompt for GPT-4o-mini
-        system_prompt = (
-            "You are an AI assistant that generates smart reply suggestions. "
-            "Create 3 brief reply suggestions (<50 chars each) that match the user's communication style. "
-            "Each reply should have a different intent: positive (affirmative/friendly), "
-            "neutral (balanced/informational), and question (follow-up/clarification). "
-            "Always return valid JSON in the exact format specified."
-        )
-
-        user_prompt = f"""Generate 3 smart reply suggestions for this incoming message.
-
-Incoming message: "{incoming_message_text}"
-
-Recent conversation context:
-{context_str}
-
-User's communication style:
-- Description: {style_description}
-- Average message length: {avg_length} chars
-- Emoji usage rate: {emoji_rate}
-- Casualty score: {casualty} (0=formal, 1=casual)
-
-Requirements:
-- Each reply must be <50 characters
-- Match the user's style (emoji usage, casualty, message length)
-- Provide 3 different intents: positive, neutral, question
-- Be contextually relevant to the incoming message
-- Sound natural and conversational
-
-Return JSON in this exact format:
-{{
-  "suggestions": [
-    {{"text": "positive reply here", "intent": "positive"}},
-    {{"text": "neutral reply here", "intent": "neutral"}},
-    {{"text": "question reply here", "intent": "question"}}
-  ]
-}}
-
-Only return the JSON, no additional text."""
-
-        # Get OpenAI client
-        client = get_openai_client(OPENAI_API_KEY.value)
-
-        # Call OpenAI API (GPT-4o-mini)
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.7,
-            max_tokens=300,
-            response_format={"type": "json_object"}
-        )
-
-        llm_ms = (time.time() - llm_start) * 1000
-        print(f"GPT-4o-mini completed in {llm_ms:.0f}ms")
-
-        # Extract and parse response
-        response_text = response.choices[0].message.content.strip()
-
-        # Parse JSON response
-        try:
-            result = json.loads(response_text)
-            suggestions = result.get("suggestions", [])
-
-            # Validate suggestions
-            if not suggestions or len(suggestions) != 3:
-                raise ValueError(f"Expected 3 suggestions, got {len(suggestions)}")
-
-            # Validate each suggestion
-            for suggestion in suggestions:
-                if "text" not in suggestion or "intent" not in suggestion:
-                    raise ValueError("Each suggestion must have 'text' and 'intent' fields")
-                if suggestion["intent"] not in ["positive", "neutral", "question"]:
-                    raise ValueError(f"Invalid intent: {suggestion['intent']}")
-
-        except (json.JSONDecodeError, ValueError) as e:
-            print(f"Failed to parse or validate JSON response: {e}")
-            print(f"Response was: {response_text}")
-
-            # Return fallback suggestions
-            suggestions = [
-                {"text": "Thanks!", "intent": "positive"},
-                {"text": "Got it", "intent": "neutral"},
-                {"text": "Can you clarify?", "intent": "question"}
-            ]
+            suggestions = _generate_smart_replies(db, conversation_id, incoming_message_text, user_id)
+        if suggestions is None:
+            # Degraded: generic suggestions, not cached so the next request retries
+            return {
+                "suggestions": list(FALLBACK_SMART_REPLIES),
+                "cached": False,
+                "degraded": True,
+                "latency": (time.time() - start_time) * 1000,
+            }
 
         # Step 3: Store in cache for future requests (7-day TTL)
-        cache_ref.set({
+        cache_store.SMART_REPLIES.set(cache_ref, {
             "conversationId": conversation_id,
             "incomingMessageText": incoming_message_text,
             "userId": user_id,
             "suggestions": suggestions,
-            "timestamp": time.time(),
         })
 
         total_latency = (time.time() - start_time) * 1000
-        print(f"Smart reply complete successful in {total_latency:.0f}ms total "
-              f"(embed: {embedding_ms:.0f}ms, search: {search_ms:.0f}ms, "
-              f"style: {style_ms:.0f}ms, llm: {llm_ms:.0f}ms)")
 
         return {
             "suggestions": suggestions,
@@ -1393,6 +2889,13 @@ Only return the JSON, no additional text."""
             "latency": total_latency,
         }
 
+    except deadlines.DeadlineExceeded as e:
+        print(f"Smart reply generation deadline exceeded: {e}")
+        raise https_fn.HttpsError(
+            code=https_fn.FunctionsErrorCode.DEADLINE_EXCEEDED,
+            message="Smart reply generation took too long. Please try again."
+        )
+
     except Exception as e:
         print(f"Smart reply complete error: {e}")
         import traceback
@@ -1403,7 +2906,122 @@ Only return the JSON, no additional text."""
         )
 
 
-@https_fn.on_call()
+@firestore_fn.on_document_created(
+    document="conversations/{conversationId}/messages/{messageId}",
+    secrets=[OPENAI_API_KEY],
+    **concurrency_options("precompute_smart_replies", 40),
+)
+@traced("precompute_smart_replies")
+@deadline(45)
+def precompute_smart_replies(
+    event: firestore_fn.Event[firestore_fn.DocumentSnapshot | None],
+) -> None:
+    """
+    Speculatively generates smart replies for the recipients of a new message.
+
+    Triggered by: New document in conversations/{conversationId}/messages/
+    Action: For direct conversations and groups of up to 5 participants,
+    runs the smart reply pipeline for each recipient and writes the result
+    to smart_reply_cache under the key generate_smart_replies_complete uses,
+    so that opening the chat is a cache hit.
+
+    Disabled unless SMART_REPLY_PRECOMPUTE=1. Each recipient has an hourly
+    budget of speculative generations (smart_reply_precompute_budgets);
+    trivial messages ("ok", emoji, links) are not precomputed.
+
+    Note: Errors are logged but don't throw to avoid retry loops
+    """
+    if not SMART_REPLY_PRECOMPUTE:
+        return
+
+    try:
+        if event.data is None:
+            print("Warning: Event data is None, skipping smart reply precompute")
+            return
+
+        message_data = event.data.to_dict()
+        if message_data is None:
+            print("Warning: Message data is None, skipping smart reply precompute")
+            return
+
+        text = message_data.get("text", "")
+        sender_id = message_data.get("senderId")
+        if not isinstance(text, str) or not text.strip() or fast_path.classify(text) is not None:
+            return
+
+        conversation_id = event.params["conversationId"]
+        db = firestore.client()
+
+        # Step 1: Recipients (everyone but the sender), small conversations only
+        with span("conversation_lookup"):
+            conversation = db.collection("conversations").document(conversation_id).get()
+        if not conversation.exists:
+            return
+        recipient_ids = [
+            uid for uid in conversation_tokens.participant_ids(conversation.to_dict() or {}) if uid != sender_id
+        ]
+        if not recipient_ids or len(recipient_ids) > SMART_REPLY_PRECOMPUTE_MAX_RECIPIENTS:
+            return
+
+        current_hour = int(time.time() // 3600)
+        pending = []
+        for recipient_id in recipient_ids:
+            # Step 2: Skip recipients that already have suggestions (redelivery)
+            cache_ref = _smart_reply_cache_ref(db, conversation_id, text, recipient_id)
+            with span("cache_lookup"):
+                if cache_store.SMART_REPLIES.exists(cache_ref):
+                    continue
+
+            # Step 3: Spend one unit of the recipient's hourly budget
+            with span("budget"):
+                spent = rate_limit.consume(db, "smart_reply_precompute_budgets", recipient_id, current_hour,
+                                           SMART_REPLY_PRECOMPUTE_BUDGET)
+            if spent >= SMART_REPLY_PRECOMPUTE_BUDGET:
+                increment("smart_replies.precomputeOverBudget")
+                continue
+            pending.append((recipient_id, cache_ref))
+
+        # Step 4: Generate; concurrently for all recipients on the async path
+        if ASYNC_HANDLERS:
+            async def generate_all() -> list[list[dict[str, str]] | None]:
+                return await asyncio.gather(*(
+                    _generate_smart_replies_async(conversation_id, text, recipient_id)
+                    for recipient_id, _ in pending
+                ))
+            results = async_core.run(generate_all())
+        else:
+            results = []
+            for recipient_id, _ in pending:
+                suggestions = _generate_smart_replies(db, conversation_id, text, recipient_id)
+                results.append(suggestions)
+                if suggestions is None:
+                    break  # OpenAI unavailable: don't try the other recipients
+
+        # Step 5: Cache; nothing is cached while OpenAI is unavailable
+        precomputed = 0
+        for (recipient_id, cache_ref), suggestions in zip(pending, results):
+            if suggestions is None:
+                continue
+            cache_store.SMART_REPLIES.set(cache_ref, {
+                "conversationId": conversation_id,
+                "incomingMessageText": text,
+                "userId": recipient_id,
+                "suggestions": suggestions,
+                "precomputed": True,
+            })
+            increment("smart_replies.precomputed")
+            precomputed += 1
+
+        print(f"Precomputed smart replies for {precomputed}/{len(recipient_ids)} recipient(s) in {conversation_id}")
+
+    except Exception as e:
+        # Log error but don't throw to avoid retry loops
+        print(f"Error precomputing smart replies: {e}")
+
+
+@https_fn.on_call(**concurrency_options("search_messages_semantic", 80))
+@traced("search_messages_semantic")
+@deadline(10)
 def search_messages_semantic(req: https_fn.CallableRequest) -> dict[str, Any]:
     """
     Performs semantic search on messages using Firestore vector search.
@@ -1414,7 +3032,8 @@ def search_messages_semantic(req: https_fn.CallableRequest) -> dict[str, Any]:
     Args:
         req.data should contain:
             - conversationId (str): The conversation to search within
-            - queryEmbedding (list): 1536-dimensional embedding vector
+            - queryEmbedding (list): Embedding vector from the search model
+              (EMBEDDING_READ_MODEL; 768 dimensions by default)
             - limit (int, optional): Max results (default: 5, optimized for speed)
 
     Returns:
@@ -1434,140 +3053,118 @@ def search_messages_semantic(req: https_fn.CallableRequest) -> dict[str, Any]:
     start_time = time.time()
 
     # Extract and validate request data
-    data = req.data
+    with span("validation"):
+        data = req.data
 
-    if not isinstance(data, dict):
-        raise https_fn.HttpsError(
-            code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
-            message="Request data must be a dictionary"
-        )
+        if not isinstance(data, dict):
+            raise https_fn.HttpsError(
+                code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+                message="Request data must be a dictionary"
+            )
 
-    conversation_id = data.get("conversationId")
-    query_embedding = data.get("queryEmbedding")
-    limit = data.get("limit", 5)  # Default 5 for speed
+        conversation_id = data.get("conversationId")
+        query_embedding = data.get("queryEmbedding")
+        limit = data.get("limit", 5)  # Default 5 for speed
 
-    # Validate required fields
-    if not conversation_id or not isinstance(conversation_id, str):
-        raise https_fn.HttpsError(
-            code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
-            message="'conversationId' field is required and must be a string"
-        )
+        # Validate required fields
+        if not conversation_id or not isinstance(conversation_id, str):
+            raise https_fn.HttpsError(
+                code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+                message="'conversationId' field is required and must be a string"
+            )
 
-    if not query_embedding or not isinstance(query_embedding, list):
-        raise https_fn.HttpsError(
-            code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
-            message="'queryEmbedding' field is required and must be a list"
-        )
+        if not query_embedding or not isinstance(query_embedding, list):
+            raise https_fn.HttpsError(
+                code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+                message="'queryEmbedding' field is required and must be a list"
+            )
 
-    if len(query_embedding) != 1536:
-        raise https_fn.HttpsError(
-            code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
-            message=f"'queryEmbedding' must be 1536 dimensions, got {len(query_embedding)}"
-        )
+        search_model = embedding_models.READ_MODEL
+        if len(query_embedding) != search_model.dimension:
+            raise https_fn.HttpsError(
+                code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+                message=f"'queryEmbedding' must be {search_model.dimension} dimensions "
+                        f"({search_model.model}), got {len(query_embedding)}"
+            )
 
-    if not isinstance(limit, int) or limit < 1 or limit > 100:
-        raise https_fn.HttpsError(
-            code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
-            message="'limit' must be an integer between 1 and 100"
-        )
+        if not isinstance(limit, int) or limit < 1 or limit > 100:
+            raise https_fn.HttpsError(
+                code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+                message="'limit' must be an integer between 1 and 100"
+            )
 
     print(f"Semantic search: conversation={conversation_id}, limit={limit}")
 
     try:
         # Step 1: Check cache (5-minute TTL for demo smoothness)
-        import hashlib
-        import json
-
         db = firestore.client()
-
-        # Create cache key from hash of inputs
-        cache_input = {
-            "conversationId": conversation_id,
-            "queryEmbedding": query_embedding,
-            "limit": limit,
-        }
-        cache_key_hash = hashlib.sha256(
-            json.dumps(cache_input, sort_keys=True).encode('utf-8')
-        ).hexdigest()
-
-        cache_collection = db.collection("semantic_search_cache")
-        cache_ref = cache_collection.document(cache_key_hash)
-        cache_doc = cache_ref.get()
-
-        # Check if cache entry exists and is not expired (5 minutes = 300 seconds)
-        if cache_doc.exists:
-            cache_data = cache_doc.to_dict()
-            timestamp = cache_data.get("timestamp")
-
-            if timestamp:
-                age_seconds = time.time() - timestamp
-                if age_seconds < 300:  # 5 minutes
-                    elapsed_ms = (time.time() - start_time) * 1000
-                    print(f"Semantic search cache HIT ({elapsed_ms:.1f}ms, age: {age_seconds:.1f}s)")
-
-                    return {
-                        "messages": cache_data["messages"],
-                        "count": len(cache_data["messages"]),
-                        "cached": True,
-                        "latency": elapsed_ms,
-                    }
+        cache_ref = cache_store.SEMANTIC_SEARCH.document(db, conversation_id, search_model.key, query_embedding, limit)
+        cache_entry = cache_store.SEMANTIC_SEARCH.get(cache_ref, timeout=deadlines.timeout())
+        if cache_entry is not None and cache_entry.fresh:
+            return {
+                "messages": cache_entry.value["messages"],
+                "count": len(cache_entry.value["messages"]),
+                "cached": True,
+                "latency": (time.time() - start_time) * 1000,
+            }
 
         # Step 2: Cache miss - perform Firestore vector search
         print("Semantic search cache MISS - querying Firestore")
 
-        # Import vector search dependencies
-        from google.cloud.firestore_v1.vector import Vector
-        from google.cloud.firestore_v1.base_vector_query import DistanceMeasure
-
-        # Get messages collection for this conversation
-        messages_ref = db.collection_group("messages")
-
-        # Perform k-NN vector search with Firestore
-        vector_query = messages_ref.find_nearest(
-            vector_field="embedding",
-            query_vector=Vector(query_embedding),
-            distance_measure=DistanceMeasure.COSINE,
-            limit=limit * 2,  # Get more candidates for filtering
-        ).where("conversationId", "==", conversation_id)
-
-        # Execute query
-        results = vector_query.get()
+        with span("upstream.vector_search") as search_attrs:
+            # Import vector search dependencies
+            from google.cloud.firestore_v1.vector import Vector
+            from google.cloud.firestore_v1.base_vector_query import DistanceMeasure
+
+            # Get messages collection for this conversation
+            messages_ref = db.collection_group("messages")
+
+            # Perform k-NN vector search with Firestore
+            vector_query = messages_ref.find_nearest(
+                vector_field=search_model.field,
+                query_vector=Vector(query_embedding),
+                distance_measure=DistanceMeasure.COSINE,
+                limit=limit * 2,  # Get more candidates for filtering
+            ).where("conversationId", "==", conversation_id)
+
+            # Execute query
+            results = vector_query.get()
+
+            # Convert to list and format (exclude embeddings to reduce payload)
+            messages = []
+            for doc in results:
+                try:
+                    message_data = doc.to_dict()
+
+                    # Format for response (remove embedding to reduce payload size)
+                    formatted_message = {
+                        "id": doc.id,
+                        "text": message_data.get("text", ""),
+                        "senderId": message_data.get("senderId", ""),
+                        "timestamp": message_data.get("timestamp"),
+                        "detectedLanguage": message_data.get("detectedLanguage"),
+                        "translations": message_data.get("translations"),
+                        # embedding excluded for performance
+                    }
 
-        # Convert to list and format (exclude embeddings to reduce payload)
-        messages = []
-        for doc in results:
-            try:
-                message_data = doc.to_dict()
-
-                # Format for response (remove embedding to reduce payload size)
-                formatted_message = {
-                    "id": doc.id,
-                    "text": message_data.get("text", ""),
-                    "senderId": message_data.get("senderId", ""),
-                    "timestamp": message_data.get("timestamp"),
-                    "detectedLanguage": message_data.get("detectedLanguage"),
-                    "translations": message_data.get("translations"),
-                    # embedding excluded for performance
-                }
+                    messages.append(formatted_message)
 
-                messages.append(formatted_message)
+                    # Stop once we have enough results
+                    if len(messages) >= limit:
+                        break
 
-                # Stop once we have enough results
-                if len(messages) >= limit:
-                    break
+                except Exception as e:
+                    print(f"Error processing message {doc.id}: {e}")
+                    continue
 
-            except Exception as e:
-                print(f"Error processing message {doc.id}: {e}")
-                continue
+            search_attrs["results"] = len(messages)
 
         elapsed_ms = (time.time() - start_time) * 1000
-        print(f"Semantic search found {len(messages)} messages in {elapsed_ms:.1f}ms")
 
         # Step 3: Cache the results for 5 minutes
-        cache_ref.set({
+        cache_store.SEMANTIC_SEARCH.set(cache_ref, {
             "conversationId": conversation_id,
             "messages": messages,
-            "timestamp": time.time(),
             "limit": limit,
         })
 
@@ -1578,6 +3175,13 @@ def search_messages_semantic(req: https_fn.CallableRequest) -> dict[str, Any]:
             "latency": elapsed_ms,
         }
 
+    except deadlines.DeadlineExceeded as e:
+        print(f"Semantic search deadline exceeded: {e}")
+        raise https_fn.HttpsError(
+            code=https_fn.FunctionsErrorCode.DEADLINE_EXCEEDED,
+            message="Semantic search took too long. Please try again."
+        )
+
     except Exception as e:
         print(f"Semantic search error: {e}")
         import traceback
@@ -1589,7 +3193,9 @@ def search_messages_semantic(req: https_fn.CallableRequest) -> dict[str, Any]:
         )
 
 
-@https_fn.on_call(secrets=[OPENAI_API_KEY])
+@https_fn.on_call(secrets=[OPENAI_API_KEY], **concurrency_options("analyze_message_context", 40))
+@traced("analyze_message_context")
+@deadline(25)
 def analyze_message_context(req: https_fn.CallableRequest) -> dict[str, Any]:
     """
     Analyzes a message for cultural context, formality, and idioms using GPT-4o-mini.
@@ -1615,73 +3221,84 @@ def analyze_message_context(req: https_fn.CallableRequest) -> dict[str, Any]:
                     'equivalentIn': {language_code: equivalent_phrase}
                 }
             ],
-            'cached': bool
+            'cached': bool,
+            'fastPath': bool,  # Only present for trivial messages answered locally
+            'lexicon': bool    # Only present when every idiom came from the idiom lexicon
         }
 
     Raises:
         https_fn.HttpsError: If validation fails or analysis errors occur
     """
     # Extract and validate request data
-    data = req.data
+    with span("validation"):
+        data = req.data
 
-    if not isinstance(data, dict):
-        raise https_fn.HttpsError(
-            code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
-            message="Request data must be a dictionary"
-        )
+        if not isinstance(data, dict):
+            raise https_fn.HttpsError(
+                code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+                message="Request data must be a dictionary"
+            )
 
-    text = data.get("text")
-    language = data.get("language", "en")
+        text = data.get("text")
+        language = data.get("language", "en")
 
-    # Validate required fields
-    if not text or not isinstance(text, str):
-        raise https_fn.HttpsError(
-            code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
-            message="'text' field is required and must be a string"
-        )
+        # Validate required fields
+        if not text or not isinstance(text, str):
+            raise https_fn.HttpsError(
+                code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+                message="'text' field is required and must be a string"
+            )
 
-    if len(text.strip()) == 0:
-        raise https_fn.HttpsError(
-            code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
-            message="'text' cannot be empty"
-        )
+        if len(text.strip()) == 0:
+            raise https_fn.HttpsError(
+                code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+                message="'text' cannot be empty"
+            )
 
     # Log message context request
     print(f"Message context analysis request: '{text[:50]}...' (lang: {language})")
 
     try:
-        start_time = time.time()
+        # Step 0: Trivial messages ("ok", emoji, links) have nothing to analyze
+        trivial = fast_path.classify(text, language)
+        if trivial is not None:
+            increment(f"fast_path.analyze_message_context.{trivial}")
+            print(f"Message context fast path ({trivial}) - skipping OpenAI")
+            return {**fast_path.context_analysis(trivial), "cached": False, "fastPath": True}
+
+        # Step 0b: Idioms already in the lexicon are explained without GPT
+        with span("idiom_lexicon") as lexicon_attrs:
+            known_matches = idiom_lexicon.get().find(text, language)
+            known_idioms = idiom_lexicon.idioms(text, known_matches)
+            lexicon_attrs["matches"] = len(known_matches)
+        if known_matches and idiom_lexicon.fully_covered(text, known_matches, language):
+            increment("idiom_lexicon.gptSkipped")
+            print(f"Message context from idiom lexicon ({len(known_idioms)} idioms) - skipping OpenAI")
+            return {
+                "culturalHint": None,
+                "formality": None,
+                "culturalNote": None,
+                "idioms": known_idioms,
+                "cached": False,
+                "lexicon": True,
+            }
 
         # Step 1: Check cache first (30-day TTL for cost reduction)
         db = firestore.client()
-        cache_collection = db.collection("message_context_cache")
-
-        # Create cache key from text + language
-        cache_key = f"{text}_{language}"
-        cache_ref = cache_collection.document(cache_key)
-        cache_doc = cache_ref.get()
-
-        # Check if cache entry exists and is not expired (30 days = 2592000 seconds)
-        if cache_doc.exists:
-            cache_data = cache_doc.to_dict()
-            timestamp = cache_data.get("timestamp")
-
-            if timestamp:
-                # Check if cache is still valid (30 days)
-                age_seconds = time.time() - timestamp
-                if age_seconds < 2592000:  # 30 days
-                    # Cache hit!
-                    elapsed_time = time.time() - start_time
-                    print(f"Message context cache HIT in {elapsed_time:.3f}s (age: {age_seconds/86400:.1f} days)")
-
-                    return {
-                        "culturalHint": cache_data.get("culturalHint"),
-                        "formality": cache_data.get("formality"),
-                        "culturalNote": cache_data.get("culturalNote"),
-                        "idioms": cache_data.get("idioms", []),
-                        "cached": True,
-                        "cacheAge": age_seconds,
-                    }
+        cache_ref = cache_store.MESSAGE_CONTEXT.document(db, text, language)
+        cache_entry = cache_store.MESSAGE_CONTEXT.get(cache_ref, timeout=deadlines.timeout())
+
+        # Expired entries are kept as a fallback if OpenAI is unavailable
+        if cache_entry is not None and cache_entry.fresh:
+            cache_data = cache_entry.value
+            return {
+                "culturalHint": cache_data.get("culturalHint"),
+                "formality": cache_data.get("formality"),
+                "culturalNote": cache_data.get("culturalNote"),
+                "idioms": cache_data.get("idioms", []),
+                "cached": True,
+                "cacheAge": cache_entry.age_seconds,
+            }
 
         # Step 2: Cache miss - call OpenAI API
         print("Message context cache MISS - calling OpenAI API")
@@ -1696,12 +3313,19 @@ def analyze_message_context(req: https_fn.CallableRequest) -> dict[str, Any]:
             "formality level, and idioms/slang. Always return valid JSON."
         )
 
+        # Idioms found in the lexicon are not explained again
+        known_str = ""
+        if known_idioms:
+            known_str = "Already explained (do not include in idioms): " + ", ".join(
+                f'"{idiom["phrase"]}"' for idiom in known_idioms
+            ) + "\n\n"
+
         user_prompt = f"""Analyze this message for cultural context, formality, and idioms.
 
 Language: {language}
 Message: "{text}"
 
-Provide a comprehensive analysis in JSON format:
+{known_str}Provide a comprehensive analysis in JSON format:
 1. culturalHint: Brief 1-sentence summary of key cultural aspects (or null if none)
 2. formality: Assess formality level - choose from: "very formal", "formal", "neutral", "casual", "very casual" (or null if unclear)
 3. culturalNote: Detailed explanation of cultural nuances, greetings, customs, or references that might not be obvious to non-native speakers (or null if none)
@@ -1731,56 +3355,89 @@ Return JSON in this exact format:
 If the message is straightforward with no cultural context, return all fields as null except idioms as empty array.
 Only return the JSON, no additional text."""
 
-        # Call OpenAI API (GPT-4o-mini)
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.3,  # Lower temperature for consistent analysis
-            max_tokens=1000,   # Allow for detailed analysis
-            response_format={"type": "json_object"}  # Ensure JSON response
-        )
-
-        elapsed_time = time.time() - start_time
+        # Call OpenAI API (GPT-4o-mini); fails fast while the breaker is open
+        try:
+            with circuit_breaker.guard("openai"), span("upstream.openai"):
+                response = deadlines.call(
+                    lambda timeout: client.with_options(timeout=timeout, max_retries=0).chat.completions.create(
+                        model="gpt-4o-mini",
+                        messages=[
+                            {"role": "system", "content": system_prompt},
+                            {"role": "user", "content": user_prompt}
+                        ],
+                        temperature=0.3,  # Lower temperature for consistent analysis
+                        max_tokens=1000,   # Allow for detailed analysis
+                        response_format={"type": "json_object"}  # Ensure JSON response
+                    ),
+                    name="openai",
+                )
 
-        # Extract and parse response
-        response_text = response.choices[0].message.content.strip()
+                # Extract and parse response
+                response_text = response.choices[0].message.content.strip()
+
+                # Parse JSON response
+                try:
+                    result = json.loads(response_text)
+                except json.JSONDecodeError as e:
+                    print(f"Failed to parse JSON response: {e}")
+                    print(f"Response was: {response_text}")
+                    # Return empty result if parsing fails
+                    result = {
+                        "culturalHint": None,
+                        "formality": None,
+                        "culturalNote": None,
+                        "idioms": []
+                    }
 
-        # Parse JSON response
-        import json
-        try:
-            result = json.loads(response_text)
-        except json.JSONDecodeError as e:
-            print(f"Failed to parse JSON response: {e}")
-            print(f"Response was: {response_text}")
-            # Return empty result if parsing fails
-            result = {
+                # Extract fields with defaults
+                cultural_hint = result.get("culturalHint")
+                formality = result.get("formality")
+                cultural_note = result.get("culturalNote")
+                idioms = result.get("idioms", [])
+
+                # Lexicon idioms first; drop any the model explained anyway
+                if known_idioms:
+                    known_phrases = {idiom_lexicon.normalize(idiom["phrase"]) for idiom in known_idioms}
+                    idioms = known_idioms + [
+                        idiom for idiom in idioms
+                        if isinstance(idiom, dict)
+                        and idiom_lexicon.normalize(str(idiom.get("phrase", ""))) not in known_phrases
+                    ]
+        except Exception as e:
+            print(f"OpenAI unavailable ({e}) - returning degraded message context")
+            # Degraded: serve the expired cache entry, or an empty analysis
+            # (the same shape as a message without cultural context)
+            if cache_entry is not None:
+                stale_data = cache_entry.value
+                return {
+                    "culturalHint": stale_data.get("culturalHint"),
+                    "formality": stale_data.get("formality"),
+                    "culturalNote": stale_data.get("culturalNote"),
+                    "idioms": stale_data.get("idioms", []),
+                    "cached": True,
+                    "stale": True,
+                    "cacheAge": cache_entry.age_seconds,
+                }
+            return {
                 "culturalHint": None,
                 "formality": None,
                 "culturalNote": None,
-                "idioms": []
+                "idioms": known_idioms,
+                "cached": False,
+                "degraded": True,
             }
 
-        # Extract fields with defaults
-        cultural_hint = result.get("culturalHint")
-        formality = result.get("formality")
-        cultural_note = result.get("culturalNote")
-        idioms = result.get("idioms", [])
-
         # Step 3: Store in cache for future requests (30-day TTL)
-        cache_ref.set({
+        cache_store.MESSAGE_CONTEXT.set(cache_ref, {
             "text": text,
             "language": language,
             "culturalHint": cultural_hint,
             "formality": formality,
             "culturalNote": cultural_note,
             "idioms": idioms,
-            "timestamp": time.time(),
         })
 
-        print(f"Message context analysis successful in {elapsed_time:.2f}s: "
+        print(f"Message context analysis successful: "
               f"formality={formality}, idioms={len(idioms)}, "
               f"{'has cultural context' if cultural_hint else 'no cultural context'}")
 
@@ -1792,9 +3449,47 @@ Only return the JSON, no additional text."""
             "cached": False,
         }
 
+    except deadlines.DeadlineExceeded as e:
+        print(f"Message context analysis deadline exceeded: {e}")
+        raise https_fn.HttpsError(
+            code=https_fn.FunctionsErrorCode.DEADLINE_EXCEEDED,
+            message="Message context analysis took too long. Please try again."
+        )
+
     except Exception as e:
         print(f"Message context analysis error: {e}")
         raise https_fn.HttpsError(
             code=https_fn.FunctionsErrorCode.INTERNAL,
             message=f"Message context analysis failed: {str(e)}"
         )
+
+
+# ========== Instance Warm-up ==========
+
+
+def warm_up() -> None:
+    """
+    Import heavy SDKs and create API clients before the first request.
+
+    Enabled with WARMUP_CLIENTS=1; intended for functions deployed with
+    min_instances > 0, where startup time is not on any request's path.
+    Failures are logged and left to the first real request to surface.
+    """
+    steps = [
+        ("firestore", firestore.client),
+        ("translate", get_translate_client),
+        ("credentials", google_auth.default),
+        ("requests", lambda: requests.Session),
+    ]
+    if os.environ.get("OPENAI_API_KEY"):
+        steps.append(("openai", lambda: get_openai_client(os.environ["OPENAI_API_KEY"])))
+    for name, step in steps:
+        try:
+            step()
+        except Exception as e:
+            print(f"Warm-up of {name} failed: {e}")
+
+
+if WARM_UP:
+    warm_up()
+mark_initialized(warmUp=WARM_UP)
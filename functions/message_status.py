@@ -0,0 +1,176 @@
+"""
+Server-maintained delivery/read aggregates.
+
+Every message has a status subcollection with one document per recipient
+({"status": "sent" | "delivered" | "read", "userId", ...}), so showing
+"read by 12" used to mean reading the whole subcollection, and the
+conversation list had no server-side unread counts. The status and
+message triggers in main.py keep the aggregates instead:
+
+    conversations/{conversationId}/messages/{messageId}
+        deliveredCount:  recipients that received the message (read implies delivered)
+        readCount:       recipients that read it
+        statusUpdatedAt: when the counts were last rolled up
+
+    conversations/{conversationId}
+        unreadCount:     {uid: messages not yet read}
+        lastUpdatedAt:   timestamp of the latest message
+
+A status change in a large group comes from every recipient at once, far
+beyond the one write per second a single document sustains, so each event
+is only a blind increment of a sharded counter (see sharded_counter.py):
+
+    {message document}/shards/{n}            delivered, read
+    conversation_unread/{conversationId}/shards/{n}
+        <uid>: +1 per message received, -1 per message read
+
+A rollup task (rollup_message_status in main.py) then sums the shards and
+writes the document once. Rollups are named per document and
+ROLLUP_SECONDS window, so Cloud Tasks drops the duplicates and a document
+is written at most once per window however many events arrive.
+
+Increments are not idempotent: a redelivered event is counted twice.
+Rolled-up counts are clamped at zero.
+"""
+
+import os
+import re
+import time
+from typing import Any
+
+import sharded_counter
+
+UNREAD_COLLECTION = "conversation_unread"
+
+# Shards per counter; a large group marks a message read within seconds
+MESSAGE_SHARDS = 10
+UNREAD_SHARDS = 10
+
+# Longest a rolled-up aggregate lags behind the status documents
+ROLLUP_SECONDS = float(os.environ.get("MESSAGE_STATUS_ROLLUP_SECONDS", "5"))
+
+# Ordered so that a higher rank implies the lower ones
+_RANKS = {"sent": 0, "delivered": 1, "read": 2}
+
+_TASK_ID_UNSAFE = re.compile(r"[^A-Za-z0-9_-]")
+
+
+def _rank(status_data: dict[str, Any] | None) -> int:
+    return _RANKS.get((status_data or {}).get("status"), 0)
+
+
+def status_increments(before: dict[str, Any] | None, after: dict[str, Any] | None) -> dict[str, int]:
+    """
+    Counter changes for one status document write.
+
+    Args:
+        before: Status document before the write (None if it was created)
+        after: Status document after the write (None if it was deleted)
+
+    Returns:
+        {"delivered": -1/0/1, "read": -1/0/1}
+    """
+    old, new = _rank(before), _rank(after)
+    return {
+        "delivered": int(new >= 1) - int(old >= 1),
+        "read": int(new >= 2) - int(old >= 2),
+    }
+
+
+def message_counter_ref(db: Any, conversation_id: str, message_id: str) -> Any:
+    return db.collection("conversations").document(conversation_id).collection("messages").document(message_id)
+
+
+def unread_counter_ref(db: Any, conversation_id: str) -> Any:
+    return db.collection(UNREAD_COLLECTION).document(conversation_id)
+
+
+def record_status(db: Any, conversation_id: str, message_id: str, user_id: str, increments: dict[str, int]) -> None:
+    """Count one status change for a message and, if it was read or unread, its reader."""
+    sharded_counter.increment(message_counter_ref(db, conversation_id, message_id), increments,
+                              num_shards=MESSAGE_SHARDS)
+    if increments["read"]:
+        sharded_counter.increment(unread_counter_ref(db, conversation_id), {user_id: -increments["read"]},
+                                  num_shards=UNREAD_SHARDS)
+
+
+def record_message(db: Any, conversation_id: str, recipient_ids: list[str]) -> None:
+    """Count a new message as unread for each of its recipients (one write)."""
+    sharded_counter.increment(unread_counter_ref(db, conversation_id), {uid: 1 for uid in recipient_ids},
+                              num_shards=UNREAD_SHARDS)
+
+
+def rollup_task(conversation_id: str, message_id: str | None = None, now: float | None = None) -> tuple[str, float]:
+    """
+    Name and delay of the rollup task covering an event at `now`.
+
+    Every event of one document inside the same ROLLUP_SECONDS window maps
+    to the same task name, due at the end of the window.
+
+    Returns:
+        (task ID, seconds until the task should run)
+    """
+    now = time.time() if now is None else now
+    window = int(now // ROLLUP_SECONDS)
+    key = f"{conversation_id}-{message_id}" if message_id else conversation_id
+    task_id = f"status-{_TASK_ID_UNSAFE.sub('_', key)}-{window}"
+    return task_id, (window + 1) * ROLLUP_SECONDS - now
+
+
+def rollup_message(db: Any, conversation_id: str, message_id: str) -> dict[str, Any] | None:
+    """
+    Write a message's delivered/read counts from its shards.
+
+    Returns:
+        The fields written, or None if the message no longer exists
+    """
+    message_ref = message_counter_ref(db, conversation_id, message_id)
+    if not message_ref.get().exists:
+        return None
+    totals = sharded_counter.totals(message_ref)
+    counts = {
+        "deliveredCount": max(0, int(totals.get("delivered", 0))),
+        "readCount": max(0, int(totals.get("read", 0))),
+        "statusUpdatedAt": time.time(),
+    }
+    message_ref.update(counts)
+    return counts
+
+
+def rollup_conversation(db: Any, conversation_id: str) -> dict[str, Any] | None:
+    """
+    Write a conversation's unread counts and lastUpdatedAt.
+
+    lastUpdatedAt is only moved forward, to the latest message's timestamp,
+    so updates the app made since (members added, ...) are kept.
+
+    Returns:
+        The fields written, or None if the conversation no longer exists
+    """
+    conversation_ref = db.collection("conversations").document(conversation_id)
+    conversation = conversation_ref.get()
+    if not conversation.exists:
+        return None
+    data = conversation.to_dict() or {}
+
+    participants = set(data.get("participantIds", []))
+    totals = sharded_counter.totals(unread_counter_ref(db, conversation_id))
+    updates: dict[str, Any] = {
+        # Users who left keep no count
+        "unreadCount": {uid: max(0, int(count)) for uid, count in totals.items() if uid in participants},
+    }
+
+    latest = list(
+        conversation_ref.collection("messages").order_by("timestamp", direction="DESCENDING").limit(1).stream()
+    )
+    latest_at = (latest[0].to_dict() or {}).get("timestamp") if latest else None
+    current_at = data.get("lastUpdatedAt")
+    try:
+        if latest_at is not None and (current_at is None or latest_at > current_at):
+            updates["lastUpdatedAt"] = latest_at
+    except TypeError:
+        # Legacy documents store lastUpdatedAt as a string; the message timestamp wins
+        updates["lastUpdatedAt"] = latest_at
+
+    conversation_ref.update(updates)
+    return updates
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Cache Key Migration: Move response cache entries to CacheStore keys
+
+translation_cache, formality_cache and message_context_cache used to key
+documents on raw text (e.g. "{text}_{source}_{target}"), and
+smart_reply_cache hashed its inputs without normalization. cache_store.py
+now keys every cache on a hash of the normalized inputs
+("v{version}_{sha256}"), so entries under the old IDs are no longer read.
+This script rewrites them under their new IDs, keeping their original
+timestamp (and therefore their remaining TTL):
+
+    translation_cache      text and languages parsed from the old ID
+    formality_cache        text and formality levels parsed from the old ID
+    message_context_cache  text and language fields
+    smart_reply_cache      conversationId, incomingMessageText and userId fields
+    semantic_search_cache  not migrated: the query embedding is not stored and
+                           entries only live 5 minutes; --delete-old removes them
+
+When several old entries map to the same new key (whitespace or Unicode
+variants of one message), the most recent one wins. Entries already under
+a CacheStore ID are left alone, so the script can be re-run safely.
+
+Usage:
+    python3 migrate_cache_keys.py [--dry-run] [--delete-old]
+        [--collection translation_cache ...]
+
+Arguments:
+    --dry-run: Count what would be migrated without making changes
+    --delete-old: Delete old entries once their replacement is written
+    --collection: Only migrate these cache collections (repeatable)
+"""
+
+import argparse
+import re
+import sys
+import time
+from typing import Any
+
+import cache_store
+
+# Progress is printed every this many scanned entries
+PROGRESS_INTERVAL = 5000
+
+# Document IDs written by CacheStore
+_STORE_ID = re.compile(r"^v\d+_[0-9a-f]{64}$")
+
+
+def initialize_firebase() -> Any:
+    """Initialize Firebase Admin SDK and return Firestore client."""
+    import firebase_admin
+    from firebase_admin import firestore
+
+    if not firebase_admin._apps:
+        # Initialize with default credentials (ADC or service account)
+        firebase_admin.initialize_app()
+    return firestore.client()
+
+
+def legacy_key_parts(store: cache_store.CacheStore, doc_id: str, data: dict[str, Any]) -> tuple[Any, ...] | None:
+    """
+    CacheStore key parts for an entry stored under an old ID.
+
+    Returns:
+        The parts the handler now passes to store.document(), or None if
+        the entry cannot be migrated
+    """
+    if store is cache_store.TRANSLATION:
+        # "{text}_{source or 'auto'}_{target}"; language codes contain no "_"
+        parts = doc_id.rsplit("_", 2)
+        if len(parts) != 3 or not data.get("translatedText"):
+            return None
+        return (data.get("sourceText") or parts[0], parts[1], parts[2])
+    if store is cache_store.FORMALITY:
+        # "{text}_{current}_{target}_{language}"
+        parts = doc_id.rsplit("_", 3)
+        if len(parts) != 4 or not data.get("adjustedText"):
+            return None
+        return (data.get("originalText") or parts[0], parts[1], parts[2], parts[3])
+    if store is cache_store.MESSAGE_CONTEXT:
+        if not data.get("text") or not data.get("language"):
+            return None
+        return (data["text"], data["language"])
+    if store is cache_store.SMART_REPLIES:
+        if not data.get("conversationId") or not data.get("incomingMessageText") or not data.get("userId"):
+            return None
+        return (data["conversationId"], data["incomingMessageText"], data["userId"])
+    return None
+
+
+def migrate_store(db: Any, store: cache_store.CacheStore, dry_run: bool, delete_old: bool) -> dict[str, int]:
+    """
+    Rewrite one cache collection's old entries under CacheStore IDs.
+
+    Returns:
+        Counts: scanned, migrated, superseded (an equal or newer entry
+        already had the key), skipped (not migratable) and deleted
+    """
+    stats = {"scanned": 0, "migrated": 0, "superseded": 0, "skipped": 0, "deleted": 0}
+    collection = db.collection(store.collection)
+    # New ID -> timestamp written in this run, so the newest variant wins
+    written: dict[str, float] = {}
+    writer = None if dry_run else db.bulk_writer()
+
+    for doc in collection.stream():
+        if _STORE_ID.match(doc.id):
+            continue
+        stats["scanned"] += 1
+        if stats["scanned"] % PROGRESS_INTERVAL == 0:
+            print(f"   ... {store.collection}: {stats['scanned']} old entries scanned")
+
+        data = doc.to_dict() or {}
+        timestamp = data.get("timestamp")
+        parts = legacy_key_parts(store, doc.id, data)
+        if parts is None or not isinstance(timestamp, (int, float)):
+            stats["skipped"] += 1
+        else:
+            new_id = store.key(*parts)
+            existing = written.get(new_id)
+            if existing is None and not dry_run:
+                snapshot = collection.document(new_id).get()
+                if snapshot.exists:
+                    existing = (snapshot.to_dict() or {}).get("timestamp", 0)
+            if existing is not None and existing >= timestamp:
+                stats["superseded"] += 1
+            else:
+                written[new_id] = timestamp
+                stats["migrated"] += 1
+                if writer is not None:
+                    value = {field: v for field, v in data.items() if field not in cache_store.METADATA_FIELDS}
+                    writer.set(collection.document(new_id),
+                               {**value, "timestamp": timestamp, "cacheVersion": store.version})
+
+        # Unmigratable entries go too: nothing reads them any more
+        if delete_old:
+            stats["deleted"] += 1
+            if writer is not None:
+                writer.delete(doc.reference)
+
+    if writer is not None:
+        writer.close()
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Move response cache entries to CacheStore keys")
+    parser.add_argument("--dry-run", action="store_true", help="Count what would be migrated without writing")
+    parser.add_argument("--delete-old", action="store_true", help="Delete old entries after migrating them")
+    parser.add_argument(
+        "--collection",
+        action="append",
+        choices=[store.collection for store in cache_store.STORES],
+        help="Only migrate this cache collection (repeatable)",
+    )
+    args = parser.parse_args()
+
+    try:
+        db = initialize_firebase()
+        print("✅ Connected to Firestore")
+    except Exception as e:
+        print(f"❌ Failed to connect to Firestore: {e}")
+        sys.exit(1)
+
+    stores = [store for store in cache_store.STORES if not args.collection or store.collection in args.collection]
+    start = time.time()
+    results = {}
+    for store in stores:
+        print(f"\n🔄 Migrating {store.collection} (v{store.version})")
+        results[store.collection] = migrate_store(db, store, args.dry_run, args.delete_old)
+
+    print("\n" + "=" * 60)
+    print("CACHE KEY MIGRATION SUMMARY")
+    print("=" * 60)
+    for collection, stats in results.items():
+        print(f"{collection}: scanned {stats['scanned']}, migrated {stats['migrated']}, "
+              f"superseded {stats['superseded']}, skipped {stats['skipped']}, deleted {stats['deleted']}")
+    print(f"Elapsed: {time.time() - start:.1f}s")
+
+    if args.dry_run:
+        print("\n⚠️  This was a DRY RUN - no changes were made")
+    elif not args.delete_old:
+        print("\nℹ️  Old entries were kept; re-run with --delete-old to remove them")
+
+
+if __name__ == "__main__":
+    main()
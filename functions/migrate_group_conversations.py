@@ -6,21 +6,66 @@ This script migrates all documents from the 'group-conversations' collection
 to the unified 'conversations' collection, including all messages and status
 subcollections.
 
+Writes go through a Firestore BulkWriter (batched, parallel commits) and
+conversations are copied concurrently by a worker pool. The source
+collection is split into partition queries so that it can be listed in
+parallel, and writes are paced by a rate ramp that starts at
+--initial-ops-per-second and grows by --ramp-factor every
+--ramp-interval-seconds (Firestore's 500/50/5 rule for new traffic).
+Progress is reported in docs/sec while the migration runs.
+
+Progress is checkpointed per conversation, so an interrupted run picks up
+where it stopped. After copying, a verification pass streams both sides
+and compares document counts and content hashes; --delete-old then
+recursively deletes only conversations that verified.
+
 Usage:
     python3 migrate_group_conversations.py [--dry-run] [--delete-old]
+        [--workers 8] [--partitions 8]
+        [--initial-ops-per-second 500] [--max-ops-per-second 5000]
 
 Arguments:
     --dry-run: Preview what would be migrated without making changes
-    --delete-old: Delete old group-conversations collection after migration
+    --delete-old: Delete verified conversations from group-conversations
+    --no-verify: Skip the verification pass
+    --restart: Ignore checkpoints from earlier runs
+    --workers: Conversations copied concurrently
+    --partitions: Partition queries used to list the source collection
+    --initial-ops-per-second / --max-ops-per-second: Write ramp bounds
 """
 
 import argparse
+import datetime
+import hashlib
+import json
 import sys
-from typing import Any
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
 
 import firebase_admin
 from firebase_admin import credentials, firestore
 from google.cloud.firestore_v1.base_query import FieldFilter
+from google.cloud.firestore_v1.bulk_writer import BulkWriterOptions
+
+SOURCE_COLLECTION = "group-conversations"
+TARGET_COLLECTION = "conversations"
+
+# Checkpoints live at migrations/{MIGRATION_ID}/conversations/{conversationId}
+CHECKPOINT_COLLECTION = "migrations"
+MIGRATION_ID = "group-conversations-to-conversations"
+
+DEFAULT_WORKERS = 8
+DEFAULT_PARTITIONS = 8
+DEFAULT_INITIAL_OPS_PER_SECOND = 500
+DEFAULT_MAX_OPS_PER_SECOND = 5000
+DEFAULT_RAMP_FACTOR = 1.5
+DEFAULT_RAMP_INTERVAL_SECONDS = 300
+PROGRESS_INTERVAL_SECONDS = 10
+
+# A failed write is retried by the BulkWriter until this many attempts
+MAX_WRITE_ATTEMPTS = 5
 
 
 def initialize_firebase() -> firestore.Client:
@@ -31,130 +76,554 @@ def initialize_firebase() -> firestore.Client:
     return firestore.client()
 
 
+class WriteRamp:
+    """
+    Thread-safe pacing for write operations.
+
+    Allows `initial_ops_per_second` at first and multiplies the rate by
+    `factor` every `interval_seconds`, up to `max_ops_per_second`.
+    """
+
+    def __init__(
+        self,
+        initial_ops_per_second: float = DEFAULT_INITIAL_OPS_PER_SECOND,
+        max_ops_per_second: float = DEFAULT_MAX_OPS_PER_SECOND,
+        factor: float = DEFAULT_RAMP_FACTOR,
+        interval_seconds: float = DEFAULT_RAMP_INTERVAL_SECONDS,
+    ) -> None:
+        self.initial_ops_per_second = initial_ops_per_second
+        self.max_ops_per_second = max(max_ops_per_second, initial_ops_per_second)
+        self.factor = factor
+        self.interval_seconds = interval_seconds
+        self._started_at = time.monotonic()
+        self._next_slot = self._started_at
+        self._lock = threading.Lock()
+
+    def rate(self, now: float | None = None) -> float:
+        """Current allowed operations per second."""
+        elapsed = (now if now is not None else time.monotonic()) - self._started_at
+        steps = int(elapsed // self.interval_seconds) if self.interval_seconds > 0 else 0
+        return min(self.max_ops_per_second, self.initial_ops_per_second * self.factor ** steps)
+
+    def acquire(self, operations: int = 1) -> None:
+        """Block until `operations` more writes fit within the current rate."""
+        with self._lock:
+            now = time.monotonic()
+            self._next_slot = max(self._next_slot, now)
+            wait = self._next_slot - now
+            self._next_slot += operations / self.rate(now)
+        if wait > 0:
+            time.sleep(wait)
+
+
+class MigrationProgress:
+    """Thread-safe migration counters with periodic docs/sec reporting."""
+
+    def __init__(self, ramp: WriteRamp | None = None, interval_seconds: float = PROGRESS_INTERVAL_SECONDS) -> None:
+        self.stats = {
+            "conversations_migrated": 0,
+            "conversations_skipped": 0,
+            "conversations_resumed": 0,
+            "conversations_verified": 0,
+            "verification_mismatches": 0,
+            "conversations_deleted": 0,
+            "messages_migrated": 0,
+            "status_docs_migrated": 0,
+            "docs_written": 0,
+            "docs_deleted": 0,
+            "errors": 0,
+        }
+        self._ramp = ramp
+        self._interval_seconds = interval_seconds
+        self._lock = threading.Lock()
+        self._started_at = time.monotonic()
+        self._last_report = (self._started_at, 0)
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def add(self, key: str, count: int = 1) -> None:
+        with self._lock:
+            self.stats[key] += count
+
+    def docs_per_second(self) -> float:
+        elapsed = time.monotonic() - self._started_at
+        return self.stats["docs_written"] / elapsed if elapsed > 0 else 0.0
+
+    def report(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            written = self.stats["docs_written"]
+            last_at, last_written = self._last_report
+            self._last_report = (now, written)
+        current = (written - last_written) / (now - last_at) if now > last_at else 0.0
+        ramp = f", ramp {self._ramp.rate():.0f} ops/sec" if self._ramp else ""
+        print(f"   ⏱️  {written:,} docs written, {current:,.0f} docs/sec now, "
+              f"{self.docs_per_second():,.0f} docs/sec overall{ramp}")
+
+    def start(self) -> None:
+        def loop() -> None:
+            while not self._stop.wait(self._interval_seconds):
+                self.report()
+        self._thread = threading.Thread(target=loop, name="migration-progress", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> dict[str, Any]:
+        """Stop reporting and return the final statistics."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        elapsed = time.monotonic() - self._started_at
+        result: dict[str, Any] = dict(self.stats)
+        result["elapsed_seconds"] = round(elapsed, 1)
+        result["docs_per_second"] = round(self.docs_per_second(), 1)
+        return result
+
+
+class _PacedWriter:
+    """Funnels writes from all workers into one BulkWriter, paced by the ramp."""
+
+    def __init__(self, db: firestore.Client, ramp: WriteRamp, progress: MigrationProgress) -> None:
+        # The ramp does the pacing, so the BulkWriter's own limiter is opened up to the ramp's ceiling
+        max_ops = int(ramp.max_ops_per_second)
+        self._writer = db.bulk_writer(
+            options=BulkWriterOptions(initial_ops_per_second=max_ops, max_ops_per_second=max_ops),
+        )
+        self._writer.on_write_result(self._on_result)
+        self._writer.on_write_error(self._on_error)
+        self._ramp = ramp
+        self._progress = progress
+        self._lock = threading.Lock()
+        self.failed_paths: set[str] = set()
+
+    def _on_result(self, reference: Any, result: Any, writer: Any) -> None:
+        self._progress.add("docs_written")
+
+    def _on_error(self, failure: Any, writer: Any) -> bool:
+        if failure.attempts < MAX_WRITE_ATTEMPTS:
+            return True
+        print(f"   ❌ Write failed for {failure.reference.path}: {failure.message}")
+        self._progress.add("errors")
+        with self._lock:
+            self.failed_paths.add(failure.reference.path)
+        return False
+
+    def _enqueue(self, operation: Callable[..., Any], *args: Any) -> None:
+        self._ramp.acquire()
+        with self._lock:
+            operation(*args)
+
+    def set(self, reference: Any, data: dict[str, Any]) -> None:
+        self._enqueue(self._writer.set, reference, data)
+
+    def delete(self, reference: Any) -> None:
+        self._enqueue(self._writer.delete, reference)
+
+    def flush(self) -> None:
+        self._writer.flush()
+
+    def close(self) -> None:
+        self._writer.close()
+
+
+def list_source_conversations(db: firestore.Client, partitions: int, workers: int) -> list[Any]:
+    """
+    List all source conversation documents, streaming partitions in parallel.
+
+    Args:
+        db: Firestore client
+        partitions: Number of partition queries to split the collection into
+        workers: Partitions streamed concurrently
+
+    Returns:
+        Conversation document snapshots
+    """
+    if partitions <= 1:
+        return list(db.collection(SOURCE_COLLECTION).stream())
+
+    # Partition queries are only available on collection group queries; no
+    # subcollection shares the source collection's name, so this is equivalent
+    queries = [p.query() for p in db.collection_group(SOURCE_COLLECTION).get_partitions(partitions)]
+    print(f"Listing '{SOURCE_COLLECTION}' with {len(queries)} partition queries...")
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(queries)))) as pool:
+        chunks = list(pool.map(lambda query: list(query.stream()), queries))
+    return [doc for chunk in chunks for doc in chunk if doc.reference.parent.id == SOURCE_COLLECTION]
+
+
+def _belongs_to(path: str, conversation_id: str, collection: str = TARGET_COLLECTION) -> bool:
+    """Whether a document path is part of the given conversation in `collection`."""
+    root = f"{collection}/{conversation_id}"
+    return path == root or path.startswith(root + "/")
+
+
+# ========== Checkpoints ==========
+
+
+class CheckpointStore:
+    """
+    Per-conversation migration state in Firestore.
+
+    Stored at migrations/{MIGRATION_ID}/conversations/{conversationId} with a
+    `status` of copying, copied, verified, mismatch, deleted or skipped. A
+    conversation left in `copying` by an interrupted run is copied again;
+    copies are idempotent set() calls, so a half-finished copy is completed
+    rather than skipped.
+    """
+
+    def __init__(self, db: firestore.Client, dry_run: bool = False) -> None:
+        self._collection = db.collection(CHECKPOINT_COLLECTION).document(MIGRATION_ID).collection("conversations")
+        self._dry_run = dry_run
+        self._lock = threading.Lock()
+        self._cache: dict[str, dict[str, Any]] = {}
+
+    def load(self) -> dict[str, dict[str, Any]]:
+        """Read all checkpoints (one streamed query)."""
+        checkpoints = {doc.id: doc.to_dict() or {} for doc in self._collection.stream()}
+        with self._lock:
+            self._cache = checkpoints
+        return checkpoints
+
+    def status(self, conversation_id: str) -> str | None:
+        with self._lock:
+            return self._cache.get(conversation_id, {}).get("status")
+
+    def with_status(self, *statuses: str) -> list[str]:
+        with self._lock:
+            return sorted(cid for cid, data in self._cache.items() if data.get("status") in statuses)
+
+    def record(self, conversation_id: str, status: str, **fields: Any) -> None:
+        data = {"status": status, "updatedAt": time.time(), **fields}
+        with self._lock:
+            self._cache.setdefault(conversation_id, {}).update(data)
+        if not self._dry_run:
+            self._collection.document(conversation_id).set(data, merge=True)
+
+    def clear(self) -> None:
+        """Forget all checkpoints (--restart)."""
+        with self._lock:
+            self._cache = {}
+        if not self._dry_run:
+            for doc in self._collection.stream():
+                doc.reference.delete()
+
+
+# ========== Copy ==========
+
+
+def copy_conversation(
+    db: firestore.Client,
+    group_conv_doc: Any,
+    writer: _PacedWriter | None,
+    progress: MigrationProgress,
+    checkpoints: CheckpointStore,
+) -> bool:
+    """
+    Copy one conversation with its messages and status docs.
+
+    Args:
+        db: Firestore client
+        group_conv_doc: Source conversation snapshot
+        writer: Paced bulk writer, or None for a dry run
+        progress: Shared counters
+        checkpoints: Checkpoint store (marked `copying` before the first write)
+
+    Returns:
+        True if the conversation was copied (or would be, in a dry run)
+    """
+    conversation_id = group_conv_doc.id
+    conversation_data = group_conv_doc.to_dict()
+    previous_status = checkpoints.status(conversation_id)
+
+    if previous_status in ("copied", "verified", "deleted", "skipped"):
+        progress.add("conversations_skipped")
+        return False
+
+    try:
+        target_ref = db.collection(TARGET_COLLECTION).document(conversation_id)
+        if previous_status is None and target_ref.get().exists:
+            # Created outside this migration (no checkpoint): leave it alone
+            print(f"   ⚠️  {conversation_id}: already exists in '{TARGET_COLLECTION}', skipping...")
+            checkpoints.record(conversation_id, "skipped", reason="target exists")
+            progress.add("conversations_skipped")
+            return False
+
+        if previous_status is not None:
+            print(f"   ↩️  {conversation_id}: resuming ({previous_status})")
+            progress.add("conversations_resumed")
+        checkpoints.record(conversation_id, "copying")
+
+        if writer:
+            writer.set(target_ref, conversation_data)
+
+        messages = 0
+        status_docs = 0
+        for message_doc in group_conv_doc.reference.collection("messages").stream():
+            target_message_ref = target_ref.collection("messages").document(message_doc.id)
+            if writer:
+                writer.set(target_message_ref, message_doc.to_dict())
+            messages += 1
+
+            for status_doc in message_doc.reference.collection("status").stream():
+                if writer:
+                    writer.set(target_message_ref.collection("status").document(status_doc.id), status_doc.to_dict())
+                status_docs += 1
+
+        progress.add("conversations_migrated")
+        progress.add("messages_migrated", messages)
+        progress.add("status_docs_migrated", status_docs)
+
+        group_name = conversation_data.get("groupName", "N/A")
+        prefix = "[DRY RUN] Would copy" if writer is None else "✅ Copied"
+        print(f"   {prefix} {conversation_id} ({group_name}): "
+              f"{messages} messages, {status_docs} status docs, "
+              f"{len(conversation_data.get('participantIds', []))} participants")
+        return True
+
+    except Exception as e:
+        print(f"   ❌ Error migrating conversation {conversation_id}: {e}")
+        checkpoints.record(conversation_id, "copying", error=str(e))
+        progress.add("errors")
+        return False
+
+
+# ========== Verification ==========
+
+
+def _canonical(value: Any) -> Any:
+    """Convert a Firestore value into something json.dumps can hash stably."""
+    if isinstance(value, dict):
+        return {key: _canonical(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(item) for item in value]
+    if isinstance(value, datetime.datetime):
+        return {"__timestamp__": value.isoformat()}
+    if isinstance(value, bytes):
+        return {"__bytes__": value.hex()}
+    if hasattr(value, "path") and hasattr(value, "id"):
+        # DocumentReference
+        return {"__reference__": value.path}
+    if hasattr(value, "latitude") and hasattr(value, "longitude"):
+        return {"__geopoint__": [value.latitude, value.longitude]}
+    return value
+
+
+def _tree_digest(conversation_ref: Any) -> tuple[int, str]:
+    """
+    Stream a conversation with its messages and status docs.
+
+    Returns:
+        (document count, sha256 of relative paths and canonical contents)
+    """
+    digest = hashlib.sha256()
+    count = 0
+
+    def add(relative_path: str, data: dict[str, Any] | None) -> None:
+        nonlocal count
+        count += 1
+        digest.update(relative_path.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(json.dumps(_canonical(data or {}), sort_keys=True, default=str).encode("utf-8"))
+        digest.update(b"\n")
+
+    snapshot = conversation_ref.get()
+    if not snapshot.exists:
+        return 0, ""
+    add("", snapshot.to_dict())
+    # Streams are ordered by document ID, so both sides hash in the same order
+    for message_doc in conversation_ref.collection("messages").stream():
+        add(f"messages/{message_doc.id}", message_doc.to_dict())
+        for status_doc in message_doc.reference.collection("status").stream():
+            add(f"messages/{message_doc.id}/status/{status_doc.id}", status_doc.to_dict())
+    return count, digest.hexdigest()
+
+
+def verify_conversation(
+    db: firestore.Client,
+    conversation_id: str,
+    progress: MigrationProgress,
+    checkpoints: CheckpointStore,
+) -> bool:
+    """
+    Compare document counts and content hashes of source and target.
+
+    Marks the checkpoint `verified` on a match and `mismatch` otherwise.
+    """
+    try:
+        source_count, source_hash = _tree_digest(db.collection(SOURCE_COLLECTION).document(conversation_id))
+        target_count, target_hash = _tree_digest(db.collection(TARGET_COLLECTION).document(conversation_id))
+    except Exception as e:
+        print(f"   ❌ Error verifying conversation {conversation_id}: {e}")
+        progress.add("errors")
+        return False
+
+    fields = {
+        "sourceDocs": source_count,
+        "targetDocs": target_count,
+        "sourceHash": source_hash,
+        "targetHash": target_hash,
+    }
+    if source_count and source_count == target_count and source_hash == target_hash:
+        checkpoints.record(conversation_id, "verified", **fields)
+        progress.add("conversations_verified")
+        return True
+
+    print(f"   ❌ {conversation_id}: verification failed "
+          f"(source {source_count} docs, target {target_count} docs, "
+          f"hashes {'match' if source_hash == target_hash else 'differ'})")
+    checkpoints.record(conversation_id, "mismatch", **fields)
+    progress.add("verification_mismatches")
+    return False
+
+
+# ========== Deletion ==========
+
+
+class _DeleteOnlyWriter:
+    """
+    BulkWriter stand-in for recursive_delete().
+
+    recursive_delete() only calls delete() and close(); deletes are routed
+    through the paced writer and close() is a no-op so the shared writer
+    stays open for the other conversations (it is flushed by the caller).
+    """
+
+    def __init__(self, writer: _PacedWriter) -> None:
+        self._writer = writer
+
+    def delete(self, reference: Any, **_: Any) -> None:
+        self._writer.delete(reference)
+
+    def close(self) -> None:
+        pass
+
+
+def delete_verified_conversation(
+    db: firestore.Client,
+    conversation_id: str,
+    writer: _PacedWriter,
+    progress: MigrationProgress,
+) -> int | None:
+    """
+    Recursively delete a verified source conversation.
+
+    The deletes are only queued on the shared writer; the caller records
+    the conversation as deleted once they have been flushed.
+
+    Returns:
+        Number of documents queued for deletion, or None on error
+    """
+    try:
+        source_ref = db.collection(SOURCE_COLLECTION).document(conversation_id)
+        deleted = db.recursive_delete(source_ref, bulk_writer=_DeleteOnlyWriter(writer))
+        progress.add("docs_deleted", deleted)
+        return deleted
+    except Exception as e:
+        print(f"   ❌ Error deleting conversation {conversation_id}: {e}")
+        progress.add("errors")
+        return None
+
+
 def migrate_conversations(
     db: firestore.Client,
     dry_run: bool = False,
     delete_old: bool = False,
-) -> dict[str, int]:
+    workers: int = DEFAULT_WORKERS,
+    partitions: int = DEFAULT_PARTITIONS,
+    ramp: WriteRamp | None = None,
+    progress_interval_seconds: float = PROGRESS_INTERVAL_SECONDS,
+    verify: bool = True,
+    restart: bool = False,
+) -> dict[str, Any]:
     """
     Migrate all group conversations to the unified conversations collection.
 
+    Runs in three resumable phases, each recorded in per-conversation
+    checkpoints: copy, verify (counts + content hashes) and, with
+    delete_old, recursive deletion of verified sources only.
+
     Args:
         db: Firestore client
         dry_run: If True, only preview changes without writing
-        delete_old: If True, delete old collection after migration
+        delete_old: If True, delete verified conversations from the old collection
+        workers: Conversations processed concurrently
+        partitions: Partition queries used to list the source collection
+        ramp: Write pacing (defaults to the 500/50/5 ramp)
+        progress_interval_seconds: How often to report docs/sec
+        verify: Compare source and target after copying (required for delete_old)
+        restart: Ignore existing checkpoints and start from scratch
 
     Returns:
         Dictionary with migration statistics
     """
-    stats = {
-        "conversations_migrated": 0,
-        "messages_migrated": 0,
-        "status_docs_migrated": 0,
-        "errors": 0,
-    }
+    ramp = ramp or WriteRamp()
+    progress = MigrationProgress(ramp, progress_interval_seconds)
+    checkpoints = CheckpointStore(db, dry_run=dry_run)
+    verify = verify or delete_old
 
-    # Get all documents from group-conversations
-    group_conversations_ref = db.collection("group-conversations")
-    group_conversations = group_conversations_ref.stream()
-
-    print("Starting migration from 'group-conversations' to 'conversations'...")
+    print(f"Starting migration from '{SOURCE_COLLECTION}' to '{TARGET_COLLECTION}'...")
     print(f"Dry run: {dry_run}")
     print(f"Delete old collection: {delete_old}")
+    print(f"Workers: {workers}, partitions: {partitions}, "
+          f"write ramp: {ramp.initial_ops_per_second:.0f} -> {ramp.max_ops_per_second:.0f} ops/sec")
     print("-" * 60)
 
-    for group_conv_doc in group_conversations:
-        conversation_id = group_conv_doc.id
-        conversation_data = group_conv_doc.to_dict()
+    if restart:
+        checkpoints.clear()
+    existing = checkpoints.load()
+    if existing:
+        print(f"Resuming: {len(existing)} conversations have checkpoints")
 
-        print(f"\n📄 Processing conversation: {conversation_id}")
-        print(f"   Type: {conversation_data.get('type', 'unknown')}")
-        print(f"   Group name: {conversation_data.get('groupName', 'N/A')}")
-        print(
-            f"   Participants: {len(conversation_data.get('participantIds', []))}",
-        )
+    group_conversations = list_source_conversations(db, partitions, workers)
+    print(f"Found {len(group_conversations)} conversations to process")
 
-        try:
-            # Check if conversation already exists in target collection
-            target_ref = db.collection("conversations").document(conversation_id)
-            target_doc = target_ref.get()
-
-            if target_doc.exists:
-                print(f"   ⚠️  Already exists in 'conversations', skipping...")
-                continue
-
-            if not dry_run:
-                # Copy conversation document
-                target_ref.set(conversation_data)
-                print(f"   ✅ Copied conversation document")
-            else:
-                print(f"   [DRY RUN] Would copy conversation document")
-
-            stats["conversations_migrated"] += 1
-
-            # Migrate messages subcollection
-            messages_ref = group_conv_doc.reference.collection("messages")
-            messages = messages_ref.stream()
-
-            for message_doc in messages:
-                message_id = message_doc.id
-                message_data = message_doc.to_dict()
-
-                if not dry_run:
-                    # Copy message document
-                    target_message_ref = (
-                        target_ref.collection("messages").document(message_id)
-                    )
-                    target_message_ref.set(message_data)
-                else:
-                    print(f"      [DRY RUN] Would copy message: {message_id}")
-
-                stats["messages_migrated"] += 1
-
-                # Migrate status subcollection for this message
-                status_ref = message_doc.reference.collection("status")
-                status_docs = status_ref.stream()
-
-                for status_doc in status_docs:
-                    status_id = status_doc.id
-                    status_data = status_doc.to_dict()
-
-                    if not dry_run:
-                        # Copy status document
-                        target_status_ref = (
-                            target_ref.collection("messages")
-                            .document(message_id)
-                            .collection("status")
-                            .document(status_id)
-                        )
-                        target_status_ref.set(status_data)
-                    else:
-                        print(
-                            f"         [DRY RUN] Would copy status doc: {status_id}",
-                        )
-
-                    stats["status_docs_migrated"] += 1
-
-            print(
-                f"   ✅ Migrated {stats['messages_migrated']} messages with status docs",
-            )
-
-            # Delete old conversation if requested
-            if delete_old and not dry_run:
-                print(f"   🗑️  Deleting old conversation from group-conversations...")
-                # Delete all status docs
-                for message_doc in messages_ref.stream():
-                    status_ref = message_doc.reference.collection("status")
-                    for status_doc in status_ref.stream():
-                        status_doc.reference.delete()
-                    message_doc.reference.delete()
-                # Delete conversation doc
-                group_conv_doc.reference.delete()
-                print(f"   ✅ Deleted old conversation")
-
-        except Exception as e:
-            print(f"   ❌ Error migrating conversation {conversation_id}: {e}")
-            stats["errors"] += 1
+    writer = None if dry_run else _PacedWriter(db, ramp, progress)
+    progress.start()
+    try:
+        # Phase 1: copy
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            copied = list(pool.map(
+                lambda doc: copy_conversation(db, doc, writer, progress, checkpoints), group_conversations,
+            ))
+
+        if writer:
+            # A conversation only counts as copied once its writes are durable
+            writer.flush()
+            failed = writer.failed_paths
+            for doc, ok in zip(group_conversations, copied):
+                if ok and not any(_belongs_to(path, doc.id) for path in failed):
+                    checkpoints.record(doc.id, "copied")
+
+        # Phase 2: verify everything copied (now or by an earlier run) but not yet verified
+        if verify and writer:
+            to_verify = checkpoints.with_status("copied", "mismatch")
+            print(f"   🔍 Verifying {len(to_verify)} conversations...")
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+                list(pool.map(lambda cid: verify_conversation(db, cid, progress, checkpoints), to_verify))
+
+        # Phase 3: delete verified sources
+        if delete_old and writer:
+            to_delete = checkpoints.with_status("verified")
+            print(f"   🗑️  Deleting {len(to_delete)} verified conversations from '{SOURCE_COLLECTION}'...")
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+                deleted = list(pool.map(
+                    lambda cid: delete_verified_conversation(db, cid, writer, progress), to_delete,
+                ))
+
+            # Same as copying: only durable deletes count. Conversations with a
+            # failed delete stay verified and are deleted again on the next run
+            writer.flush()
+            failed = writer.failed_paths
+            for cid, count in zip(to_delete, deleted):
+                if count is None:
+                    continue
+                if any(_belongs_to(path, cid, SOURCE_COLLECTION) for path in failed):
+                    print(f"   ❌ Some deletes failed for conversation {cid}; it will be retried")
+                    continue
+                progress.add("conversations_deleted")
+                checkpoints.record(cid, "deleted", deletedDocs=count)
+    finally:
+        if writer:
+            writer.close()
+        stats = progress.stop()
 
     return stats
 
@@ -174,8 +643,56 @@ def main() -> None:
         action="store_true",
         help="Delete old group-conversations collection after migration",
     )
+    parser.add_argument(
+        "--no-verify",
+        action="store_true",
+        help="Skip the verification pass (not allowed with --delete-old)",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Discard checkpoints from earlier runs and start from scratch",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help="Conversations copied concurrently",
+    )
+    parser.add_argument(
+        "--partitions",
+        type=int,
+        default=DEFAULT_PARTITIONS,
+        help="Partition queries used to list the source collection (1 disables)",
+    )
+    parser.add_argument(
+        "--initial-ops-per-second",
+        type=int,
+        default=DEFAULT_INITIAL_OPS_PER_SECOND,
+        help="Write rate at the start of the ramp",
+    )
+    parser.add_argument(
+        "--max-ops-per-second",
+        type=int,
+        default=DEFAULT_MAX_OPS_PER_SECOND,
+        help="Write rate ceiling",
+    )
+    parser.add_argument(
+        "--ramp-factor",
+        type=float,
+        default=DEFAULT_RAMP_FACTOR,
+        help="Multiplier applied to the write rate every ramp interval",
+    )
+    parser.add_argument(
+        "--ramp-interval-seconds",
+        type=float,
+        default=DEFAULT_RAMP_INTERVAL_SECONDS,
+        help="Seconds between write rate increases",
+    )
 
     args = parser.parse_args()
+    if args.no_verify and args.delete_old:
+        parser.error("--delete-old only deletes verified conversations; drop --no-verify")
 
     # Initialize Firestore
     try:
@@ -190,6 +707,16 @@ def main() -> None:
         db,
         dry_run=args.dry_run,
         delete_old=args.delete_old,
+        workers=args.workers,
+        partitions=args.partitions,
+        ramp=WriteRamp(
+            args.initial_ops_per_second,
+            args.max_ops_per_second,
+            args.ramp_factor,
+            args.ramp_interval_seconds,
+        ),
+        verify=not args.no_verify,
+        restart=args.restart,
     )
 
     # Print summary
@@ -197,8 +724,18 @@ def main() -> None:
     print("MIGRATION SUMMARY")
     print("=" * 60)
     print(f"Conversations migrated: {stats['conversations_migrated']}")
+    print(f"Conversations skipped (already migrated): {stats['conversations_skipped']}")
+    print(f"Conversations resumed from a checkpoint: {stats['conversations_resumed']}")
     print(f"Messages migrated: {stats['messages_migrated']}")
     print(f"Status documents migrated: {stats['status_docs_migrated']}")
+    if not args.no_verify and not args.dry_run:
+        print(f"Conversations verified: {stats['conversations_verified']}")
+        print(f"Verification mismatches: {stats['verification_mismatches']}")
+    if args.delete_old:
+        print(f"Conversations deleted: {stats['conversations_deleted']} ({stats['docs_deleted']} documents)")
+    # docs_written counts every committed BulkWriter operation, deletes included
+    print(f"Write operations committed: {stats['docs_written']}")
+    print(f"Elapsed: {stats['elapsed_seconds']}s ({stats['docs_per_second']} docs/sec)")
     print(f"Errors: {stats['errors']}")
 
     if args.dry_run:
@@ -207,7 +744,7 @@ def main() -> None:
     else:
         print("\n✅ Migration completed successfully!")
 
-    if stats["errors"] > 0:
+    if stats["errors"] > 0 or stats["verification_mismatches"] > 0:
         sys.exit(1)
 
 
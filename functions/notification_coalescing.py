@@ -0,0 +1,182 @@
+"""
+Per-(conversation, recipient) notification coalescing.
+
+A burst of quick messages used to reach every recipient as one push per
+message. With coalescing, the first message of a burst is pushed at once
+and opens a window of WINDOW_SECONDS for that recipient; messages inside
+the window are held. One task (flush_notification_bursts in main.py) runs
+when the window ends and sends a single "N new messages" push for
+everything held. All pushes for a conversation share an FCM collapse key,
+so the summary replaces the earlier notification on the device instead of
+stacking under it. The flush opens a new window, so a sustained
+conversation costs each recipient at most one push per window.
+
+State lives in one small document per conversation and recipient:
+
+    notification_bursts/{conversationId}_{recipientId}
+        windowEndsAt:   end of the current window (epoch seconds)
+        pending:        messages held since the last push
+        flushScheduled: a flush task is queued for this window
+        lastMessageId:  last message recorded (redelivered events are ignored)
+        notice:         title, text and data payload of the last message
+
+Held messages are never lost: if a flush task fails or is late, the next
+message after the window counts them in its own push.
+"""
+
+import os
+import time
+from typing import Any, NamedTuple
+
+from firebase_admin import firestore
+
+BURSTS_COLLECTION = "notification_bursts"
+
+# Debounce window per conversation and recipient
+WINDOW_SECONDS = float(os.environ.get("NOTIFICATION_COALESCE_SECONDS", "30"))
+
+# Recipients per transaction (Firestore's write limit)
+TRANSACTION_SIZE = 500
+
+
+class Coalesced(NamedTuple):
+    # Messages the immediate push covers -> recipients (more than 1 if held
+    # messages were never flushed)
+    send_now: dict[int, list[str]]
+    # Recipients whose notification was held for the trailing push
+    held: list[str]
+    # Recipients that need a flush task, and when it should run
+    flush_recipients: list[str]
+    flush_delay_seconds: float
+
+
+def collapse_key(conversation_id: str) -> str:
+    """FCM collapse key / notification tag shared by a conversation's pushes."""
+    return f"conversation-{conversation_id}"
+
+
+def summary_body(count: int, text: str) -> str:
+    """Notification body covering `count` messages, the last of which is `text`."""
+    return text[:100] if count == 1 else f"{count} new messages"
+
+
+def _burst_ref(db: Any, conversation_id: str, recipient_id: str) -> Any:
+    return db.collection(BURSTS_COLLECTION).document(f"{conversation_id}_{recipient_id}")
+
+
+@firestore.transactional
+def _record_in_transaction(
+    transaction: Any,
+    refs: dict[str, Any],
+    message_id: str,
+    notice: dict[str, Any],
+    now: float,
+) -> list[tuple[str, int, float | None]]:
+    # (recipient, messages to push now or 0 if held, window end if a flush must be scheduled)
+    decisions = []
+    snapshots = {snapshot.reference.path: snapshot for snapshot in transaction.get_all(list(refs.values()))}
+    for recipient_id, ref in refs.items():
+        snapshot = snapshots.get(ref.path)
+        state = snapshot.to_dict() if snapshot is not None and snapshot.exists else None
+        if state and state.get("lastMessageId") == message_id:
+            continue  # Redelivered event
+
+        if state is None or now >= state.get("windowEndsAt", 0):
+            # New window: push now, covering anything held and never flushed
+            count = (state or {}).get("pending", 0) + 1
+            transaction.set(ref, {
+                "windowEndsAt": now + WINDOW_SECONDS,
+                "pending": 0,
+                "flushScheduled": False,
+                "lastMessageId": message_id,
+                "notice": notice,
+            })
+            decisions.append((recipient_id, count, None))
+        else:
+            schedule = not state.get("flushScheduled")
+            transaction.update(ref, {
+                "pending": state.get("pending", 0) + 1,
+                "flushScheduled": True,
+                "lastMessageId": message_id,
+                "notice": notice,
+            })
+            decisions.append((recipient_id, 0, state.get("windowEndsAt") if schedule else None))
+    return decisions
+
+
+def record_message(
+    db: Any,
+    conversation_id: str,
+    recipient_ids: list[str],
+    message_id: str,
+    notice: dict[str, Any],
+) -> Coalesced:
+    """
+    Record a new message for its recipients and decide who is pushed now.
+
+    Args:
+        db: Firestore client
+        conversation_id: Conversation the message belongs to
+        recipient_ids: Recipients (the sender excluded)
+        message_id: Message document ID
+        notice: {"title", "text", "data"} of the message's notification
+
+    Returns:
+        Recipients to push now (by messages covered), recipients held, and
+        the recipients and delay of the flush task to schedule
+    """
+    now = time.time()
+    send_now: dict[int, list[str]] = {}
+    held = []
+    flush_recipients = []
+    flush_at = now
+    for i in range(0, len(recipient_ids), TRANSACTION_SIZE):
+        refs = {rid: _burst_ref(db, conversation_id, rid) for rid in recipient_ids[i:i + TRANSACTION_SIZE]}
+        for recipient_id, count, window_ends_at in _record_in_transaction(
+            db.transaction(), refs, message_id, notice, now
+        ):
+            if count:
+                send_now.setdefault(count, []).append(recipient_id)
+                continue
+            held.append(recipient_id)
+            if window_ends_at is not None:
+                flush_recipients.append(recipient_id)
+                flush_at = max(flush_at, window_ends_at)
+    return Coalesced(send_now, held, flush_recipients, flush_at - now)
+
+
+@firestore.transactional
+def _claim_in_transaction(transaction: Any, refs: dict[str, Any], now: float) -> list[tuple[str, int, dict]]:
+    claimed = []
+    snapshots = {snapshot.reference.path: snapshot for snapshot in transaction.get_all(list(refs.values()))}
+    for recipient_id, ref in refs.items():
+        snapshot = snapshots.get(ref.path)
+        state = snapshot.to_dict() if snapshot is not None and snapshot.exists else None
+        if not state or not state.get("pending"):
+            continue  # Already covered by a later push
+        transaction.update(ref, {
+            "windowEndsAt": now + WINDOW_SECONDS,
+            "pending": 0,
+            "flushScheduled": False,
+        })
+        claimed.append((recipient_id, state["pending"], state.get("notice") or {}))
+    return claimed
+
+
+def claim_pending(db: Any, conversation_id: str, recipient_ids: list[str]) -> list[tuple[str, int, dict[str, Any]]]:
+    """
+    Take the held messages of recipients whose window ended.
+
+    Each recipient's count is reset and a new window opened, so a message
+    arriving right after the flush is held again rather than pushed.
+
+    Returns:
+        (recipient_id, held message count, notice of the last message) for
+        every recipient with held messages
+    """
+    now = time.time()
+    claimed = []
+    for i in range(0, len(recipient_ids), TRANSACTION_SIZE):
+        refs = {rid: _burst_ref(db, conversation_id, rid) for rid in recipient_ids[i:i + TRANSACTION_SIZE]}
+        claimed.extend(_claim_in_transaction(db.transaction(), refs, now))
+    return claimed
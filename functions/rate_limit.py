@@ -0,0 +1,189 @@
+"""
+Sharded hourly rate limits for callable functions.
+
+Every request used to read and write one counter document per caller and
+hour in a transaction. Requests from one caller therefore serialized on
+that document, and every unauthenticated caller shared a single
+"anonymous" document (and one quota), which capped anonymous traffic at
+Firestore's per-document write rate.
+
+Each caller's counter is now split over NUM_SHARDS documents in the same
+collection:
+
+    {collection}/{key}_{hourWindow}_{shard}
+        userId:     caller key
+        hourWindow: Unix hour the shard covers
+        count:      requests counted in this shard
+        lastRequest
+
+Each shard holds an equal share of the limit. A request counts itself in
+a transaction on one randomly chosen shard, reading and writing only that
+document; the other shards are read only when that one is full. Concurrent
+requests from a caller spread over NUM_SHARDS documents, and the limit
+stays exact: a shard never exceeds its share. The documents keep the old fields, so the
+cleanup job's lastRequest query still finds them.
+
+Unauthenticated callers are keyed by a hash of their IP address, so they
+no longer share one quota. The address is the X-Forwarded-For entry added
+by Google's front end, which appends the address it received the request
+from. Entries before it are whatever the client sent, so the key is taken
+TRUSTED_PROXY_HOPS entries from the end: 1 behind the front end alone, 2
+behind an external HTTPS load balancer (which appends its own address
+after the client's). Only when no address is available is the caller
+keyed by App Check app ID, or "anonymous" without one. App Check tokens
+identify the app, not the device, so the app ID does not tell callers
+apart.
+
+Per-address quotas alone would not bound what signed-out callers cost in
+total (addresses are cheap), so their requests also count against one
+shared hourly ceiling (consume_anonymous), sharded over ANONYMOUS_SHARDS
+documents:
+
+    {collection}/anonymous-all_{hourWindow}_{shard}
+"""
+
+import hashlib
+import os
+import random
+import time
+from typing import Any
+
+from firebase_admin import firestore
+
+# Counter documents per caller and hour
+NUM_SHARDS = int(os.environ.get("RATE_LIMIT_SHARDS", "4"))
+
+# X-Forwarded-For entries appended by our own proxies (front end, load balancer)
+TRUSTED_PROXY_HOPS = int(os.environ.get("RATE_LIMIT_TRUSTED_PROXY_HOPS", "1"))
+
+# Hourly ceiling for all signed-out callers of a function together
+ANONYMOUS_KEY = "anonymous-all"
+ANONYMOUS_LIMIT = int(os.environ.get("RATE_LIMIT_ANONYMOUS_PER_HOUR", "1000"))
+ANONYMOUS_SHARDS = int(os.environ.get("RATE_LIMIT_ANONYMOUS_SHARDS", "16"))
+
+
+def caller_key(req: Any) -> str:
+    """Rate-limit key of a callable request: the UID, else the client's IP (hashed)."""
+    if req.auth:
+        return req.auth.uid
+    raw_request = getattr(req, "raw_request", None)
+    if raw_request is not None:
+        forwarded = [hop.strip() for hop in raw_request.headers.get("X-Forwarded-For", "").split(",") if hop.strip()]
+        # Leading entries are client-supplied; only the ones our proxies appended can be trusted
+        address = forwarded[-TRUSTED_PROXY_HOPS] if len(forwarded) >= TRUSTED_PROXY_HOPS else raw_request.remote_addr
+        if address:
+            # Raw addresses are personal data; the key only needs to tell callers apart
+            return "ip_" + hashlib.sha256(address.encode("utf-8")).hexdigest()[:20]
+    app_check = getattr(req, "app", None)
+    if app_check is not None and getattr(app_check, "app_id", None):
+        return f"app_{app_check.app_id}"
+    return "anonymous"
+
+
+def _shard_share(limit: int, shard: int, num_shards: int = NUM_SHARDS) -> int:
+    """Requests shard `shard` may count; the shares add up to `limit`."""
+    return limit // num_shards + (1 if shard < limit % num_shards else 0)
+
+
+@firestore.transactional
+def _consume_shard(
+    transaction: Any,
+    shard_ref: Any,
+    key: str,
+    hour_window: int,
+    share: int,
+) -> int | None:
+    """Count a request on one shard; returns its count before, or None if it is full."""
+    snapshot = shard_ref.get(transaction=transaction)
+    count = (snapshot.to_dict() or {}).get("count", 0) if snapshot.exists else 0
+    if count >= share:
+        return None
+    transaction.set(shard_ref, {
+        "userId": key,
+        "hourWindow": hour_window,
+        "count": count + 1,
+        "lastRequest": time.time(),
+    })
+    return count
+
+
+@firestore.transactional
+def _refund_shard(transaction: Any, shard_ref: Any) -> bool:
+    snapshot = shard_ref.get(transaction=transaction)
+    count = (snapshot.to_dict() or {}).get("count", 0) if snapshot.exists else 0
+    if count <= 0:
+        return False
+    transaction.update(shard_ref, {"count": count - 1})
+    return True
+
+
+def _shard_refs(db: Any, collection: str, key: str, hour_window: int, num_shards: int) -> list[Any]:
+    return [db.collection(collection).document(f"{key}_{hour_window}_{shard}") for shard in range(num_shards)]
+
+
+def consume(db: Any, collection: str, key: str, hour_window: int, limit: int, num_shards: int = NUM_SHARDS) -> int:
+    """
+    Count a request against a caller's hourly limit.
+
+    One random shard is tried first, in a transaction that reads and writes
+    only that document. The other shards are read only when it is full.
+
+    Args:
+        db: Firestore client
+        collection: Rate limit collection of the function
+        key: Caller key (see caller_key)
+        hour_window: Unix hour the limit covers
+        limit: Maximum requests per hour
+        num_shards: Counter documents the limit is split over
+
+    Returns:
+        Request count before this request. The request was counted only
+        if that is below the limit (a full quota returns `limit`). When the
+        first shard had room the count is estimated from that shard alone;
+        the limit itself is exact either way.
+    """
+    refs = _shard_refs(db, collection, key, hour_window, num_shards)
+    first = random.randrange(num_shards)
+    count = _consume_shard(db.transaction(), refs[first], key, hour_window, _shard_share(limit, first, num_shards))
+    if count is not None:
+        # Requests spread evenly, so the other shards hold about as many
+        return min(count * num_shards, limit - 1)
+
+    # That shard is full: read the others once and try those with room
+    others = [shard for shard in range(num_shards) if shard != first]
+    counts = {snapshot.id: (snapshot.to_dict() or {}).get("count", 0) if snapshot.exists else 0
+              for snapshot in db.get_all([refs[shard] for shard in others])}
+    total = _shard_share(limit, first, num_shards) + sum(counts.values())
+
+    open_shards = [shard for shard in others if counts.get(refs[shard].id, 0) < _shard_share(limit, shard, num_shards)]
+    random.shuffle(open_shards)
+    for shard in open_shards:
+        if _consume_shard(db.transaction(), refs[shard], key, hour_window,
+                          _shard_share(limit, shard, num_shards)) is not None:
+            return min(total, limit - 1)
+        # Filled since the read; count it as full and try another shard
+        total += _shard_share(limit, shard, num_shards) - counts.get(refs[shard].id, 0)
+    return limit
+
+
+def refund(db: Any, collection: str, key: str, hour_window: int, num_shards: int = NUM_SHARDS) -> None:
+    """Give back one request counted by consume (e.g. when a later check rejected it)."""
+    refs = _shard_refs(db, collection, key, hour_window, num_shards)
+    random.shuffle(refs)
+    for ref in refs:
+        if _refund_shard(db.transaction(), ref):
+            return
+
+
+def consume_anonymous(db: Any, collection: str, hour_window: int) -> int:
+    """
+    Count a signed-out request against the shared anonymous ceiling.
+
+    Call it only after the caller's own limit passed, so one address that
+    is over its quota does not use up the ceiling for everyone else, and
+    refund the caller's request if the ceiling rejects it.
+
+    Returns:
+        Anonymous request count before this request (see consume)
+    """
+    return consume(db, collection, ANONYMOUS_KEY, hour_window, ANONYMOUS_LIMIT, num_shards=ANONYMOUS_SHARDS)
@@ -0,0 +1,73 @@
+"""
+Sharded counters for frequently updated aggregates.
+
+A single Firestore document sustains roughly one write per second, so a
+counter updated by many concurrent triggers is split over a fixed number of
+shard documents in a subcollection of the counter document:
+
+    {counter document}/shards/{0..num_shards-1}
+        <field>: running total of the increments written to this shard
+
+Each update is one blind write (Increment transforms, no read, no
+transaction) to a randomly chosen shard. Readers sum the shards with a
+single query, so reads cost one RPC regardless of how many updates were
+made.
+
+Increments are not idempotent: a redelivered event is counted twice. Use a
+transaction where exact counts matter more than write throughput.
+"""
+
+import random
+from typing import Any
+
+from firebase_admin import firestore
+
+SHARDS_COLLECTION = "shards"
+
+DEFAULT_NUM_SHARDS = 4
+
+
+def shard_ref(counter_ref: Any, shard: int) -> Any:
+    """Reference to one shard document of a counter."""
+    return counter_ref.collection(SHARDS_COLLECTION).document(str(shard))
+
+
+def increment(
+    counter_ref: Any,
+    values: dict[str, int | float],
+    num_shards: int = DEFAULT_NUM_SHARDS,
+    shard: int | None = None,
+) -> int:
+    """
+    Add `values` to a counter.
+
+    Args:
+        counter_ref: Document the counter belongs to
+        values: Amount to add per field (zero values are skipped)
+        num_shards: Number of shards the counter is spread over
+        shard: Shard to write to (random when not given)
+
+    Returns:
+        The shard that was written
+    """
+    if shard is None:
+        shard = random.randrange(num_shards)
+    updates = {field: firestore.Increment(amount) for field, amount in values.items() if amount}
+    if updates:
+        shard_ref(counter_ref, shard).set(updates, merge=True)
+    return shard
+
+
+def totals(counter_ref: Any) -> dict[str, int | float]:
+    """
+    Sum all shards of a counter.
+
+    Returns:
+        Total per field; empty if nothing has been counted yet
+    """
+    result: dict[str, int | float] = {}
+    for snapshot in counter_ref.collection(SHARDS_COLLECTION).stream():
+        for field, value in (snapshot.to_dict() or {}).items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                result[field] = result.get(field, 0) + value
+    return result
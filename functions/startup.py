@@ -0,0 +1,131 @@
+"""
+Cold-start helpers for MessageAI Cloud Functions.
+
+Every function in main.py is deployed as its own service but loads the
+same module, so anything imported at top level is paid for by every cold
+start (a notification trigger does not need the OpenAI SDK). Heavy
+dependencies are therefore imported on first use through lazy_import():
+
+    openai = lazy_import("openai")
+    ...
+    client = openai.OpenAI(api_key=key)   # imported here, once per instance
+
+Startup costs are recorded per instance and logged as structured entries:
+- one "instance startup" entry once main.py has been loaded (instance init
+  time plus the lazy modules loaded so far, e.g. by warm-up)
+- one entry per lazy import, with the function that triggered it
+
+Set WARMUP_CLIENTS=1 on deployments with min_instances > 0 to import the
+lazy modules and create API clients while the instance starts, instead of
+on its first request. For a per-module breakdown of the top-level imports
+run `python -m benchmarks.coldstart`.
+"""
+
+import importlib
+import os
+import threading
+import time
+from types import ModuleType
+from typing import Any
+
+from firebase_functions import logger
+
+from tracing import INSTANCE_ID, current_function, span
+
+_PROCESS_STARTED_AT = time.perf_counter()
+
+# Eagerly import lazy modules and create clients at instance start
+WARM_UP = os.environ.get("WARMUP_CLIENTS", "0").lower() in ("1", "true", "yes")
+
+_lock = threading.RLock()
+_import_times_ms: dict[str, float] = {}
+_init_ms: float | None = None
+
+
+class _LazyModule(ModuleType):
+    """Module proxy that imports the real module on first attribute access."""
+
+    def __init__(self, name: str) -> None:
+        super().__init__(name)
+        self.__dict__["_module"] = None
+
+    def _load(self) -> ModuleType:
+        module = self.__dict__["_module"]
+        if module is not None:
+            return module
+        with _lock:
+            module = self.__dict__["_module"]
+            if module is None:
+                start = time.perf_counter()
+                with span("lazy_import", module=self.__name__):
+                    module = importlib.import_module(self.__name__)
+                duration_ms = (time.perf_counter() - start) * 1000
+                _import_times_ms[self.__name__] = duration_ms
+                self.__dict__["_module"] = module
+                logger.write({  # type: ignore[arg-type]
+                    "severity": "INFO",
+                    "message": f"lazy import {self.__name__} {duration_ms:.1f}ms",
+                    "lazyImport": self.__name__,
+                    "function": current_function(),
+                    "instanceId": INSTANCE_ID,
+                    "durationMs": round(duration_ms, 3),
+                })
+        return module
+
+    def __getattr__(self, attribute: str) -> Any:
+        return getattr(self._load(), attribute)
+
+    def __dir__(self) -> list[str]:
+        return dir(self._load())
+
+
+def lazy_import(name: str) -> Any:
+    """
+    Return a proxy for module `name` that is imported on first attribute access.
+
+    Args:
+        name: Fully qualified module name (e.g. 'google.cloud.translate_v2')
+    """
+    return _LazyModule(name)
+
+
+def is_loaded(module: Any) -> bool:
+    """Whether a lazy_import() proxy has imported its module yet."""
+    if isinstance(module, _LazyModule):
+        return module.__dict__["_module"] is not None
+    return True
+
+
+def mark_initialized(**fields: Any) -> float:
+    """
+    Record the end of instance initialization and log the startup profile.
+
+    Call once, at the bottom of main.py.
+
+    Args:
+        **fields: Extra attributes to log (e.g. warmUp=True)
+
+    Returns:
+        Instance init time in milliseconds
+    """
+    global _init_ms
+    _init_ms = (time.perf_counter() - _PROCESS_STARTED_AT) * 1000
+    logger.write({  # type: ignore[arg-type]
+        "severity": "INFO",
+        "message": f"instance startup {_init_ms:.1f}ms",
+        "startupProfile": True,
+        "instanceId": INSTANCE_ID,
+        "initMs": round(_init_ms, 3),
+        **profile(),
+        **fields,
+    })
+    return _init_ms
+
+
+def profile() -> dict[str, Any]:
+    """Return instance init time and lazy import times recorded so far."""
+    with _lock:
+        return {
+            "initMs": round(_init_ms, 3) if _init_ms is not None else None,
+            "lazyImportsMs": {name: round(ms, 3) for name, ms in sorted(_import_times_ms.items())},
+        }
@@ -0,0 +1,289 @@
+"""
+Hot-path instrumentation for MessageAI Cloud Functions.
+
+Provides span context managers and a decorator for timing handler stages
+(validation, rate limiting, cache lookup, upstream API, cache write, fan-out).
+
+Every finished span is emitted as one structured JSON log line through the
+Firebase Functions logger, so Cloud Logging stores it as a jsonPayload and
+log-based metrics can be defined on the `span` and `durationMs` fields.
+
+Latencies are also aggregated into per-instance histograms. Each Cloud
+Function runs as its own service, so histograms are dumped from inside the
+instance: on demand via dump_histograms(), periodically (see
+TRACE_DUMP_INTERVAL_SECONDS) and once more when the instance shuts down.
+
+Usage:
+    @https_fn.on_call()
+    @traced("translate_message")
+    def translate_message(req):
+        with span("validation"):
+            ...
+        with span("cache_lookup") as attrs:
+            attrs["hit"] = True
+"""
+
+import atexit
+import contextlib
+import contextvars
+import functools
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterator, TypeVar
+
+from firebase_functions import logger
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+# Histogram bucket upper bounds in milliseconds (last bucket is +Inf)
+BUCKET_BOUNDS_MS: tuple[float, ...] = (
+    5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000,
+)
+
+# Emit a histogram snapshot at most this often (0 disables periodic dumps)
+DUMP_INTERVAL_SECONDS = float(os.environ.get("TRACE_DUMP_INTERVAL_SECONDS", "300"))
+
+# Set TRACE_LOG_SPANS=0 to keep histograms without a log line per span
+LOG_SPANS = os.environ.get("TRACE_LOG_SPANS", "1") != "0"
+
+INSTANCE_ID = uuid.uuid4().hex[:12]
+_INSTANCE_STARTED_AT = time.time()
+
+
+@dataclass
+class _Trace:
+    """Per-invocation trace context, propagated through a ContextVar."""
+
+    function: str
+    trace_id: str = field(default_factory=lambda: uuid.uuid4().hex[:16])
+
+
+_current_trace: contextvars.ContextVar[_Trace | None] = contextvars.ContextVar(
+    "message_ai_trace", default=None,
+)
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram with count, sum, min and max."""
+
+    def __init__(self) -> None:
+        self.buckets = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.sum_ms = 0.0
+        self.min_ms = float("inf")
+        self.max_ms = 0.0
+
+    def record(self, duration_ms: float, error: bool = False) -> None:
+        index = len(BUCKET_BOUNDS_MS)
+        for i, bound in enumerate(BUCKET_BOUNDS_MS):
+            if duration_ms <= bound:
+                index = i
+                break
+        self.buckets[index] += 1
+        self.count += 1
+        self.sum_ms += duration_ms
+        self.min_ms = min(self.min_ms, duration_ms)
+        self.max_ms = max(self.max_ms, duration_ms)
+        if error:
+            self.errors += 1
+
+    def percentile(self, q: float) -> float:
+        """
+        Estimate the q-th percentile (0-1) by interpolating within its bucket.
+
+        The bucket's edges are narrowed to the observed min and max, so a
+        small sample does not report every percentile as the max.
+        """
+        if self.count == 0:
+            return 0.0
+        target = q * self.count
+        cumulative = 0
+        for i, bucket_count in enumerate(self.buckets):
+            if bucket_count and cumulative + bucket_count >= target:
+                lower = max(BUCKET_BOUNDS_MS[i - 1] if i > 0 else 0.0, self.min_ms)
+                upper = min(BUCKET_BOUNDS_MS[i] if i < len(BUCKET_BOUNDS_MS) else self.max_ms, self.max_ms)
+                fraction = max(0.0, target - cumulative) / bucket_count
+                return lower + (upper - lower) * fraction
+            cumulative += bucket_count
+        return self.max_ms
+
+    def to_dict(self) -> dict[str, Any]:
+        labels = [f"le_{int(b)}" for b in BUCKET_BOUNDS_MS] + ["le_inf"]
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "sumMs": round(self.sum_ms, 3),
+            "minMs": round(self.min_ms, 3) if self.count else 0.0,
+            "maxMs": round(self.max_ms, 3),
+            "meanMs": round(self.sum_ms / self.count, 3) if self.count else 0.0,
+            "p50Ms": round(self.percentile(0.50), 3),
+            "p95Ms": round(self.percentile(0.95), 3),
+            "p99Ms": round(self.percentile(0.99), 3),
+            "buckets": dict(zip(labels, self.buckets)),
+        }
+
+
+_lock = threading.Lock()
+_histograms: dict[str, LatencyHistogram] = {}
+_counters: dict[str, int] = {}
+_gauges: dict[str, Any] = {}
+_last_dump_at = time.monotonic()
+
+
+def _record(span_name: str, duration_ms: float, error: bool) -> None:
+    with _lock:
+        histogram = _histograms.get(span_name)
+        if histogram is None:
+            histogram = _histograms[span_name] = LatencyHistogram()
+        histogram.record(duration_ms, error)
+
+
+def increment(name: str, value: int = 1) -> None:
+    """Increment a per-instance counter (included in histogram dumps)."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name: str, value: Any) -> None:
+    """Set a per-instance gauge (current value, e.g. a breaker state; included in histogram dumps)."""
+    with _lock:
+        _gauges[name] = value
+
+
+def current_function() -> str | None:
+    """Name of the traced function handling the current invocation, if any."""
+    trace = _current_trace.get()
+    return trace.function if trace else None
+
+
+@contextlib.contextmanager
+def span(stage: str, **fields: Any) -> Iterator[dict[str, Any]]:
+    """
+    Time a stage of the current handler.
+
+    Yields a mutable dict; anything the caller adds to it (e.g. `hit`,
+    `count`) is attached to the structured log entry for the span.
+
+    Args:
+        stage: Stage name (e.g. 'validation', 'rate_limit', 'cache_lookup',
+            'upstream', 'cache_write', 'fanout')
+        **fields: Extra attributes to log with the span
+    """
+    trace = _current_trace.get()
+    function = trace.function if trace else None
+    span_name = f"{function}.{stage}" if function else stage
+    attrs: dict[str, Any] = dict(fields)
+    error_type: str | None = None
+    start = time.perf_counter()
+    try:
+        yield attrs
+    except BaseException as e:
+        error_type = type(e).__name__
+        raise
+    finally:
+        duration_ms = (time.perf_counter() - start) * 1000
+        _record(span_name, duration_ms, error_type is not None)
+        if LOG_SPANS:
+            entry: dict[str, Any] = {
+                "severity": "INFO",
+                "message": f"span {span_name} {duration_ms:.1f}ms",
+                "span": span_name,
+                "stage": stage,
+                "function": function,
+                "traceId": trace.trace_id if trace else None,
+                "instanceId": INSTANCE_ID,
+                "durationMs": round(duration_ms, 3),
+                "error": error_type is not None,
+                **attrs,
+            }
+            if error_type:
+                entry["errorType"] = error_type
+            logger.write(entry)  # type: ignore[arg-type]
+
+
+def traced(function_name: str) -> Callable[[F], F]:
+    """
+    Decorator that traces a whole function invocation.
+
+    Establishes the trace context used by nested span() calls and records the
+    end-to-end latency under the span name '<function_name>.total'.
+    Apply it beneath the Firebase trigger decorator.
+    """
+    def decorator(func: F) -> F:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            token = _current_trace.set(_Trace(function_name))
+            try:
+                with span("total"):
+                    return func(*args, **kwargs)
+            finally:
+                _current_trace.reset(token)
+                _maybe_dump()
+        return wrapper  # type: ignore[return-value]
+    return decorator
+
+
+def snapshot() -> dict[str, Any]:
+    """Return the per-instance histograms and counters as a dict."""
+    with _lock:
+        return {
+            "instanceId": INSTANCE_ID,
+            "uptimeSeconds": round(time.time() - _INSTANCE_STARTED_AT, 1),
+            "histograms": {name: h.to_dict() for name, h in sorted(_histograms.items())},
+            "counters": dict(sorted(_counters.items())),
+            "gauges": dict(sorted(_gauges.items())),
+        }
+
+
+def get_histogram(span_name: str) -> LatencyHistogram | None:
+    """Return the live histogram for a span name, if it has been recorded."""
+    with _lock:
+        return _histograms.get(span_name)
+
+
+def reset() -> None:
+    """Clear all per-instance histograms and counters (gauges keep their current value)."""
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+def dump_histograms(reset_after: bool = False) -> dict[str, Any]:
+    """
+    Emit the per-instance histograms as one structured log entry.
+
+    Args:
+        reset_after: Clear the histograms after dumping
+
+    Returns:
+        The snapshot that was logged
+    """
+    global _last_dump_at
+    data = snapshot()
+    if reset_after:
+        reset()
+    _last_dump_at = time.monotonic()
+    logger.write({  # type: ignore[arg-type]
+        "severity": "INFO",
+        "message": f"latency histograms for instance {INSTANCE_ID}",
+        "histogramDump": True,
+        **data,
+    })
+    return data
+
+
+def _maybe_dump() -> None:
+    if DUMP_INTERVAL_SECONDS <= 0:
+        return
+    if time.monotonic() - _last_dump_at >= DUMP_INTERVAL_SECONDS:
+        dump_histograms()
+
+
+@atexit.register
+def _dump_on_shutdown() -> None:
+    if _histograms:
+        dump_histograms()
@@ -0,0 +1,169 @@
+"""
+Sentence-level translation memory.
+
+translation_cache keys on the whole message, so a long message that
+repeats most of an earlier one still misses. On a translation_cache miss,
+translate_message splits the text into sentences and reuses earlier
+translations of individual sentences:
+
+    translation_memory/{source}_{target}_{sha256(sentence)}
+        sourceLanguage, targetLanguage, sourceText, translatedText, timestamp
+
+All segments are looked up with one batched read. Only the missing ones
+are sent to the Translation API, in a single request of up to
+MAX_SEGMENTS_PER_REQUEST segments. The translated sentences are then put
+back together with the original whitespace between them.
+
+Only used when the source language is known, because segment keys are
+per language pair. Characters billed and saved are counted in the
+per-instance tracing counters (translation_memory.charsBilled and
+translation_memory.charsSaved).
+"""
+
+import hashlib
+import re
+import time
+from typing import Any, NamedTuple
+
+import circuit_breaker
+import deadlines
+from tracing import increment, span
+
+MEMORY_COLLECTION = "translation_memory"
+
+# Cloud Translation v2 accepts at most 128 text segments per request
+MAX_SEGMENTS_PER_REQUEST = 128
+
+# Segments kept by clean_translation_cache (30 days)
+MEMORY_TTL_SECONDS = 2592000
+
+# Sentence end: terminal punctuation (plus closing quotes/brackets) followed
+# by whitespace, or CJK full stops, which are not followed by spaces
+_SENTENCE_END = re.compile(r"""(?<=[.!?…])["')\]]*\s+|(?<=[。！？])\s*""")
+
+# Words ending in a period that rarely end a sentence
+_ABBREVIATIONS = frozenset({
+    "mr.", "mrs.", "ms.", "dr.", "st.", "vs.", "etc.", "e.g.", "i.e.", "approx.",
+    "sr.", "sra.", "dra.", "p.ej.", "mme.", "mlle.", "z.b.", "bzw.", "ca.", "nr.",
+})
+
+
+class Segment(NamedTuple):
+    text: str
+    separator: str
+
+
+class MemoryResult(NamedTuple):
+    translated_text: str
+    segments: int
+    reused: int
+    characters_billed: int
+    characters_saved: int
+
+
+def split_sentences(text: str) -> list[Segment]:
+    """
+    Split text into sentences, keeping the whitespace that follows each.
+
+    ''.join(s.text + s.separator for s in split_sentences(text)) == text
+    """
+    segments = []
+    start = 0
+    for match in _SENTENCE_END.finditer(text):
+        if match.end() == start or match.end() >= len(text):
+            continue
+        sentence_end = match.start() + len(match.group(0).rstrip())
+        words = text[start:sentence_end].split()
+        if words and words[-1].lower() in _ABBREVIATIONS:
+            continue
+        segments.append(Segment(text[start:sentence_end], text[sentence_end:match.end()]))
+        start = match.end()
+    if start < len(text):
+        tail = text[start:]
+        stripped = tail.rstrip()
+        segments.append(Segment(stripped, tail[len(stripped):]))
+    return [segment for segment in segments if segment.text] or [Segment(text, "")]
+
+
+def segment_key(sentence: str, source_language: str, target_language: str) -> str:
+    """Document ID of a sentence in the translation memory."""
+    digest = hashlib.sha256(sentence.encode("utf-8")).hexdigest()
+    return f"{source_language}_{target_language}_{digest}"
+
+
+def translate(
+    db: Any,
+    client: Any,
+    text: str,
+    source_language: str,
+    target_language: str,
+) -> MemoryResult:
+    """
+    Translate `text` sentence by sentence, reusing remembered sentences.
+
+    Args:
+        db: Firestore client
+        client: Cloud Translation v2 client
+        text: Text to translate
+        source_language: Source language code (required)
+        target_language: Target language code
+
+    Returns:
+        MemoryResult with the reassembled translation and billing counts
+    """
+    segments = split_sentences(text)
+    collection = db.collection(MEMORY_COLLECTION)
+    unique = list(dict.fromkeys(segment.text for segment in segments))
+    refs = {sentence: collection.document(segment_key(sentence, source_language, target_language))
+            for sentence in unique}
+
+    # Step 1: Look up every distinct sentence in one batched read
+    with span("memory_lookup") as lookup_attrs:
+        translations: dict[str, str] = {}
+        for snapshot in db.get_all(list(refs.values())):
+            if snapshot.exists:
+                data = snapshot.to_dict() or {}
+                if data.get("translatedText") is not None:
+                    translations[data["sourceText"]] = data["translatedText"]
+        lookup_attrs["segments"] = len(unique)
+        lookup_attrs["hits"] = len(translations)
+
+    # Step 2: Translate only the missing sentences, batched, and remember them
+    missing = [sentence for sentence in unique if sentence not in translations]
+    for offset in range(0, len(missing), MAX_SEGMENTS_PER_REQUEST):
+        chunk = missing[offset:offset + MAX_SEGMENTS_PER_REQUEST]
+        with circuit_breaker.guard("translate"), span("upstream.translate", segments=len(chunk)):
+            results = deadlines.call(
+                lambda _timeout: client.translate(
+                    chunk,
+                    target_language=target_language,
+                    source_language=source_language,
+                    format_="text",
+                ),
+                name="translate",
+                idempotent=True,
+                hedge=True,
+            )
+        if isinstance(results, dict):
+            results = [results]
+
+        with span("memory_write"):
+            batch = db.batch()
+            now = time.time()
+            for sentence, result in zip(chunk, results):
+                translations[sentence] = result["translatedText"]
+                batch.set(refs[sentence], {
+                    "sourceLanguage": source_language,
+                    "targetLanguage": target_language,
+                    "sourceText": sentence,
+                    "translatedText": result["translatedText"],
+                    "timestamp": now,
+                })
+            batch.commit()
+
+    translated_text = "".join(translations[segment.text] + segment.separator for segment in segments)
+    billed = sum(len(sentence) for sentence in missing)
+    saved = sum(len(segment.text) for segment in segments) - billed
+    increment("translation_memory.charsBilled", billed)
+    increment("translation_memory.charsSaved", saved)
+    return MemoryResult(translated_text, len(segments), len(segments) - len(missing), billed, saved)